@@ -0,0 +1,353 @@
+"""
+`slot_store` operations for `firestore.AsyncClient`.
+
+Used by the async request handlers. The storage layout, merge rules and the
+slot cache are shared with `slot_store`.
+"""
+from datetime import date, datetime, timezone
+from typing import Callable, Collection, Dict, List, Optional, Tuple
+
+from google.cloud import firestore
+
+from booking_store import check_new_booking
+from metrics import traced
+from slot_store import (
+    cache_slots,
+    check_team_reservation,
+    day_bucket_doc,
+    day_bucket_holds,
+    day_bucket_slots,
+    changed_days,
+    changed_days_query,
+    flatten_day_buckets_with_expiry,
+    hold_day_id,
+    hold_slot_in_day,
+    legacy_slots_of,
+    regeneration_scope,
+    release_hold_in_day,
+    release_slot_from_array,
+    release_slot_from_day,
+    slot_day_id,
+    slot_days_ref,
+    slot_writes,
+    slots_cache,
+    slots_changed,
+    slots_header_ref,
+    slots_version,
+    take_slot_from_array,
+    take_slot_from_day,
+    team_reservation_ref,
+    touch_header,
+    write_regeneration,
+)
+
+
+async def read_slots_async(db, user_id: str) -> List[dict]:
+    """Async `slot_store.read_slots`."""
+    return (await read_versioned_slots_async(db, user_id))[1]
+
+
+@traced('firestore.read_versioned_slots')
+async def read_versioned_slots_async(
+        db, user_id: str, known_versions: Collection[int] = ()) -> Tuple[Optional[int], Optional[List[dict]]]:
+    """Async `slot_store.read_versioned_slots`."""
+    cached = slots_cache.get(user_id)
+    if cached is not None:
+        return cached if cached[0] not in known_versions else (cached[0], None)
+
+    writes = slot_writes(user_id)
+    header = await slots_header_ref(db, user_id).get()
+    header_data = header.to_dict() if header.exists else None
+    version = slots_version(header_data)
+    if version is not None and version in known_versions:
+        return version, None
+    now = datetime.now(timezone.utc)
+    holds_expire_at = None
+    if header_data and 'slots' in header_data:
+        slots = header_data['slots']
+    else:
+        slots, holds_expire_at = flatten_day_buckets_with_expiry(
+            [day_doc async for day_doc in slot_days_ref(db, user_id).stream()], now)
+    cache_slots(user_id, version, slots, writes, holds_expire_at, now)
+    return version, slots
+
+
+@traced('firestore.read_slots_version')
+async def read_slots_version_async(db, user_id: str) -> Optional[int]:
+    """The version of a user's slots (`slot_store.slots_version`). Reads only the header."""
+    header = await slots_header_ref(db, user_id).get()
+    return slots_version(header.to_dict() if header.exists else None)
+
+
+@traced('firestore.read_slot_changes')
+async def read_slot_changes_async(db, user_id: str,
+                                  since: int) -> Tuple[Optional[int], Optional[Dict[str, List[dict]]]]:
+    """Async `slot_store.read_slot_changes`."""
+    header = await slots_header_ref(db, user_id).get()
+    header_data = header.to_dict() if header.exists else None
+    version = slots_version(header_data)
+    if version is None or since > version or 'slots' in header_data:
+        return version, None
+    if since == version:
+        return version, {}
+    return version, changed_days([day_doc async for day_doc in changed_days_query(db, user_id, since).stream()])
+
+
+@firestore.async_transactional
+async def _book_slot_in_transaction(transaction, db, user_id, slot_id, booking):
+    slots_ref = slots_header_ref(db, user_id)
+    snapshot = await slots_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        raise FileNotFoundError("Slots document not found.")
+    check_team_reservation(await team_reservation_ref(db, user_id, slot_id).get(transaction=transaction))
+    if booking is not None:
+        check_new_booking(await booking[0].get(transaction=transaction))
+
+    slots = snapshot.to_dict().get('slots', [])
+    slot = take_slot_from_array(slots, slot_id)
+    transaction.update(slots_ref, {'slots': slots, 'updatedAt': firestore.SERVER_TIMESTAMP})
+    if booking is not None:
+        booking_ref, booking_data = booking
+        transaction.set(booking_ref, booking_data(slot))
+    return slot
+
+
+@firestore.async_transactional
+async def _book_slot_in_day_transaction(transaction, db, user_id, slot_id, booking, hold_id):
+    day_ref = slot_days_ref(db, user_id).document(slot_day_id(slot_id))
+    snapshot = await day_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        raise FileNotFoundError("Slots document not found.")
+    check_team_reservation(await team_reservation_ref(db, user_id, slot_id).get(transaction=transaction))
+    if booking is not None:
+        check_new_booking(await booking[0].get(transaction=transaction))
+
+    day_data = snapshot.to_dict()
+    slots = day_bucket_slots(day_data)
+    holds = day_bucket_holds(day_data, datetime.now(timezone.utc))
+    slot = take_slot_from_day(slots, slot_id, holds, hold_id)
+    transaction.set(day_ref, day_bucket_doc(day_ref.id, slots, holds))
+    touch_header(transaction, db, user_id)
+    if booking is not None:
+        booking_ref, booking_data = booking
+        transaction.set(booking_ref, booking_data(slot))
+    return slot
+
+
+@traced('firestore.book_slot')
+async def book_slot_async(db, user_id: str, slot_id: str,
+                          booking: Optional[Tuple[object, Callable[[dict], dict]]] = None,
+                          hold_id: Optional[str] = None) -> dict:
+    """
+    Async `slot_store.book_slot`.
+
+    Args:
+        booking: Optional (document reference, function of the booked slot
+            returning the document data). The document is written in the same
+            transaction, so the booking record exists exactly when the slot is taken.
+        hold_id: The booker's hold on the slot, if any.
+
+    Raises:
+        DuplicateBookingError: If `booking`'s document already holds a booking
+            that has not failed; nothing is written.
+    """
+    try:
+        slot_day_id(slot_id)
+    except ValueError:
+        raise ValueError("Slot ID not found.")
+
+    try:
+        try:
+            return await _book_slot_in_day_transaction(db.transaction(), db, user_id, slot_id, booking, hold_id)
+        except FileNotFoundError:
+            # Not migrated yet: the slot may still be in the legacy array.
+            return await _book_slot_in_transaction(db.transaction(), db, user_id, slot_id, booking)
+    finally:
+        slots_changed(user_id)
+
+
+@firestore.async_transactional
+async def _release_slot_in_transaction(transaction, db, user_id, slot_id, booking_ref, booking_update):
+    header_ref = slots_header_ref(db, user_id)
+    day_ref = slot_days_ref(db, user_id).document(slot_day_id(slot_id))
+    day = await day_ref.get(transaction=transaction)
+    header = None if day.exists else await header_ref.get(transaction=transaction)
+
+    released = False
+    if day.exists:
+        day_data = day.to_dict()
+        slots = day_bucket_slots(day_data)
+        released = release_slot_from_day(slots, slot_id)
+        if released:
+            transaction.set(day_ref, day_bucket_doc(day_ref.id, slots,
+                                                    day_bucket_holds(day_data, datetime.now(timezone.utc))))
+            touch_header(transaction, db, user_id)
+    elif header.exists and 'slots' in header.to_dict():
+        slots = header.to_dict()['slots']
+        released = release_slot_from_array(slots, slot_id)
+        if released:
+            transaction.update(header_ref, {'slots': slots, 'updatedAt': firestore.SERVER_TIMESTAMP})
+    if booking_ref is not None:
+        transaction.update(booking_ref, booking_update)
+    return released
+
+
+@traced('firestore.release_slot')
+async def release_slot_async(db, user_id: str, slot_id: str, booking_ref,
+                             booking_update: Optional[dict] = None) -> bool:
+    """
+    Makes a booked slot available again and updates its booking record in
+    the same transaction. A slot that no longer exists (e.g. it has passed)
+    is left alone. Slots booked without a record pass no `booking_ref`.
+
+    Returns:
+        True if the slot was released.
+    """
+    try:
+        return await _release_slot_in_transaction(
+            db.transaction(), db, user_id, slot_id, booking_ref, booking_update)
+    finally:
+        slots_changed(user_id)
+
+
+@firestore.async_transactional
+async def _hold_slot_in_transaction(transaction, db, user_id, slot_id):
+    day_ref = slot_days_ref(db, user_id).document(slot_day_id(slot_id))
+    snapshot = await day_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        raise FileNotFoundError("Slots document not found.")
+
+    day_data = snapshot.to_dict()
+    now = datetime.now(timezone.utc)
+    slots = day_bucket_slots(day_data)
+    holds = day_bucket_holds(day_data, now)
+    hold = hold_slot_in_day(slots, holds, slot_id, now)
+    transaction.set(day_ref, day_bucket_doc(day_ref.id, slots, holds))
+    touch_header(transaction, db, user_id)
+    return hold
+
+
+@traced('firestore.hold_slot')
+async def hold_slot_async(db, user_id: str, slot_id: str) -> dict:
+    """
+    Holds an available slot for HOLD_TTL_SECONDS, so that only the holder can
+    book it meanwhile. Hosts whose slots are not in day buckets yet cannot
+    hold slots.
+
+    Returns:
+        The hold: {'holdId', 'expiresAt'}.
+
+    Raises:
+        FileNotFoundError: If the slot's day has no slots document.
+        ValueError: If the slot does not exist, is booked or is held.
+    """
+    try:
+        slot_day_id(slot_id)
+    except ValueError:
+        raise ValueError("Slot ID not found.")
+
+    try:
+        return await _hold_slot_in_transaction(db.transaction(), db, user_id, slot_id)
+    finally:
+        slots_changed(user_id)
+
+
+@firestore.async_transactional
+async def _release_hold_in_transaction(transaction, db, user_id, hold_id):
+    day_ref = slot_days_ref(db, user_id).document(hold_day_id(hold_id))
+    snapshot = await day_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return False
+
+    day_data = snapshot.to_dict()
+    holds = day_bucket_holds(day_data, datetime.now(timezone.utc))
+    if not release_hold_in_day(holds, hold_id):
+        return False
+    transaction.set(day_ref, day_bucket_doc(day_ref.id, day_bucket_slots(day_data), holds))
+    touch_header(transaction, db, user_id)
+    return True
+
+
+@traced('firestore.release_hold')
+async def release_hold_async(db, user_id: str, hold_id: str) -> bool:
+    """
+    Gives up a hold before it expires.
+
+    Returns:
+        True if the hold was still there.
+
+    Raises:
+        ValueError: If the hold ID is malformed.
+    """
+    released = await _release_hold_in_transaction(db.transaction(), db, user_id, hold_id)
+    if released:
+        slots_changed(user_id)
+    return released
+
+
+@firestore.async_transactional
+async def _drop_expired_holds_in_transaction(transaction, db, user_id, day_id, now):
+    day_ref = slot_days_ref(db, user_id).document(day_id)
+    snapshot = await day_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return False
+
+    day_data = snapshot.to_dict()
+    holds = day_bucket_holds(day_data, now)
+    if len(holds) == len(day_data.get('holds', {})):
+        return False
+    transaction.set(day_ref, day_bucket_doc(day_ref.id, day_bucket_slots(day_data), holds))
+    touch_header(transaction, db, user_id)
+    return True
+
+
+@traced('firestore.sweep_expired_holds')
+async def sweep_expired_holds_async(db, now: Optional[datetime] = None) -> int:
+    """
+    Rewrites the day documents holding expired holds without them.
+
+    Reads already ignore expired holds; the rewrite bumps the slots' version,
+    so ETags, `since` deltas and event streams show the slots free again too.
+    Queries the `days` collection group on `holdsExpireAt`, which needs that
+    field's collection group index enabled.
+
+    Returns:
+        The number of day documents rewritten.
+    """
+    now = now or datetime.now(timezone.utc)
+    swept = 0
+    query = db.collection_group('days').where(filter=firestore.FieldFilter('holdsExpireAt', '<=', now))
+    async for day_doc in query.stream():
+        user_id = day_doc.reference.parent.parent.id
+        if await _drop_expired_holds_in_transaction(db.transaction(), db, user_id, day_doc.id, now):
+            swept += 1
+            slots_changed(user_id)
+    return swept
+
+
+@firestore.async_transactional
+async def _save_regenerated_slots_in_transaction(transaction, db, user_id, regenerated_slots, now, dates):
+    legacy_slots = legacy_slots_of(await slots_header_ref(db, user_id).get(transaction=transaction))
+
+    days_ref = slot_days_ref(db, user_id)
+    scope = regeneration_scope(legacy_slots, dates)
+    if scope is None:
+        day_docs = [day_doc async for day_doc in days_ref.stream(transaction=transaction)]
+    else:
+        day_docs = [await days_ref.document(day_id).get(transaction=transaction) for day_id in scope]
+    return write_regeneration(transaction, db, user_id, legacy_slots, day_docs, regenerated_slots, now, dates)
+
+
+@traced('firestore.save_regenerated_slots')
+async def save_regenerated_slots_async(
+    db,
+    user_id: str,
+    regenerated_slots: List[dict],
+    now: datetime,
+    dates: Optional[Collection[date]] = None,
+) -> List[dict]:
+    """Async `slot_store.save_regenerated_slots`."""
+    slots = await _save_regenerated_slots_in_transaction(
+        db.transaction(), db, user_id, regenerated_slots, now, dates)
+    slots_changed(user_id)
+    return slots
@@ -1,9 +1,14 @@
 import os
+import time
+from collections import Counter
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 import jwt
 from dotenv import load_dotenv
 
+from cache import TTLCache
+from metrics import allow_server_timing
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -13,9 +18,20 @@ ALGORITHM = "HS256"
 # This will look for a token in the "Authorization: Bearer <token>" header
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token") 
 
+# Per-process cache of verified token -> user ID. Entries never outlive the token's expiry.
+verified_tokens = TTLCache(
+    maxsize=int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("AUTH_TOKEN_CACHE_TTL_SECONDS", "60")),
+)
+
+# Authenticated requests, and the user document reads they caused (see `user_context`).
+auth_stats = Counter()
+
 def get_current_user(token: str = Depends(oauth2_scheme)):
     """
     Decodes the JWT token to get the user ID.
+
+    A token verified in the last AUTH_TOKEN_CACHE_TTL_SECONDS is not decoded again.
     
     Args:
         token: The JWT token from the Authorization header.
@@ -31,6 +47,11 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    user_id = verified_tokens.get(token)
+    if user_id is not None:
+        auth_stats['requests'] += 1
+        allow_server_timing()
+        return user_id
     try:
         if JWT_SECRET_KEY is None:
             raise ValueError("JWT_SECRET_KEY is not set in the environment.")
@@ -39,6 +60,12 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
         user_id: str = payload.get("sub")
         if user_id is None:
             raise credentials_exception
+        if 'exp' in payload:
+            verified_tokens.set(token, user_id, ttl=payload['exp'] - time.time())
+        else:
+            verified_tokens.set(token, user_id)
+        auth_stats['requests'] += 1
+        allow_server_timing()
         return user_id
     except jwt.ExpiredSignatureError:
         raise HTTPException(
@@ -0,0 +1,106 @@
+"""
+On-the-fly availability for arbitrary date ranges and slot durations.
+
+Stored slots cover SLOT_HORIZON_DAYS with the host's own slot duration. This
+module computes free slots for any range instead, without storing them: days
+are swept lazily (`slot_engine.iter_available_slots`), with busy intervals
+fetched chunk by chunk as the sweep reaches them. A page stops after `limit`
+slots or AVAILABILITY_MAX_SCAN_DAYS days, whichever comes first, and returns
+a cursor to continue from, so memory and latency per request stay bounded
+however long the range is.
+"""
+import os
+from dataclasses import replace
+from datetime import date, datetime, timedelta
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from slot_engine import SlotSettings, iter_available_slots, merge_intervals
+from team_engine import iter_team_slots
+
+AVAILABILITY_MAX_RANGE_DAYS = int(os.getenv("AVAILABILITY_MAX_RANGE_DAYS", "366"))
+AVAILABILITY_PAGE_SIZE = 100
+AVAILABILITY_MAX_PAGE_SIZE = 500
+# Busy intervals are fetched for this many days at a time. Chunks are aligned
+# to a fixed grid of days, so consecutive pages ask for the same windows and
+# hit the busy-interval cache.
+AVAILABILITY_FETCH_DAYS = 14
+# Days swept by a single page at most, so a fully booked range still answers quickly.
+AVAILABILITY_MAX_SCAN_DAYS = int(os.getenv("AVAILABILITY_MAX_SCAN_DAYS", "62"))
+
+BusyFetcher = Callable[[datetime, datetime], Awaitable[List[Tuple[datetime, datetime]]]]
+
+
+def _chunk_start(day: date) -> date:
+    return day - timedelta(days=day.toordinal() % AVAILABILITY_FETCH_DAYS)
+
+
+def _local_midnight(slot_settings: SlotSettings, day: date) -> datetime:
+    return slot_settings.timezone.localize(datetime.combine(day, datetime.min.time()))
+
+
+async def availability_page(fetch_busy: BusyFetcher, slot_settings: SlotSettings, date_from: date, date_to: date,
+                            now: datetime, duration_minutes: Optional[int] = None, cursor: Optional[str] = None,
+                            limit: int = AVAILABILITY_PAGE_SIZE,
+                            extra_busy: List[Tuple[datetime, datetime]] = (),
+                            team_mode: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    """
+    Computes one page of free slots between `date_from` and `date_to` (inclusive, host timezone).
+
+    Args:
+        fetch_busy: Returns the host's busy intervals between two instants.
+        duration_minutes: Slot length; defaults to the host's slot duration.
+        cursor: `next_cursor` of the previous page. Only slots starting at or after it are returned.
+        extra_busy: Further busy intervals, e.g. slots booked but not on the calendar yet.
+        team_mode: For team pages. `fetch_busy` then returns a list of busy intervals per member, and
+            slots are free as `team_engine.iter_team_slots` decides for the mode.
+
+    Returns:
+        (slots, next_cursor). `next_cursor` is None once the range is exhausted;
+        otherwise it may be followed by an empty page.
+
+    Raises:
+        ValueError: On an invalid cursor.
+    """
+    if duration_minutes:
+        slot_settings = replace(slot_settings, slot_duration_minutes=duration_minutes)
+    user_timezone = slot_settings.timezone
+
+    not_before_ts = now.timestamp()
+    day = date_from
+    if cursor:
+        try:
+            resume_at = datetime.fromisoformat(cursor)
+        except ValueError:
+            raise ValueError("Invalid cursor.")
+        if resume_at.tzinfo is None:
+            raise ValueError("Invalid cursor.")
+        # Slots start on whole minutes, so this keeps a slot starting exactly at the cursor.
+        not_before_ts = max(not_before_ts, resume_at.timestamp() - 1)
+        day = max(day, resume_at.astimezone(user_timezone).date())
+    day = max(day, now.astimezone(user_timezone).date())
+    scan_end = min(date_to, day + timedelta(days=AVAILABILITY_MAX_SCAN_DAYS - 1))
+
+    slots = []
+    while day <= scan_end:
+        chunk_start = _chunk_start(day)
+        chunk_end = min(scan_end, chunk_start + timedelta(days=AVAILABILITY_FETCH_DAYS - 1))
+        busy = await fetch_busy(_local_midnight(slot_settings, chunk_start),
+                                _local_midnight(slot_settings, chunk_start + timedelta(days=AVAILABILITY_FETCH_DAYS)))
+        days = (day + timedelta(days=i) for i in range((chunk_end - day).days + 1))
+        if team_mode:
+            host_busy = [merge_intervals((start.timestamp(), end.timestamp())
+                                         for start, end in [*intervals, *extra_busy]) for intervals in busy]
+            free_slots = iter_team_slots(host_busy, team_mode, slot_settings, days, not_before_ts)
+        else:
+            merged = merge_intervals((start.timestamp(), end.timestamp()) for start, end in [*busy, *extra_busy])
+            free_slots = iter_available_slots(merged, slot_settings, days, not_before_ts)
+        for slot in free_slots:
+            slots.append(slot)
+            if len(slots) == limit:
+                # Slots of a day never overlap, so the next one starts at or after this one ends.
+                return slots, slot['endTime']
+        day = chunk_end + timedelta(days=1)
+
+    if day > date_to:
+        return slots, None
+    return slots, _local_midnight(slot_settings, day).isoformat()
@@ -0,0 +1,183 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from slot_engine import SLOT_HORIZON_DAYS, SlotSettings, day_slot_runs
+from tz_engine import DAY_SECONDS, local_day_start, zone_transitions
+
+# Each host's timeline is shifted by host_index * HOST_SPAN seconds so that all
+# hosts can share one sorted array. It must exceed the busy/slot range of a host.
+HOST_SPAN = 1 << 34
+
+
+@dataclass
+class HostAvailability:
+    """Input for one host of a batch run."""
+    user_id: str
+    busy_times: Sequence[Tuple[datetime, datetime]]
+    slot_settings: SlotSettings
+
+
+@dataclass
+class HostSlots:
+    """
+    Free slots of one host as epoch-second arrays.
+
+    `utc_offsets` and `end_offsets` hold, per slot, the UTC offsets (in
+    seconds) that the per-user path serializes its start and end with, so
+    `to_dicts` reproduces its output exactly.
+    """
+    starts: np.ndarray
+    ends: np.ndarray
+    utc_offsets: np.ndarray
+    end_offsets: np.ndarray
+
+    def to_dicts(self) -> List[dict]:
+        slots = []
+        tz_cache = {}
+
+        def tz_of(offset):
+            tz = tz_cache.get(offset)
+            if tz is None:
+                tz = tz_cache[offset] = timezone(timedelta(seconds=offset))
+            return tz
+
+        for start, end, start_offset, end_offset in zip(self.starts.tolist(), self.ends.tolist(),
+                                                        self.utc_offsets.tolist(), self.end_offsets.tolist()):
+            start_iso = datetime.fromtimestamp(start, tz_of(start_offset)).isoformat()
+            slots.append({
+                'slotId': start_iso,
+                'startTime': start_iso,
+                'endTime': datetime.fromtimestamp(end, tz_of(end_offset)).isoformat(),
+                'status': 'available'
+            })
+        return slots
+
+
+def _candidate_slots(slot_settings: SlotSettings, now: datetime,
+                     days: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the start epochs and start/end UTC offsets of every slot in the working-hours windows."""
+    transitions = zone_transitions(slot_settings.timezone)
+    duration = slot_settings.slot_duration_minutes * 60
+    today = now.astimezone(slot_settings.timezone).date()
+
+    run_starts, run_counts, run_days = [], [], []
+    for i in range(days):
+        current_day = today + timedelta(days=i)
+        day_index = local_day_start(current_day) // DAY_SECONDS
+        for window_start, first, stop in day_slot_runs(slot_settings, transitions, current_day):
+            run_starts.append(window_start + first * duration)
+            run_counts.append(stop - first)
+            run_days.append(day_index)
+
+    counts = np.asarray(run_counts, dtype=np.int64)
+    total = int(counts.sum())
+    # Index of each slot within its run: 0, 1, ..., count - 1 for every run.
+    first_of_run = np.repeat(np.cumsum(counts) - counts, counts)
+    within_run = np.arange(total, dtype=np.int64) - first_of_run
+    starts = np.repeat(np.asarray(run_starts, dtype=np.int64), counts) + within_run * duration
+
+    period_starts = np.asarray(transitions.starts, dtype=np.int64)
+    period_offsets = np.asarray(transitions.offsets, dtype=np.int32)
+    start_offsets = period_offsets[np.searchsorted(period_starts, starts, side='right') - 1]
+    end_offsets = period_offsets[np.searchsorted(period_starts, starts + duration, side='right') - 1]
+    # Where a DST overlap repeats midnight, a slot may still start on the day before.
+    on_day = (starts + start_offsets) // DAY_SECONDS == np.repeat(np.asarray(run_days, dtype=np.int64), counts)
+    return starts[on_day], start_offsets[on_day], end_offsets[on_day]
+
+
+def compute_available_slots_batch(
+    hosts: Sequence[HostAvailability],
+    now: Optional[datetime] = None,
+    days: int = SLOT_HORIZON_DAYS,
+) -> Dict[str, HostSlots]:
+    """
+    Computes free slots for many hosts at once.
+
+    Candidate slots are generated once per distinct set of slot settings. All
+    hosts' busy intervals are then laid out on a single shifted timeline and the
+    overlap test for every candidate is one `searchsorted` over that timeline.
+    The result matches `slot_engine.compute_available_slots` for each host.
+
+    Args:
+        hosts: The hosts to generate slots for.
+        now: Slots starting at or before this instant are skipped. Defaults to the current time.
+        days: Number of days, starting from today in each host's timezone, to generate slots for.
+
+    Returns:
+        A dict mapping each host's user ID to its free slots.
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+    now_ts = now.timestamp()
+
+    candidates_by_settings = {}
+    cand_starts, cand_ends, cand_offsets, cand_end_offsets, cand_counts = [], [], [], [], []
+    busy_starts, busy_ends, busy_counts = [], [], []
+    for host_index, host in enumerate(hosts):
+        slot_settings = host.slot_settings
+        if slot_settings.slot_duration_minutes <= 0:
+            raise ValueError("slotDuration must be a positive number of minutes.")
+        candidates = candidates_by_settings.get(slot_settings)
+        if candidates is None:
+            candidates = candidates_by_settings[slot_settings] = _candidate_slots(slot_settings, now, days)
+        starts, offsets, end_offsets = candidates
+        base = host_index * HOST_SPAN
+
+        cand_starts.append(starts + base)
+        cand_ends.append(starts + (base + slot_settings.slot_duration_minutes * 60))
+        cand_offsets.append(offsets)
+        cand_end_offsets.append(end_offsets)
+        cand_counts.append(len(starts))
+
+        busy_starts.extend(busy_start.timestamp() for busy_start, _ in host.busy_times)
+        busy_ends.extend(busy_end.timestamp() for _, busy_end in host.busy_times)
+        busy_counts.append(len(host.busy_times))
+
+    if not hosts:
+        return {}
+
+    starts = np.concatenate(cand_starts)
+    ends = np.concatenate(cand_ends)
+    offsets = np.concatenate(cand_offsets)
+    end_offsets = np.concatenate(cand_end_offsets)
+    host_of_slot = np.repeat(np.arange(len(hosts), dtype=np.int64), cand_counts)
+
+    busy_base = np.repeat(np.arange(len(hosts), dtype=np.int64) * HOST_SPAN, busy_counts)
+    # Slot boundaries are whole seconds, so flooring starts and ceiling ends keeps the overlap test exact.
+    busy_starts = busy_base + np.floor(np.asarray(busy_starts, dtype=np.float64)).astype(np.int64)
+    busy_ends = busy_base + np.ceil(np.asarray(busy_ends, dtype=np.float64)).astype(np.int64)
+    non_empty = busy_ends > busy_starts
+    busy_starts, busy_ends = busy_starts[non_empty], busy_ends[non_empty]
+    order = np.argsort(busy_starts, kind='stable')
+    busy_starts = busy_starts[order]
+    # Running max of ends: the furthest any busy interval starting at or before i reaches.
+    busy_reach = np.maximum.accumulate(busy_ends[order]) if len(order) else busy_ends
+
+    # The last busy interval starting before each slot ends overlaps it iff its reach passes the slot start.
+    last_before_end = np.searchsorted(busy_starts, ends, side='left') - 1
+    has_busy = last_before_end >= 0
+    overlaps = np.zeros(len(starts), dtype=bool)
+    overlaps[has_busy] = busy_reach[last_before_end[has_busy]] > starts[has_busy]
+
+    local_starts = starts - host_of_slot * HOST_SPAN
+    free = ~overlaps & (local_starts > now_ts)
+
+    free_hosts = host_of_slot[free]
+    free_starts = local_starts[free]
+    free_ends = ends[free] - free_hosts * HOST_SPAN
+    free_offsets = offsets[free]
+    free_end_offsets = end_offsets[free]
+    bounds = np.searchsorted(free_hosts, np.arange(len(hosts) + 1), side='left')
+
+    return {
+        host.user_id: HostSlots(
+            starts=free_starts[bounds[i]:bounds[i + 1]],
+            ends=free_ends[bounds[i]:bounds[i + 1]],
+            utc_offsets=free_offsets[bounds[i]:bounds[i + 1]],
+            end_offsets=free_end_offsets[bounds[i]:bounds[i + 1]],
+        )
+        for i, host in enumerate(hosts)
+    }
@@ -0,0 +1,83 @@
+"""
+Load test for the signed-in user caches.
+
+Replays dashboard page loads (GET /api/user/me, /api/user/me/settings and
+/api/user/me/slots with one bearer token), with a settings update every 10
+loads, and reports Firestore user document reads and JWT decodes per
+authenticated request with the token/profile caches enabled and disabled.
+
+Run from the backend directory:
+    python -m benchmarks.bench_auth_context
+"""
+import time
+from unittest import mock
+
+from benchmarks.fixtures import auth_headers, configure_app_env, fixed_now, metrics_headers
+
+configure_app_env()
+
+import jwt
+from fastapi.testclient import TestClient
+
+import auth
+import main as api
+import slot_store
+from slot_engine import SlotSettings, compute_available_slots
+from user_context import user_profiles
+from benchmarks.fake_firestore import FakeAsyncFirestore, FakeFirestore
+
+PAGE_LOADS = 1_000
+UPDATE_EVERY = 10
+SETTINGS = {'workingHours': {'start': '09:00', 'end': '17:00'}, 'slotDuration': 30,
+            'timezone': 'Asia/Tokyo', 'workingDays': [0, 1, 2, 3, 4]}
+
+
+def seed(db):
+    now = fixed_now()
+    db.collection('users').document('host-1').set({
+        'userId': 'host-1', 'email': 'host@example.com', 'publicUrlToken': 'public-token', 'settings': SETTINGS})
+    slot_store.save_regenerated_slots(db, 'host-1', compute_available_slots([], SlotSettings.from_user_settings(SETTINGS), now), now)
+
+
+def run(cached):
+    db = FakeFirestore()
+    api.db = db
+    api.async_db = FakeAsyncFirestore(db)
+    seed(db)
+    for cache in (auth.verified_tokens, user_profiles, slot_store.slots_cache):
+        cache.clear()
+        cache.reset_stats()
+        cache.ttl = 300 if cached else 0
+    auth.auth_stats.clear()
+
+    headers = auth_headers('host-1')
+    client = TestClient(api.app)
+    db.reset_stats()
+    started = time.perf_counter()
+    with mock.patch.object(auth.jwt, 'decode', wraps=jwt.decode) as decode:
+        for load in range(PAGE_LOADS):
+            for path in ('/api/user/me', '/api/user/me/settings', '/api/user/me/slots'):
+                response = client.get(path, headers=headers)
+                assert response.status_code == 200, response.text
+            if load % UPDATE_EVERY == UPDATE_EVERY - 1:
+                response = client.put('/api/user/me/settings', headers=headers,
+                                      json={**SETTINGS, 'slotDuration': 30 + 15 * (load % 2)})
+                assert response.status_code == 204, response.text
+                expected = 30 + 15 * (load % 2)
+                assert client.get('/api/user/me/settings', headers=headers).json()['slotDuration'] == expected
+    elapsed = time.perf_counter() - started
+
+    label = 'cached' if cached else 'uncached'
+    reads = client.get('/api/cache/stats', headers=metrics_headers()).json()['authReads']
+    print(f"{label:<9} requests={reads['requests']}  user reads={reads['userReads']:5} "
+          f"per request={reads['readsPerRequest']:.3f}  JWT decodes={decode.call_count:5}  "
+          f"Firestore reads={db.stats['reads']:6}  wall={elapsed:5.2f} s")
+
+
+def main():
+    run(cached=False)
+    run(cached=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+On-the-fly availability (GET /api/slots/public/{token}/availability) over a
+180-day range.
+
+Runs the app in-process with the in-memory Firestore double and the fake
+Calendar server. Pages through the whole range, checks that the pages add up
+to exactly the slots of one full computation, and reports per-page latency,
+the peak memory of a page against computing the whole range at once, and the
+number of freebusy requests with a cold and a warm busy-interval cache.
+
+Run from the backend directory:
+    python -m benchmarks.bench_availability
+"""
+import asyncio
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from benchmarks.fixtures import configure_app_env
+
+configure_app_env()
+
+import httpx
+
+import main as api
+from calendar_client import AsyncCalendarClient
+from calendar_pool import CalendarServicePool
+from freebusy import busy_cache
+from slot_engine import SlotSettings, compute_available_slots, parse_busy_intervals
+from benchmarks.fake_calendar import FakeCalendar, FakeCalendarServer
+from benchmarks.fake_firestore import FakeAsyncFirestore, FakeFirestore
+from benchmarks.fixtures import random_busy_intervals
+
+RANGE_DAYS = 180
+USER_ID = 'host-1'
+SETTINGS = {'workingHours': {'start': '09:00', 'end': '18:00'}, 'slotDuration': 30,
+            'timezone': 'Asia/Tokyo', 'workingDays': [0, 1, 2, 3, 4]}
+
+
+async def page_through(client, params):
+    pages, slots, latencies = 0, [], []
+    cursor = None
+    while True:
+        started = time.perf_counter()
+        response = await client.get('/api/slots/public/public-token/availability',
+                                    params={**params, **({'cursor': cursor} if cursor else {})})
+        latencies.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.text
+        body = response.json()
+        pages += 1
+        slots.extend(body['slots'])
+        cursor = body['nextCursor']
+        if cursor is None:
+            return pages, slots, sorted(latencies)
+
+
+def expected_slots(calendar, slot_settings, date_from, date_to, now):
+    busy = [interval for event in calendar.calendars['primary'].values()
+            for interval in parse_busy_intervals([{'start': event['start']['dateTime'],
+                                                   'end': event['end']['dateTime']}])]
+    days = (date_to - now.date()).days + 1
+    return [slot for slot in compute_available_slots(busy, slot_settings, now, days=days)
+            if datetime.fromisoformat(slot['startTime']).date() >= date_from]
+
+
+async def run(client, calendar, label, duration=None, limit=100):
+    slot_settings = SlotSettings.from_user_settings(SETTINGS)
+    now = datetime.now(slot_settings.timezone)
+    date_from, date_to = now.date(), now.date() + timedelta(days=RANGE_DAYS - 1)
+    params = {'from': date_from.isoformat(), 'to': date_to.isoformat(), 'limit': limit}
+    if duration:
+        params['duration'] = duration
+        slot_settings = SlotSettings.from_user_settings({**SETTINGS, 'slotDuration': duration})
+
+    busy_cache.clear()
+    for warm in (False, True):
+        calendar.requests.clear()
+        started = time.perf_counter()
+        pages, slots, latencies = await page_through(client, params)
+        elapsed = time.perf_counter() - started
+        print(f"{label:<24} {'warm' if warm else 'cold'}  pages={pages:<3} slots={len(slots):<5} "
+              f"total={elapsed * 1000:7.1f} ms  page p50={latencies[len(latencies) // 2] * 1000:6.1f} ms "
+              f"max={latencies[-1] * 1000:6.1f} ms  freebusy={calendar.request_count('freebusy')}")
+    assert slots == expected_slots(calendar, slot_settings, date_from, date_to, now), f"{label}: slots differ"
+
+
+async def peak_memory(client, calendar):
+    slot_settings = SlotSettings.from_user_settings(SETTINGS)
+    now = datetime.now(slot_settings.timezone)
+    date_to = now.date() + timedelta(days=RANGE_DAYS - 1)
+
+    tracemalloc.start()
+    await client.get('/api/slots/public/public-token/availability',
+                     params={'to': date_to.isoformat(), 'limit': 100})
+    page_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    expected_slots(calendar, slot_settings, now.date(), date_to, now)
+    full_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"peak memory: one page {page_peak / 1024:7.0f} KiB, whole {RANGE_DAYS}-day range at once "
+          f"{full_peak / 1024:7.0f} KiB")
+
+
+async def main():
+    api.db = FakeFirestore()
+    api.async_db = FakeAsyncFirestore(api.db)
+    api.db.collection('users').document(USER_ID).set({
+        'userId': USER_ID, 'email': 'host@example.com', 'publicUrlToken': 'public-token', 'settings': SETTINGS,
+        'encryptedAccessToken': api.encrypt_token('access'), 'encryptedRefreshToken': api.encrypt_token('refresh'),
+    })
+
+    calendar = FakeCalendar(latency=0.02)
+    now = datetime.now(SlotSettings.from_user_settings(SETTINGS).timezone)
+    for i, interval in enumerate(parse_busy_intervals(random_busy_intervals(3000, now, RANGE_DAYS + 1))):
+        calendar.upsert_event(f"event-{i}", *interval)
+
+    with FakeCalendarServer(calendar) as server:
+        api.calendar_client = AsyncCalendarClient(base_url=server.url)
+        api.calendar_pool = CalendarServicePool(api.build_credentials, client_options={'api_endpoint': server.url})
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            await run(client, calendar, "30 min (host default)")
+            await run(client, calendar, "60 min", duration=60)
+            await run(client, calendar, "15 min, 500 per page", duration=15, limit=500)
+            await peak_memory(client, calendar)
+
+            response = await client.get('/api/slots/public/public-token/availability', params={'cursor': 'nope'})
+            assert response.status_code == 400, response.text
+            response = await client.get('/api/slots/public/public-token/availability',
+                                        params={'from': '2025-02-01', 'to': '2025-01-01'})
+            assert response.status_code == 400, response.text
+        await api.calendar_client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
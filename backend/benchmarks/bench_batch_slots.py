@@ -0,0 +1,71 @@
+"""
+Benchmark for batch_slots.compute_available_slots_batch.
+
+Run from the backend directory:
+    python -m benchmarks.bench_batch_slots
+"""
+import random
+import time
+
+from batch_slots import HostAvailability, compute_available_slots_batch
+from slot_engine import SlotSettings, compute_available_slots, parse_busy_intervals
+from benchmarks.fixtures import fixed_now, random_busy_intervals
+
+TIMEZONES = ['Asia/Tokyo', 'UTC', 'America/New_York', 'Europe/London', 'Australia/Sydney']
+WORKING_HOURS = [{'start': '09:00', 'end': '17:00'}, {'start': '10:00', 'end': '18:30'}, {'start': '08:15', 'end': '12:00'}]
+SLOT_DURATIONS = [15, 30, 45, 60]
+
+
+def make_hosts(count, busy_per_host=40, seed=0):
+    rng = random.Random(seed)
+    now = fixed_now()
+    hosts = []
+    for i in range(count):
+        settings = {
+            'workingHours': rng.choice(WORKING_HOURS),
+            'workingDays': rng.choice([[0, 1, 2, 3, 4], [0, 1, 2, 3, 4, 5], [1, 3]]),
+            'slotDuration': rng.choice(SLOT_DURATIONS),
+            'timezone': rng.choice(TIMEZONES),
+        }
+        busy = random_busy_intervals(busy_per_host, now, 14, seed=seed * 1_000_003 + i)
+        hosts.append(HostAvailability(
+            user_id=f"user-{i}",
+            busy_times=parse_busy_intervals(busy),
+            slot_settings=SlotSettings.from_user_settings(settings),
+        ))
+    return hosts
+
+
+def check_matches_per_user_path(hosts, now):
+    batch = compute_available_slots_batch(hosts, now)
+    for host in hosts:
+        expected = compute_available_slots(host.busy_times, host.slot_settings, now)
+        assert batch[host.user_id].to_dicts() == expected, f"batch output differs for {host.user_id}"
+
+
+def run_case(count):
+    now = fixed_now()
+    hosts = make_hosts(count)
+
+    started = time.perf_counter()
+    result = compute_available_slots_batch(hosts, now)
+    batch_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for host in hosts:
+        compute_available_slots(host.busy_times, host.slot_settings, now)
+    per_user_seconds = time.perf_counter() - started
+
+    slot_count = sum(len(slots.starts) for slots in result.values())
+    print(f"{count:>6} hosts  batch={count / batch_seconds:10.0f} hosts/s  "
+          f"per-user={count / per_user_seconds:8.0f} hosts/s  slots={slot_count}")
+
+
+def main():
+    check_matches_per_user_path(make_hosts(300, seed=1), fixed_now())
+    run_case(1_000)
+    run_case(10_000)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Booking contention benchmark: N parallel bookers against one host.
+
+Each booker books a different slot of the same host, once with the legacy
+single-array layout and once with per-day slot documents. Uses the Firestore
+emulator when FIRESTORE_EMULATOR_HOST is set, otherwise the in-memory double
+with a simulated round-trip latency.
+
+The double aborts conflicting commits like Firestore's optimistic transactions
+do, but does not model server-side locking or real round trips, so its numbers
+only compare the two layouts. Use the emulator for absolute latencies.
+
+Run from the backend directory:
+    python -m benchmarks.bench_booking_contention [bookers]
+    FIRESTORE_EMULATOR_HOST=localhost:8081 python -m benchmarks.bench_booking_contention [bookers]
+"""
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from google.cloud import firestore
+
+import slot_store
+from slot_engine import SlotSettings, compute_available_slots
+from benchmarks.fake_firestore import FakeFirestore
+from benchmarks.fixtures import fixed_now
+
+
+def make_db():
+    if os.getenv("FIRESTORE_EMULATOR_HOST"):
+        return firestore.Client(project=os.getenv("FIRESTORE_PROJECT_ID", "demo-schedule-sync")), "emulator"
+    return FakeFirestore(latency=0.002), "in-memory (2 ms latency, layouts comparable only)"
+
+
+def seed_slots(db, user_id, layout):
+    now = fixed_now()
+    slots = compute_available_slots([], SlotSettings.from_user_settings({}), now)
+    if layout == 'legacy':
+        db.collection('slots').document(user_id).set({'userId': user_id, 'slots': slots})
+    else:
+        slot_store.save_regenerated_slots(db, user_id, slots, now)
+    return [slot['slotId'] for slot in slots]
+
+
+def book_legacy(db, user_id, slot_id):
+    return slot_store.book_slot_in_transaction(db.transaction(), db, user_id, slot_id)
+
+
+def run(db, layout, bookers):
+    user_id = f"bench-{layout}-{uuid.uuid4().hex[:8]}"
+    all_slot_ids = seed_slots(db, user_id, layout)
+    # Spread the bookers over the whole horizon, as real traffic would be.
+    slot_ids = all_slot_ids[::max(len(all_slot_ids) // bookers, 1)][:bookers]
+    book = book_legacy if layout == 'legacy' else slot_store.book_slot
+    aborts_before = db.stats['aborts'] if isinstance(db, FakeFirestore) else None
+
+    def attempt(slot_id):
+        started = time.perf_counter()
+        try:
+            book(db, user_id, slot_id)
+            return True, time.perf_counter() - started
+        except ValueError:
+            # Raised when the transaction keeps conflicting past its retry budget.
+            return False, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=bookers) as pool:
+        results = list(pool.map(attempt, slot_ids))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for _, latency in results)
+    failed = sum(1 for ok, _ in results if not ok)
+    line = (f"{layout:<7} bookers={len(slot_ids):<4} failed={failed:<4} wall={elapsed * 1000:8.1f} ms  "
+            f"p50={latencies[len(latencies) // 2] * 1000:7.1f} ms  max={latencies[-1] * 1000:7.1f} ms")
+    if aborts_before is not None:
+        line += f"  aborted commits={db.stats['aborts'] - aborts_before}"
+    print(line)
+
+
+def main():
+    bookers = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    db, backend = make_db()
+    print(f"Firestore: {backend}")
+    for layout in ('legacy', 'daily'):
+        run(db, layout, bookers)
+
+
+if __name__ == "__main__":
+    main()
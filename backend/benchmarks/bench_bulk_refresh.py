@@ -0,0 +1,113 @@
+"""
+Bulk slot refresh (refresh_slots.BulkRefresh) against the in-memory Firestore
+double and the fake Calendar server.
+
+Reports throughput with 1 and 16 workers, checks that the per-project rate
+limit holds, compares Firestore commits of batched writes with one
+transaction per host, and checks that an interrupted run resumes from its
+checkpoint without redoing finished pages.
+
+Run from the backend directory:
+    python -m benchmarks.bench_bulk_refresh
+"""
+import os
+import tempfile
+from datetime import datetime, timezone
+
+from benchmarks.fixtures import configure_app_env
+
+configure_app_env()
+
+import main as api
+from calendar_pool import CalendarServicePool
+from refresh_slots import BulkRefresh
+from slot_store import book_slot, read_slots
+from benchmarks.fake_calendar import FakeCalendar, FakeCalendarServer
+from benchmarks.fake_firestore import FakeFirestore
+
+HOSTS = 400
+SETTINGS = {'workingHours': {'start': '09:00', 'end': '17:00'}, 'slotDuration': 30,
+            'timezone': 'Asia/Tokyo', 'workingDays': [0, 1, 2, 3, 4]}
+
+
+def seed(db):
+    for i in range(HOSTS):
+        user_id = f"host-{i:04d}"
+        user = {'userId': user_id, 'settings': SETTINGS}
+        # Every tenth user never connected their calendar.
+        if i % 10:
+            user['encryptedAccessToken'] = api.encrypt_token(f"access-{i}")
+            user['encryptedRefreshToken'] = api.encrypt_token(f"refresh-{i}")
+        db.collection('users').document(user_id).set(user)
+
+
+def new_refresh(db, server_url, **options):
+    pool = CalendarServicePool(api.build_credentials, client_options={'api_endpoint': server_url})
+    return BulkRefresh(db, pool, page_size=100, **options)
+
+
+class Interrupted(Exception):
+    pass
+
+
+def main():
+    calendar = FakeCalendar(latency=0.01)
+    with FakeCalendarServer(calendar) as server:
+        for workers in (1, 16):
+            db = FakeFirestore()
+            seed(db)
+            metrics = new_refresh(db, server.url, workers=workers, qps=10_000).run()
+            batched_commits = db.stats['commits']
+            print(f"workers={workers:<3} {metrics['hostsPerSecond']:7.1f} hosts/s  refreshed={metrics['refreshed']} "
+                  f"skipped={metrics['skipped']} failed={metrics['failed']} commits={db.stats['commits']}")
+
+        db = FakeFirestore()
+        seed(db)
+        metrics = new_refresh(db, server.url, workers=16, qps=100).run()
+        # The bucket starts full, so the first 100 requests are a burst.
+        sustained = (metrics['calendarRequests'] - 100) / metrics['elapsedSeconds']
+        assert sustained <= 100 * 1.05, sustained
+        print(f"qps=100     {sustained:7.1f} Calendar requests/s after the initial burst  "
+              f"rate limit wait={metrics['rateLimitWaitSeconds']:.1f}s")
+
+        db = FakeFirestore()
+        seed(db)
+        metrics = new_refresh(db, server.url, workers=16, qps=10_000, write_batch=1).run()
+        print(f"write batch=1  commits={db.stats['commits']} (vs {batched_commits} with up to 25 hosts per commit)")
+
+        # Bookings made between refreshes survive.
+        slot_id = read_slots(db, 'host-0001')[0]['slotId']
+        book_slot(db, 'host-0001', slot_id)
+        new_refresh(db, server.url, workers=16, qps=10_000).run()
+        assert next(s for s in read_slots(db, 'host-0001') if s['slotId'] == slot_id)['status'] == 'booked'
+
+        # Interrupt after two pages, then resume from the checkpoint.
+        checkpoint = os.path.join(tempfile.mkdtemp(), 'refresh_checkpoint.json')
+        db = FakeFirestore()
+        seed(db)
+        first = new_refresh(db, server.url, workers=16, qps=10_000, checkpoint=checkpoint)
+        original_refresh_page = first._refresh_page
+        pages = []
+
+        def refresh_page_then_stop(executor, page, now):
+            if len(pages) == 2:
+                raise Interrupted()
+            pages.append(page)
+            original_refresh_page(executor, page, now)
+
+        first._refresh_page = refresh_page_then_stop
+        try:
+            first.run()
+        except Interrupted:
+            pass
+        calendar.requests.clear()
+        metrics = new_refresh(db, server.url, workers=16, qps=10_000, checkpoint=checkpoint).run(
+            now=datetime.now(timezone.utc))
+        assert metrics['hosts'] == HOSTS and calendar.request_count('freebusy') == (HOSTS - 200) // 10 * 9
+        assert not os.path.exists(checkpoint)
+        print(f"resumed     hosts={metrics['hosts']} refreshed={metrics['refreshed']} "
+              f"freebusy calls after resume={calendar.request_count('freebusy')}")
+
+
+if __name__ == "__main__":
+    main()
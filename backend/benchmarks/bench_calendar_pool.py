@@ -0,0 +1,78 @@
+"""
+Per-request overhead of getting a Calendar service: built per request vs pooled.
+
+Each request re-reads the user document (as the handlers do), gets a service
+and runs one freebusy query against the fake Calendar server. "fresh" users
+have a valid stored access token; "expired" users have one that must be
+refreshed. Reports time per request, OAuth token refreshes and new TCP
+connections.
+
+Run from the backend directory:
+    python -m benchmarks.bench_calendar_pool
+"""
+import time
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.fixtures import configure_app_env
+
+configure_app_env()
+
+import main as api
+from calendar_pool import CalendarServicePool
+from calendar_sync import fetch_busy_times
+from benchmarks.fake_calendar import FakeCalendar, FakeCalendarServer
+from benchmarks.fake_firestore import FakeFirestore
+
+REQUESTS = 200
+USER_ID = 'host-1'
+
+
+def seed_user(db, expired):
+    expiry = datetime.now(timezone.utc) + (timedelta(minutes=-5) if expired else timedelta(minutes=30))
+    db.collection('users').document(USER_ID).set({
+        'userId': USER_ID,
+        'encryptedAccessToken': api.encrypt_token('stored-access-token'),
+        'encryptedRefreshToken': api.encrypt_token('stored-refresh-token'),
+        'accessTokenExpiry': expiry,
+    })
+
+
+def run(label, calendar, pooled):
+    start = datetime.now(timezone.utc)
+    calendar.requests.clear()
+    calendar.connections = 0
+    api.calendar_pool.clear()
+
+    started = time.perf_counter()
+    for _ in range(REQUESTS):
+        user_data = api.db.collection('users').document(USER_ID).get().to_dict()
+        if pooled:
+            with api.calendar_pool.service(USER_ID, user_data) as service:
+                fetch_busy_times(service, start, start + timedelta(days=14))
+            api.save_refreshed_token(USER_ID)
+        else:
+            service = api.build_calendar_service(user_data)
+            fetch_busy_times(service, start, start + timedelta(days=14))
+    elapsed = time.perf_counter() - started
+
+    print(f"{label:<24} {elapsed / REQUESTS * 1000:7.2f} ms/request  "
+          f"token refreshes={calendar.request_count('token'):<4} connections={calendar.connections}")
+
+
+def main():
+    calendar = FakeCalendar()
+    with FakeCalendarServer(calendar) as server:
+        api.client_config['web']['token_uri'] = server.url + 'token'
+        api.CALENDAR_CLIENT_OPTIONS = {'api_endpoint': server.url}
+        api.calendar_pool = CalendarServicePool(api.build_credentials, client_options=api.CALENDAR_CLIENT_OPTIONS)
+        api.db = FakeFirestore()
+
+        for expired in (False, True):
+            for pooled in (False, True):
+                seed_user(api.db, expired)
+                label = f"{'pooled' if pooled else 'build per request'} ({'expired' if expired else 'fresh'})"
+                run(label, calendar, pooled)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Token decryption, refresh and write-back per slot regeneration, and key rotation.
+
+Runs POST /api/user/me/slots/generate in-process for HOSTS hosts against the
+in-memory Firestore double and the fake Calendar (and OAuth token) server, in
+three rounds that model two API processes:
+
+- steady: stored tokens are valid; counts Fernet decryptions per request.
+- process A: an hour later every access token has expired; CONCURRENT
+  requests per host arrive at once, so each host's token is refreshed and
+  written back.
+- process B: the other process, whose pool still holds the expired tokens,
+  gets the same requests after A stored the new ones.
+
+"baseline" runs the same rounds without the decrypted-token cache, with every
+request refreshing an expired token itself, without taking over tokens
+another process stored and with a Firestore commit per refreshed token.
+Finally times re-encrypting ROTATION_USERS users' tokens after a key rotation.
+
+Run from the backend directory:
+    python -m benchmarks.bench_credentials
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.fixtures import auth_headers, configure_app_env
+
+configure_app_env()
+
+import httpx
+from cryptography.fernet import Fernet
+from google.auth.transport.requests import Request as GoogleAuthRequest
+
+import main as api
+from calendar_client import AsyncCalendarClient
+from calendar_pool import CalendarServicePool
+from rotate_tokens import rotate_stored_tokens
+from token_crypto import TokenCipher, decrypted_tokens, token_stats
+from user_context import user_profiles
+from benchmarks.fake_calendar import FakeCalendar, FakeCalendarServer
+from benchmarks.fake_firestore import FakeAsyncFirestore, FakeFirestore
+
+HOSTS = 50
+STEADY_REQUESTS = 4
+CONCURRENT = 8
+ROTATION_USERS = 2_000
+SETTINGS = {'workingHours': {'start': '09:00', 'end': '17:00'}, 'slotDuration': 30,
+            'timezone': 'Asia/Tokyo', 'workingDays': [0, 1, 2, 3, 4]}
+
+
+class UnsharedRefreshClient(AsyncCalendarClient):
+    """Every request refreshes an expired token itself."""
+
+    async def _authorize(self, credentials) -> dict:
+        if not credentials.valid:
+            await asyncio.to_thread(credentials.refresh, GoogleAuthRequest())
+        return {'Authorization': f"Bearer {credentials.token}"}
+
+
+class NoAdoptionPool(CalendarServicePool):
+    """Keeps an expired token even when the user document holds a newer one."""
+
+    def _adopt_stored_token(self, entry, user_data):
+        pass
+
+
+def seed(hosts):
+    api.db = FakeFirestore()
+    api.async_db = FakeAsyncFirestore(api.db)
+    for user_id in hosts:
+        api.db.collection('users').document(user_id).set({
+            'userId': user_id, 'email': f"{user_id}@example.com", 'publicUrlToken': f"{user_id}-token",
+            'encryptedAccessToken': api.encrypt_token(f"access-{user_id}"),
+            'encryptedRefreshToken': api.encrypt_token(f"refresh-{user_id}"),
+            'accessTokenExpiry': datetime.now(timezone.utc) + timedelta(minutes=50),
+            'settings': SETTINGS,
+        })
+
+
+def expire_tokens(hosts, pools):
+    """An hour passes: the stored tokens and the ones the pools hold have expired."""
+    expired = datetime.now(timezone.utc) - timedelta(minutes=10)
+    for user_id in hosts:
+        api.db.collection('users').document(user_id).update({'accessTokenExpiry': expired})
+        for pool in pools:
+            entry = pool._entries.get(user_id)
+            if entry is not None:
+                entry.credentials.expiry = expired.replace(tzinfo=None)
+
+
+async def regenerate(client, hosts, per_host):
+    requests = [client.post('/api/user/me/slots/generate', headers=auth_headers(user_id))
+                for user_id in hosts for _ in range(per_host)]
+    for response in await asyncio.gather(*requests):
+        assert response.status_code == 200, response.text
+
+
+async def run(label, calendar, server_url, baseline):
+    hosts = [f"host-{n}" for n in range(HOSTS)]
+    seed(hosts)
+    pool_class = NoAdoptionPool if baseline else CalendarServicePool
+    pool_a = pool_class(api.build_credentials, client_options={'api_endpoint': server_url})
+    pool_b = pool_class(api.build_credentials, client_options={'api_endpoint': server_url})
+    api.calendar_client = (UnsharedRefreshClient if baseline else AsyncCalendarClient)(base_url=server_url)
+    api.token_writes.batch_size = 1 if baseline else 500
+    api.token_writes.stats.clear()
+    decrypted_tokens.clear()
+    decrypted_tokens.ttl = 0 if baseline else 3600
+    api.busy_cache.ttl = 0
+
+    rows = []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://bench") as client:
+        for round_label, pool, per_host in (('steady', pool_b, STEADY_REQUESTS), ('process A', pool_a, CONCURRENT),
+                                            ('process B', pool_b, CONCURRENT)):
+            if round_label == 'process A':
+                expire_tokens(hosts, (pool_a, pool_b))
+            api.calendar_pool = pool
+            user_profiles.clear()  # Each process has its own profile cache.
+            calendar.requests.clear()
+            token_stats.clear()
+            batches_before = api.token_writes.stats['batches']
+            started = time.perf_counter()
+            await regenerate(client, hosts, per_host)
+            await api.token_writes.flush_async(api.async_db)
+            elapsed = time.perf_counter() - started
+            rows.append((round_label, HOSTS * per_host, token_stats['decrypts'], calendar.request_count('token'),
+                         api.token_writes.stats['batches'] - batches_before, elapsed))
+    await api.calendar_client.aclose()
+
+    print(f"{label}:  (adopted tokens in process B: {pool_b.adopted_tokens})")
+    for round_label, requests, decrypts, refreshes, commits, elapsed in rows:
+        print(f"  {round_label:<10} requests={requests:4}  decrypts/request={decrypts / requests:5.2f}  "
+              f"token refreshes={refreshes:4}  token write commits={commits:4}  wall={elapsed:6.2f} s")
+
+
+def bench_rotation():
+    old_key, new_key = Fernet.generate_key().decode(), Fernet.generate_key().decode()
+    old_cipher = TokenCipher([old_key])
+    db = FakeFirestore()
+    for n in range(ROTATION_USERS):
+        db.collection('users').document(f"user-{n:05}").set({
+            'encryptedAccessToken': old_cipher.encrypt(f"access-{n}"),
+            'encryptedRefreshToken': old_cipher.encrypt(f"refresh-{n}")})
+
+    rotating_cipher = TokenCipher([new_key, old_key])
+    for attempt in ('first pass', 'second pass'):
+        started = time.perf_counter()
+        stats = rotate_stored_tokens(db, rotating_cipher)
+        print(f"rotation {attempt:<12} {dict(stats)}  {time.perf_counter() - started:6.2f} s")
+
+    new_cipher = TokenCipher([new_key])
+    decrypted_tokens.clear()
+    for user_doc in db.collection('users').stream():
+        new_cipher.decrypt(user_doc.to_dict()['encryptedRefreshToken'])
+    print(f"every token decrypts with the new key alone ({ROTATION_USERS} users)")
+
+    token = old_cipher.encrypt('x' * 180)
+    started = time.perf_counter()
+    for _ in range(10_000):
+        old_cipher._fernet.decrypt(token.encode())
+    decrypt_us = (time.perf_counter() - started) / 10_000 * 1e6
+    decrypted_tokens.ttl = 3600
+    old_cipher.decrypt(token, 'bench-user', 'encryptedRefreshToken')
+    started = time.perf_counter()
+    for _ in range(10_000):
+        old_cipher.decrypt(token, 'bench-user', 'encryptedRefreshToken')
+    cached_us = (time.perf_counter() - started) / 10_000 * 1e6
+    print(f"Fernet decrypt {decrypt_us:6.1f} us   cached decrypt {cached_us:6.1f} us")
+
+
+async def main():
+    calendar = FakeCalendar(latency=0.01)
+    with FakeCalendarServer(calendar) as server:
+        api.client_config['web']['token_uri'] = server.url + 'token'
+        for label, baseline in (('baseline', True), ('current', False)):
+            await run(label, calendar, server.url, baseline)
+    print()
+    bench_rotation()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
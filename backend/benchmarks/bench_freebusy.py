@@ -0,0 +1,153 @@
+"""
+Multi-calendar freebusy queries and the busy-interval cache, against the fake
+Calendar server.
+
+Checks that batched queries return the same intervals as one query per
+calendar while needing a request per 50 calendars, that per-calendar errors
+are reported without losing the other calendars, and that repeated slot
+generations within the cache TTL reuse the cached intervals until the
+calendar changes or the entries expire. Runs both the googleapiclient and the
+async client path.
+
+Run from the backend directory:
+    python -m benchmarks.bench_freebusy
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from google.oauth2.credentials import Credentials
+
+import freebusy
+from cache import TTLCache
+from calendar_client import AsyncCalendarClient
+from calendar_sync import (fetch_busy_times, fetch_busy_times_by_calendar, regenerate_slots_for_dates,
+                           sync_user_calendar)
+from freebusy import FreeBusyCalendarError
+from slot_engine import SlotSettings, compute_available_slots, parse_busy_intervals
+from slot_store import read_slots, slots_cache
+from benchmarks.fake_calendar import FakeCalendar, FakeCalendarServer, calendar_service
+from benchmarks.fake_firestore import FakeFirestore
+from benchmarks.fixtures import fixed_now, random_busy_intervals
+
+TEAM_SIZE = 120
+USER_ID = 'host-1'
+CALENDAR_IDS = ['primary', 'team@example.com', 'holidays@example.com']
+SETTINGS = {'workingHours': {'start': '09:00', 'end': '17:00'}, 'slotDuration': 30,
+            'timezone': 'Asia/Tokyo', 'workingDays': [0, 1, 2, 3, 4], 'calendarIds': CALENDAR_IDS}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def seed_calendar(calendar, calendar_id, now, seed):
+    calendar.add_calendar(calendar_id)
+    for i, interval in enumerate(parse_busy_intervals(random_busy_intervals(40, now, 14, seed=seed))):
+        calendar.upsert_event(f"{calendar_id}-{i}", *interval, calendar_id=calendar_id)
+
+
+def check_batching(calendar, service, now):
+    members = [f"member-{i:03d}@example.com" for i in range(TEAM_SIZE)]
+    for seed, member in enumerate(members):
+        seed_calendar(calendar, member, now, seed)
+    time_max = now + timedelta(days=14)
+
+    calendar.requests.clear()
+    started = time.perf_counter()
+    one_by_one = {member: fetch_busy_times(service, now, time_max, [member]) for member in members}
+    single_seconds = time.perf_counter() - started
+    single_requests = calendar.request_count('freebusy')
+
+    calendar.requests.clear()
+    started = time.perf_counter()
+    batched = fetch_busy_times_by_calendar(service, members, now, time_max)
+    batched_seconds = time.perf_counter() - started
+    assert batched == one_by_one
+    assert calendar.request_count('freebusy') == -(-TEAM_SIZE // freebusy.FREEBUSY_MAX_CALENDARS)
+    print(f"{TEAM_SIZE} calendars: one per query {single_requests} requests {single_seconds * 1000:6.1f} ms, "
+          f"batched {calendar.request_count('freebusy')} requests {batched_seconds * 1000:6.1f} ms")
+
+    try:
+        fetch_busy_times_by_calendar(service, members[:2] + ['gone@example.com'], now, time_max)
+        raise AssertionError("expected FreeBusyCalendarError")
+    except FreeBusyCalendarError as error:
+        assert error.errors == {'gone@example.com': 'notFound'} and set(error.busy) == set(members[:2])
+        print(f"unknown calendar: {error}")
+
+
+def check_cache(calendar, service, now, clock):
+    db = FakeFirestore()
+    slot_settings = SlotSettings.from_user_settings(SETTINGS)
+    for seed, calendar_id in enumerate(CALENDAR_IDS):
+        seed_calendar(calendar, calendar_id, now, 1000 + seed)
+
+    def generate(at):
+        calendar.requests.clear()
+        regenerate_slots_for_dates(db, service, USER_ID, slot_settings, at, calendar_ids=CALENDAR_IDS)
+        slots_cache.clear()
+        return calendar.request_count('freebusy')
+
+    def expected_slots(at):
+        busy = fetch_busy_times(service, at, at + timedelta(days=14), CALENDAR_IDS)
+        return compute_available_slots(busy, slot_settings, at)
+
+    assert generate(now) == 1, "all calendars of a host go in one query"
+    assert read_slots(db, USER_ID) == expected_slots(now)
+
+    # A minute later the window has moved on, but is still covered by what was fetched.
+    clock.now += 60
+    later = now + timedelta(minutes=1)
+    assert generate(later) == 0
+    assert read_slots(db, USER_ID) == expected_slots(later)
+    print("generation 1 minute later: 0 freebusy requests, slots identical to an uncached generation")
+
+    # An event on the primary calendar reaches the incremental sync, which drops the cached intervals.
+    event_day = now + timedelta(days=1)
+    calendar.upsert_event('new-meeting', event_day.replace(hour=10), event_day.replace(hour=12))
+    sync_user_calendar(db, service, USER_ID, {'settings': SETTINGS}, now=later)
+    slots_cache.clear()
+    assert [slot for slot in read_slots(db, USER_ID) if slot['status'] == 'available'] == expected_slots(later)
+    assert generate(later) == 0, "the sync refilled the cache"
+    print("calendar change: the incremental sync refetched, the next generation reused its result")
+
+    clock.now += freebusy.busy_cache.ttl
+    assert generate(later) == 1
+    print(f"after the {freebusy.busy_cache.ttl:.0f}s TTL: refetched")
+
+
+async def check_async(calendar, server_url, now):
+    client = AsyncCalendarClient(base_url=server_url)
+    members = [f"member-{i:03d}@example.com" for i in range(TEAM_SIZE)]
+    time_max = now + timedelta(days=14)
+    expected = fetch_busy_times_by_calendar(calendar_service(server_url), members, now, time_max)
+    calendar.requests.clear()
+    # The fake does not check tokens; an unexpired access token is enough.
+    credentials = Credentials('access', expiry=datetime.utcnow() + timedelta(hours=1))
+    busy = await client.fetch_busy_times_by_calendar(credentials, members, now, time_max, owner='team-page')
+    assert busy == expected
+    calendar.requests.clear()
+    assert await client.fetch_busy_times_by_calendar(credentials, members, now, time_max, owner='team-page') == busy
+    assert calendar.request_count('freebusy') == 0
+    await client.aclose()
+    print(f"async client: {TEAM_SIZE} calendars identical to the sync path, second call served from the cache")
+
+
+def main():
+    now = fixed_now()
+    clock = FakeClock()
+    freebusy.busy_cache = TTLCache(maxsize=4096, ttl=120, clock=clock)
+    calendar = FakeCalendar()
+    with FakeCalendarServer(calendar) as server:
+        service = calendar_service(server.url)
+        check_batching(calendar, service, now)
+        check_cache(calendar, service, now, clock)
+        asyncio.run(check_async(calendar, server.url, now))
+
+
+if __name__ == "__main__":
+    main()
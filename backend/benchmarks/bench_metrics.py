@@ -0,0 +1,161 @@
+"""
+Where the time of a booking and a slot regeneration goes, and what measuring it costs.
+
+Runs POST /api/bookings (BOOKING_MODE=sync) and POST
+/api/user/me/slots/generate in-process against the in-memory Firestore double
+and the fake Calendar server, both with latency, then reads GET /metrics back
+and prints the per-route and per-span breakdown, one request's Server-Timing
+header and a sampled profile of one regeneration. Finally compares a trivial
+route with and without the metrics middleware to show the per-request cost.
+
+Run from the backend directory:
+    python -m benchmarks.bench_metrics
+"""
+import asyncio
+import re
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from benchmarks.fixtures import auth_headers, configure_app_env, metrics_headers
+
+configure_app_env()
+
+import httpx
+from fastapi import FastAPI
+
+import main as api
+import metrics
+from booking_queue import BookingQueue
+from calendar_client import AsyncCalendarClient
+from slot_engine import SlotSettings, compute_available_slots
+from slot_store import read_slots, save_regenerated_slots
+from benchmarks.fake_calendar import FakeCalendar, FakeCalendarServer
+from benchmarks.fake_firestore import FakeAsyncFirestore, FakeFirestore
+
+USER_ID = 'host-1'
+SETTINGS = {'workingHours': {'start': '09:00', 'end': '17:00'}, 'slotDuration': 30,
+            'timezone': 'Asia/Tokyo', 'workingDays': [0, 1, 2, 3, 4]}
+BOOKINGS = 20
+REGENERATIONS = 5
+OVERHEAD_REQUESTS = 1_000
+OVERHEAD_ROUNDS = 5
+SERIES = re.compile(r'^(\w+)\{(.*)\} (\S+)$')
+
+
+def scrape(text):
+    """(metric name, labels) -> value for the _sum and _count series of GET /metrics."""
+    values = {}
+    for line in text.splitlines():
+        match = SERIES.match(line)
+        if match and match.group(1).endswith(('_sum', '_count')):
+            labels = tuple(sorted(re.findall(r'(\w+)="([^"]*)"', match.group(2))))
+            values[match.group(1), labels] = float(match.group(3))
+    return values
+
+
+def print_breakdown(text):
+    values = scrape(text)
+    routes = defaultdict(lambda: [0.0, 0.0])
+    for (name, labels), value in values.items():
+        if name.startswith('schedule_sync_http_request_duration_seconds'):
+            key = (dict(labels)['method'], dict(labels)['route'])
+            routes[key][name.endswith('_count')] += value
+    for (method, route), (seconds, count) in sorted(routes.items()):
+        if route.startswith('/api/'):
+            print(f"{method:<5} {route:<32} requests={count:4.0f}  mean={seconds / count * 1000:7.2f} ms")
+
+    spans = defaultdict(lambda: [0.0, 0.0])
+    for (name, labels), value in values.items():
+        if name.startswith('schedule_sync_span_seconds'):
+            spans[dict(labels)['span']][name.endswith('_count')] += value
+    for span_name, (seconds, count) in sorted(spans.items(), key=lambda item: -item[1][0]):
+        print(f"  {span_name:<36} calls={count:5.0f}  total={seconds * 1000:8.1f} ms  "
+              f"mean={seconds / count * 1000:6.2f} ms")
+
+
+def seed(now):
+    api.db = FakeFirestore(latency=0.002)
+    api.async_db = FakeAsyncFirestore(api.db)
+    api.db.collection('users').document(USER_ID).set({
+        'userId': USER_ID, 'email': 'host@example.com', 'publicUrlToken': 'public-token', 'settings': SETTINGS,
+        'encryptedAccessToken': api.encrypt_token('access'), 'encryptedRefreshToken': api.encrypt_token('refresh'),
+    })
+    save_regenerated_slots(api.db, USER_ID,
+                           compute_available_slots([], SlotSettings.from_user_settings(SETTINGS), now), now)
+
+
+async def measure_overhead():
+    bare = FastAPI()
+    bare.get('/hello')(lambda: {'message': 'ok'})
+    measured = FastAPI()
+    measured.get('/hello')(lambda: {'message': 'ok'})
+    measured.add_middleware(metrics.RequestMetricsMiddleware)
+
+    # Alternating rounds, best of each: the difference is small next to the noise of one run.
+    results = defaultdict(lambda: float('inf'))
+    for _ in range(OVERHEAD_ROUNDS):
+        for label, app in (('without middleware', bare), ('with middleware', measured)):
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+                await client.get('/hello')
+                started = time.perf_counter()
+                for _ in range(OVERHEAD_REQUESTS):
+                    await client.get('/hello')
+                results[label] = min(results[label], (time.perf_counter() - started) / OVERHEAD_REQUESTS)
+    for label, seconds in results.items():
+        print(f"{label:<20} {seconds * 1e6:7.1f} us/request")
+    print(f"{'middleware cost':<20} {(results['with middleware'] - results['without middleware']) * 1e6:7.1f} "
+          f"us/request")
+
+    started = time.perf_counter()
+    for _ in range(100_000):
+        with metrics.span('bench.noop'):
+            pass
+    print(f"{'one span':<20} {(time.perf_counter() - started) / 100_000 * 1e6:7.2f} us")
+
+
+async def main():
+    # Show the breakdown on the public booking requests too.
+    metrics.SERVER_TIMING = 'all'
+    now = datetime.now(SlotSettings.from_user_settings(SETTINGS).timezone)
+    seed(now)
+    slot_ids = iter([slot['slotId'] for slot in read_slots(api.db, USER_ID)])
+    api.BOOKING_MODE = 'sync'
+
+    calendar = FakeCalendar(latency=0.02)
+    with FakeCalendarServer(calendar) as server:
+        api.calendar_client = AsyncCalendarClient(base_url=server.url)
+        api.booking_queue = BookingQueue(api.process_booking_job, api.fail_booking_job)
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for n in range(BOOKINGS):
+                response = await client.post('/api/bookings', json={
+                    'publicUrlToken': 'public-token', 'slotId': next(slot_ids),
+                    'bookerName': f"Booker {n}", 'bookerEmail': f"booker{n}@example.com"})
+                assert response.status_code == 200, response.text
+            print(f"Server-Timing of a booking: {response.headers['server-timing']}\n")
+
+            headers = auth_headers(USER_ID)
+            for _ in range(REGENERATIONS):
+                api.busy_cache.clear()
+                response = await client.post('/api/user/me/slots/generate', headers=headers)
+                assert response.status_code == 200, response.text
+
+            print_breakdown((await client.get('/metrics', headers=metrics_headers())).text)
+
+            metrics.PROFILE_REQUESTS_KEY = 'bench-profile'
+            api.busy_cache.clear()
+            response = await client.post('/api/user/me/slots/generate',
+                                         headers={**headers, 'X-Profile': 'bench-profile'})
+            assert response.status_code == 200, response.text
+            metrics.PROFILE_REQUESTS_KEY = None
+
+        await api.booking_queue.aclose()
+        await api.calendar_client.aclose()
+
+    print()
+    await measure_overhead()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+"""
+Load test for the public page caches.
+
+Serves 1k views of GET /api/slots/public/{token} for one host, with a booking
+every 100 views, and reports Firestore reads per 1k page views with the
+token/slot caches enabled and disabled.
+
+Run from the backend directory:
+    python -m benchmarks.bench_public_cache
+"""
+from benchmarks.fixtures import configure_app_env, fixed_now, metrics_headers
+
+configure_app_env()
+
+from fastapi.testclient import TestClient
+
+import main as api
+import slot_store
+from slot_engine import SlotSettings, compute_available_slots
+from benchmarks.fake_firestore import FakeAsyncFirestore, FakeFirestore
+
+PAGE_VIEWS = 1_000
+BOOK_EVERY = 100
+
+
+def seed(db):
+    now = fixed_now()
+    db.collection('users').document('host-1').set({
+        'userId': 'host-1', 'email': 'host@example.com', 'publicUrlToken': 'public-token'})
+    slot_store.save_regenerated_slots(db, 'host-1', compute_available_slots([], SlotSettings.from_user_settings({}), now), now)
+
+
+def run(cached):
+    db = FakeFirestore()
+    api.db = db
+    api.async_db = FakeAsyncFirestore(db)
+    seed(db)
+    for cache in (api.public_user_cache, slot_store.slots_cache):
+        cache.clear()
+        cache.reset_stats()
+        cache.ttl = 300 if cached else 0
+
+    client = TestClient(api.app)
+    db.reset_stats()
+    for view in range(PAGE_VIEWS):
+        response = client.get('/api/slots/public/public-token')
+        assert response.status_code == 200
+        if view % BOOK_EVERY == BOOK_EVERY - 1:
+            available = [slot for slot in response.json()['slots'] if slot['status'] == 'available']
+            slot_store.book_slot(db, 'host-1', available[0]['slotId'])
+
+    label = 'cached' if cached else 'uncached'
+    stats = client.get('/api/cache/stats', headers=metrics_headers()).json()
+    print(f"{label:<9} reads per {PAGE_VIEWS} views={db.stats['reads']:6}  "
+          f"token cache hits={stats['publicUsers']['hits']}  slot cache hits={stats['slots']['hits']}")
+
+
+def main():
+    run(cached=False)
+    run(cached=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Packed slot encoding (slot_codec) against the slot-map / JSON list format.
+
+For hosts with a few hundred to a few thousand slots, reports the Firestore
+storage size of the day documents, the size of the public slots response
+(raw and gzipped) and the time to encode and decode, checking that every
+round trip returns the original slots. Then serves GET /api/slots/public/{token}
+in both formats with the in-memory Firestore double and checks that they hold
+the same slots.
+
+Firestore sizes follow the documented storage size rules: strings and field
+names count their UTF-8 length plus one, integers and timestamps 8 bytes,
+bytes their length, and every document 32 bytes plus its name.
+
+Run from the backend directory:
+    python -m benchmarks.bench_slot_encoding
+"""
+import base64
+import gzip
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+from fastapi.testclient import TestClient
+from google.cloud import firestore
+
+import main as api
+import slot_store
+from slot_codec import PackedSlots
+from slot_engine import SlotSettings, compute_available_slots, slot_date
+from benchmarks.fake_firestore import FakeAsyncFirestore, FakeFirestore
+from benchmarks.fixtures import fixed_now
+
+# (label, settings, days): roughly 300, 1.3k and 5k slots.
+HOSTS = [
+    ("30 min, 2 weeks", {'slotDuration': 30}, 14),
+    ("30 min, 8 weeks", {'slotDuration': 30, 'workingDays': [0, 1, 2, 3, 4, 5]}, 56),
+    ("15 min, 12 weeks", {'slotDuration': 15, 'workingHours': {'start': '08:00', 'end': '20:00'},
+                          'timezone': 'America/New_York', 'workingDays': [0, 1, 2, 3, 4, 5, 6]}, 84),
+]
+REPEAT = 20
+
+
+def firestore_size(value) -> int:
+    if isinstance(value, str):
+        return len(value.encode()) + 1
+    if isinstance(value, bytes):
+        return len(value)
+    if value is firestore.SERVER_TIMESTAMP or isinstance(value, datetime):
+        return 8
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, (int, float)):
+        return 8
+    if isinstance(value, dict):
+        return sum(firestore_size(key) + firestore_size(item) for key, item in value.items())
+    if isinstance(value, list):
+        return sum(firestore_size(item) for item in value)
+    raise TypeError(type(value))
+
+
+def day_documents(user_id, slots, packed):
+    slot_store.SLOT_ENCODING = 'packed' if packed else 'map'
+    by_day = {}
+    for slot in slots:
+        by_day.setdefault(slot_date(slot).isoformat(), {})[slot['slotId']] = slot
+    return {f"slots/{user_id}/days/{day_id}": slot_store.day_bucket_doc(day_id, day_slots)
+            for day_id, day_slots in by_day.items()}
+
+
+def storage_size(documents) -> int:
+    return sum(firestore_size(name) + 32 + firestore_size(data) for name, data in documents.items())
+
+
+def timed(function):
+    started = time.perf_counter()
+    for _ in range(REPEAT):
+        result = function()
+    return result, (time.perf_counter() - started) / REPEAT
+
+
+def host_slots(settings, days):
+    now = fixed_now(settings.get('timezone', 'Asia/Tokyo'))
+    slots = compute_available_slots([], SlotSettings.from_user_settings(settings), now, days=days)
+    for slot in slots[::5]:
+        slot['status'] = 'booked'
+    return slots
+
+
+def bench_sizes():
+    for label, settings, days in HOSTS:
+        slots = host_slots(settings, days)
+        legacy_docs = day_documents('host-1', slots, packed=False)
+        packed_docs = day_documents('host-1', slots, packed=True)
+        legacy_json = json.dumps({'userName': 'host@example.com', 'slots': slots}).encode()
+
+        packed, encode_seconds = timed(lambda: PackedSlots.from_slots(slots))
+        compact_json = json.dumps({'userName': 'host@example.com', **packed.to_json()}).encode()
+        decoded, decode_seconds = timed(packed.to_slots)
+        _, parse_seconds = timed(lambda: json.loads(legacy_json))
+        assert decoded == slots, f"{label}: round trip differs"
+        assert slot_store.flatten_day_buckets(FakeSnapshot(data) for data in packed_docs.values()) == slots
+
+        print(f"{label:<17} slots={len(slots):<5} firestore {storage_size(legacy_docs) / 1024:7.1f} KiB -> "
+              f"{storage_size(packed_docs) / 1024:6.1f} KiB  response {len(legacy_json) / 1024:7.1f} KiB -> "
+              f"{len(compact_json) / 1024:5.1f} KiB  gzipped {len(gzip.compress(legacy_json)) / 1024:5.1f} KiB -> "
+              f"{len(gzip.compress(compact_json)) / 1024:4.1f} KiB")
+        print(f"{'':<17} encode={encode_seconds * 1000:6.2f} ms  decode={decode_seconds * 1000:6.2f} ms  "
+              f"(json.loads of the list response={parse_seconds * 1000:6.2f} ms)")
+    slot_store.SLOT_ENCODING = 'packed'
+
+
+class FakeSnapshot:
+    def __init__(self, data):
+        self._data = data
+
+    def to_dict(self):
+        return self._data
+
+
+def decode_compact(body):
+    """What a client does with a compact response."""
+    booked = base64.b64decode(body['booked'])
+    tz = timezone(timedelta(minutes=body['offset'] if 'offset' in body else 0))
+    slots = []
+    for i, start_minutes in enumerate(body['starts']):
+        if 'offsets' in body:
+            tz = timezone(timedelta(minutes=body['offsets'][i]))
+        start = datetime.fromtimestamp(body['base'] + start_minutes * 60, tz)
+        duration = body['durations'][i] if 'durations' in body else body['duration']
+        slots.append({'slotId': start.isoformat(), 'startTime': start.isoformat(),
+                      'endTime': (start + timedelta(minutes=duration)).isoformat(),
+                      'status': 'booked' if booked[i >> 3] & (1 << (i & 7)) else 'available'})
+    return slots
+
+
+def bench_endpoint():
+    db = FakeFirestore()
+    api.db = db
+    api.async_db = FakeAsyncFirestore(db)
+    db.collection('users').document('host-1').set({
+        'userId': 'host-1', 'email': 'host@example.com', 'publicUrlToken': 'public-token'})
+    label, settings, days = HOSTS[-1]
+    now = fixed_now(settings['timezone'])
+    slot_store.save_regenerated_slots(
+        db, 'host-1', compute_available_slots([], SlotSettings.from_user_settings(settings), now, days=days), now)
+    first = slot_store.read_slots(db, 'host-1')[0]['slotId']
+    slot_store.book_slot(db, 'host-1', first)
+
+    client = TestClient(api.app)
+    legacy = client.get('/api/slots/public/public-token')
+    compact = client.get('/api/slots/public/public-token', params={'format': 'compact'})
+    assert legacy.status_code == compact.status_code == 200
+    assert decode_compact(compact.json()) == legacy.json()['slots'], "compact response differs"
+    assert legacy.json()['slots'][0]['status'] == 'booked'
+    print(f"GET /api/slots/public/{{token}} ({label}): {len(legacy.content) / 1024:.1f} KiB, "
+          f"format=compact {len(compact.content) / 1024:.1f} KiB, same slots")
+
+
+if __name__ == "__main__":
+    bench_sizes()
+    bench_endpoint()
@@ -0,0 +1,79 @@
+"""
+Micro-benchmark for slot_engine.compute_available_slots.
+
+Run from the backend directory:
+    python -m benchmarks.bench_slot_engine
+"""
+import time
+from datetime import datetime, timedelta
+
+from slot_engine import SlotSettings, compute_available_slots, parse_busy_intervals
+from benchmarks.fixtures import fixed_now, random_busy_intervals
+
+
+def legacy_compute_available_slots(busy_times, slot_settings, now, days):
+    """The nested busy-time scan that generate_user_slots used before slot_engine."""
+    user_timezone = slot_settings.timezone
+    slot_duration = timedelta(minutes=slot_settings.slot_duration_minutes)
+    available_slots = []
+    today = now.astimezone(user_timezone).date()
+    for i in range(days):
+        current_day = today + timedelta(days=i)
+        if current_day.weekday() not in slot_settings.working_days:
+            continue
+        day_start = user_timezone.localize(datetime.combine(current_day, slot_settings.work_start))
+        day_end = user_timezone.localize(datetime.combine(current_day, slot_settings.work_end))
+        potential_slot_start = day_start
+        while potential_slot_start + slot_duration <= day_end:
+            potential_slot_end = potential_slot_start + slot_duration
+            is_busy = False
+            for busy_start, busy_end in busy_times:
+                if potential_slot_start < busy_end and potential_slot_end > busy_start:
+                    is_busy = True
+                    break
+            if not is_busy and potential_slot_start > now:
+                available_slots.append({
+                    'slotId': potential_slot_start.isoformat(),
+                    'startTime': potential_slot_start.isoformat(),
+                    'endTime': potential_slot_end.isoformat(),
+                    'status': 'available'
+                })
+            potential_slot_start += slot_duration
+    return available_slots
+
+
+def timed(fn, *args, repeat=3):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def run_case(label, busy_count, days, slot_duration, max_busy_minutes, with_legacy):
+    now = fixed_now()
+    slot_settings = SlotSettings.from_user_settings({'slotDuration': slot_duration})
+    busy_times = parse_busy_intervals(random_busy_intervals(busy_count, now, days, max_minutes=max_busy_minutes))
+
+    sweep_seconds, sweep_slots = timed(compute_available_slots, busy_times, slot_settings, now, days)
+    line = f"{label:<34} sweep={sweep_seconds * 1000:9.2f} ms  slots={len(sweep_slots)}"
+    if with_legacy:
+        legacy_seconds, legacy_slots = timed(
+            legacy_compute_available_slots, busy_times, slot_settings, now, days, repeat=1)
+        assert legacy_slots == sweep_slots, "sweep output differs from the legacy scan"
+        line += f"  legacy={legacy_seconds * 1000:9.2f} ms  x{legacy_seconds / sweep_seconds:.0f}"
+    print(line)
+
+
+def main():
+    run_case("200 busy / 14 days / 30 min", 200, 14, 30, 60, with_legacy=True)
+    run_case("1k busy / 30 days / 5 min", 1_000, 30, 5, 30, with_legacy=True)
+    # The legacy scan would take minutes here, so only the sweep is timed.
+    run_case("10k busy / 90 days / 5 min", 10_000, 90, 5, 10, with_legacy=False)
+    run_case("10k busy / 90 days / 30 min", 10_000, 90, 30, 10, with_legacy=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Slot holds under contention (POST /api/slots/public/{token}/holds).
+
+Simulates a popular host: 200 bookers arrive within four seconds, look at the
+public page, pick one of the ten earliest free slots and fill in the booking
+form before submitting. Without holds, two bookers can spend the whole form on
+the same slot and the later one gets a 409 only on submit. With holds, the
+slot is held as soon as it is picked; a conflict shows up before the form is
+filled in and the page no longer offers held slots. A booker that loses picks
+again, up to five times.
+
+Runs the app in-process (inline booking mode) with the in-memory Firestore
+double and the fake Calendar server, and reports per mode the conflict rate
+of booking submissions, form time thrown away, Calendar calls per confirmed
+booking and Calendar calls that did not end in a booking. Times are scaled
+down: a form takes 0.2-0.6 s instead of minutes.
+
+Also checks that an expired hold stops blocking the slot right away on reads
+and bookings, and that the sweeper bumps the slots' version once it drops it.
+
+Run from the backend directory:
+    python -m benchmarks.bench_slot_holds
+"""
+import asyncio
+import random
+import time
+from datetime import datetime
+
+from benchmarks.fixtures import configure_app_env
+
+configure_app_env()
+
+import httpx
+
+import main as api
+import slot_store
+from async_slot_store import sweep_expired_holds_async
+from booking_store import booking_results
+from calendar_client import AsyncCalendarClient
+from slot_engine import SlotSettings, compute_available_slots
+from benchmarks.fake_calendar import FakeCalendar, FakeCalendarServer
+from benchmarks.fake_firestore import FakeAsyncFirestore, FakeFirestore
+
+USER_ID = 'host-1'
+SETTINGS = {'workingHours': {'start': '09:00', 'end': '17:00'}, 'slotDuration': 30,
+            'timezone': 'UTC', 'workingDays': [0, 1, 2, 3, 4, 5, 6]}
+BOOKERS = 200
+ARRIVAL_SECONDS = 4.0
+CHOICES = 10
+MAX_ATTEMPTS = 5
+THINK_SECONDS = (0.02, 0.06)
+FORM_SECONDS = (0.2, 0.6)
+URL = '/api/slots/public/public-token'
+
+
+def seed():
+    now = datetime.now(SlotSettings.from_user_settings(SETTINGS).timezone)
+    api.db = FakeFirestore(latency=0.002)
+    api.async_db = FakeAsyncFirestore(api.db)
+    api.db.collection('users').document(USER_ID).set({
+        'userId': USER_ID, 'email': 'host@example.com', 'publicUrlToken': 'public-token', 'settings': SETTINGS,
+        'encryptedAccessToken': api.encrypt_token('access'), 'encryptedRefreshToken': api.encrypt_token('refresh'),
+    })
+    slot_store.save_regenerated_slots(
+        api.db, USER_ID, compute_available_slots([], SlotSettings.from_user_settings(SETTINGS), now), now)
+    api.public_user_cache.clear()
+    booking_results.clear()
+    slot_store.slots_cache.clear()
+
+
+class Stats:
+    def __init__(self):
+        self.booked = self.gave_up = self.submits = self.submit_conflicts = self.hold_conflicts = 0
+        self.wasted_form_seconds = 0.0
+        self.booking_seconds = []
+
+
+async def free_slots(client):
+    response = await client.get(URL)
+    return [slot['slotId'] for slot in response.json()['slots'] if slot['status'] == 'available']
+
+
+async def booker(client, n, rng, use_holds, stats):
+    await asyncio.sleep(rng.uniform(0, ARRIVAL_SECONDS))
+    arrived = time.perf_counter()
+    for attempt in range(MAX_ATTEMPTS):
+        await asyncio.sleep(rng.uniform(*THINK_SECONDS))
+        slot_id = rng.choice((await free_slots(client))[:CHOICES])
+        hold_id = None
+        if use_holds:
+            response = await client.post(f"{URL}/holds", json={'slotId': slot_id})
+            if response.status_code == 409:
+                stats.hold_conflicts += 1
+                continue
+            assert response.status_code == 201, response.text
+            hold_id = response.json()['holdId']
+
+        # A booker who lost a slot only has to pick again, not retype the form.
+        form_seconds = rng.uniform(*FORM_SECONDS) if attempt == 0 or use_holds else THINK_SECONDS[1]
+        await asyncio.sleep(form_seconds)
+        stats.submits += 1
+        response = await client.post('/api/bookings', json={
+            'publicUrlToken': 'public-token', 'slotId': slot_id, 'holdId': hold_id,
+            'bookerName': f"Booker {n}", 'bookerEmail': f"booker{n}@example.com"})
+        if response.status_code == 200:
+            stats.booked += 1
+            stats.booking_seconds.append(time.perf_counter() - arrived)
+            return
+        assert response.status_code == 409, response.text
+        stats.submit_conflicts += 1
+        stats.wasted_form_seconds += form_seconds
+    stats.gave_up += 1
+
+
+async def simulate(client, calendar, use_holds):
+    seed()
+    calendar.requests.clear()
+    stats = Stats()
+    rng = random.Random(7)
+    await asyncio.gather(*(booker(client, n, random.Random(rng.random()), use_holds, stats)
+                           for n in range(BOOKERS)))
+
+    booked = [slot for slot in slot_store.read_slots(api.db, USER_ID) if slot['status'] == 'booked']
+    calendar_calls = len(calendar.requests)
+    assert len(booked) == stats.booked == calendar.request_count('events.insert')
+    label = 'holds' if use_holds else 'no holds'
+    print(f"{label:<9} booked={stats.booked}/{BOOKERS}  gave up={stats.gave_up:<3} "
+          f"submit conflicts={stats.submit_conflicts}/{stats.submits} "
+          f"({stats.submit_conflicts / stats.submits:.1%})  hold conflicts={stats.hold_conflicts:<4} "
+          f"wasted form time={stats.wasted_form_seconds:5.1f} s")
+    print(f"{'':<9} Calendar calls={calendar_calls} per booking={calendar_calls / max(stats.booked, 1):.2f} "
+          f"wasted={calendar_calls - stats.booked}  "
+          f"time to book p50={sorted(stats.booking_seconds)[len(stats.booking_seconds) // 2]:.2f} s")
+
+
+async def check_expiry(client):
+    """An expired hold frees its slot on reads and bookings at once; the sweeper then bumps the version."""
+    seed()
+    slot_store.HOLD_TTL_SECONDS = 0.2
+    slot_id = (await free_slots(client))[0]
+    hold = (await client.post(f"{URL}/holds", json={'slotId': slot_id})).json()
+    first = await client.get(URL)
+    assert next(s for s in first.json()['slots'] if s['slotId'] == slot_id)['status'] == 'held'
+    assert (await client.post(f"{URL}/holds", json={'slotId': slot_id})).status_code == 409
+    compact = (await client.get(URL, params={'format': 'compact'})).json()
+    assert 'starts' in compact, "held slots must not stop the compact format"
+
+    await asyncio.sleep(0.25)
+    assert slot_id in await free_slots(client), "expired hold still shown"
+    assert (await client.get(URL, headers={'If-None-Match': first.headers['ETag']})).status_code == 304
+    assert await sweep_expired_holds_async(api.async_db) == 1
+    assert await sweep_expired_holds_async(api.async_db) == 0
+    assert (await client.get(URL, headers={'If-None-Match': first.headers['ETag']})).status_code == 200
+    changes = (await client.get(URL, params={'since': first.json()['version']})).json()['days']
+    assert [s['status'] for s in changes[slot_id[:10]] if s['slotId'] == slot_id] == ['available']
+
+    # Someone else books it; the late holder's booking is refused.
+    other = await client.post('/api/bookings', json={
+        'publicUrlToken': 'public-token', 'slotId': slot_id, 'bookerName': 'Other', 'bookerEmail': 'o@example.com'})
+    late = await client.post('/api/bookings', json={
+        'publicUrlToken': 'public-token', 'slotId': slot_id, 'holdId': hold['holdId'],
+        'bookerName': 'Late', 'bookerEmail': 'l@example.com'})
+    assert other.status_code == 200 and late.status_code == 409, (other.text, late.text)
+
+    # Giving a hold back frees the slot for the next booker.
+    slot_store.HOLD_TTL_SECONDS = 300
+    slot_id = (await free_slots(client))[0]
+    hold = (await client.post(f"{URL}/holds", json={'slotId': slot_id})).json()
+    assert (await client.delete(f"{URL}/holds/{hold['holdId']}")).status_code == 204
+    assert (await client.post(f"{URL}/holds", json={'slotId': slot_id})).status_code == 201
+    print("expiry: expired holds free their slot on read and booking; the sweep bumps the version")
+
+
+async def main():
+    calendar = FakeCalendar(latency=0.05)
+    with FakeCalendarServer(calendar) as server:
+        api.calendar_client = AsyncCalendarClient(base_url=server.url)
+        api.BOOKING_MODE = 'sync'
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            await check_expiry(client)
+            for use_holds in (False, True):
+                await simulate(client, calendar, use_holds)
+        await api.calendar_client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
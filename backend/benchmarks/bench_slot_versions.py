@@ -0,0 +1,123 @@
+"""
+Versioned slots on GET /api/slots/public/{token}: ETags, 304s and deltas.
+
+Plays a booking page that polls one host's slots 500 times while other
+bookers take a slot every 25 polls and the calendar sync regenerates a few
+days (emptying one) every 100, in three ways: refetching everything,
+revalidating with If-None-Match, and asking for the changes `since` the last
+version. Reports response bytes and Firestore reads per poll with the slot
+cache off, so every read shows, and checks after every poll that the
+client's copy equals the stored slots.
+
+Run from the backend directory:
+    python -m benchmarks.bench_slot_versions
+"""
+from fastapi.testclient import TestClient
+
+import main as api
+import slot_store
+from slot_engine import SlotSettings, compute_available_slots, slot_date
+from benchmarks.fake_firestore import FakeAsyncFirestore, FakeFirestore
+from benchmarks.fixtures import fixed_now
+
+POLLS = 500
+BOOK_EVERY = 25
+REGENERATE_EVERY = 100
+SETTINGS = SlotSettings.from_user_settings({'slotDuration': 30, 'workingDays': [0, 1, 2, 3, 4, 5]})
+DAYS = 56
+URL = '/api/slots/public/public-token'
+
+
+def seed():
+    db = FakeFirestore()
+    api.db = db
+    api.async_db = FakeAsyncFirestore(db)
+    db.collection('users').document('host-1').set({
+        'userId': 'host-1', 'email': 'host@example.com', 'publicUrlToken': 'public-token'})
+    now = fixed_now()
+    slot_store.save_regenerated_slots(db, 'host-1', compute_available_slots([], SETTINGS, now, days=DAYS), now)
+    for cache in (api.public_user_cache, slot_store.slots_cache):
+        cache.clear()
+    slot_store.slots_cache.ttl = 0
+    return db, now
+
+
+def change(db, now, poll):
+    """Other bookers and the calendar sync."""
+    if poll % BOOK_EVERY == BOOK_EVERY - 1:
+        slots = slot_store.read_slots(db, 'host-1')
+        available = [slot for slot in slots if slot['status'] == 'available']
+        slot_store.book_slot(db, 'host-1', available[len(available) // 2]['slotId'])
+    if poll % REGENERATE_EVERY == REGENERATE_EVERY - 1:
+        # A busy block fills the first working day's slots; the next days lose their first hour.
+        slots = compute_available_slots([], SETTINGS, now, days=DAYS)
+        days = sorted({slot_date(slot) for slot in slots})[1:4]
+        regenerated = [slot for slot in slots if slot_date(slot) in days[1:]
+                       and slot['startTime'][11:13] != '09']
+        slot_store.save_regenerated_slots(db, 'host-1', regenerated, now, set(days))
+
+
+def group_by_day(slots):
+    days = {}
+    for slot in slots:
+        days.setdefault(slot['slotId'][:10], []).append(slot)
+    return days
+
+
+def run(mode):
+    db, now = seed()
+    client = TestClient(api.app)
+    first = client.get(URL)
+    etag, version = first.headers['ETag'], first.json()['version']
+    days = group_by_day(first.json()['slots'])
+
+    sent = reads = not_modified = 0
+    for poll in range(POLLS):
+        change(db, now, poll)
+        reads_before = db.stats['reads']
+        if mode == 'full':
+            response = client.get(URL)
+            days = group_by_day(response.json()['slots'])
+        elif mode == 'etag':
+            response = client.get(URL, headers={'If-None-Match': etag})
+            if response.status_code == 200:
+                etag = response.headers['ETag']
+                days = group_by_day(response.json()['slots'])
+            else:
+                assert response.status_code == 304 and response.headers['ETag'] == etag
+                not_modified += 1
+        else:
+            response = client.get(URL, params={'since': version})
+            body = response.json()
+            for day_id, day_slots in body['days'].items():
+                days[day_id] = day_slots
+            version = body['version']
+        reads += db.stats['reads'] - reads_before
+        sent += len(response.content)
+        stored = [slot for day_id in sorted(days) for slot in days[day_id]]
+        assert stored == slot_store.read_slots(db, 'host-1'), f"{mode}: client copy differs at poll {poll}"
+
+    extra = f"  304s={not_modified}" if mode == 'etag' else ''
+    print(f"{mode:<5} bytes per poll={sent / POLLS:9.0f}  reads per poll={reads / POLLS:5.2f}{extra}")
+    return sent, reads
+
+
+def check_conditional():
+    seed()
+    client = TestClient(api.app)
+    response = client.get(URL)
+    etag = response.headers['ETag']
+    compact = client.get(URL, params={'format': 'compact'})
+    assert compact.headers['ETag'] != etag
+    assert client.get(URL, headers={'If-None-Match': compact.headers['ETag']}).status_code == 200
+    assert client.get(URL, headers={'If-None-Match': f'"1", W/{etag}'}).status_code == 304
+    # A version from the future (another deployment, a typo) falls back to everything.
+    assert 'slots' in client.get(URL, params={'since': response.json()['version'] + 1}).json()
+
+
+if __name__ == "__main__":
+    check_conditional()
+    full_bytes, full_reads = run('full')
+    for mode in ('etag', 'delta'):
+        sent, reads = run(mode)
+        print(f"      saved vs full: {1 - sent / full_bytes:.1%} bytes, {1 - reads / full_reads:.1%} reads")
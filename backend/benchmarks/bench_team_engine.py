@@ -0,0 +1,192 @@
+"""
+Team availability (team_engine) and team bookings.
+
+For teams of 10, 50 and 200 hosts, times collective and round-robin slot
+computation (`team_engine.iter_team_slots`) against checking every candidate
+slot against every host, and checks that both agree. Then runs the team endpoints
+in-process with the in-memory Firestore double and the fake Calendar server:
+concurrent round-robin bookings must never give a host the same slot twice and
+should spread evenly, and concurrent collective bookings of one slot must let
+exactly one through.
+
+Run from the backend directory:
+    python -m benchmarks.bench_team_engine
+"""
+import asyncio
+import random
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.fixtures import configure_app_env
+
+configure_app_env()
+
+import httpx
+import jwt
+
+import main as api
+from calendar_client import AsyncCalendarClient
+from calendar_pool import CalendarServicePool
+from slot_engine import SlotSettings, compute_available_slots, merge_intervals
+from team_engine import TEAM_MODE_COLLECTIVE, TEAM_MODE_ROUND_ROBIN, iter_team_slots
+from benchmarks.fake_calendar import FakeCalendar, FakeCalendarServer
+from benchmarks.fake_firestore import FakeAsyncFirestore, FakeFirestore
+from benchmarks.fixtures import fixed_now
+
+SETTINGS = {'workingHours': {'start': '09:00', 'end': '18:00'}, 'slotDuration': 30,
+            'timezone': 'Asia/Tokyo', 'workingDays': [0, 1, 2, 3, 4]}
+DAYS = 28
+BUSY_PER_HOST = 12
+
+
+def random_host_busy(rng, now):
+    """Busy blocks of 30-120 minutes in working hours, like a typical host's calendar."""
+    tz = now.tzinfo
+    busy = []
+    for _ in range(BUSY_PER_HOST):
+        day = now.date() + timedelta(days=rng.randrange(DAYS))
+        start = tz.localize(datetime(day.year, day.month, day.day, 9) + timedelta(minutes=rng.randrange(0, 540, 15)))
+        busy.append((start, start + timedelta(minutes=rng.choice((30, 60, 90, 120)))))
+    return busy
+
+
+def naive_team_slots(host_busy, slot_settings, now, mode):
+    """Checks every candidate slot against every host's intervals."""
+    need_all = mode == TEAM_MODE_COLLECTIVE
+    slots = []
+    for slot in compute_available_slots([], slot_settings, now, days=DAYS):
+        start = datetime.fromisoformat(slot['startTime']).timestamp()
+        end = datetime.fromisoformat(slot['endTime']).timestamp()
+        free = [all(b_end <= start or b_start >= end for b_start, b_end in busy) for busy in host_busy]
+        if (all(free) if need_all else any(free)):
+            slots.append(slot)
+    return slots
+
+
+def bench_engine():
+    now = fixed_now()
+    slot_settings = SlotSettings.from_user_settings(SETTINGS)
+    rng = random.Random(7)
+    for team_size in (10, 50, 200):
+        raw = [random_host_busy(rng, now) for _ in range(team_size)]
+        for mode in (TEAM_MODE_COLLECTIVE, TEAM_MODE_ROUND_ROBIN):
+            started = time.perf_counter()
+            host_busy = [merge_intervals((start.timestamp(), end.timestamp()) for start, end in busy) for busy in raw]
+            today = now.date()
+            slots = list(iter_team_slots(host_busy, mode, slot_settings,
+                                         (today + timedelta(days=i) for i in range(DAYS)), now.timestamp()))
+            engine_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            expected = naive_team_slots(host_busy, slot_settings, now, mode)
+            naive_seconds = time.perf_counter() - started
+            assert slots == expected, f"{team_size} hosts, {mode}: slots differ"
+            print(f"{team_size:>4} hosts  {mode:<12} team engine={engine_seconds * 1000:7.2f} ms  "
+                  f"per-slot check={naive_seconds * 1000:8.2f} ms  slots={len(slots)}")
+
+
+def auth_header(user_id):
+    token = jwt.encode({'sub': user_id, 'exp': datetime.now(timezone.utc) + timedelta(hours=1)},
+                       api.JWT_SECRET_KEY, algorithm="HS256")
+    return {'Authorization': f"Bearer {token}"}
+
+
+def seed_members(count):
+    for i in range(count):
+        user_id = f"member-{i:03d}"
+        api.db.collection('users').document(user_id).set({
+            'userId': user_id, 'email': f"{user_id}@example.com", 'settings': SETTINGS,
+            'encryptedAccessToken': api.encrypt_token('access'), 'encryptedRefreshToken': api.encrypt_token('refresh'),
+        })
+
+
+async def create_team(client, mode, size):
+    response = await client.post('/api/teams', headers=auth_header('member-000'), json={
+        'name': f"{mode} team", 'mode': mode, 'sharedFreeBusy': True,
+        'memberEmails': [f"member-{i:03d}@example.com" for i in range(1, size)]})
+    assert response.status_code == 201, response.text
+    return response.json()['publicUrlToken']
+
+
+async def book(client, token, slot_id, booker):
+    return await client.post(f'/api/teams/public/{token}/bookings', json={
+        'slotId': slot_id, 'bookerName': booker, 'bookerEmail': f"{booker}@example.com"})
+
+
+async def bench_bookings(client, calendar, now):
+    # Round robin: 50 members, 20 slots with 5 bookers racing for each.
+    token = await create_team(client, TEAM_MODE_ROUND_ROBIN, 50)
+    response = await client.get(f'/api/teams/public/{token}/slots', params={'limit': 20})
+    assert response.status_code == 200, response.text
+    slot_ids = [slot['slotId'] for slot in response.json()['slots']]
+    calendar.requests.clear()
+
+    started = time.perf_counter()
+    responses = await asyncio.gather(*(book(client, token, slot_id, f"booker-{i}-{n}")
+                                       for i, slot_id in enumerate(slot_ids) for n in range(5)))
+    elapsed = time.perf_counter() - started
+    assert all(response.status_code == 200 for response in responses), [r.text for r in responses
+                                                                         if r.status_code != 200]
+    assignments = [(response.json()['hostUserIds'][0], slot_id)
+                   for response, slot_id in zip(responses, [s for s in slot_ids for _ in range(5)])]
+    assert len(set(assignments)) == len(assignments), "a host got the same slot twice"
+    per_host = Counter(host for host, _ in assignments)
+    print(f"round robin, 50 members: {len(responses)} concurrent bookings in {elapsed:.2f}s, "
+          f"hosts used={len(per_host)}, bookings per host min={min(per_host.values())} max={max(per_host.values())}, "
+          f"freebusy requests={calendar.request_count('freebusy')} aborted transactions={api.db.stats['aborts']}")
+
+    # Later sequential bookings go to the least assigned members first.
+    response = await client.get(f'/api/teams/public/{token}/slots', params={'limit': 40})
+    for n, slot in enumerate(response.json()['slots'][20:]):
+        assert (await book(client, token, slot['slotId'], f"late-{n}")).status_code == 200
+    counts = [member.to_dict()['assignments'] for member in
+              api.db.collection('teams').document(api.db.collection('teams').where(
+                  'publicUrlToken', '==', token).get()[0].id).collection('members').stream()]
+    assert max(counts) - min(counts) <= 1, counts
+    print(f"after {sum(counts)} bookings: assignments per member min={min(counts)} max={max(counts)}")
+
+    # Collective: 10 members, 8 bookers racing for one slot. The fake files every new event under
+    # 'primary', so the round-robin bookings above don't show as busy; race for a later slot.
+    token = await create_team(client, TEAM_MODE_COLLECTIVE, 10)
+    response = await client.get(f'/api/teams/public/{token}/slots',
+                                params={'from': (now + timedelta(days=7)).date().isoformat(), 'limit': 1})
+    slot_id = response.json()['slots'][0]['slotId']
+    responses = await asyncio.gather(*(book(client, token, slot_id, f"racer-{n}") for n in range(8)))
+    codes = Counter(response.status_code for response in responses)
+    assert codes == {200: 1, 409: 7}, codes
+    winner = next(response.json() for response in responses if response.status_code == 200)
+    assert len(winner['hostUserIds']) == 10
+    event_id = api.db.collection('bookings').document(winner['bookingId']).get().to_dict()['eventId']
+    attendees = {a['email'] for a in calendar.calendars['primary'][event_id]['attendees']}
+    assert {f"member-{i:03d}@example.com" for i in range(10)} <= attendees
+    print(f"collective, 10 members: 8 concurrent bookings of one slot -> {dict(codes)}, "
+          f"one event with {len(attendees)} attendees")
+
+
+async def main():
+    bench_engine()
+
+    api.db = FakeFirestore()
+    api.async_db = FakeAsyncFirestore(api.db)
+    seed_members(50)
+    calendar = FakeCalendar(latency=0.01)
+    rng = random.Random(3)
+    now = datetime.now(SlotSettings.from_user_settings(SETTINGS).timezone)
+    for i in range(50):
+        email = f"member-{i:03d}@example.com"
+        calendar.add_calendar(email)
+        for n, (start, end) in enumerate(random_host_busy(rng, now)):
+            calendar.upsert_event(f"busy-{i}-{n}", start, end, calendar_id=email)
+
+    with FakeCalendarServer(calendar) as server:
+        api.calendar_client = AsyncCalendarClient(base_url=server.url)
+        api.calendar_pool = CalendarServicePool(api.build_credentials, client_options={'api_endpoint': server.url})
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            await bench_bookings(client, calendar, now)
+        await api.calendar_client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,270 @@
+"""
+Checks and benchmark for timezone handling in slot generation (tz_engine).
+
+1. Randomized comparison with the pytz path the slot engine used before
+   tz_engine (`pytz_available_slots`, one `localize` per day and window):
+   random zones, dates between 1990 and 2037, working hours, per-weekday
+   hours and busy times. Days without a UTC offset change near them must
+   produce exactly the same slots. Every day, including DST days, must
+   produce slots that are sorted, disjoint, a whole slot long, written with
+   the offset in effect at each instant and inside the working hours. The
+   batch path (`batch_slots`) must match the per-user path.
+2. Fixed DST cases: overnight hours across a spring-forward and a fall-back
+   night, a window starting in a gap at midnight, windows starting, ending
+   and lying in a repeated hour and a 30-minute DST shift.
+3. Benchmark: 90 days of slots in 400 zones, the pytz path against tz_engine.
+
+Run from the backend directory:
+    python -m benchmarks.bench_tz_engine [--samples 3000]
+"""
+import argparse
+import random
+import time
+from bisect import bisect_left
+from datetime import date, datetime, timedelta, time as dt_time
+
+import pytz
+
+from batch_slots import HostAvailability, compute_available_slots_batch
+from slot_engine import SlotSettings, compute_available_slots, merge_intervals, parse_busy_intervals
+from tz_engine import DAY_SECONDS, local_day_start, zone_transitions
+from benchmarks.fixtures import random_busy_intervals
+
+ZONES = pytz.common_timezones
+DURATIONS = [15, 20, 30, 45, 60, 90]
+
+
+def pytz_available_slots(busy_times, slot_settings, now, days):
+    """The sweep slot_engine ran before tz_engine, extended to per-weekday windows that don't cross midnight."""
+    user_timezone = slot_settings.timezone
+    slot_duration = timedelta(minutes=slot_settings.slot_duration_minutes)
+    duration_seconds = slot_duration.total_seconds()
+    busy = merge_intervals((start.timestamp(), end.timestamp()) for start, end in busy_times)
+    busy_count = len(busy)
+    busy_index = 0
+    today = now.astimezone(user_timezone).date()
+    slots = []
+    for i in range(days):
+        current_day = today + timedelta(days=i)
+        for work_start, work_end in slot_settings.windows(current_day.weekday()):
+            day_start = user_timezone.localize(datetime.combine(current_day, work_start))
+            day_end = user_timezone.localize(datetime.combine(current_day, work_end))
+            day_start_ts = day_start.timestamp()
+            slot_count = int((day_end - day_start) // slot_duration) if day_end > day_start else 0
+            k = 0
+            while k < slot_count:
+                slot_start_ts = day_start_ts + k * duration_seconds
+                slot_end_ts = slot_start_ts + duration_seconds
+                while busy_index < busy_count and busy[busy_index][1] <= slot_start_ts:
+                    busy_index += 1
+                if busy_index < busy_count and busy[busy_index][0] < slot_end_ts:
+                    skip_to = -(-(busy[busy_index][1] - day_start_ts) // duration_seconds)
+                    k = max(k + 1, int(skip_to))
+                    continue
+                if slot_start_ts > now.timestamp():
+                    slot_start = day_start + k * slot_duration
+                    slot_end = slot_start + slot_duration
+                    slots.append({
+                        'slotId': slot_start.isoformat(),
+                        'startTime': slot_start.isoformat(),
+                        'endTime': slot_end.isoformat(),
+                        'status': 'available'
+                    })
+                k += 1
+    return slots
+
+
+def random_time(rng, low=0, high=24 * 60 - 1, step=15):
+    minutes = rng.randrange(low, high + 1, step) if high >= low else low
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def random_settings(rng, zone, overnight):
+    """Random working hours. Without `overnight`, windows are disjoint and end on the day they start."""
+    settings = {'timezone': zone, 'slotDuration': rng.choice(DURATIONS)}
+    if rng.random() < 0.5:
+        start = random_time(rng, 0, 20 * 60)
+        end = random_time(rng, 0, 24 * 60 - 15) if overnight else random_time(rng, int(start[:2]) * 60 + 60, 24 * 60 - 15)
+        settings['workingHours'] = {'start': start, 'end': end}
+        settings['workingDays'] = sorted(rng.sample(range(7), rng.randint(1, 7)))
+        return settings
+    weekly = {}
+    for weekday in range(7):
+        bounds = sorted(rng.sample(range(0, 24 * 60, 15), 2 * rng.randint(0, 3)))
+        windows = [{'start': random_time(rng, a, a), 'end': random_time(rng, b, b)}
+                   for a, b in zip(bounds[::2], bounds[1::2])]
+        if overnight and windows and rng.random() < 0.5:
+            windows[-1]['end'] = random_time(rng, 0, 6 * 60)
+        weekly[str(weekday)] = windows
+    settings['weeklyHours'] = weekly
+    return settings
+
+
+def near_transition(transitions, day):
+    """Whether the UTC offset changes within a day of `day` (where the two paths may differ)."""
+    midnight = local_day_start(day)
+    low = midnight - 2 * DAY_SECONDS - 14 * 3600
+    high = midnight + 3 * DAY_SECONDS + 14 * 3600
+    i = bisect_left(transitions.starts, low)
+    return i < len(transitions.starts) and transitions.starts[i] <= high
+
+
+def random_day(rng, zone):
+    """A random day; half the time one next to a DST change of the zone."""
+    transitions = zone_transitions(pytz.timezone(zone))
+    nearby = [start for start in transitions.starts[1:] if 631152000 <= start < 2145916800]  # 1990-2037
+    if nearby and rng.random() < 0.5:
+        instant = rng.choice(nearby) + rng.randint(-2, 1) * DAY_SECONDS
+    else:
+        instant = rng.randrange(631152000, 2145916800)
+    return date(1970, 1, 1) + timedelta(days=(instant + transitions.offset_at(instant)) // DAY_SECONDS)
+
+
+def wall_minutes(iso):
+    moment = datetime.fromisoformat(iso)
+    return moment.date(), moment.hour * 60 + moment.minute
+
+
+def check_invariants(slots, slot_settings, first_day, days):
+    tz = slot_settings.timezone
+    duration = slot_settings.slot_duration_minutes * 60
+    previous_end = None
+    for slot in slots:
+        start = datetime.fromisoformat(slot['startTime'])
+        end = datetime.fromisoformat(slot['endTime'])
+        assert slot['slotId'] == slot['startTime']
+        assert (end - start).total_seconds() == duration, slot
+        for moment in (start, end):
+            assert moment.utcoffset() == moment.astimezone(tz).utcoffset(), ("wrong offset", slot)
+        assert previous_end is None or start >= previous_end, ("overlap or out of order", slot)
+        previous_end = end
+
+        day, minute = wall_minutes(slot['startTime'])
+        assert first_day <= day < first_day + timedelta(days=days), slot
+        inside = False
+        for work_start, work_end in slot_settings.windows(day.weekday()):
+            a, b = work_start.hour * 60 + work_start.minute, work_end.hour * 60 + work_end.minute
+            inside |= a <= minute and (b <= a or minute < b)
+        for work_start, work_end in slot_settings.windows((day.weekday() - 1) % 7):
+            a, b = work_start.hour * 60 + work_start.minute, work_end.hour * 60 + work_end.minute
+            inside |= b < a and minute < b
+        assert inside, ("outside working hours", slot)
+
+
+def run_checks(samples, seed=0):
+    rng = random.Random(seed)
+    compared = dst_days = 0
+    for n in range(samples):
+        zone = rng.choice(ZONES)
+        overnight = n % 3 == 0
+        slot_settings = SlotSettings.from_user_settings(random_settings(rng, zone, overnight))
+        first_day = random_day(rng, zone)
+        days = rng.randint(1, 4)
+        tz = slot_settings.timezone
+        now = tz.localize(datetime.combine(first_day, dt_time(12)))
+        busy = parse_busy_intervals(random_busy_intervals(rng.randint(0, 12), now, days, seed=n, max_minutes=180))
+
+        slots = compute_available_slots(busy, slot_settings, now, days)
+        check_invariants(slots, slot_settings, first_day, days)
+
+        batch = compute_available_slots_batch(
+            [HostAvailability('host', busy, slot_settings)], now, days)['host'].to_dicts()
+        assert batch == slots, ("batch differs", zone, first_day)
+
+        transitions = zone_transitions(tz)
+        if overnight or any(near_transition(transitions, first_day + timedelta(days=i)) for i in range(-1, days + 1)):
+            dst_days += 1
+            continue
+        expected = pytz_available_slots(busy, slot_settings, now, days)
+        assert slots == expected, (zone, first_day, slot_settings, slots[:3], expected[:3])
+        compared += 1
+    print(f"random checks: {samples} cases, {compared} equal to the pytz path, "
+          f"{dst_days} near DST changes or overnight checked for invariants only")
+
+
+def slots_on(zone, settings, day, days=1):
+    slot_settings = SlotSettings.from_user_settings(
+        {'timezone': zone, 'slotDuration': 30, 'workingDays': list(range(7)), **settings})
+    now = slot_settings.timezone.localize(datetime.combine(day - timedelta(days=1), dt_time(12)))
+    return [slot for slot in compute_available_slots([], slot_settings, now, days + 1)
+            if date.fromisoformat(slot['startTime'][:10]) >= day]
+
+
+def run_dst_cases():
+    night = {'workingHours': {'start': '22:00', 'end': '06:00'}, 'workingDays': [5]}
+    # Saturday night into the spring-forward Sunday: 02:00 does not exist, the shift lasts 7 hours.
+    spring = slots_on('Europe/Berlin', night, date(2025, 3, 29), 2)
+    assert len(spring) == 14, len(spring)
+    assert spring[7]['startTime'] == '2025-03-30T01:30:00+01:00' and spring[8]['startTime'] == '2025-03-30T03:00:00+02:00'
+    # Saturday night into the fall-back Sunday: 02:00-03:00 happens twice, the shift lasts 9 hours.
+    autumn = slots_on('Europe/Berlin', night, date(2025, 10, 25), 2)
+    assert len(autumn) == 18, len(autumn)
+    assert [s['startTime'] for s in autumn[8:12]] == [
+        '2025-10-26T02:00:00+02:00', '2025-10-26T02:30:00+02:00',
+        '2025-10-26T02:00:00+01:00', '2025-10-26T02:30:00+01:00']
+    assert autumn[-1]['endTime'] == '2025-10-26T06:00:00+01:00'
+
+    # Sao Paulo skipped from midnight to 01:00 on 2018-11-04: the window starts at 01:00.
+    gap = slots_on('America/Sao_Paulo', {'workingHours': {'start': '00:00', 'end': '02:00'}}, date(2018, 11, 4))
+    assert [s['startTime'] for s in gap] == ['2018-11-04T01:00:00-02:00', '2018-11-04T01:30:00-02:00'], gap
+
+    # New York repeats 01:00-02:00: a window ending at 01:30 ends at its first occurrence,
+    # one starting at 01:30 starts at its second, so neither shows wall times outside it.
+    ending = slots_on('America/New_York', {'workingHours': {'start': '00:00', 'end': '01:30'}}, date(2025, 11, 2))
+    assert [s['startTime'][11:] for s in ending] == ['00:00:00-04:00', '00:30:00-04:00', '01:00:00-04:00'], ending
+    starting = slots_on('America/New_York', {'workingHours': {'start': '01:30', 'end': '03:00'}}, date(2025, 11, 2))
+    assert [s['startTime'][11:] for s in starting] == ['01:30:00-05:00', '02:00:00-05:00', '02:30:00-05:00'], starting
+    # A window inside the repeated hour takes its first occurrence.
+    inside = slots_on('America/New_York', {'workingHours': {'start': '01:00', 'end': '01:30'}}, date(2025, 11, 2))
+    assert [s['startTime'][11:] for s in inside] == ['01:00:00-04:00'], inside
+
+    # Lord Howe Island moves its clocks by 30 minutes.
+    howe = slots_on('Australia/Lord_Howe', {'workingHours': {'start': '00:00', 'end': '04:00'}}, date(2025, 10, 5))
+    assert len(howe) == 7 and howe[4]['startTime'] == '2025-10-05T02:30:00+11:00', howe
+    print("DST cases: overnight spring-forward/fall-back, gap at midnight, repeated hour, 30-minute shift ok")
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - started, result
+
+
+def run_benchmark(zone_count, days=90):
+    zones = list(ZONES)[:zone_count]
+    settings = [SlotSettings.from_user_settings({'timezone': zone, 'slotDuration': 30}) for zone in zones]
+    busy = {}
+    for zone, slot_settings in zip(zones, settings):
+        now = slot_settings.timezone.localize(datetime(2025, 1, 6, 8, 0))
+        busy[zone] = (now, parse_busy_intervals(random_busy_intervals(200, now, days)))
+
+    table_seconds = 0.0
+    zone_transitions.cache_clear()
+    for slot_settings in settings:
+        table_seconds += timed(zone_transitions, slot_settings.timezone)[0]
+
+    pytz_seconds = engine_seconds = 0.0
+    slot_count = 0
+    for zone, slot_settings in zip(zones, settings):
+        now, busy_times = busy[zone]
+        legacy_time, legacy = timed(pytz_available_slots, busy_times, slot_settings, now, days)
+        engine_time, slots = timed(compute_available_slots, busy_times, slot_settings, now, days)
+        # Offsets are only labelled differently inside a window that spans a change, which 09:00-17:00 never does.
+        assert slots == legacy, zone
+        pytz_seconds += legacy_time
+        engine_seconds += engine_time
+        slot_count += len(slots)
+
+    print(f"{len(zones)} zones x {days} days: slots={slot_count}  pytz={pytz_seconds * 1000:8.1f} ms  "
+          f"tz_engine={engine_seconds * 1000:8.1f} ms  x{pytz_seconds / engine_seconds:.1f}  "
+          f"(transition tables built once in {table_seconds * 1000:.1f} ms)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--samples', type=int, default=3000)
+    parser.add_argument('--zones', type=int, default=400)
+    args = parser.parse_args()
+    run_dst_cases()
+    run_checks(args.samples)
+    run_benchmark(args.zones)
@@ -0,0 +1,309 @@
+"""
+Local stand-in for the Google Calendar v3 endpoints the backend calls.
+
+It serves freeBusy, events list/get/insert/delete/watch, channels.stop and an OAuth token
+endpoint over HTTP so the real `googleapiclient` service can be pointed at it
+with `calendar_service()`.
+Every event change is appended to a change feed; sync tokens are positions in
+that feed, so incremental syncs replay exactly the changes made since.
+"""
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import httplib2
+from googleapiclient.discovery import build
+
+# Like Google, a freebusy query may name at most this many calendars.
+FREEBUSY_MAX_CALENDARS = 50
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def _event_bounds(event):
+    start, end = event['start'], event['end']
+    if 'dateTime' in start:
+        return _parse_time(start['dateTime']), _parse_time(end['dateTime'])
+    return (datetime.fromisoformat(start['date']).replace(tzinfo=timezone.utc),
+            datetime.fromisoformat(end['date']).replace(tzinfo=timezone.utc))
+
+
+class FakeCalendar:
+    """Calendar state shared by all fake users; one event list per calendar ID."""
+
+    def __init__(self, latency: float = 0.0, page_size: int = 250):
+        self.latency = latency
+        self.page_size = page_size
+        self.calendars = {}  # calendar ID -> {event ID -> event}
+        self.feed = []  # (calendar ID, event snapshot)
+        self.expired_before = 0
+        self.requests = []
+        self.connections = 0
+        self.insert_failures = []  # (status, after_create) per upcoming insert
+        self._lock = threading.Lock()
+
+    # --- Test / scenario API ---
+    def upsert_event(self, event_id, start, end, calendar_id='primary', **fields):
+        event = {'id': event_id, 'status': 'confirmed',
+                 'start': {'dateTime': start.isoformat()}, 'end': {'dateTime': end.isoformat()}, **fields}
+        with self._lock:
+            self.calendars.setdefault(calendar_id, {})[event_id] = event
+            self.feed.append((calendar_id, dict(event)))
+        return event
+
+    def add_calendar(self, calendar_id):
+        """Creates an empty calendar; freebusy reports `notFound` for calendars never created."""
+        with self._lock:
+            self.calendars.setdefault(calendar_id, {})
+
+    def cancel_event(self, event_id, calendar_id='primary'):
+        with self._lock:
+            self.calendars.get(calendar_id, {}).pop(event_id, None)
+            # Like Google, deleted events come back with only their ID and status.
+            self.feed.append((calendar_id, {'id': event_id, 'status': 'cancelled'}))
+
+    def expire_sync_tokens(self):
+        """Makes every sync token issued so far answer 410 Gone."""
+        with self._lock:
+            self.expired_before = len(self.feed) + 1
+
+    def request_count(self, kind=None):
+        return sum(1 for name in self.requests if kind is None or name == kind)
+
+    # --- Endpoint implementations ---
+    def freebusy(self, body):
+        time_min, time_max = _parse_time(body['timeMin']), _parse_time(body['timeMax'])
+        if len(body.get('items', [])) > FREEBUSY_MAX_CALENDARS:
+            return 400, {'error': {'code': 400, 'message': 'Too many calendars requested.'}}
+        calendars = {}
+        with self._lock:
+            for item in body.get('items', []):
+                if item['id'] != 'primary' and item['id'] not in self.calendars:
+                    calendars[item['id']] = {'errors': [{'domain': 'global', 'reason': 'notFound'}], 'busy': []}
+                    continue
+                busy = []
+                for event in self.calendars.get(item['id'], {}).values():
+                    if event.get('transparency') == 'transparent':
+                        continue
+                    start, end = _event_bounds(event)
+                    if start < time_max and end > time_min:
+                        busy.append((max(start, time_min), min(end, time_max)))
+                busy.sort()
+                calendars[item['id']] = {'busy': [
+                    {'start': start.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                     'end': end.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}
+                    for start, end in busy
+                ]}
+        return 200, {'kind': 'calendar#freeBusy', 'calendars': calendars}
+
+    def list_events(self, calendar_id, params):
+        offset = int(params.get('pageToken', '0'))
+        with self._lock:
+            if 'syncToken' in params:
+                position = int(params['syncToken'])
+                if position < self.expired_before:
+                    return 410, {'error': {'code': 410, 'message': 'Sync token is no longer valid.'}}
+                latest = {}
+                for feed_calendar, event in self.feed[position:]:
+                    if feed_calendar == calendar_id:
+                        latest[event['id']] = event
+                items = list(latest.values())
+            else:
+                items = list(self.calendars.get(calendar_id, {}).values())
+                if 'timeMin' in params:
+                    time_min, time_max = _parse_time(params['timeMin']), _parse_time(params['timeMax'])
+                    items = [event for event in items
+                             if _event_bounds(event)[0] < time_max and _event_bounds(event)[1] > time_min]
+            sync_position = len(self.feed)
+
+        page = items[offset:offset + self.page_size]
+        response = {'kind': 'calendar#events', 'items': page}
+        if offset + self.page_size < len(items):
+            response['nextPageToken'] = str(offset + self.page_size)
+        else:
+            response['nextSyncToken'] = str(sync_position)
+        return 200, response
+
+    def fail_inserts(self, count, status=503, after_create=False):
+        """
+        Makes the next `count` event inserts answer `status`. With after_create
+        the event is still created, like a request that timed out after Google
+        processed it.
+        """
+        with self._lock:
+            self.insert_failures.extend([(status, after_create)] * count)
+
+    def insert_event(self, calendar_id, body):
+        event_id = body.get('id') or uuid.uuid4().hex
+        with self._lock:
+            failure = self.insert_failures.pop(0) if self.insert_failures else None
+            if event_id in self.calendars.get(calendar_id, {}):
+                return 409, {'error': {'code': 409, 'message': 'The requested identifier already exists.'}}
+        if failure and not failure[1]:
+            return failure[0], {'error': {'code': failure[0], 'message': 'Injected failure.'}}
+
+        start, end = _event_bounds(body)
+        event = self.upsert_event(event_id, start, end, calendar_id=calendar_id,
+                                  summary=body.get('summary'), attendees=body.get('attendees', []))
+        if 'conferenceData' in body:
+            event['hangoutLink'] = f"https://meet.google.com/fake-{event_id[:10]}"
+        if failure:
+            return failure[0], {'error': {'code': failure[0], 'message': 'Injected failure.'}}
+        return 200, event
+
+    def get_event(self, calendar_id, event_id):
+        with self._lock:
+            event = self.calendars.get(calendar_id, {}).get(event_id)
+        if event is None:
+            return 404, {'error': {'code': 404, 'message': 'Not Found'}}
+        return 200, event
+
+    def delete_event(self, calendar_id, event_id):
+        with self._lock:
+            exists = event_id in self.calendars.get(calendar_id, {})
+        if not exists:
+            return 404, {'error': {'code': 404, 'message': 'Not Found'}}
+        self.cancel_event(event_id, calendar_id)
+        return 204, None
+
+    def refresh_token(self):
+        """OAuth token endpoint; point `Credentials.token_uri` at `{url}token`."""
+        return 200, {'access_token': f"fake-access-{uuid.uuid4().hex}", 'expires_in': 3600, 'token_type': 'Bearer'}
+
+    def watch(self, calendar_id, body):
+        return 200, {'kind': 'api#channel', 'id': body['id'], 'resourceId': f"resource-{calendar_id}",
+                     'expiration': str(int(time.time() * 1000) + 7 * 24 * 3600 * 1000)}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so that clients can keep connections alive; without Nagle, kept-alive
+    # responses are not held back by delayed ACKs.
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    calendar: FakeCalendar = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.calendar._lock:
+            self.calendar.connections += 1
+
+    def _respond(self, status, body):
+        payload = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _body(self):
+        # Always read the whole body, or the next request on a kept-alive connection breaks.
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length)
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            return json.loads(raw or b'{}')
+        return {}
+
+    def _route(self, method):
+        calendar = self.calendar
+        if calendar.latency:
+            time.sleep(calendar.latency)
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        body = self._body()
+
+        if method == 'POST' and parts == ['token']:
+            calendar.requests.append('token')
+            return self._respond(*calendar.refresh_token())
+        if method == 'POST' and parts == ['freeBusy']:
+            calendar.requests.append('freebusy')
+            return self._respond(*calendar.freebusy(body))
+        if method == 'POST' and parts == ['channels', 'stop']:
+            calendar.requests.append('channels.stop')
+            return self._respond(204, None)
+        if len(parts) >= 3 and parts[0] == 'calendars' and parts[2] == 'events':
+            calendar_id = parts[1]
+            if method == 'GET' and len(parts) == 3:
+                calendar.requests.append('events.list')
+                return self._respond(*calendar.list_events(calendar_id, params))
+            if method == 'POST' and len(parts) == 3:
+                calendar.requests.append('events.insert')
+                return self._respond(*calendar.insert_event(calendar_id, body))
+            if method == 'GET' and len(parts) == 4:
+                calendar.requests.append('events.get')
+                return self._respond(*calendar.get_event(calendar_id, parts[3]))
+            if method == 'DELETE' and len(parts) == 4:
+                calendar.requests.append('events.delete')
+                return self._respond(*calendar.delete_event(calendar_id, parts[3]))
+            if method == 'POST' and parts[3:] == ['watch']:
+                calendar.requests.append('events.watch')
+                return self._respond(*calendar.watch(calendar_id, body))
+        self._respond(404, {'error': {'code': 404, 'message': f'No fake for {method} {url.path}'}})
+
+    def do_GET(self):
+        self._route('GET')
+
+    def do_POST(self):
+        self._route('POST')
+
+    def do_DELETE(self):
+        self._route('DELETE')
+
+
+class FakeCalendarServer:
+    """Runs a FakeCalendar on a local port in a background thread."""
+
+    def __init__(self, calendar: FakeCalendar = None, host='127.0.0.1', port=0):
+        self.calendar = calendar or FakeCalendar()
+        handler = type('BoundHandler', (_Handler,), {'calendar': self.calendar})
+        server_class = type('Server', (ThreadingHTTPServer,), {'request_queue_size': 128})
+        self._server = server_class((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def calendar_service(base_url):
+    """Builds a real googleapiclient Calendar service that talks to the fake server."""
+    return build('calendar', 'v3', http=httplib2.Http(), static_discovery=True,
+                 client_options={'api_endpoint': base_url})
+
+
+def main():
+    """Serves an empty fake Calendar until interrupted, for a server or CLI started separately."""
+    import argparse
+    parser = argparse.ArgumentParser(description="Runs the fake Google Calendar API server.")
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+    with FakeCalendarServer(FakeCalendar(latency=args.latency), port=args.port) as server:
+        print(f"Fake Calendar API at {server.url} (set GOOGLE_CALENDAR_API_ENDPOINT to this)")
+        try:
+            server._thread.join()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
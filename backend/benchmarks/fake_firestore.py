@@ -0,0 +1,542 @@
+"""
+In-memory stand-in for the parts of `google.cloud.firestore.Client` the backend uses.
+
+Transactions use optimistic concurrency: documents read in a transaction are
+version-checked at commit and a conflicting commit raises `Aborted`, which
+`firestore.transactional` retries just like against the real service.
+An optional per-operation latency lets concurrent callers interleave, and
+`fail_writes` makes commits fail to replay outages.
+`FakeAsyncFirestore` exposes the same data through the `AsyncClient` API.
+"""
+import asyncio
+import itertools
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from google.api_core import exceptions
+from google.cloud import firestore
+
+
+_awaited_latency = ContextVar('awaited_latency', default=False)
+
+
+class FakeFirestore:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.docs = {}  # path tuple -> data
+        self.versions = Counter()  # path tuple -> version
+        self.stats = Counter()  # reads, writes, commits, aborts
+        self._write_faults = {}  # collection ID -> [commits to let through, commits to fail, error]
+        self._lock = threading.RLock()
+
+    # --- Client API ---
+    def collection(self, name):
+        return FakeCollection(self, (name,))
+
+    def document(self, path):
+        parts = tuple(path.split('/'))
+        return FakeDocument(self, parts[:-1], parts[-1])
+
+    def collection_group(self, collection_id):
+        return FakeQuery(self, (collection_id,), group=True)
+
+    def transaction(self, max_attempts=5, read_only=False):
+        return FakeTransaction(self, max_attempts, read_only)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def reset_stats(self):
+        self.stats.clear()
+
+    def fail_writes(self, collection_id: str, count: int = 1, error: Exception = None, after: int = 0):
+        """
+        Makes `count` commits writing to a `collection_id` collection raise
+        `error` (503 by default), once `after` such commits have gone through.
+        """
+        self._write_faults[collection_id] = [after, count,
+                                             error or exceptions.ServiceUnavailable("Injected write failure.")]
+
+    # --- Internals ---
+    def _sleep(self):
+        # The async wrapper awaits the latency itself instead of blocking the event loop.
+        if self.latency and not _awaited_latency.get():
+            time.sleep(self.latency)
+
+    def _read(self, path):
+        self._sleep()
+        with self._lock:
+            self.stats['reads'] += 1
+            data = self.docs.get(path)
+            return (_copy(data) if data is not None else None), self.versions[path]
+
+    def _apply(self, path, op, data=None, merge=False):
+        """Applies one write. Must be called with the lock held."""
+        self.stats['writes'] += 1
+        if op == 'delete':
+            self.docs.pop(path, None)
+        else:
+            current = self.docs.get(path)
+            if op == 'update' and current is None:
+                raise exceptions.NotFound(f"No document to update: {'/'.join(path)}")
+            base = _copy(current) if (current is not None and (merge or op == 'update')) else {}
+            _merge_into(base, _resolve(data), update_paths=(op == 'update'))
+            self.docs[path] = base
+        self.versions[path] += 1
+
+    def _check_write_faults(self, paths):
+        """Raises an injected failure before anything is written. Must be called with the lock held."""
+        for collection_id, fault in self._write_faults.items():
+            if fault[1] <= 0 or not any(path[-2] == collection_id for path in paths):
+                continue
+            if fault[0] > 0:
+                fault[0] -= 1
+                continue
+            fault[1] -= 1
+            self.stats['failed_commits'] += 1
+            raise fault[2]
+
+    def _write(self, path, op, data=None, merge=False):
+        self._sleep()
+        with self._lock:
+            self._check_write_faults([path])
+            self._apply(path, op, data, merge)
+
+    def _children(self, collection_path):
+        with self._lock:
+            return sorted(
+                (path[-1], path) for path in self.docs
+                if len(path) == len(collection_path) + 1 and path[:-1] == collection_path
+            )
+
+    def _group_members(self, collection_id):
+        """Documents of every collection named `collection_id`, at any depth."""
+        with self._lock:
+            return sorted((path[-1], path) for path in self.docs if path[-2] == collection_id)
+
+
+def _copy(value):
+    """Copies document data. Much cheaper than deepcopy for plain dicts, lists and scalars."""
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+
+def _resolve(value):
+    """Replaces write sentinels with concrete values."""
+    if value is firestore.SERVER_TIMESTAMP:
+        return datetime.now(timezone.utc)
+    if value is firestore.DELETE_FIELD:
+        return value
+    if isinstance(value, dict):
+        return {key: _resolve(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_resolve(item) for item in value]
+    return value
+
+
+def _merge_into(target, data, update_paths=False):
+    for key, value in data.items():
+        if update_paths and '.' in key:
+            # update() treats dots as nested field paths.
+            *parents, leaf = key.split('.')
+            node = target
+            for parent in parents:
+                node = node.setdefault(parent, {})
+            _set_field(node, leaf, value)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict) and not update_paths:
+            _merge_into(target[key], value)
+        else:
+            _set_field(target, key, value)
+
+
+def _set_field(node, key, value):
+    if value is firestore.DELETE_FIELD:
+        node.pop(key, None)
+    elif isinstance(value, firestore.Increment):
+        node[key] = node.get(key, 0) + value.value
+    else:
+        node[key] = value
+
+
+def _get_field(data, field_path):
+    for part in field_path.split('.'):
+        if not isinstance(data, dict) or part not in data:
+            return None
+        data = data[part]
+    return data
+
+
+_OPS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a is not None and a < b,
+    '<=': lambda a, b: a is not None and a <= b,
+    '>': lambda a, b: a is not None and a > b,
+    '>=': lambda a, b: a is not None and a >= b,
+    'in': lambda a, b: a in b,
+    'array_contains': lambda a, b: isinstance(a, list) and b in a,
+}
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return _copy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        return _get_field(self._data or {}, field_path)
+
+
+class FakeDocument:
+    def __init__(self, store, collection_path, doc_id):
+        self._store = store
+        self.id = doc_id
+        self.path_tuple = collection_path + (doc_id,)
+
+    @property
+    def path(self):
+        return '/'.join(self.path_tuple)
+
+    @property
+    def parent(self):
+        return FakeCollection(self._store, self.path_tuple[:-1])
+
+    def collection(self, name):
+        return FakeCollection(self._store, self.path_tuple + (name,))
+
+    def get(self, transaction=None, field_paths=None):
+        data, version = self._store._read(self.path_tuple)
+        if transaction is not None:
+            transaction._record_read(self.path_tuple, version)
+        return FakeSnapshot(self, data)
+
+    def set(self, data, merge=False):
+        self._store._write(self.path_tuple, 'set', data, merge)
+
+    def update(self, data):
+        self._store._write(self.path_tuple, 'update', data)
+
+    def delete(self):
+        self._store._write(self.path_tuple, 'delete')
+
+
+class FakeQuery:
+    def __init__(self, store, collection_path, filters=(), limit_count=None, order=None, cursor=None, group=False):
+        self._store = store
+        self._collection_path = collection_path
+        self._filters = filters
+        self._limit = limit_count
+        self._order = order
+        self._cursor = cursor
+        self._group = group
+
+    def _clone(self, **changes):
+        params = dict(filters=self._filters, limit_count=self._limit, order=self._order, cursor=self._cursor,
+                      group=self._group)
+        params.update(changes)
+        return FakeQuery(self._store, self._collection_path, **params)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._clone(filters=self._filters + ((field_path, op_string, value),))
+
+    def limit(self, count):
+        return self._clone(limit_count=count)
+
+    def order_by(self, field_path, direction='ASCENDING'):
+        return self._clone(order=(field_path, direction))
+
+    def start_after(self, document_or_values):
+        return self._clone(cursor=document_or_values)
+
+    def stream(self, transaction=None):
+        store = self._store
+        store._sleep()
+        results = []
+        with store._lock:
+            members = (store._group_members(self._collection_path[-1]) if self._group
+                       else store._children(self._collection_path))
+            for doc_id, path in members:
+                data = store.docs.get(path)
+                if data is not None and all(
+                        _OPS[op](_get_field(data, field), value) for field, op, value in self._filters):
+                    snapshot = FakeSnapshot(FakeDocument(store, path[:-1], doc_id), _copy(data))
+                    results.append((snapshot, path, store.versions[path]))
+
+            if self._order:
+                field, direction = self._order
+                key = (lambda snap: snap.id) if field == '__name__' else (lambda snap: _get_field(snap._data, field))
+                results.sort(key=lambda item: key(item[0]), reverse=(direction == 'DESCENDING'))
+                if self._cursor is not None:
+                    if isinstance(self._cursor, FakeSnapshot):
+                        cursor = key(self._cursor)
+                    elif isinstance(self._cursor, dict):
+                        cursor = self._cursor[field]
+                    else:
+                        cursor = self._cursor
+                    results = [item for item in results if key(item[0]) > cursor]
+            if self._limit is not None:
+                results = results[:self._limit]
+            # Like Firestore, a query costs one read per returned document and at least one read.
+            store.stats['reads'] += max(len(results), 1)
+
+        if transaction is not None:
+            for _, path, version in results:
+                transaction._record_read(path, version)
+        return iter(snapshot for snapshot, _, _ in results)
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, store, path):
+        super().__init__(store, path)
+        self.id = path[-1]
+
+    @property
+    def parent(self):
+        if len(self._collection_path) < 2:
+            return None
+        return FakeDocument(self._store, self._collection_path[:-2], self._collection_path[-2])
+
+    def document(self, doc_id=None):
+        return FakeDocument(self._store, self._collection_path, doc_id or f"auto-{next(_auto_ids)}")
+
+    def list_documents(self):
+        return [FakeDocument(self._store, self._collection_path, doc_id)
+                for doc_id, _ in self._store._children(self._collection_path)]
+
+
+_auto_ids = itertools.count()
+
+
+class FakeWriteBatch:
+    def __init__(self, store):
+        self._store = store
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append((reference.path_tuple, 'set', data, merge))
+
+    def update(self, reference, data):
+        self._writes.append((reference.path_tuple, 'update', data, False))
+
+    def delete(self, reference):
+        self._writes.append((reference.path_tuple, 'delete', None, False))
+
+    def __len__(self):
+        return len(self._writes)
+
+    def commit(self):
+        self._store._sleep()
+        with self._store._lock:
+            self._store._check_write_faults([path for path, *_ in self._writes])
+            self._store.stats['commits'] += 1
+            for path, op, data, merge in self._writes:
+                self._store._apply(path, op, data, merge)
+        self._writes = []
+
+
+class FakeTransaction(FakeWriteBatch):
+    """Implements the hooks `firestore.transactional` drives."""
+    _ids = itertools.count(1)
+
+    def __init__(self, store, max_attempts, read_only):
+        super().__init__(store)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._reads = {}
+
+    def _record_read(self, path, version):
+        self._reads.setdefault(path, version)
+
+    def _clean_up(self):
+        self._writes = []
+        self._reads = {}
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._id = next(self._ids)
+
+    def _rollback(self):
+        self._clean_up()
+
+    def _commit(self):
+        self._store._sleep()
+        with self._store._lock:
+            for path, version in self._reads.items():
+                if self._store.versions[path] != version:
+                    self._store.stats['aborts'] += 1
+                    self._clean_up()
+                    raise exceptions.Aborted("Transaction conflicted with a concurrent write.")
+            try:
+                self._store._check_write_faults([path for path, *_ in self._writes])
+            except Exception:
+                self._clean_up()
+                raise
+            self._store.stats['commits'] += 1
+            for path, op, data, merge in self._writes:
+                self._store._apply(path, op, data, merge)
+        self._clean_up()
+        return []
+
+
+# --- AsyncClient API ---
+
+async def _call_async(store, fn, *args, **kwargs):
+    if store.latency:
+        await asyncio.sleep(store.latency)
+    token = _awaited_latency.set(True)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _awaited_latency.reset(token)
+
+
+def _sync_transaction(transaction):
+    return transaction._sync if transaction is not None else None
+
+
+class FakeAsyncFirestore:
+    def __init__(self, store: FakeFirestore):
+        self.store = store
+
+    def collection(self, name):
+        return FakeAsyncCollection(self.store.collection(name))
+
+    def document(self, path):
+        return FakeAsyncDocument(self.store.document(path))
+
+    def collection_group(self, collection_id):
+        return FakeAsyncQuery(self.store.collection_group(collection_id))
+
+    def transaction(self, max_attempts=5, read_only=False):
+        return FakeAsyncTransaction(self.store.transaction(max_attempts, read_only))
+
+    def batch(self):
+        return FakeAsyncWriteBatch(self.store.batch())
+
+
+class FakeAsyncDocument:
+    def __init__(self, sync_document):
+        self._sync = sync_document
+        self.id = sync_document.id
+
+    @property
+    def path(self):
+        return self._sync.path
+
+    def collection(self, name):
+        return FakeAsyncCollection(self._sync.collection(name))
+
+    async def get(self, transaction=None, field_paths=None):
+        return await _call_async(self._sync._store, self._sync.get, transaction=_sync_transaction(transaction))
+
+    async def set(self, data, merge=False):
+        return await _call_async(self._sync._store, self._sync.set, data, merge=merge)
+
+    async def update(self, data):
+        return await _call_async(self._sync._store, self._sync.update, data)
+
+    async def delete(self):
+        return await _call_async(self._sync._store, self._sync.delete)
+
+
+class FakeAsyncQuery:
+    def __init__(self, sync_query):
+        self._sync = sync_query
+
+    def where(self, *args, **kwargs):
+        return FakeAsyncQuery(self._sync.where(*args, **kwargs))
+
+    def limit(self, count):
+        return FakeAsyncQuery(self._sync.limit(count))
+
+    def order_by(self, *args, **kwargs):
+        return FakeAsyncQuery(self._sync.order_by(*args, **kwargs))
+
+    def start_after(self, document_or_values):
+        return FakeAsyncQuery(self._sync.start_after(document_or_values))
+
+    async def stream(self, transaction=None):
+        snapshots = await _call_async(
+            self._sync._store, lambda: list(self._sync.stream(transaction=_sync_transaction(transaction))))
+        for snapshot in snapshots:
+            yield snapshot
+
+    async def get(self, transaction=None):
+        return [snapshot async for snapshot in self.stream(transaction=transaction)]
+
+
+class FakeAsyncCollection(FakeAsyncQuery):
+    def __init__(self, sync_collection):
+        super().__init__(sync_collection)
+        self.id = sync_collection.id
+
+    def document(self, doc_id=None):
+        return FakeAsyncDocument(self._sync.document(doc_id))
+
+
+class FakeAsyncWriteBatch:
+    def __init__(self, sync_batch):
+        self._sync = sync_batch
+
+    def set(self, reference, data, merge=False):
+        self._sync.set(reference._sync, data, merge=merge)
+
+    def update(self, reference, data):
+        self._sync.update(reference._sync, data)
+
+    def delete(self, reference):
+        self._sync.delete(reference._sync)
+
+    def __len__(self):
+        return len(self._sync)
+
+    async def commit(self):
+        return await _call_async(self._sync._store, self._sync.commit)
+
+
+class FakeAsyncTransaction(FakeAsyncWriteBatch):
+    """Implements the hooks `firestore.async_transactional` drives."""
+
+    @property
+    def _max_attempts(self):
+        return self._sync._max_attempts
+
+    @property
+    def _read_only(self):
+        return self._sync._read_only
+
+    @property
+    def _id(self):
+        return self._sync._id
+
+    def _clean_up(self):
+        self._sync._clean_up()
+
+    async def _begin(self, retry_id=None):
+        self._sync._begin(retry_id)
+
+    async def _rollback(self):
+        self._sync._rollback()
+
+    async def _commit(self):
+        return await _call_async(self._sync._store, self._sync._commit)
@@ -0,0 +1,63 @@
+import os
+import random
+from datetime import datetime, timedelta
+
+import jwt
+import pytz
+
+
+def random_busy_intervals(count, start, days, seed=0, max_minutes=60):
+    """
+    Generates `count` random busy intervals spread over `days` days from `start`.
+
+    Returns a list of dicts shaped like the `busy` entries of a freebusy response.
+    """
+    rng = random.Random(seed)
+    horizon_minutes = days * 24 * 60
+    intervals = []
+    for _ in range(count):
+        offset = rng.randrange(horizon_minutes)
+        length = rng.randrange(5, max_minutes + 1, 5)
+        busy_start = start + timedelta(minutes=offset)
+        busy_end = busy_start + timedelta(minutes=length)
+        intervals.append({
+            'start': busy_start.astimezone(pytz.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'end': busy_end.astimezone(pytz.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        })
+    return intervals
+
+
+def fixed_now(tz_name='Asia/Tokyo'):
+    """A fixed 'now' so benchmark runs are comparable."""
+    return pytz.timezone(tz_name).localize(datetime(2025, 1, 6, 8, 0))
+
+
+def configure_app_env():
+    """Default settings `main` needs at import time. Call before importing it."""
+    os.environ.setdefault("JWT_SECRET_KEY", "benchmark-only-jwt-secret-0123456789")
+    os.environ.setdefault("FERNET_KEY", "Zm9yLWxvYWQtdGVzdHMtb25seS0wMTIzNDU2Nzg5MDE=")
+    os.environ.setdefault("GOOGLE_CLIENT_ID", "benchmark-client")
+    os.environ.setdefault("GOOGLE_CLIENT_SECRET", "benchmark-secret")
+    os.environ.setdefault("METRICS_TOKEN", "benchmark-only-metrics-token")
+
+
+def metrics_headers():
+    """The Authorization header GET /metrics and GET /api/cache/stats need."""
+    return {'Authorization': f"Bearer {os.environ['METRICS_TOKEN']}"}
+
+
+def auth_headers(user_id, minutes=60):
+    """An Authorization header with a JWT for `user_id`, signed like `main.auth_callback` signs them."""
+    now = datetime.utcnow()
+    token = jwt.encode({'sub': user_id, 'exp': now + timedelta(minutes=minutes), 'iat': now},
+                       os.environ["JWT_SECRET_KEY"], algorithm="HS256")
+    return {'Authorization': f"Bearer {token}"}
+
+
+def fill_calendar(calendar, start, days, events_per_day, seed=0, calendar_id='primary'):
+    """Adds `events_per_day` random events per day for `days` days from `start` to a `FakeCalendar`."""
+    calendar.add_calendar(calendar_id)
+    intervals = random_busy_intervals(days * events_per_day, start, days, seed=seed, max_minutes=90)
+    for n, busy in enumerate(intervals):
+        busy_start, busy_end = (datetime.fromisoformat(busy[key].replace('Z', '+00:00')) for key in ('start', 'end'))
+        calendar.upsert_event(f"busy-{seed}-{n}", busy_start, busy_end, calendar_id=calendar_id)
@@ -0,0 +1,208 @@
+"""
+Load test for the hot endpoints: public slot reads, bookings and slot generation.
+
+By default everything runs in-process against the in-memory Firestore double
+and the fake Calendar server, both with simulated latency. The async handlers
+in `main` are compared with a thread-pool baseline that runs the same work
+through the sync clients, the way the endpoints did before they were async.
+
+With --base-url the requests go to a running server instead. Seed the
+Firestore emulator it uses with --seed-emulator (requires
+FIRESTORE_EMULATOR_HOST) and start it with GOOGLE_CALENDAR_API_ENDPOINT
+pointing at the fake Calendar server this script starts on --calendar-port.
+
+Run from the backend directory:
+    python -m benchmarks.load_test --concurrency 100 --requests 2000
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.fixtures import auth_headers, configure_app_env
+
+configure_app_env()
+
+import httpx
+from fastapi import Depends, FastAPI, HTTPException
+
+import main as api
+from auth import get_current_user
+from calendar_client import AsyncCalendarClient
+from calendar_pool import CalendarServicePool
+from calendar_sync import regenerate_slots_for_dates
+from slot_engine import SlotSettings, compute_available_slots
+from slot_store import book_slot, read_slots, save_regenerated_slots, slots_cache
+from benchmarks.fake_calendar import FakeCalendar, FakeCalendarServer
+from benchmarks.fake_firestore import FakeAsyncFirestore, FakeFirestore
+
+HOSTS = 20
+SETTINGS = {'workingHours': {'start': '00:00', 'end': '23:30'}, 'slotDuration': 60,
+            'timezone': 'UTC', 'workingDays': [0, 1, 2, 3, 4, 5, 6], 'eventName': 'Meeting'}
+
+
+def seed(db, calendar):
+    now = datetime.now(SlotSettings.from_user_settings(SETTINGS).timezone)
+    slot_settings = SlotSettings.from_user_settings(SETTINGS)
+    for i in range(HOSTS):
+        user_id = f"host-{i}"
+        db.collection('users').document(user_id).set({
+            'userId': user_id, 'email': f"{user_id}@example.com", 'publicUrlToken': f"token-{i}",
+            'encryptedAccessToken': api.encrypt_token(f"access-{i}"),
+            'encryptedRefreshToken': api.encrypt_token(f"refresh-{i}"),
+            'settings': SETTINGS,
+        })
+        save_regenerated_slots(db, user_id, compute_available_slots([], slot_settings, now), now)
+        for day in range(14):
+            start = now + timedelta(days=day, hours=2)
+            calendar.upsert_event(f"busy-{i}-{day}", start, start + timedelta(hours=1), calendar_id='primary')
+
+
+def baseline_app() -> FastAPI:
+    """The three endpoints as sync handlers on the sync clients, run in Starlette's thread pool."""
+    baseline = FastAPI()
+
+    @baseline.get("/api/slots/public/{token}")
+    def get_public_slots(token: str):
+        results = list(api.db.collection('users').where('publicUrlToken', '==', token).limit(1).stream())
+        if not results:
+            raise HTTPException(status_code=404, detail="Public booking page not found.")
+        return {"userName": results[0].to_dict().get('email'), "slots": read_slots(api.db, results[0].id)}
+
+    @baseline.post("/api/bookings")
+    def create_booking(req: api.BookingRequest):
+        results = list(api.db.collection('users').where('publicUrlToken', '==', req.publicUrlToken).limit(1).stream())
+        host_user_id, host_user_data = results[0].id, results[0].to_dict()
+        try:
+            slot = book_slot(api.db, host_user_id, req.slotId)
+        except ValueError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        service = api.build_calendar_service(host_user_data)
+        event = service.events().insert(calendarId='primary', conferenceDataVersion=1, body={
+            'summary': f"Meeting with {req.bookerName}",
+            'start': {'dateTime': slot['startTime']}, 'end': {'dateTime': slot['endTime']},
+            'conferenceData': {'createRequest': {'requestId': f"{req.slotId}-{req.bookerEmail}"}},
+        }).execute()
+        api.db.collection('bookings').document(event['id']).set({'bookingId': event['id'], 'slotId': req.slotId})
+        return {"message": "Booking successful!", "event_details": event}
+
+    @baseline.post("/api/user/me/slots/generate")
+    def generate_user_slots(user_id: str = Depends(get_current_user)):
+        user_data = api.db.collection('users').document(user_id).get().to_dict()
+        slot_settings = SlotSettings.from_user_settings(user_data.get('settings', {}))
+        count = regenerate_slots_for_dates(api.db, api.build_calendar_service(user_data), user_id, slot_settings,
+                                           datetime.now(slot_settings.timezone))
+        return {"message": f"Successfully generated and saved {count} available slots."}
+
+    return baseline
+
+
+def make_requests(count, slot_ids_by_host):
+    """A fixed mix: 85% public page reads, 12% bookings, 3% slot generations."""
+    rng = random.Random(42)
+    requests = []
+    for _ in range(count):
+        host = rng.randrange(HOSTS)
+        roll = rng.random()
+        if roll < 0.85:
+            requests.append(('public', 'GET', f"/api/slots/public/token-{host}", None, None))
+        elif roll < 0.97 and slot_ids_by_host[host]:
+            slot_id = slot_ids_by_host[host].pop()
+            body = {'publicUrlToken': f"token-{host}", 'slotId': slot_id,
+                    'bookerName': 'Load Test', 'bookerEmail': 'booker@example.com'}
+            requests.append(('booking', 'POST', '/api/bookings', body, None))
+        else:
+            requests.append(('generate', 'POST', '/api/user/me/slots/generate', None,
+                             auth_headers(f"host-{host}", minutes=10)))
+    return requests
+
+
+async def drive(client, requests, concurrency):
+    latencies = {}
+    errors = {}
+    queue = iter(requests)
+
+    async def worker():
+        for kind, method, path, body, headers in queue:
+            started = time.perf_counter()
+            response = await client.request(method, path, json=body, headers=headers)
+            latencies.setdefault(kind, []).append(time.perf_counter() - started)
+            if response.status_code >= 400 and response.status_code != 409:
+                errors[kind] = errors.get(kind, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started, latencies, errors
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def report(label, elapsed, latencies, errors, total):
+    print(f"{label}: {total / elapsed:7.1f} req/s")
+    for kind, values in sorted(latencies.items()):
+        print(f"  {kind:<9} n={len(values):<5} p50={percentile(values, 0.5) * 1000:8.1f} ms  "
+              f"p99={percentile(values, 0.99) * 1000:8.1f} ms  errors={errors.get(kind, 0)}")
+
+
+async def run_in_process(args):
+    calendar = FakeCalendar(latency=args.calendar_latency)
+    with FakeCalendarServer(calendar) as server:
+        for label, app_factory in (("before (sync, thread pool)", baseline_app), ("after (async)", lambda: api.app)):
+            api.db = FakeFirestore(latency=args.firestore_latency)
+            api.async_db = FakeAsyncFirestore(api.db)
+            api.CALENDAR_CLIENT_OPTIONS = {'api_endpoint': server.url}
+            api.calendar_pool = CalendarServicePool(api.build_credentials, client_options=api.CALENDAR_CLIENT_OPTIONS)
+            api.calendar_client = AsyncCalendarClient(base_url=server.url)
+            api.public_user_cache.clear()
+            slots_cache.clear()
+            seed(api.db, calendar)
+
+            slot_ids = {i: [slot['slotId'] for slot in read_slots(api.db, f"host-{i}")] for i in range(HOSTS)}
+            for ids in slot_ids.values():
+                random.Random(7).shuffle(ids)
+            requests = make_requests(args.requests, slot_ids)
+
+            transport = httpx.ASGITransport(app=app_factory())
+            async with httpx.AsyncClient(transport=transport, base_url="http://load-test") as client:
+                elapsed, latencies, errors = await drive(client, requests, args.concurrency)
+            await api.calendar_client.aclose()
+            report(label, elapsed, latencies, errors, len(requests))
+
+
+async def run_against_server(args):
+    calendar = FakeCalendar(latency=args.calendar_latency)
+    with FakeCalendarServer(calendar, port=args.calendar_port):
+        if args.seed_emulator:
+            from google.cloud import firestore
+            seed(firestore.Client(), calendar)
+        slot_ids = {i: [] for i in range(HOSTS)}
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=60) as client:
+            for i in range(HOSTS):
+                response = await client.get(f"/api/slots/public/token-{i}")
+                slot_ids[i] = [slot['slotId'] for slot in response.json().get('slots', [])
+                               if slot['status'] == 'available']
+                random.Random(7).shuffle(slot_ids[i])
+            requests = make_requests(args.requests, slot_ids)
+            elapsed, latencies, errors = await drive(client, requests, args.concurrency)
+        report(args.base_url, elapsed, latencies, errors, len(requests))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--firestore-latency', type=float, default=0.005)
+    parser.add_argument('--calendar-latency', type=float, default=0.05)
+    parser.add_argument('--base-url')
+    parser.add_argument('--calendar-port', type=int, default=8089)
+    parser.add_argument('--seed-emulator', action='store_true')
+    args = parser.parse_args()
+    asyncio.run(run_against_server(args) if args.base_url else run_in_process(args))
+
+
+if __name__ == "__main__":
+    main()
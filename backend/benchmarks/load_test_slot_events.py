@@ -0,0 +1,214 @@
+"""
+Load test for the slot event stream (GET /api/slots/public/{token}/events).
+
+Serves the app with uvicorn on a local port, opens 5k concurrent EventSource
+style subscribers on one host's page, then books slots and regenerates the
+host's days from another thread, the way sync endpoints and the calendar
+sync do. For every change it reports how long the event took to reach all
+subscribers and how many Firestore reads the fan-out cost. It also checks
+that a subscriber that stops reading gets a single resync instead of an
+unbounded buffer, and that closed streams unsubscribe.
+
+Run from the backend directory:
+    python -m benchmarks.load_test_slot_events --subscribers 5000
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+
+from benchmarks.fixtures import configure_app_env
+
+configure_app_env()
+
+import uvicorn
+
+import main as api
+import slot_store
+from slot_engine import SlotSettings, compute_available_slots, slot_date
+from slot_events import SlotEventHub
+from benchmarks.fake_firestore import FakeAsyncFirestore, FakeFirestore
+from benchmarks.fixtures import fixed_now
+
+SETTINGS = SlotSettings.from_user_settings({'slotDuration': 30})
+CHANGES = 20
+OPEN_CONCURRENCY = 500
+
+
+class Server:
+    """The app on a local port, served by uvicorn on its own thread and event loop."""
+
+    def __init__(self):
+        config = uvicorn.Config(api.app, host='127.0.0.1', port=0, log_level='warning', backlog=8192, lifespan='off')
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    @property
+    def port(self):
+        return self._server.servers[0].sockets[0].getsockname()[1]
+
+    def __exit__(self, *exc):
+        self._server.should_exit = True
+        self._thread.join()
+
+
+class Deliveries:
+    """Receive times of every version across all subscribers."""
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.times = {}  # version -> [receive time]
+        self.complete = {}  # version -> asyncio.Event, set once every subscriber has it
+
+    def add(self, version):
+        times = self.times.setdefault(version, [])
+        times.append(time.perf_counter())
+        if len(times) == self.expected:
+            self.event(version).set()
+
+    def event(self, version):
+        return self.complete.setdefault(version, asyncio.Event())
+
+
+class Subscriber:
+    def __init__(self, deliveries):
+        self.deliveries = deliveries
+        self.resyncs = 0
+        self.ready = asyncio.Event()
+        self.writer = None
+
+    async def run(self, port, since):
+        reader, self.writer = await asyncio.open_connection('127.0.0.1', port)
+        self.writer.write(f"GET /api/slots/public/public-token/events?since={since} HTTP/1.1\r\n"
+                          f"Host: bench\r\nAccept: text/event-stream\r\n\r\n".encode())
+        status = await reader.readline()
+        assert b' 200 ' in status, status
+        event = None
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            line = line.strip()
+            if line.startswith(b'retry:'):
+                self.ready.set()
+            elif line.startswith(b'event:'):
+                event = line[6:].strip()
+            elif line.startswith(b'data:'):
+                if event == b'slots':
+                    self.deliveries.add(json.loads(line[5:])['version'])
+                elif event == b'resync':
+                    self.resyncs += 1
+
+    def close(self):
+        self.writer.close()
+
+
+async def open_subscribers(count, port, since, deliveries):
+    subscribers = [Subscriber(deliveries) for _ in range(count)]
+    gate = asyncio.Semaphore(OPEN_CONCURRENCY)
+    tasks = []
+
+    async def start(subscriber):
+        async with gate:
+            tasks.append(asyncio.create_task(subscriber.run(port, since)))
+            await subscriber.ready.wait()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(start(subscriber) for subscriber in subscribers))
+    return subscribers, tasks, time.perf_counter() - started
+
+
+def regenerate(db, now):
+    """The calendar sync finds a meeting on the second working day."""
+    slots = compute_available_slots([], SETTINGS, now)
+    day = sorted({slot_date(slot) for slot in slots})[1]
+    regenerated = [slot for slot in slots if slot_date(slot) == day and slot['startTime'][11:13] != '10']
+    slot_store.save_regenerated_slots(db, 'host-1', regenerated, now, {day})
+
+
+async def make_changes(db, now, deliveries):
+    latencies = []
+    reads = []
+    for n in range(CHANGES):
+        reads_before = api.slot_event_hub.stats['reads']
+        committed = time.perf_counter()
+        if n == CHANGES // 2:
+            await asyncio.to_thread(regenerate, db, now)
+        else:
+            available = [slot for slot in slot_store.read_slots(db, 'host-1') if slot['status'] == 'available']
+            await asyncio.to_thread(slot_store.book_slot, db, 'host-1', available[n * 7]['slotId'])
+        version = slot_store.read_versioned_slots(db, 'host-1')[0]
+        await asyncio.wait_for(deliveries.event(version).wait(), 30)
+        delays = sorted(received - committed for received in deliveries.times[version])
+        latencies.append(delays)
+        reads.append(api.slot_event_hub.stats['reads'] - reads_before)
+    return latencies, reads
+
+
+async def check_overflow():
+    """A subscriber that stops reading holds at most one resync."""
+    async def read_version(user_id):
+        return 1
+
+    async def read_changes(user_id, since):
+        return since + 1, {'2025-01-06': []}
+
+    hub = SlotEventHub(read_version, read_changes, buffer_size=4, poll_seconds=0.001)
+    subscription = await hub.subscribe('host-1')
+    await asyncio.sleep(0.2)
+    frames = []
+    while not subscription._queue.empty():
+        frames.append(subscription._queue.get_nowait())
+    await hub.aclose()
+    assert len(frames) <= 4 and any(frame.startswith('event: resync') for frame in frames), frames
+    print(f"slow subscriber: buffer bounded at {len(frames)} frames, overflows={hub.stats['overflows']}")
+
+
+async def main(subscriber_count):
+    db = FakeFirestore()
+    api.db = db
+    api.async_db = FakeAsyncFirestore(db)
+    db.collection('users').document('host-1').set({
+        'userId': 'host-1', 'email': 'host@example.com', 'publicUrlToken': 'public-token'})
+    now = fixed_now()
+    slot_store.save_regenerated_slots(db, 'host-1', compute_available_slots([], SETTINGS, now), now)
+    version = slot_store.read_versioned_slots(db, 'host-1')[0]
+
+    await check_overflow()
+    with Server() as server:
+        deliveries = Deliveries(subscriber_count)
+        subscribers, tasks, open_seconds = await open_subscribers(subscriber_count, server.port, version, deliveries)
+        print(f"{subscriber_count} subscribers connected in {open_seconds:.2f}s, "
+              f"hub={api.slot_event_hub.channel_stats()}")
+
+        latencies, reads = await make_changes(db, now, deliveries)
+        for n, (delays, change_reads) in enumerate(zip(latencies, reads)):
+            kind = 'regeneration' if n == CHANGES // 2 else 'booking'
+            print(f"{kind:<12} delivered to {len(delays)}: first={delays[0] * 1000:6.1f} ms  "
+                  f"p50={delays[len(delays) // 2] * 1000:6.1f} ms  "
+                  f"p99={delays[int(len(delays) * 0.99)] * 1000:6.1f} ms  "
+                  f"all={delays[-1] * 1000:6.1f} ms  change reads={change_reads}")
+        assert sum(s.resyncs for s in subscribers) == 0
+
+        for subscriber in subscribers:
+            subscriber.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        deadline = time.perf_counter() + 10
+        while api.slot_event_hub.subscribers and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        print(f"after closing: hub={api.slot_event_hub.channel_stats()}")
+        assert api.slot_event_hub.subscribers == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--subscribers', type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(main(args.subscribers))
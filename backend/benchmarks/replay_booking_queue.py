@@ -0,0 +1,114 @@
+"""
+Replays queued bookings (BOOKING_MODE=queued) against failure scenarios.
+
+Runs the app in-process with the in-memory Firestore double, the fake
+Calendar server and the in-process booking queue. For each scenario it posts a
+booking, waits for the queue, and checks the booking status, the number of
+Calendar events created and whether the slot ended up booked or freed again.
+It also compares the POST latency with the inline booking mode.
+
+Run from the backend directory:
+    python -m benchmarks.replay_booking_queue
+"""
+import asyncio
+import time
+from datetime import datetime
+
+from benchmarks.fixtures import configure_app_env
+
+configure_app_env()
+
+import httpx
+
+import main as api
+from booking_queue import BookingQueue
+from calendar_client import AsyncCalendarClient
+from slot_engine import SlotSettings, compute_available_slots
+from slot_store import read_slots, save_regenerated_slots, slots_cache
+from benchmarks.fake_calendar import FakeCalendar, FakeCalendarServer
+from benchmarks.fake_firestore import FakeAsyncFirestore, FakeFirestore
+
+USER_ID = 'host-1'
+SETTINGS = {'workingHours': {'start': '09:00', 'end': '17:00'}, 'slotDuration': 30,
+            'timezone': 'UTC', 'workingDays': [0, 1, 2, 3, 4, 5, 6]}
+
+
+def slot_status(slot_id):
+    return next(slot['status'] for slot in read_slots(api.db, USER_ID) if slot['slotId'] == slot_id)
+
+
+async def book(client, slot_id):
+    started = time.perf_counter()
+    response = await client.post('/api/bookings', json={
+        'publicUrlToken': 'public-token', 'slotId': slot_id,
+        'bookerName': 'Replay', 'bookerEmail': 'booker@example.com'})
+    return response, time.perf_counter() - started
+
+
+async def run_scenario(client, calendar, slot_id, label, expected_status, expected_slot, inserts, events=1):
+    calendar.requests.clear()
+    response, elapsed = await book(client, slot_id)
+    assert response.status_code == 202, response.text
+    booking_id = response.json()['bookingId']
+    await api.booking_queue.join()
+
+    booking = (await client.get(f"/api/bookings/{booking_id}")).json()
+    event_id = api.db.collection('bookings').document(booking_id).get().to_dict()['eventId']
+    created = sum(1 for event in calendar.calendars.get('primary', {}).values() if event['id'] == event_id)
+    slots_cache.clear()
+    assert booking['status'] == expected_status, f"{label}: status {booking['status']}"
+    assert slot_status(slot_id) == expected_slot, f"{label}: slot {slot_status(slot_id)}"
+    assert calendar.request_count('events.insert') == inserts, f"{label}: {calendar.request_count('events.insert')} inserts"
+    assert created == events, f"{label}: {created} events"
+    print(f"{label:<34} POST={elapsed * 1000:6.1f} ms  status={booking['status']:<9} slot={expected_slot:<9} "
+          f"inserts={inserts}  events={events}")
+
+
+async def main():
+    now = datetime.now(SlotSettings.from_user_settings(SETTINGS).timezone)
+    api.db = FakeFirestore()
+    api.async_db = FakeAsyncFirestore(api.db)
+    api.db.collection('users').document(USER_ID).set({
+        'userId': USER_ID, 'email': 'host@example.com', 'publicUrlToken': 'public-token', 'settings': SETTINGS,
+        'encryptedAccessToken': api.encrypt_token('access'), 'encryptedRefreshToken': api.encrypt_token('refresh'),
+    })
+    save_regenerated_slots(api.db, USER_ID,
+                           compute_available_slots([], SlotSettings.from_user_settings(SETTINGS), now), now)
+    slot_ids = iter([slot['slotId'] for slot in read_slots(api.db, USER_ID)])
+
+    calendar = FakeCalendar(latency=0.3)
+    with FakeCalendarServer(calendar) as server:
+        api.calendar_client = AsyncCalendarClient(base_url=server.url)
+        api.booking_queue = BookingQueue(api.process_booking_job, api.fail_booking_job,
+                                         max_attempts=3, retry_base_seconds=0.01)
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://replay") as client:
+            api.BOOKING_MODE = 'sync'
+            response, elapsed = await book(client, next(slot_ids))
+            assert response.status_code == 200, response.text
+            print(f"{'inline booking (BOOKING_MODE=sync)':<34} POST={elapsed * 1000:6.1f} ms")
+
+            api.BOOKING_MODE = 'queued'
+            await run_scenario(client, calendar, next(slot_ids), "queued, succeeds", 'confirmed', 'booked', 1)
+
+            calendar.fail_inserts(2, status=503)
+            await run_scenario(client, calendar, next(slot_ids), "two 503s, then succeeds", 'confirmed', 'booked', 3)
+
+            # The first insert creates the event but the response is lost; the retry gets a 409.
+            calendar.fail_inserts(1, status=503, after_create=True)
+            await run_scenario(client, calendar, next(slot_ids), "created, response lost", 'confirmed', 'booked', 2)
+
+            calendar.fail_inserts(1, status=403)
+            await run_scenario(client, calendar, next(slot_ids), "permanent 403", 'failed', 'available', 1, events=0)
+
+            calendar.fail_inserts(3, status=503)
+            await run_scenario(client, calendar, next(slot_ids), "503 on every attempt", 'failed', 'available', 3,
+                               events=0)
+
+        await api.booking_queue.aclose()
+        await api.calendar_client.aclose()
+    print(f"queue stats: {api.booking_queue.stats}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
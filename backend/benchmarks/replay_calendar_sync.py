@@ -0,0 +1,79 @@
+"""
+Replays a calendar change feed through the incremental slot sync.
+
+Runs calendar_sync.sync_user_calendar against a local fake Calendar server and
+an in-memory Firestore, and checks after every step that the patched slots
+equal a full regeneration and that booked slots survive.
+
+Run from the backend directory:
+    python -m benchmarks.replay_calendar_sync
+"""
+from datetime import timedelta
+
+from calendar_sync import fetch_busy_times, sync_user_calendar
+from slot_engine import SlotSettings, compute_available_slots
+from slot_store import book_slot, read_slots
+from benchmarks.fake_calendar import FakeCalendarServer, calendar_service
+from benchmarks.fake_firestore import FakeFirestore
+from benchmarks.fixtures import fixed_now
+
+USER_ID = 'host-1'
+USER_DATA = {'settings': {'workingHours': {'start': '09:00', 'end': '17:00'}, 'slotDuration': 30,
+                          'timezone': 'Asia/Tokyo', 'workingDays': [0, 1, 2, 3, 4]}}
+
+
+def check(db, service, now, booked_ids, label, affected):
+    slot_settings = SlotSettings.from_user_settings(USER_DATA['settings'])
+    expected = compute_available_slots(
+        fetch_busy_times(service, now, now + timedelta(days=14)), slot_settings, now)
+    slots = read_slots(db, USER_ID)
+    available = [slot for slot in slots if slot['status'] == 'available']
+    booked = {slot['slotId'] for slot in slots if slot['status'] == 'booked'}
+    assert available == [slot for slot in expected if slot['slotId'] not in booked], f"{label}: slots differ"
+    assert booked_ids <= booked, f"{label}: a booked slot was lost"
+    days = 'all' if affected is None else sorted(day.isoformat() for day in affected)
+    print(f"{label:<28} regenerated days={days}  available={len(available)}  booked={len(booked)}")
+
+
+def main():
+    now = fixed_now()
+    tz = now.tzinfo
+    db = FakeFirestore()
+    with FakeCalendarServer() as server:
+        calendar = server.calendar
+        service = calendar_service(server.url)
+        day = lambda offset, hour, minute=0: tz.normalize(now.replace(hour=hour, minute=minute) + timedelta(days=offset))
+
+        calendar.upsert_event('standup', day(1, 10), day(1, 11))
+        affected = sync_user_calendar(db, service, USER_ID, USER_DATA, now=now)
+        check(db, service, now, set(), "initial full sync", affected)
+
+        # A booker takes a slot; later syncs must not undo that.
+        booked_ids = {book_slot(db, USER_ID, read_slots(db, USER_ID)[0]['slotId'])['slotId']}
+
+        calendar.upsert_event('lunch', day(2, 12), day(2, 13))
+        affected = sync_user_calendar(db, service, USER_ID, USER_DATA, now=now)
+        check(db, service, now, booked_ids, "event added", affected)
+
+        calendar.upsert_event('standup', day(3, 15), day(3, 16))
+        affected = sync_user_calendar(db, service, USER_ID, USER_DATA, now=now)
+        check(db, service, now, booked_ids, "event moved", affected)
+
+        calendar.cancel_event('lunch')
+        affected = sync_user_calendar(db, service, USER_ID, USER_DATA, now=now)
+        check(db, service, now, booked_ids, "event cancelled", affected)
+
+        affected = sync_user_calendar(db, service, USER_ID, USER_DATA, now=now)
+        check(db, service, now, booked_ids, "no changes", affected)
+
+        calendar.expire_sync_tokens()
+        calendar.upsert_event('offsite', day(8, 9), day(8, 17))
+        affected = sync_user_calendar(db, service, USER_ID, USER_DATA, now=now)
+        check(db, service, now, booked_ids, "sync token expired", affected)
+
+        print(f"calendar requests: {calendar.request_count('events.list')} events.list, "
+              f"{calendar.request_count('freebusy')} freebusy")
+
+
+if __name__ == "__main__":
+    main()
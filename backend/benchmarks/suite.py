@@ -0,0 +1,346 @@
+"""
+Reproducible end-to-end benchmark suite.
+
+Runs fixed scenarios through the real app (`main`, in-process over ASGI)
+against the Firestore double and the fake Calendar server, with fixed
+latencies, seeds and concurrency, so that runs on different commits compare:
+
+- public_reads: GET /api/slots/public/{token} spread over the hosts.
+- generate_density_N: POST /api/user/me/slots/generate for hosts whose
+  calendars hold N events a day. The busy-time cache is off, so every request
+  runs a freebusy query.
+- booking_contention: parallel POST /api/bookings for different slots of one
+  host (BOOKING_MODE=sync), a fresh host per round.
+- booking_same_slots: parallel bookers racing for a few slots. 409s are
+  expected; the run fails if any slot is booked twice.
+
+Each scenario reports throughput, p50/p95/p99 latency and, with the double,
+its Firestore and Calendar operation counts. The run is written as JSON
+together with the commit it ran on; --compare prints the change against a
+baseline file and exits with 1 when a scenario got slower than --threshold.
+With --firestore emulator the Firestore emulator at FIRESTORE_EMULATOR_HOST
+is used instead of the double (its latency is then whatever it is).
+
+Run from the backend directory:
+    python -m benchmarks.suite --output bench-results.json
+    python -m benchmarks.suite --compare bench-results.json --output bench-new.json
+    python -m benchmarks.suite --compare bench-results.json bench-new.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.fixtures import auth_headers, configure_app_env, fill_calendar
+
+configure_app_env()
+
+import httpx
+import numpy as np
+
+import main as api
+from booking_queue import BookingQueue
+from booking_store import booking_results
+from calendar_client import AsyncCalendarClient
+from calendar_pool import CalendarServicePool
+from slot_engine import SLOT_HORIZON_DAYS, SlotSettings, compute_available_slots
+from slot_store import read_slots, save_regenerated_slots
+from user_context import user_profiles
+from benchmarks.fake_calendar import FakeCalendar, FakeCalendarServer
+from benchmarks.fake_firestore import FakeAsyncFirestore, FakeFirestore
+
+RESULTS_SCHEMA = 1
+SETTINGS = {'workingHours': {'start': '09:00', 'end': '18:00'}, 'slotDuration': 30,
+            'timezone': 'Asia/Tokyo', 'workingDays': [0, 1, 2, 3, 4], 'eventName': 'Meeting'}
+DENSITIES = (0, 8, 32)
+SAME_SLOTS = 5
+
+# Full runs and --quick runs; a results file records which one it was.
+SIZES = {
+    'full': {'hosts': 20, 'public_requests': 2000, 'public_concurrency': 50, 'generate_requests': 100,
+             'generate_concurrency': 10, 'bookers': 50, 'booking_rounds': 4},
+    'quick': {'hosts': 5, 'public_requests': 300, 'public_concurrency': 20, 'generate_requests': 20,
+              'generate_concurrency': 5, 'bookers': 20, 'booking_rounds': 2},
+}
+
+
+def make_firestore(kind, latency):
+    if kind == 'emulator':
+        if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+            sys.exit("--firestore emulator needs FIRESTORE_EMULATOR_HOST.")
+        from google.cloud import firestore
+        project = os.getenv("FIRESTORE_PROJECT_ID", "demo-schedule-sync")
+        return firestore.Client(project=project), firestore.AsyncClient(project=project)
+    db = FakeFirestore(latency=latency)
+    return db, FakeAsyncFirestore(db)
+
+
+class Bench:
+    """One scenario's app state: a fresh Firestore, Calendar and caches, and an ASGI client."""
+
+    def __init__(self, args, calendar, server_url):
+        self.args = args
+        self.calendar = calendar
+        self.server_url = server_url
+        # Emulator data outlives a run; unique IDs keep runs apart.
+        self.run_id = uuid.uuid4().hex[:8] if args.firestore == 'emulator' else 'bench'
+
+    async def __aenter__(self):
+        api.db, api.async_db = make_firestore(self.args.firestore, self.args.firestore_latency)
+        with self.calendar._lock:
+            self.calendar.calendars.clear()
+            self.calendar.feed.clear()
+        self.calendar.requests.clear()
+        api.calendar_pool = CalendarServicePool(api.build_credentials, client_options={'api_endpoint': self.server_url})
+        api.calendar_client = AsyncCalendarClient(base_url=self.server_url)
+        api.booking_queue = BookingQueue(api.process_booking_job, api.fail_booking_job)
+        api.BOOKING_MODE = 'sync'
+        for cache in (api.public_user_cache, api.public_team_cache, api.busy_cache, api.slots_cache,
+                      user_profiles, booking_results):
+            cache.clear()
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://bench",
+                                        timeout=120)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()
+        await api.booking_queue.aclose()
+        await api.calendar_client.aclose()
+
+    def host_id(self, n):
+        return f"{self.run_id}-host-{n}"
+
+    def seed_host(self, n, now):
+        user_id = self.host_id(n)
+        api.db.collection('users').document(user_id).set({
+            'userId': user_id, 'email': f"{user_id}@example.com", 'publicUrlToken': f"{user_id}-token",
+            'encryptedAccessToken': api.encrypt_token(f"access-{n}"),
+            'encryptedRefreshToken': api.encrypt_token(f"refresh-{n}"),
+            'settings': SETTINGS,
+        })
+        slot_settings = SlotSettings.from_user_settings(SETTINGS)
+        save_regenerated_slots(api.db, user_id, compute_available_slots([], slot_settings, now), now)
+        return user_id
+
+    def operation_counts(self):
+        counts = {f"calendar.{kind}": count for kind, count in sorted(Counter(self.calendar.requests).items())}
+        if isinstance(api.db, FakeFirestore):
+            counts.update({f"firestore.{kind}": count for kind, count in sorted(api.db.stats.items())})
+        return counts
+
+    def reset_counts(self):
+        self.calendar.requests.clear()
+        if isinstance(api.db, FakeFirestore):
+            api.db.reset_stats()
+
+
+async def drive(client, requests, concurrency):
+    """Sends (method, path, body, headers) requests from `concurrency` workers; returns time, latencies, statuses."""
+    latencies = []
+    statuses = Counter()
+    pending = iter(requests)
+
+    async def worker():
+        for method, path, body, headers in pending:
+            started = time.perf_counter()
+            response = await client.request(method, path, json=body, headers=headers)
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started, latencies, statuses
+
+
+def summarize(elapsed, latencies, statuses, ok_statuses, concurrency, counts):
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+    errors = sum(count for status, count in statuses.items() if status not in ok_statuses)
+    return {
+        'requests': len(latencies),
+        'concurrency': concurrency,
+        'errors': errors,
+        'seconds': round(elapsed, 4),
+        'throughput': round(len(latencies) / elapsed, 2),
+        'mean_ms': round(float(np.mean(latencies)) * 1000, 3),
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'operations': counts,
+    }
+
+
+async def public_reads(bench, sizes, now):
+    tokens = [f"{bench.seed_host(n, now)}-token" for n in range(sizes['hosts'])]
+    rng = random.Random(1)
+    requests = [('GET', f"/api/slots/public/{rng.choice(tokens)}", None, None)
+                for _ in range(sizes['public_requests'])]
+    # One read per host first, as a page in steady state has been read before.
+    await drive(bench.client, [('GET', f"/api/slots/public/{token}", None, None) for token in tokens], 1)
+    bench.reset_counts()
+    result = await drive(bench.client, requests, sizes['public_concurrency'])
+    return summarize(*result, {200}, sizes['public_concurrency'], bench.operation_counts())
+
+
+def generate_density(density):
+    async def scenario(bench, sizes, now):
+        hosts = [bench.seed_host(n, now) for n in range(sizes['hosts'])]
+        horizon_start = now.astimezone(timezone.utc) - timedelta(days=1)
+        # The fake Calendar keeps one event list per calendar ID, which all hosts share as 'primary'.
+        fill_calendar(bench.calendar, horizon_start, SLOT_HORIZON_DAYS + 2, density, seed=density)
+        headers = [auth_headers(user_id) for user_id in hosts]
+        requests = [('POST', '/api/user/me/slots/generate', None, headers[n % len(hosts)])
+                    for n in range(sizes['generate_requests'])]
+        busy_ttl, api.busy_cache.ttl = api.busy_cache.ttl, 0
+        try:
+            bench.reset_counts()
+            result = await drive(bench.client, requests, sizes['generate_concurrency'])
+        finally:
+            api.busy_cache.ttl = busy_ttl
+        return summarize(*result, {200}, sizes['generate_concurrency'], bench.operation_counts())
+    return scenario
+
+
+def booking_request(token, slot_id, n):
+    return ('POST', '/api/bookings', {'publicUrlToken': token, 'slotId': slot_id, 'bookerName': f"Booker {n}",
+                                      'bookerEmail': f"booker{n}@example.com"}, None)
+
+
+async def booking_contention(bench, sizes, now):
+    elapsed, latencies, statuses = 0.0, [], Counter()
+    counts = Counter()
+    for round_number in range(sizes['booking_rounds']):
+        user_id = bench.seed_host(round_number, now)
+        slot_ids = [slot['slotId'] for slot in read_slots(api.db, user_id)]
+        # Spread over the horizon like real traffic, so bookings mostly hit different day documents.
+        slot_ids = slot_ids[::max(len(slot_ids) // sizes['bookers'], 1)][:sizes['bookers']]
+        bench.reset_counts()
+        round_elapsed, round_latencies, round_statuses = await drive(
+            bench.client, [booking_request(f"{user_id}-token", slot_id, n) for n, slot_id in enumerate(slot_ids)],
+            sizes['bookers'])
+        elapsed += round_elapsed
+        latencies += round_latencies
+        statuses.update(round_statuses)
+        counts.update(bench.operation_counts())
+    return summarize(elapsed, latencies, statuses, {200}, sizes['bookers'], dict(sorted(counts.items())))
+
+
+async def booking_same_slots(bench, sizes, now):
+    user_id = bench.seed_host(0, now)
+    slot_ids = [slot['slotId'] for slot in read_slots(api.db, user_id)][:SAME_SLOTS]
+    requests = [booking_request(f"{user_id}-token", slot_ids[n % SAME_SLOTS], n) for n in range(sizes['bookers'])]
+    bench.reset_counts()
+    result = await drive(bench.client, requests, sizes['bookers'])
+    booked = result[2][200]
+    if booked != SAME_SLOTS or bench.calendar.request_count('events.insert') != SAME_SLOTS:
+        raise AssertionError(f"{booked} bookings and {bench.calendar.request_count('events.insert')} events "
+                             f"for {SAME_SLOTS} slots")
+    return summarize(*result, {200, 409}, sizes['bookers'], bench.operation_counts())
+
+
+SCENARIOS = {
+    'public_reads': public_reads,
+    **{f"generate_density_{density}": generate_density(density) for density in DENSITIES},
+    'booking_contention': booking_contention,
+    'booking_same_slots': booking_same_slots,
+}
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+async def run_suite(args):
+    sizes = SIZES['quick' if args.quick else 'full']
+    names = [name for name in SCENARIOS if not args.scenario or any(name.startswith(s) for s in args.scenario)]
+    commit, dirty = git_revision()
+    results = {
+        'schema': RESULTS_SCHEMA,
+        'commit': commit,
+        'dirty': dirty,
+        'startedAt': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'config': {'size': 'quick' if args.quick else 'full', **sizes, 'firestore': args.firestore,
+                   'firestoreLatency': args.firestore_latency, 'calendarLatency': args.calendar_latency},
+        'scenarios': {},
+    }
+    calendar = FakeCalendar(latency=args.calendar_latency)
+    with FakeCalendarServer(calendar) as server:
+        for name in names:
+            now = datetime.now(SlotSettings.from_user_settings(SETTINGS).timezone)
+            async with Bench(args, calendar, server.url) as bench:
+                result = await SCENARIOS[name](bench, sizes, now)
+            results['scenarios'][name] = result
+            print(f"{name:<22} {result['throughput']:8.1f} req/s  p50={result['p50_ms']:8.2f} ms  "
+                  f"p95={result['p95_ms']:8.2f} ms  p99={result['p99_ms']:8.2f} ms  errors={result['errors']}")
+    return results
+
+
+def compare(baseline, current, threshold):
+    """Prints the change of each scenario against `baseline`; returns the names that regressed."""
+    if baseline.get('config') != current.get('config'):
+        print("Note: the runs used different settings; compare with care.")
+    print(f"baseline {baseline.get('commit')} vs current {current.get('commit')}")
+    regressed = []
+    for name, result in current['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            continue
+        changes = {'throughput': result['throughput'] / before['throughput'] - 1}
+        changes.update({key: result[key] / before[key] - 1 for key in ('p50_ms', 'p95_ms', 'p99_ms') if before[key]})
+        slower = (changes['throughput'] < -threshold
+                  or any(changes.get(key, 0) > threshold for key in ('p50_ms', 'p95_ms')))
+        if slower:
+            regressed.append(name)
+        print(f"{name:<22} " + '  '.join(f"{key.replace('_ms', '')} {change:+7.1%}" for key, change in changes.items())
+              + ("  REGRESSED" if slower else ""))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help="Write the results as JSON to this file.")
+    parser.add_argument('--compare', nargs='+', metavar='RESULTS',
+                        help="A baseline results file; with two files, compare them without running.")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="Relative slowdown of throughput, p50 or p95 that counts as a regression.")
+    parser.add_argument('--scenario', action='append', help="Run only scenarios starting with this name.")
+    parser.add_argument('--quick', action='store_true', help="Smaller runs, e.g. for a pre-commit check.")
+    parser.add_argument('--firestore', choices=('memory', 'emulator'), default='memory')
+    parser.add_argument('--firestore-latency', type=float, default=0.002)
+    parser.add_argument('--calendar-latency', type=float, default=0.02)
+    args = parser.parse_args()
+
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[0]) as baseline, open(args.compare[1]) as current:
+            sys.exit(1 if compare(json.load(baseline), json.load(current), args.threshold) else 0)
+
+    results = asyncio.run(run_suite(args))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+            output.write('\n')
+        print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare[0]) as baseline:
+            sys.exit(1 if compare(json.load(baseline), results, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+In-process worker pool for finishing bookings in the background.
+
+With BOOKING_MODE=queued, POST /api/bookings only reserves the slot and writes
+a pending booking; the Calendar event is created by a worker from this queue.
+Jobs are booking IDs. Transient failures are retried with exponential
+backoff; anything else, or running out of attempts, goes to the failure
+handler, which undoes the reservation.
+
+The queue lives in memory, so jobs of a stopped process are picked up again by
+re-enqueueing pending bookings at startup. Processing must be idempotent.
+"""
+import asyncio
+import os
+from typing import Awaitable, Callable
+
+import httpx
+from google.api_core import exceptions as google_exceptions
+from googleapiclient.errors import HttpError
+
+BOOKING_MODE = os.getenv("BOOKING_MODE", "sync")  # 'sync' or 'queued'
+BOOKING_WORKERS = int(os.getenv("BOOKING_WORKERS", "4"))
+BOOKING_MAX_ATTEMPTS = int(os.getenv("BOOKING_MAX_ATTEMPTS", "5"))
+BOOKING_RETRY_BASE_SECONDS = float(os.getenv("BOOKING_RETRY_BASE_SECONDS", "1"))
+
+BOOKING_PENDING = 'pending'
+BOOKING_CONFIRMED = 'confirmed'
+BOOKING_FAILED = 'failed'
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Whether a failed job is worth retrying: rate limits, server errors and network trouble, of Calendar or Firestore."""
+    if isinstance(error, HttpError):
+        return error.resp.status == 429 or error.resp.status >= 500
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError, ConnectionError,
+                              google_exceptions.ServerError, google_exceptions.TooManyRequests))
+
+
+class BookingQueue:
+    """
+    Runs `process(booking_id)` on a pool of asyncio workers.
+
+    Args:
+        process: Finishes one booking. Raising retries it or fails it.
+        on_failure: Called with (booking_id, error) when a job fails for good.
+    """
+
+    def __init__(self, process: Callable[[str], Awaitable[None]],
+                 on_failure: Callable[[str, Exception], Awaitable[None]],
+                 workers: int = BOOKING_WORKERS, max_attempts: int = BOOKING_MAX_ATTEMPTS,
+                 retry_base_seconds: float = BOOKING_RETRY_BASE_SECONDS):
+        self._process = process
+        self._on_failure = on_failure
+        self._workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self._queue = None
+        self._tasks = []
+        self._outstanding = 0
+        self._idle = None
+        self.stats = {'processed': 0, 'retried': 0, 'failed': 0}
+
+    def _ensure_started(self):
+        # Started lazily so that the queue and workers bind to the running event loop.
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._idle = asyncio.Event()
+            self._idle.set()
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self._workers)]
+
+    def enqueue(self, booking_id: str):
+        self._ensure_started()
+        self._outstanding += 1
+        self._idle.clear()
+        self._queue.put_nowait((booking_id, 1))
+
+    async def _worker(self):
+        while True:
+            booking_id, attempt = await self._queue.get()
+            try:
+                await self._process(booking_id)
+                self.stats['processed'] += 1
+                self._done()
+            except Exception as e:
+                if attempt < self.max_attempts and is_transient_error(e):
+                    self.stats['retried'] += 1
+                    delay = self.retry_base_seconds * 2 ** (attempt - 1)
+                    print(f"Booking {booking_id} attempt {attempt} failed, retrying in {delay:.1f}s: {e}")
+                    asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, (booking_id, attempt + 1))
+                else:
+                    self.stats['failed'] += 1
+                    print(f"ERROR: booking {booking_id} failed after {attempt} attempt(s): {e}")
+                    try:
+                        await self._on_failure(booking_id, e)
+                    except Exception as failure_error:
+                        print(f"ERROR while failing booking {booking_id}: {failure_error}")
+                    self._done()
+            finally:
+                self._queue.task_done()
+
+    def _done(self):
+        self._outstanding -= 1
+        if self._outstanding == 0:
+            self._idle.set()
+
+    async def join(self):
+        """Waits until every enqueued booking is finished, including scheduled retries."""
+        if self._idle is not None:
+            await self._idle.wait()
+
+    async def aclose(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._queue = None
+        self._tasks = []
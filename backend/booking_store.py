@@ -0,0 +1,76 @@
+"""
+Idempotency for POST /api/bookings.
+
+Every booking request has an idempotency key: the client's `Idempotency-Key`
+header or, without one, slotId + bookerEmail (the conference `requestId`).
+The booking ID is derived from the host and the key (`booking_id_for`), and
+the booking document is written in the same transaction that takes the slot
+(`async_slot_store.book_slot_async`). A retried request therefore finds the
+booking its first attempt made instead of reserving the slot again, even
+when the attempts run at the same time: the transaction that loses raises
+`DuplicateBookingError` with the winner's booking.
+
+Finished responses are also kept in memory for BOOKING_RESULT_TTL_SECONDS, so
+a retry served by the same process reads nothing at all. A failed booking
+does not count as a duplicate; a new attempt with the same key reuses its ID.
+"""
+import hashlib
+import hmac
+import os
+from typing import Optional
+
+from booking_queue import BOOKING_FAILED
+from cache import TTLCache
+
+BOOKING_RESULT_TTL_SECONDS = float(os.getenv("BOOKING_RESULT_TTL_SECONDS", "600"))
+
+# Per-process cache of booking ID -> (slot ID, response body) of finished booking requests.
+booking_results = TTLCache(
+    maxsize=int(os.getenv("BOOKING_RESULT_CACHE_SIZE", "4096")),
+    ttl=BOOKING_RESULT_TTL_SECONDS,
+)
+
+
+class DuplicateBookingError(Exception):
+    """The booking document of a request already exists."""
+
+    def __init__(self, booking: dict):
+        super().__init__("Booking already exists.")
+        self.booking = booking
+
+
+def booking_id_for(secret: str, host_user_id: str, idempotency_key: str) -> str:
+    """
+    The booking ID of a request.
+
+    Keyed with a server secret, so that knowing a booker's email and slot is
+    not enough to look their booking up. Hex digits are valid Calendar event
+    ID characters.
+    """
+    message = f"{host_user_id}\n{idempotency_key}".encode()
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()[:32]
+
+
+def derived_booking_id_secret(secret: Optional[str]) -> Optional[str]:
+    """A key for `booking_id_for` derived from another server secret, for deployments without BOOKING_ID_SECRET."""
+    if not secret:
+        return None
+    return hmac.new(secret.encode(), b'booking-id', hashlib.sha256).hexdigest()
+
+
+def existing_booking(snapshot) -> Optional[dict]:
+    """The booking a snapshot holds, unless there is none or it failed."""
+    if not snapshot.exists:
+        return None
+    booking = snapshot.to_dict()
+    return None if booking.get('status') == BOOKING_FAILED else booking
+
+
+def check_new_booking(snapshot):
+    """
+    Raises:
+        DuplicateBookingError: If the booking document already holds a booking that has not failed.
+    """
+    booking = existing_booking(snapshot)
+    if booking is not None:
+        raise DuplicateBookingError(booking)
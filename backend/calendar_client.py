@@ -0,0 +1,139 @@
+"""
+Async Google Calendar REST client for the request handlers.
+
+Requests go through one shared `httpx.AsyncClient`, so connections are kept
+alive across requests, and a semaphore caps how many Calendar calls are in
+flight at once. Token refresh still uses google-auth, run in a worker thread;
+requests that find the same credentials expired wait for one refresh.
+"""
+import asyncio
+import os
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+from urllib.parse import quote
+
+import httpx
+import httplib2
+from google.auth.transport.requests import Request as GoogleAuthRequest
+from googleapiclient.errors import HttpError
+
+from freebusy import (DEFAULT_CALENDAR_IDS, FreeBusyCalendarError, cached_busy_times, calendar_chunks,
+                      freebusy_body, freebusy_window, record_freebusy)
+from metrics import span
+
+CALENDAR_API_ENDPOINT = os.getenv("GOOGLE_CALENDAR_API_ENDPOINT", "https://www.googleapis.com/calendar/v3/")
+CALENDAR_MAX_CONCURRENCY = int(os.getenv("CALENDAR_MAX_CONCURRENCY", "32"))
+CALENDAR_TIMEOUT_SECONDS = float(os.getenv("CALENDAR_TIMEOUT_SECONDS", "15"))
+
+
+class AsyncCalendarClient:
+    def __init__(self, base_url: str = CALENDAR_API_ENDPOINT, max_concurrency: int = CALENDAR_MAX_CONCURRENCY,
+                 timeout: float = CALENDAR_TIMEOUT_SECONDS):
+        self.base_url = base_url if base_url.endswith('/') else base_url + '/'
+        self._max_concurrency = max_concurrency
+        self._timeout = timeout
+        self._http = None
+        self._semaphore = None
+        self._refreshes = {}  # id(credentials) -> the refresh in flight
+
+    def _client(self) -> httpx.AsyncClient:
+        # Created lazily so that it binds to the running event loop.
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self._timeout,
+                limits=httpx.Limits(max_connections=self._max_concurrency,
+                                    max_keepalive_connections=self._max_concurrency),
+            )
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        return self._http
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def _refresh(self, credentials):
+        with span('token.refresh'):
+            await asyncio.to_thread(credentials.refresh, GoogleAuthRequest())
+
+    async def _authorize(self, credentials) -> dict:
+        if not credentials.valid:
+            key = id(credentials)
+            refresh = self._refreshes.get(key)
+            if refresh is None:
+                refresh = self._refreshes[key] = asyncio.ensure_future(self._refresh(credentials))
+                refresh.add_done_callback(lambda _: self._refreshes.pop(key, None))
+            # Shielded: one waiter being cancelled must not cancel the others' refresh.
+            await asyncio.shield(refresh)
+        return {'Authorization': f"Bearer {credentials.token}"}
+
+    async def request(self, credentials, method: str, path: str, body: Optional[dict] = None,
+                      params: Optional[dict] = None, operation: str = 'request') -> dict:
+        """
+        Sends one Calendar API request and returns the decoded JSON response.
+
+        Timed as span `calendar.<operation>`, the wait for a free connection included.
+
+        Raises:
+            HttpError: On a non-2xx response, like googleapiclient does.
+        """
+        http = self._client()
+        headers = await self._authorize(credentials)
+        with span(f"calendar.{operation}"):
+            async with self._semaphore:
+                response = await http.request(method, path, json=body, params=params, headers=headers)
+        if response.status_code >= 400:
+            resp = httplib2.Response({'status': response.status_code, 'reason': response.reason_phrase})
+            raise HttpError(resp, response.content, uri=str(response.url))
+        return response.json() if response.content else {}
+
+    async def freebusy_query(self, credentials, body: dict) -> dict:
+        return await self.request(credentials, 'POST', 'freeBusy', body=body, operation='freebusy')
+
+    async def insert_event(self, credentials, calendar_id: str, body: dict, conference_data_version: int = 0) -> dict:
+        return await self.request(credentials, 'POST', f"calendars/{quote(calendar_id, safe='')}/events", body=body,
+                                  params={'conferenceDataVersion': conference_data_version},
+                                  operation='events.insert')
+
+    async def get_event(self, credentials, calendar_id: str, event_id: str) -> dict:
+        return await self.request(credentials, 'GET', f"calendars/{quote(calendar_id, safe='')}/events/"
+                                                      f"{quote(event_id, safe='')}", operation='events.get')
+
+    async def delete_event(self, credentials, calendar_id: str, event_id: str, send_updates: str = 'all') -> dict:
+        return await self.request(credentials, 'DELETE', f"calendars/{quote(calendar_id, safe='')}/events/"
+                                                         f"{quote(event_id, safe='')}",
+                                  params={'sendUpdates': send_updates}, operation='events.delete')
+
+    async def list_events(self, credentials, calendar_id: str, time_min: datetime, time_max: datetime) -> list:
+        """The events overlapping [time_min, time_max), recurring events expanded. Follows every page."""
+        events = []
+        params = {'timeMin': time_min.isoformat(), 'timeMax': time_max.isoformat(), 'singleEvents': 'true'}
+        while True:
+            response = await self.request(credentials, 'GET', f"calendars/{quote(calendar_id, safe='')}/events",
+                                          params=params, operation='events.list')
+            events.extend(response.get('items', []))
+            if not response.get('nextPageToken'):
+                return events
+            params['pageToken'] = response['nextPageToken']
+
+    async def fetch_busy_times_by_calendar(self, credentials, calendar_ids: Iterable[str], time_min: datetime,
+                                           time_max: datetime, owner: Optional[str] = None) -> Dict[str, list]:
+        """Async `calendar_sync.fetch_busy_times_by_calendar`; the queries of several chunks run concurrently."""
+        busy, missing = cached_busy_times(owner, calendar_ids, time_min, time_max)
+        fetch_window = freebusy_window(owner, time_min, time_max)
+        chunks = calendar_chunks(missing)
+        responses = await asyncio.gather(*(
+            self.freebusy_query(credentials, freebusy_body(*fetch_window, chunk)) for chunk in chunks))
+        errors = {}
+        for chunk, results in zip(chunks, responses):
+            record_freebusy(owner, chunk, results, fetch_window, time_min, time_max, busy, errors)
+        if errors:
+            raise FreeBusyCalendarError(errors, busy)
+        return busy
+
+    async def fetch_busy_times(self, credentials, time_min: datetime, time_max: datetime,
+                               calendar_ids: Iterable[str] = DEFAULT_CALENDAR_IDS, owner: Optional[str] = None):
+        """Async `calendar_sync.fetch_busy_times`."""
+        busy = await self.fetch_busy_times_by_calendar(credentials, calendar_ids, time_min, time_max, owner)
+        return sorted(interval for intervals in busy.values() for interval in intervals)
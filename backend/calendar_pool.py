@@ -0,0 +1,148 @@
+"""
+Per-user pool of Google Calendar service objects.
+
+Building a service with `build('calendar', 'v3')` parses the discovery
+document, opens a new HTTP connection and starts with whatever access token
+the user document holds. The pool parses the bundled discovery document once,
+keeps each user's `Credentials` (so refreshed tokens are reused) and keeps
+their service objects, with their keep-alive connections, for later requests.
+When a kept access token has expired but the user document holds a newer one
+(another process refreshed and stored it), that one is taken over instead of
+refreshing again.
+
+Service objects are not thread-safe, so each one is checked out by a single
+caller at a time; concurrent callers for the same user get their own.
+"""
+import json
+import os
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Callable, Optional
+
+import httplib2
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+from cache import TTLCache
+
+CALENDAR_POOL_SIZE = int(os.getenv("CALENDAR_POOL_SIZE", "256"))
+CALENDAR_POOL_TTL_SECONDS = float(os.getenv("CALENDAR_POOL_TTL_SECONDS", "1800"))
+CALENDAR_POOL_SERVICES_PER_USER = int(os.getenv("CALENDAR_POOL_SERVICES_PER_USER", "4"))
+CALENDAR_HTTP_TIMEOUT_SECONDS = float(os.getenv("CALENDAR_TIMEOUT_SECONDS", "15"))
+
+
+@lru_cache(maxsize=None)
+def calendar_discovery_document() -> dict:
+    """The Calendar v3 discovery document bundled with googleapiclient, parsed once."""
+    return json.loads(get_static_doc('calendar', 'v3'))
+
+
+class _PoolEntry:
+    def __init__(self, credentials: Credentials, refresh_token_key: Optional[str], access_token_key: Optional[str]):
+        self.credentials = credentials
+        self.refresh_token_key = refresh_token_key
+        # The stored access token last looked at, so an unchanged one is not decrypted again.
+        self.access_token_key = access_token_key
+        self.saved_token = credentials.token
+        self.idle_services = []
+        self.lock = threading.Lock()
+
+
+class CalendarServicePool:
+    """
+    Caches Calendar credentials and service objects per user.
+
+    Args:
+        credentials_factory: Builds `Credentials` from a user document.
+        client_options: Passed to the service, e.g. {'api_endpoint': ...}.
+    """
+
+    def __init__(self, credentials_factory: Callable[[dict], Credentials], client_options: Optional[dict] = None,
+                 maxsize: int = CALENDAR_POOL_SIZE, ttl: float = CALENDAR_POOL_TTL_SECONDS,
+                 services_per_user: int = CALENDAR_POOL_SERVICES_PER_USER,
+                 timeout: float = CALENDAR_HTTP_TIMEOUT_SECONDS):
+        self._credentials_factory = credentials_factory
+        self._client_options = client_options
+        self._services_per_user = services_per_user
+        self._timeout = timeout
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.adopted_tokens = 0
+
+    def _entry(self, user_id: str, user_data: dict) -> _PoolEntry:
+        # The stored refresh token changes when the user signs in again; start over then.
+        refresh_token_key = user_data.get('encryptedRefreshToken')
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry.refresh_token_key != refresh_token_key:
+                entry = _PoolEntry(self._credentials_factory(user_data), refresh_token_key,
+                                   user_data.get('encryptedAccessToken'))
+            elif entry.credentials.expired and entry.access_token_key != user_data.get('encryptedAccessToken'):
+                self._adopt_stored_token(entry, user_data)
+            # Re-set on every use so that active users stay in the pool.
+            self._entries.set(user_id, entry)
+            return entry
+
+    def _adopt_stored_token(self, entry: _PoolEntry, user_data: dict):
+        entry.access_token_key = user_data.get('encryptedAccessToken')
+        stored = self._credentials_factory(user_data)
+        if stored.token and not stored.expired:
+            # Updated in place: the entry's services hold these credentials.
+            with entry.lock:
+                entry.credentials.token = stored.token
+                entry.credentials.expiry = stored.expiry
+                entry.saved_token = stored.token
+            self.adopted_tokens += 1
+
+    def credentials(self, user_id: str, user_data: dict) -> Credentials:
+        """The user's shared `Credentials`; refreshing them benefits every later request."""
+        return self._entry(user_id, user_data).credentials
+
+    def build_service(self, credentials: Credentials, http: Optional[httplib2.Http] = None):
+        """
+        Builds a Calendar service for `credentials`. Pass `http` to reuse a
+        connection across users, e.g. one per worker thread of a bulk job.
+        """
+        http = AuthorizedHttp(credentials, http=http or httplib2.Http(timeout=self._timeout))
+        return build_from_document(calendar_discovery_document(), http=http, client_options=self._client_options)
+
+    @contextmanager
+    def service(self, user_id: str, user_data: dict):
+        """Checks out a Calendar service for the user and returns it to the pool afterwards."""
+        entry = self._entry(user_id, user_data)
+        with entry.lock:
+            service = entry.idle_services.pop() if entry.idle_services else None
+        if service is None:
+            service = self.build_service(entry.credentials)
+        try:
+            yield service
+        finally:
+            with entry.lock:
+                if len(entry.idle_services) < self._services_per_user:
+                    entry.idle_services.append(service)
+
+    def take_refreshed_credentials(self, user_id: str) -> Optional[Credentials]:
+        """
+        Returns the user's credentials if their access token was refreshed since
+        the last call, so the caller can store it; otherwise None.
+        """
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        with entry.lock:
+            if entry.credentials.token == entry.saved_token:
+                return None
+            entry.saved_token = entry.credentials.token
+            return entry.credentials
+
+    def invalidate(self, user_id: str):
+        self._entries.pop(user_id)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {**self._entries.stats(), 'adoptedTokens': self.adopted_tokens}
@@ -0,0 +1,389 @@
+import secrets
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from google.cloud import firestore
+from googleapiclient.errors import HttpError
+
+from freebusy import (DEFAULT_CALENDAR_IDS, FreeBusyCalendarError, cached_busy_times, calendar_chunks,
+                      calendar_ids_of, freebusy_body, freebusy_window, invalidate_busy_times, record_freebusy)
+from metrics import span
+from slot_engine import SLOT_HORIZON_DAYS, SlotSettings, compute_available_slots
+from async_slot_store import save_regenerated_slots_async
+from slot_store import save_regenerated_slots
+
+# Fields of a watch channel in `calendarSync` documents.
+CHANNEL_FIELDS = ('channelId', 'channelToken', 'resourceId', 'channelExpiration')
+
+# Google keeps a watch channel alive for at most this long; it has to be renewed afterwards.
+WATCH_CHANNEL_TTL_SECONDS = 7 * 24 * 60 * 60
+
+EVENT_FIELDS = 'items(id,status,start,end),nextPageToken,nextSyncToken'
+
+
+class SyncTokenExpired(Exception):
+    """The stored sync token was rejected by Google (HTTP 410) and a full sync is needed."""
+
+
+def fetch_busy_times_by_calendar(service, calendar_ids: Iterable[str], time_min: datetime, time_max: datetime,
+                                 owner: Optional[str] = None) -> Dict[str, List[Tuple[datetime, datetime]]]:
+    """
+    Fetches the busy intervals of several calendars with as few freebusy queries as possible.
+
+    Args:
+        service: A Calendar service authorized as a user who can see every calendar.
+        calendar_ids: Calendar IDs; 'primary' is the authorized user's own calendar.
+        owner: ID of the user `service` is authorized as. Results are cached
+            per (owner, calendar, day) in `busy_cache`; without an owner nothing is cached.
+
+    Returns:
+        Calendar ID -> (start, end) busy intervals within the window.
+
+    Raises:
+        FreeBusyCalendarError: If Google reported errors for some of the calendars.
+    """
+    busy, missing = cached_busy_times(owner, calendar_ids, time_min, time_max)
+    fetch_window = freebusy_window(owner, time_min, time_max)
+    errors = {}
+    for chunk in calendar_chunks(missing):
+        with span('calendar.freebusy'):
+            results = service.freebusy().query(body=freebusy_body(*fetch_window, chunk)).execute()
+        record_freebusy(owner, chunk, results, fetch_window, time_min, time_max, busy, errors)
+    if errors:
+        raise FreeBusyCalendarError(errors, busy)
+    return busy
+
+
+def fetch_busy_times(service, time_min: datetime, time_max: datetime,
+                     calendar_ids: Iterable[str] = DEFAULT_CALENDAR_IDS, owner: Optional[str] = None):
+    """Runs a freebusy query and returns the (start, end) busy intervals of all `calendar_ids` together."""
+    busy = fetch_busy_times_by_calendar(service, calendar_ids, time_min, time_max, owner)
+    return sorted(interval for intervals in busy.values() for interval in intervals)
+
+
+def _list_events(service, calendar_id: str, sync_token: Optional[str]) -> Tuple[List[dict], str]:
+    events = []
+    page_token = None
+    while True:
+        params = {'calendarId': calendar_id, 'singleEvents': True, 'fields': EVENT_FIELDS}
+        if page_token:
+            params['pageToken'] = page_token
+        if sync_token:
+            params['syncToken'] = sync_token
+        else:
+            params['maxResults'] = 2500
+        try:
+            with span('calendar.events.list'):
+                response = service.events().list(**params).execute()
+        except HttpError as error:
+            if sync_token and error.resp.status == 410:
+                raise SyncTokenExpired() from error
+            raise
+        events.extend(response.get('items', []))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return events, response.get('nextSyncToken')
+
+
+def full_event_sync(service, calendar_id: str = 'primary') -> Tuple[List[dict], str]:
+    """Lists every event of the calendar and returns them with a fresh sync token."""
+    return _list_events(service, calendar_id, None)
+
+
+def fetch_changed_events(service, sync_token: str, calendar_id: str = 'primary') -> Tuple[List[dict], str]:
+    """
+    Lists the events changed since `sync_token`, including cancelled ones.
+
+    Raises:
+        SyncTokenExpired: If Google no longer accepts the sync token.
+    """
+    return _list_events(service, calendar_id, sync_token)
+
+
+def _parse_event_time(value: dict, user_timezone) -> datetime:
+    if 'dateTime' in value:
+        return datetime.fromisoformat(value['dateTime'].replace('Z', '+00:00'))
+    # All-day events only carry a date, which is interpreted in the host's timezone.
+    return user_timezone.localize(datetime.combine(date.fromisoformat(value['date']), datetime.min.time()))
+
+
+def event_dates(event: dict, user_timezone, horizon: Set[date], slot_lead: timedelta = timedelta(0)) -> Set[date]:
+    """
+    The days within `horizon` that an event covers, in the host's timezone.
+
+    Slots starting up to `slot_lead` before the event can overlap it, so the
+    day such a slot starts on (e.g. the evening before) counts too.
+    """
+    if 'start' not in event or 'end' not in event:
+        return set()
+    start = _parse_event_time(event['start'], user_timezone).astimezone(user_timezone)
+    end = _parse_event_time(event['end'], user_timezone).astimezone(user_timezone)
+    last_day = (end - timedelta(microseconds=1)).date() if end > start else start.date()
+    dates = set()
+    current_day = (start - slot_lead).date()
+    while current_day <= last_day:
+        if current_day in horizon:
+            dates.add(current_day)
+        current_day += timedelta(days=1)
+    return dates
+
+
+def apply_event_changes(
+    event_index: Dict[str, List[str]],
+    events: Iterable[dict],
+    user_timezone,
+    horizon: Set[date],
+    slot_lead: timedelta = timedelta(0),
+) -> Set[date]:
+    """
+    Updates the event index with changed events and returns the affected days.
+
+    The index maps event IDs to the ISO dates they covered when last seen, so
+    that moved or cancelled events also free up the days they used to block.
+    """
+    affected = set()
+    for event in events:
+        event_id = event['id']
+        affected.update(date.fromisoformat(day) for day in event_index.pop(event_id, []))
+        if event.get('status') == 'cancelled':
+            continue
+        dates = event_dates(event, user_timezone, horizon, slot_lead)
+        if dates:
+            event_index[event_id] = sorted(day.isoformat() for day in dates)
+            affected.update(dates)
+    return affected & horizon
+
+
+def horizon_dates(now: datetime, user_timezone, days: int = SLOT_HORIZON_DAYS) -> Set[date]:
+    today = now.astimezone(user_timezone).date()
+    return {today + timedelta(days=i) for i in range(days)}
+
+
+def _regeneration_window(slot_settings: SlotSettings, now: datetime, dates: Optional[Set[date]]):
+    if dates is None:
+        return now, now + timedelta(days=SLOT_HORIZON_DAYS)
+    user_timezone = slot_settings.timezone
+    time_min = user_timezone.localize(datetime.combine(min(dates), datetime.min.time()))
+    time_max = user_timezone.localize(datetime.combine(max(dates) + timedelta(days=1), datetime.min.time()))
+    # The last slot of a day may end after midnight (overnight hours, DST changes).
+    return time_min, time_max + timedelta(minutes=slot_settings.slot_duration_minutes)
+
+
+def regenerate_slots_for_dates(db, service, user_id: str, slot_settings: SlotSettings, now: datetime,
+                               dates: Optional[Set[date]] = None,
+                               calendar_ids: Iterable[str] = DEFAULT_CALENDAR_IDS) -> int:
+    """
+    Recomputes slots for `dates` (every day of the horizon when None) and patches them in.
+
+    Busy times of all `calendar_ids` block slots; they may come from `busy_cache`.
+
+    Returns:
+        The number of available slots computed for those days.
+    """
+    busy_times = fetch_busy_times(service, *_regeneration_window(slot_settings, now, dates),
+                                  calendar_ids=calendar_ids, owner=user_id)
+    with span('slots.compute'):
+        regenerated_slots = compute_available_slots(busy_times, slot_settings, now, dates=dates)
+    save_regenerated_slots(db, user_id, regenerated_slots, now, dates)
+    return len(regenerated_slots)
+
+
+async def regenerate_slots_for_dates_async(async_db, calendar_client, credentials, user_id: str,
+                                           slot_settings: SlotSettings, now: datetime,
+                                           dates: Optional[Set[date]] = None,
+                                           calendar_ids: Iterable[str] = DEFAULT_CALENDAR_IDS) -> int:
+    """Async `regenerate_slots_for_dates`, using an `AsyncCalendarClient` and `firestore.AsyncClient`."""
+    busy_times = await calendar_client.fetch_busy_times(credentials, *_regeneration_window(slot_settings, now, dates),
+                                                        calendar_ids=calendar_ids, owner=user_id)
+    with span('slots.compute'):
+        regenerated_slots = compute_available_slots(busy_times, slot_settings, now, dates=dates)
+    await save_regenerated_slots_async(async_db, user_id, regenerated_slots, now, dates)
+    return len(regenerated_slots)
+
+
+def calendar_sync_states(sync_state: dict) -> Dict[str, dict]:
+    """
+    The sync token and event index of each calendar in a `calendarSync` document.
+
+    Documents written before every calendar was synced separately only hold
+    the primary calendar's, in top-level fields.
+    """
+    if 'calendars' in sync_state:
+        return sync_state['calendars']
+    if sync_state.get('syncToken'):
+        return {'primary': {'syncToken': sync_state['syncToken'], 'eventIndex': sync_state.get('eventIndex', {})}}
+    return {}
+
+
+def calendar_channels(sync_state: dict) -> Dict[str, dict]:
+    """The watch channel of each calendar in a `calendarSync` document (older documents: primary's only)."""
+    if 'channels' in sync_state:
+        return sync_state['channels']
+    if sync_state.get('channelId'):
+        return {'primary': {field: sync_state.get(field) for field in CHANNEL_FIELDS}}
+    return {}
+
+
+def sync_user_calendar(db, service, user_id: str, user_data: dict, now: Optional[datetime] = None,
+                       calendar_ids: Optional[Iterable[str]] = None) -> Optional[Set[date]]:
+    """
+    Brings a host's slots up to date with their calendars using sync tokens.
+
+    Every calendar in the host's `calendarIds` has its own sync token and
+    event index. A calendar without a stored sync token (or whose token
+    Google has expired) gets a full sync, and every day of the horizon is
+    regenerated. Otherwise only the days touched by changed events are
+    recomputed. State is kept in `calendarSync/{userId}`.
+
+    Args:
+        calendar_ids: Only sync these of the host's calendars (e.g. the one a
+            push notification is about); default: all of them.
+
+    Returns:
+        The days that were regenerated, or None if the whole horizon was.
+    """
+    settings = user_data.get('settings')
+    slot_settings = SlotSettings.from_user_settings(settings or {})
+    user_timezone = slot_settings.timezone
+    if now is None:
+        now = datetime.now(user_timezone)
+    horizon = horizon_dates(now, user_timezone)
+    horizon_iso = {day.isoformat() for day in horizon}
+    slot_lead = timedelta(minutes=slot_settings.slot_duration_minutes)
+
+    sync_ref = db.collection('calendarSync').document(user_id)
+    sync_doc = sync_ref.get()
+    stored_states = calendar_sync_states(sync_doc.to_dict() if sync_doc.exists else {})
+    host_calendar_ids = calendar_ids_of(settings)
+    if calendar_ids is None:
+        to_sync = host_calendar_ids
+    else:
+        calendar_ids = set(calendar_ids)
+        to_sync = [calendar_id for calendar_id in host_calendar_ids if calendar_id in calendar_ids]
+
+    # Calendars no longer in the settings are dropped; the others not synced now keep their state.
+    states = {calendar_id: stored_states[calendar_id] for calendar_id in host_calendar_ids
+              if calendar_id in stored_states}
+    affected = set()
+    for calendar_id in to_sync:
+        state = states.get(calendar_id, {})
+        sync_token = state.get('syncToken')
+        event_index = state.get('eventIndex', {})
+        if sync_token:
+            try:
+                events, sync_token = fetch_changed_events(service, sync_token, calendar_id)
+                changed = apply_event_changes(event_index, events, user_timezone, horizon, slot_lead)
+                if affected is not None:
+                    affected |= changed
+            except SyncTokenExpired:
+                sync_token = None
+        if not sync_token:
+            events, sync_token = full_event_sync(service, calendar_id)
+            event_index = {}
+            apply_event_changes(event_index, events, user_timezone, horizon, slot_lead)
+            affected = None
+
+        # Forget days that have rolled out of the horizon.
+        states[calendar_id] = {
+            'syncToken': sync_token,
+            'eventIndex': {event_id: days for event_id, days in event_index.items()
+                           if any(day in horizon_iso for day in days)},
+        }
+
+    if affected is None or affected:
+        # A calendar changed, so cached busy times of this host are stale.
+        invalidate_busy_times(user_id)
+        regenerate_slots_for_dates(db, service, user_id, slot_settings, now, affected, host_calendar_ids)
+
+    # update() replaces the whole map, so that dropped calendars and events do not linger.
+    sync_fields = {'calendars': states, 'lastSyncedAt': firestore.SERVER_TIMESTAMP}
+    if sync_doc.exists:
+        sync_ref.update({**sync_fields, 'syncToken': firestore.DELETE_FIELD, 'eventIndex': firestore.DELETE_FIELD})
+    else:
+        sync_ref.set(sync_fields)
+    return affected
+
+
+def start_watch_channels(db, service, user_id: str, address: str, calendar_ids: Iterable[str]) -> Dict[str, dict]:
+    """
+    Registers a push notification channel for each of the host's calendars.
+
+    Previously registered channels are stopped first. The channels are stored
+    in `calendarSync/{userId}` so that webhook calls can be matched to the
+    host and calendar; `channelIds` lists them for that lookup.
+
+    Returns:
+        The channel state per calendar ID.
+    """
+    sync_ref = db.collection('calendarSync').document(user_id)
+    sync_doc = sync_ref.get()
+    if sync_doc.exists:
+        for channel_state in calendar_channels(sync_doc.to_dict()).values():
+            stop_watch_channel(service, channel_state)
+
+    channels = {}
+    try:
+        for calendar_id in calendar_ids:
+            channel = {
+                'id': str(uuid.uuid4()),
+                'type': 'web_hook',
+                'address': address,
+                'token': secrets.token_urlsafe(32),
+                'params': {'ttl': str(WATCH_CHANNEL_TTL_SECONDS)},
+            }
+            with span('calendar.events.watch'):
+                response = service.events().watch(calendarId=calendar_id, body=channel).execute()
+            channels[calendar_id] = {
+                'channelId': channel['id'],
+                'channelToken': channel['token'],
+                'resourceId': response.get('resourceId'),
+                'channelExpiration': response.get('expiration'),
+            }
+    finally:
+        # Channels registered before a failure are kept, so that they can still be matched and stopped.
+        sync_fields = {
+            'userId': user_id,
+            'channels': channels,
+            'channelIds': [channel_state['channelId'] for channel_state in channels.values()],
+        }
+        if sync_doc.exists:
+            sync_ref.update({**sync_fields, **{field: firestore.DELETE_FIELD for field in CHANNEL_FIELDS}})
+        else:
+            sync_ref.set(sync_fields)
+    return channels
+
+
+def stop_watch_channel(service, channel_state: dict):
+    if not channel_state.get('channelId') or not channel_state.get('resourceId'):
+        return
+    try:
+        service.channels().stop(
+            body={'id': channel_state['channelId'], 'resourceId': channel_state['resourceId']}).execute()
+    except HttpError as error:
+        # The channel may already have expired.
+        print(f"Could not stop calendar channel {channel_state['channelId']}: {error}")
+
+
+def find_channel_owner(db, channel_id: str, channel_token: Optional[str]) -> Optional[Tuple[str, str]]:
+    """
+    Returns the user ID and calendar ID a watch channel belongs to, or None
+    if the channel or its token is unknown.
+    """
+    query = db.collection('calendarSync').where(
+        filter=firestore.FieldFilter("channelIds", "array_contains", channel_id)).limit(1)
+    results = list(query.stream())
+    if not results:
+        # Channels registered before every calendar had its own are only in `channelId`.
+        query = db.collection('calendarSync').where(
+            filter=firestore.FieldFilter("channelId", "==", channel_id)).limit(1)
+        results = list(query.stream())
+    if not results:
+        return None
+    for calendar_id, channel_state in calendar_channels(results[0].to_dict()).items():
+        if channel_state.get('channelId') != channel_id:
+            continue
+        if not channel_token or not secrets.compare_digest(channel_state.get('channelToken') or '', channel_token):
+            return None
+        return results[0].id, calendar_id
+    return None
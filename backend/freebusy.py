@@ -0,0 +1,109 @@
+"""
+Free/busy queries: request bodies, the busy-time cache and response parsing.
+
+Shared by the sync Calendar path (`calendar_sync.fetch_busy_times_by_calendar`,
+googleapiclient) and the async one (`calendar_client.AsyncCalendarClient`,
+httpx), which only differ in how they send the queries: both look up
+`cached_busy_times`, query `freebusy_window` for the rest in
+`calendar_chunks`, and parse each response with `record_freebusy`.
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pytz
+
+from cache import TTLCache
+from slot_engine import parse_busy_intervals
+
+# Google rejects freebusy queries for more calendars than this.
+FREEBUSY_MAX_CALENDARS = 50
+
+DEFAULT_CALENDAR_IDS = ('primary',)
+
+# Per-process cache of (owner user ID, calendar ID, fetched from) -> (fetched until, busy intervals).
+# Windows are fetched from the start of their UTC day, so requests of one day
+# share entries. Calendar changes seen by the incremental sync invalidate the owner's entries.
+busy_cache = TTLCache(
+    maxsize=int(os.getenv("BUSY_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("BUSY_CACHE_TTL_SECONDS", "120")),
+)
+
+
+class FreeBusyCalendarError(Exception):
+    """Google answered a freebusy query with errors (e.g. notFound) for some of its calendars."""
+
+    def __init__(self, errors: Dict[str, str], busy: Dict[str, list]):
+        super().__init__("freebusy failed for " + ', '.join(
+            f"{calendar_id} ({reason})" for calendar_id, reason in errors.items()))
+        self.errors = errors
+        self.busy = busy
+
+
+def to_rfc3339(dt: datetime) -> str:
+    return dt.astimezone(pytz.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def freebusy_body(time_min: datetime, time_max: datetime, calendar_ids: Iterable[str] = ('primary',)) -> dict:
+    return {
+        "timeMin": to_rfc3339(time_min),
+        "timeMax": to_rfc3339(time_max),
+        "timeZone": "UTC",
+        "items": [{"id": calendar_id} for calendar_id in calendar_ids]
+    }
+
+
+def calendar_ids_of(settings: Optional[dict]) -> List[str]:
+    """The calendars whose events block a host's slots (`settings.calendarIds`, default: primary)."""
+    return list((settings or {}).get('calendarIds') or DEFAULT_CALENDAR_IDS)
+
+
+def invalidate_busy_times(owner: str):
+    """Forgets the cached busy intervals fetched with `owner`'s credentials, e.g. after their calendar changed."""
+    busy_cache.pop_where(lambda key, value: key[0] == owner)
+
+
+def cached_busy_times(owner: Optional[str], calendar_ids: Iterable[str], time_min: datetime, time_max: datetime):
+    """Splits `calendar_ids` into the ones cached for the whole window (returned clipped to it) and the rest."""
+    busy, missing = {}, []
+    for calendar_id in dict.fromkeys(calendar_ids):
+        entry = busy_cache.get((owner, calendar_id, _fetch_start(time_min))) if owner else None
+        if entry is not None and entry[0] >= time_max:
+            busy[calendar_id] = [(max(start, time_min), min(end, time_max))
+                                 for start, end in entry[1] if start < time_max and end > time_min]
+        else:
+            missing.append(calendar_id)
+    return busy, missing
+
+
+def _fetch_start(time_min: datetime) -> datetime:
+    return time_min.astimezone(pytz.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def freebusy_window(owner: Optional[str], time_min: datetime, time_max: datetime) -> Tuple[datetime, datetime]:
+    """The window to query for busy times in [time_min, time_max)."""
+    if owner:
+        # Fetch a little past the window so that a later request, whose window
+        # has moved on by less than the cache TTL, is still covered.
+        return _fetch_start(time_min), time_max + timedelta(seconds=busy_cache.ttl)
+    return time_min, time_max
+
+
+def calendar_chunks(calendar_ids: List[str]) -> List[List[str]]:
+    """`calendar_ids` in groups small enough for one freebusy query each."""
+    return [calendar_ids[i:i + FREEBUSY_MAX_CALENDARS] for i in range(0, len(calendar_ids), FREEBUSY_MAX_CALENDARS)]
+
+
+def record_freebusy(owner: Optional[str], calendar_ids: List[str], results: dict, fetch_window: Tuple,
+                    time_min: datetime, time_max: datetime, busy: Dict[str, list], errors: Dict[str, str]):
+    """Parses a freebusy response into `busy` (clipped to the window) and `errors`, caching what succeeded."""
+    for calendar_id in calendar_ids:
+        calendar = results.get('calendars', {}).get(calendar_id, {})
+        if calendar.get('errors') or 'busy' not in calendar:
+            errors[calendar_id] = ', '.join(error.get('reason', 'unknown') for error in calendar.get('errors', []))
+            continue
+        intervals = parse_busy_intervals(calendar['busy'])
+        if owner:
+            busy_cache.set((owner, calendar_id, fetch_window[0]), (fetch_window[1], intervals))
+        busy[calendar_id] = [(max(start, time_min), min(end, time_max))
+                             for start, end in intervals if start < time_max and end > time_min]
@@ -1,13 +1,17 @@
+import asyncio
 import os
 import base64
 import time
-from fastapi import FastAPI, HTTPException, Request, Depends, status
-from starlette.responses import RedirectResponse
+import uuid
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Header, Query, Request, Depends, BackgroundTasks, status
+from starlette.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Dict, List, Literal, Optional, Tuple
 from dotenv import load_dotenv
 
+from google.api_core import exceptions as google_exceptions
 from google.cloud import firestore
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
@@ -15,17 +19,65 @@ from google_auth_oauthlib.flow import Flow
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from cryptography.fernet import Fernet
 import jwt
-from datetime import datetime, timedelta, time as dt_time
-import pytz
-
-from auth import get_current_user
+from datetime import date, datetime, timedelta, timezone
+
+from async_slot_store import (book_slot_async, hold_slot_async, read_slot_changes_async, read_slots_async,
+                              read_slots_version_async, read_versioned_slots_async, release_hold_async,
+                              release_slot_async, sweep_expired_holds_async)
+from availability import (AVAILABILITY_MAX_PAGE_SIZE, AVAILABILITY_MAX_RANGE_DAYS, AVAILABILITY_PAGE_SIZE,
+                          availability_page)
+from auth import get_current_user, verified_tokens
+from booking_queue import (BOOKING_CONFIRMED, BOOKING_FAILED, BOOKING_MODE, BOOKING_PENDING, BookingQueue,
+                           is_transient_error)
+from booking_store import (DuplicateBookingError, booking_id_for, booking_results, derived_booking_id_secret,
+                           existing_booking)
+from cache import TTLCache
+from calendar_client import AsyncCalendarClient
+from calendar_pool import CalendarServicePool
+from calendar_sync import (find_channel_owner, regenerate_slots_for_dates_async, start_watch_channels,
+                           sync_user_calendar)
+from freebusy import (FREEBUSY_MAX_CALENDARS, FreeBusyCalendarError, busy_cache, calendar_ids_of,
+                      invalidate_busy_times)
+from metrics import GaugeCallback, RequestMetricsMiddleware, metrics_token_valid, render_metrics, span
+from reconcile_bookings import RECONCILE_INTERVAL_SECONDS, reconcile_bookings_async
+from rotate_tokens import TOKEN_ROTATION_INTERVAL_SECONDS, rotate_stored_tokens
+from slot_codec import PackedSlots
+from slot_engine import SLOT_HORIZON_DAYS, SlotSettings, merge_intervals
+from slot_events import SlotEventHub, TooManySubscribersError, resync_event, slots_event
+from slot_store import HOLD_SWEEP_SECONDS, STATUS_HELD, read_slots, slot_change_listeners, slots_cache
+from team_engine import TEAM_MAX_MEMBERS, TEAM_MODE_COLLECTIVE, assignment_order, free_hosts, iter_team_slots
+from team_store import read_assignments_async, release_team_slot_async, reserve_team_slot_async
+from token_crypto import TokenCipher, decrypted_tokens, parse_keys, token_stats
+from token_store import TOKEN_WRITE_INTERVAL_SECONDS, TokenWriteBack
+from user_context import UserContext, auth_read_stats, invalidate_user_profile, load_user_context, user_profiles
 
 # Load environment variables from .env file
 load_dotenv()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if not BOOKING_ID_SECRET:
+        raise RuntimeError("BOOKING_ID_SECRET (or JWT_SECRET_KEY) is not set; bookings cannot be given IDs.")
+    if BOOKING_MODE == 'queued' and async_db:
+        await requeue_pending_bookings()
+    hold_sweeper = asyncio.create_task(sweep_expired_holds()) if async_db else None
+    reconciler = asyncio.create_task(reconcile_bookings()) if async_db and RECONCILE_INTERVAL_SECONDS > 0 else None
+    token_writer = asyncio.create_task(write_refreshed_tokens()) if async_db else None
+    key_rotator = (asyncio.create_task(rotate_token_keys())
+                   if db and token_cipher and token_cipher.key_count > 1 and TOKEN_ROTATION_INTERVAL_SECONDS > 0
+                   else None)
+    yield
+    for task in (hold_sweeper, reconciler, token_writer, key_rotator):
+        if task:
+            task.cancel()
+    if async_db:
+        await token_writes.flush_async(async_db)
+    await booking_queue.aclose()
+    await slot_event_hub.aclose()
+    await calendar_client.aclose()
+
+app = FastAPI(lifespan=lifespan)
 
 # --- CORS Middleware ---
 origins = [
@@ -39,14 +91,19 @@ app.add_middleware(
     allow_methods=["*"], # Allows all methods
     allow_headers=["*"], # Allows all headers
 )
+# Outermost, so that request timings include the other middleware.
+app.add_middleware(RequestMetricsMiddleware)
 
 # --- Firestore Client ---
+# The hot request paths use the async client; the rest uses the sync one.
 try:
     db = firestore.Client()
+    async_db = firestore.AsyncClient()
     print("Firestore client initialized successfully.")
 except Exception as e:
     print(f"CRITICAL: Error initializing Firestore client: {e}")
     db = None
+    async_db = None
 
 # --- Configuration ---
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
@@ -54,25 +111,31 @@ GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
 REDIRECT_URI = os.getenv("REDIRECT_URI")
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 FERNET_KEY = os.getenv("FERNET_KEY")
+# Keys booking IDs (see booking_store); derived from JWT_SECRET_KEY when not set.
+BOOKING_ID_SECRET = os.getenv("BOOKING_ID_SECRET") or derived_booking_id_secret(JWT_SECRET_KEY)
+# Public HTTPS URL of /api/webhooks/calendar that Google sends push notifications to.
+CALENDAR_WEBHOOK_URL = os.getenv("CALENDAR_WEBHOOK_URL")
 
 # --- Encryption ---
+# FERNET_KEY may list several keys, newest first; see token_crypto.
 try:
     if FERNET_KEY:
-        f_key = Fernet(FERNET_KEY.encode())
+        token_cipher = TokenCipher(parse_keys(FERNET_KEY))
     else:
-        f_key = None
+        token_cipher = None
         print("CRITICAL: FERNET_KEY is not set. Encryption is disabled.")
 except Exception as e:
-    f_key = None
-    print(f"CRITICAL: Invalid FERNET_KEY. It must be a 32-byte URL-safe base64 string. Error: {e}")
+    token_cipher = None
+    print(f"CRITICAL: Invalid FERNET_KEY. Each key must be a 32-byte URL-safe base64 string. Error: {e}")
 
 def encrypt_token(token: str) -> str:
-    if not token or not f_key: return None
-    return f_key.encrypt(token.encode()).decode()
+    if not token or not token_cipher: return None
+    return token_cipher.encrypt(token)
 
-def decrypt_token(encrypted_token: str) -> str:
-    if not encrypted_token or not f_key: return None
-    return f_key.decrypt(encrypted_token.encode()).decode()
+def decrypt_token(encrypted_token: str, user_id: str = None, field: str = None, expires_at: datetime = None) -> str:
+    """See `TokenCipher.decrypt`; tokens of a known user and field are cached."""
+    if not encrypted_token or not token_cipher: return None
+    return token_cipher.decrypt(encrypted_token, user_id, field, expires_at)
 
 # --- Google OAuth Flow ---
 SCOPES = [
@@ -91,6 +154,123 @@ client_config = {
     }
 } if GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET else None
 
+# --- Google Calendar ---
+# Overrides the Calendar API base URL, e.g. to point at a local stub server.
+CALENDAR_API_ENDPOINT = os.getenv("GOOGLE_CALENDAR_API_ENDPOINT")
+
+calendar_client = AsyncCalendarClient(**({'base_url': CALENDAR_API_ENDPOINT} if CALENDAR_API_ENDPOINT else {}))
+
+CALENDAR_CLIENT_OPTIONS = {'api_endpoint': CALENDAR_API_ENDPOINT} if CALENDAR_API_ENDPOINT else None
+
+def build_credentials(user_data: dict) -> Credentials:
+    expiry = user_data.get('accessTokenExpiry')
+    if expiry is not None and expiry.tzinfo is not None:
+        # google-auth compares expiry against naive UTC.
+        expiry = expiry.astimezone(timezone.utc).replace(tzinfo=None)
+    user_id = user_data.get('userId')
+    return Credentials(
+        token=decrypt_token(user_data.get('encryptedAccessToken'), user_id, 'encryptedAccessToken',
+                            user_data.get('accessTokenExpiry')),
+        refresh_token=decrypt_token(user_data.get('encryptedRefreshToken'), user_id, 'encryptedRefreshToken'),
+        token_uri=client_config['web']['token_uri'],
+        client_id=client_config['web']['client_id'],
+        client_secret=client_config['web']['client_secret'],
+        scopes=SCOPES,
+        expiry=expiry,
+    )
+
+def build_calendar_service(user_data: dict):
+    """Builds a fresh, unpooled Calendar service. Request paths use `calendar_pool` instead."""
+    return build('calendar', 'v3', credentials=build_credentials(user_data), client_options=CALENDAR_CLIENT_OPTIONS)
+
+calendar_pool = CalendarServicePool(build_credentials, client_options=CALENDAR_CLIENT_OPTIONS)
+
+def access_token_fields(credentials: Credentials) -> dict:
+    """The user document fields holding an encrypted access token and its expiry."""
+    return {
+        'encryptedAccessToken': encrypt_token(credentials.token),
+        'accessTokenExpiry': credentials.expiry.replace(tzinfo=timezone.utc) if credentials.expiry else None,
+    }
+
+# Refreshed access tokens waiting to be stored; see token_store.
+token_writes = TokenWriteBack(on_written=invalidate_user_profile)
+
+def save_refreshed_token(user_id: str):
+    """Queues the user's access token for storing if the pool refreshed it, so others skip the refresh too."""
+    credentials = calendar_pool.take_refreshed_credentials(user_id)
+    if credentials is not None and token_writes.queue(user_id, access_token_fields(credentials)):
+        token_writes.flush(db)
+
+async def save_refreshed_token_async(user_id: str):
+    credentials = calendar_pool.take_refreshed_credentials(user_id)
+    if credentials is not None and token_writes.queue(user_id, access_token_fields(credentials)):
+        with span('firestore.save_tokens'):
+            await token_writes.flush_async(async_db)
+
+# --- Signed-in user ---
+
+async def current_user_context(user_id: str = Depends(get_current_user)) -> UserContext:
+    """The signed-in user and their user document; see `user_context`."""
+    if not async_db:
+        raise HTTPException(status_code=500, detail="Firestore client not available.")
+    context = await load_user_context(async_db, user_id)
+    if context is None:
+        raise HTTPException(status_code=404, detail="User not found.")
+    return context
+
+# --- Public page cache ---
+# Per-process cache of publicUrlToken -> (user ID, user data) for the public booking endpoints.
+public_user_cache = TTLCache(
+    maxsize=int(os.getenv("PUBLIC_USER_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("PUBLIC_USER_CACHE_TTL_SECONDS", "300")),
+)
+
+async def find_user_by_public_token(token: str):
+    user = public_user_cache.get(token)
+    if user is not None:
+        return user
+
+    users_ref = async_db.collection('users')
+    query = users_ref.where(filter=firestore.FieldFilter("publicUrlToken", "==", token)).limit(1)
+    with span('firestore.find_user_by_token'):
+        results = [user_doc async for user_doc in query.stream()]
+    if not results:
+        return None
+
+    user = (results[0].id, results[0].to_dict())
+    public_user_cache.set(token, user)
+    return user
+
+def invalidate_public_user(user_id: str):
+    public_user_cache.pop_where(lambda token, user: user[0] == user_id)
+
+# Per-process cache of team publicUrlToken -> (team ID, team data, member ID -> user data).
+public_team_cache = TTLCache(
+    maxsize=int(os.getenv("PUBLIC_TEAM_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("PUBLIC_TEAM_CACHE_TTL_SECONDS", "60")),
+)
+
+async def find_team_by_public_token(token: str):
+    team = public_team_cache.get(token)
+    if team is not None:
+        return team
+
+    query = async_db.collection('teams').where(
+        filter=firestore.FieldFilter("publicUrlToken", "==", token)).limit(1)
+    with span('firestore.find_team_by_token'):
+        results = [team_doc async for team_doc in query.stream()]
+    if not results:
+        return None
+
+    team_data = results[0].to_dict()
+    with span('firestore.get_team_members'):
+        member_docs = await asyncio.gather(*(
+            async_db.collection('users').document(user_id).get() for user_id in team_data['memberUserIds']))
+    members = {member_doc.id: member_doc.to_dict() for member_doc in member_docs if member_doc.exists}
+    team = (results[0].id, team_data, members)
+    public_team_cache.set(token, team)
+    return team
+
 # --- Pydantic Models ---
 class WorkingHours(BaseModel):
     start: str = Field(..., pattern=r"^([0-1]?[0-9]|2[0-3]):[0-5][0-9]$")
@@ -99,226 +279,288 @@ class WorkingHours(BaseModel):
 class UserSettings(BaseModel):
     workingHours: WorkingHours
     slotDuration: int = Field(..., gt=0) # Duration in minutes
+    # Per-weekday hours ("0" is Monday), replacing workingHours/workingDays; an end before the start runs overnight
+    weeklyHours: Optional[Dict[Literal['0', '1', '2', '3', '4', '5', '6'], List[WorkingHours]]] = None
+    # Calendars whose events block slots; 'primary' when not set
+    calendarIds: Optional[List[str]] = Field(None, min_length=1, max_length=FREEBUSY_MAX_CALENDARS)
+
+class TeamRequest(BaseModel):
+    name: str = Field(..., min_length=1)
+    mode: Literal['collective', 'round_robin']
+    memberEmails: List[str] = Field(..., max_length=TEAM_MAX_MEMBERS) # The owner is always a member
+    workingHours: Optional[WorkingHours] = None # Defaults to the owner's settings
+    slotDuration: Optional[int] = Field(None, gt=0)
+    # Read members' calendars with the owner's token (needs free/busy sharing, e.g. within a Workspace domain)
+    sharedFreeBusy: bool = False
+
+class TeamBookingRequest(BaseModel):
+    slotId: str
+    bookerName: str
+    bookerEmail: str
 
 class BookingRequest(BaseModel):
     publicUrlToken: str
     slotId: str # The startTime of the slot acts as its unique ID
     bookerName: str
     bookerEmail: str
+    holdId: Optional[str] = None # From POST /api/slots/public/{token}/holds
 
+class HoldRequest(BaseModel):
+    slotId: str
 
-@firestore.transactional
-def book_slot_in_transaction(transaction, slots_ref, slot_id):
-    snapshot = slots_ref.get(transaction=transaction)
-    if not snapshot.exists:
-        raise FileNotFoundError("Slots document not found.")
-    
-    slots = snapshot.to_dict().get('slots', [])
-    slot_found = False
-    slot_to_book = None
-    for i, slot in enumerate(slots):
-        if slot.get('slotId') == slot_id:
-            if slot.get('status') != 'available':
-                raise ValueError("Slot is no longer available.")
-            
-            slots[i]['status'] = 'booked'
-            slot_found = True
-            slot_to_book = slot
-            break
-    
-    if not slot_found:
-        raise ValueError("Slot ID not found.")
 
-    transaction.update(slots_ref, {'slots': slots})
-    return slot_to_book
+def booking_event_body(host_user_data: dict, start_time: str, end_time: str, booker_name: str,
+                       booker_email: str, request_id: str) -> dict:
+    slot_start_time = datetime.fromisoformat(start_time)
+    slot_end_time = datetime.fromisoformat(end_time)
+
+    # Use event name from user settings, with a fallback
+    settings = host_user_data.get('settings', {})
+    event_name = settings.get('eventName', 'Meeting')
+
+    return {
+        'summary': f"{event_name} with {booker_name}",
+        'start': {'dateTime': slot_start_time.isoformat(), 'timeZone': str(slot_start_time.tzinfo)},
+        'end': {'dateTime': slot_end_time.isoformat(), 'timeZone': str(slot_end_time.tzinfo)},
+        'attendees': [
+            {'email': booker_email},
+            {'email': host_user_data.get('email')}
+        ],
+        'conferenceData': {
+            'createRequest': {
+                'requestId': request_id,
+                'conferenceSolutionKey': {'type': 'hangoutsMeet'}
+            }
+        },
+        'reminders': {'useDefault': True},
+    }
+
+
+def accepted_booking(booking_id: str) -> JSONResponse:
+    return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content={
+        "message": "Booking accepted.",
+        "bookingId": booking_id,
+        "status": BOOKING_PENDING,
+        "statusUrl": f"/api/bookings/{booking_id}",
+    })
+
+
+def confirmed_booking(booking_id: str, booking: dict, event: Optional[dict] = None) -> dict:
+    content = {"message": "Booking successful!", "bookingId": booking_id, "status": BOOKING_CONFIRMED,
+               "googleMeetUrl": booking.get('googleMeetUrl')}
+    if event is not None:
+        content["event_details"] = event
+    return content
+
+
+def stored_booking_response(booking_id: str, booking: dict, slot_id: str):
+    """The response to a request whose booking already exists."""
+    if booking.get('slotId') != slot_id:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for another booking.")
+    if booking.get('status', BOOKING_CONFIRMED) == BOOKING_PENDING:
+        return accepted_booking(booking_id)
+    response = confirmed_booking(booking_id, booking)
+    booking_results.set(booking_id, (slot_id, response))
+    return response
 
 
 @app.post("/api/bookings")
-def create_booking(req: BookingRequest):
-    if not db:
+async def create_booking(req: BookingRequest, idempotency_key: Optional[str] = Header(None, max_length=255)):
+    """
+    Books a slot. Retries are safe: see `booking_store`.
+
+    The slot is reserved together with a pending booking record, then the
+    Calendar event is created, inline (200) or by the booking queue (202).
+    A request whose booking exists already gets that booking's result
+    without a new reservation or Calendar call.
+    """
+    if not async_db:
         raise HTTPException(status_code=500, detail="Firestore client not available.")
 
     try:
-        users_ref = db.collection('users')
-        query = users_ref.where(filter=firestore.FieldFilter("publicUrlToken", "==", req.publicUrlToken)).limit(1)
-        user_results = list(query.stream())
-        if not user_results:
+        host_user = await find_user_by_public_token(req.publicUrlToken)
+        if not host_user:
             raise HTTPException(status_code=404, detail="User to book with not found.")
-        
-        host_user_doc = user_results[0]
-        host_user_id = host_user_doc.id
-        host_user_data = host_user_doc.to_dict()
-
-        slots_ref = db.collection('slots').document(host_user_id)
-        transaction = db.transaction()
-        booked_slot = book_slot_in_transaction(transaction, slots_ref, req.slotId)
-
-        creds = Credentials(
-            token=decrypt_token(host_user_data.get('encryptedAccessToken')),
-            refresh_token=decrypt_token(host_user_data.get('encryptedRefreshToken')),
-            token_uri=client_config['web']['token_uri'],
-            client_id=client_config['web']['client_id'],
-            client_secret=client_config['web']['client_secret'],
-            scopes=SCOPES
-        )
-        service = build('calendar', 'v3', credentials=creds)
-        
-        slot_start_time = datetime.fromisoformat(booked_slot['startTime'])
-        slot_end_time = datetime.fromisoformat(booked_slot['endTime'])
-        
-        # Use event name from user settings, with a fallback
-        settings = host_user_data.get('settings', {})
-        event_name = settings.get('eventName', 'Meeting')
-
-        event_body = {
-            'summary': f"{event_name} with {req.bookerName}",
-            'start': {'dateTime': slot_start_time.isoformat(), 'timeZone': str(slot_start_time.tzinfo)},
-            'end': {'dateTime': slot_end_time.isoformat(), 'timeZone': str(slot_end_time.tzinfo)},
-            'attendees': [
-                {'email': req.bookerEmail},
-                {'email': host_user_data.get('email')}
-            ],
-            'conferenceData': {
-                'createRequest': {
-                    'requestId': f"{req.slotId}-{req.bookerEmail}",
-                    'conferenceSolutionKey': {'type': 'hangoutsMeet'}
-                }
-            },
-            'reminders': {'useDefault': True},
-        }
 
-        created_event = service.events().insert(calendarId='primary', body=event_body, conferenceDataVersion=1).execute()
-
-        booking_id = created_event.get('id')
-        db.collection('bookings').document(booking_id).set({
+        host_user_id, host_user_data = host_user
+        request_id = f"{req.slotId}-{req.bookerEmail}"
+        booking_id = booking_id_for(BOOKING_ID_SECRET, host_user_id, idempotency_key or request_id)
+        stored = booking_results.get(booking_id)
+        if stored is not None:
+            if stored[0] != req.slotId:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used for another booking.")
+            return stored[1]
+        booking_ref = async_db.collection('bookings').document(booking_id)
+        with span('firestore.get_booking'):
+            booking = existing_booking(await booking_ref.get())
+        if booking is not None:
+            return stored_booking_response(booking_id, booking, req.slotId)
+
+        # Every attempt gets its own event ID: Calendar keeps deleted events' IDs taken.
+        event_id = uuid.uuid4().hex
+        pending_booking = lambda slot: {
             'bookingId': booking_id,
             'hostUserId': host_user_id,
             'slotId': req.slotId,
+            'startTime': slot['startTime'],
+            'endTime': slot['endTime'],
             'bookerName': req.bookerName,
             'bookerEmail': req.bookerEmail,
-            'googleMeetUrl': created_event.get('hangoutLink'),
-            'createdAt': firestore.SERVER_TIMESTAMP
-        })
+            'requestId': request_id,
+            'eventId': event_id,
+            'status': BOOKING_PENDING,
+            'createdAt': firestore.SERVER_TIMESTAMP,
+        }
+        try:
+            await book_slot_async(async_db, host_user_id, req.slotId, booking=(booking_ref, pending_booking),
+                                  hold_id=req.holdId)
+        except DuplicateBookingError as duplicate:
+            return stored_booking_response(booking_id, duplicate.booking, req.slotId)
 
-        return {"message": "Booking successful!", "event_details": created_event}
+        if BOOKING_MODE == 'queued':
+            booking_queue.enqueue(booking_id)
+            return accepted_booking(booking_id)
+
+        try:
+            booking, created_event = await process_booking_job(booking_id)
+        except Exception as e:
+            if is_transient_error(e):
+                # The slot stays reserved; the queue keeps trying with backoff.
+                booking_queue.enqueue(booking_id)
+                return accepted_booking(booking_id)
+            await fail_booking_job(booking_id, e)
+            raise
+        response = confirmed_booking(booking_id, booking, created_event)
+        booking_results.set(booking_id, (req.slotId, response))
+        return response
 
     except (FileNotFoundError, ValueError) as e:
         raise HTTPException(status_code=409, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
 
 
-@app.post("/api/user/me/slots/generate")
-def generate_user_slots(user_id: str = Depends(get_current_user)):
-    if not db:
-        raise HTTPException(status_code=500, detail="Firestore client not available.")
+async def process_booking_job(booking_id: str) -> Tuple[Optional[dict], Optional[dict]]:
+    """
+    Creates the Calendar event of a pending booking and confirms it. Safe to run more than once.
+
+    Returns:
+        The confirmed booking and its event, or (None, None) if the booking was not pending.
+    """
+    booking_ref = async_db.collection('bookings').document(booking_id)
+    with span('firestore.get_booking'):
+        booking_doc = await booking_ref.get()
+    if not booking_doc.exists or booking_doc.to_dict().get('status') != BOOKING_PENDING:
+        return None, None
+    booking = booking_doc.to_dict()
+
+    host_user_id = booking['hostUserId']
+    with span('firestore.get_user'):
+        host_user_doc = await async_db.collection('users').document(host_user_id).get()
+    if not host_user_doc.exists:
+        raise ValueError("Host user not found.")
+    host_user_data = host_user_doc.to_dict()
+    credentials = calendar_pool.credentials(host_user_id, host_user_data)
+
+    event_body = booking_event_body(host_user_data, booking['startTime'], booking['endTime'],
+                                    booking['bookerName'], booking['bookerEmail'], booking['requestId'])
+    # A fixed event ID makes a retry after an insert that actually went through
+    # get a 409 instead of creating a second event. Bookings queued before
+    # per-attempt event IDs use the booking ID.
+    event_id = booking.get('eventId', booking_id)
+    event_body['id'] = event_id
+    try:
+        created_event = await calendar_client.insert_event(credentials, 'primary', event_body,
+                                                           conference_data_version=1)
+    except HttpError as error:
+        if error.resp.status != 409:
+            raise
+        created_event = await calendar_client.get_event(credentials, 'primary', event_id)
+        if created_event.get('status') == 'cancelled':
+            raise ValueError("The booking's calendar event was deleted.")
+    await save_refreshed_token_async(host_user_id)
+    invalidate_busy_times(host_user_id)
+
+    confirmed = {
+        'status': BOOKING_CONFIRMED,
+        'eventId': created_event.get('id'),
+        'googleMeetUrl': created_event.get('hangoutLink'),
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+    }
+    with span('firestore.confirm_booking'):
+        await booking_ref.update(confirmed)
+    return {**booking, **confirmed}, created_event
 
-    user_ref = db.collection('users').document(user_id)
-    user_doc = user_ref.get()
 
-    if not user_doc.exists:
-        raise HTTPException(status_code=404, detail="User not found.")
+async def fail_booking_job(booking_id: str, error: Exception):
+    """Marks a booking as failed and frees its slot again."""
+    booking_ref = async_db.collection('bookings').document(booking_id)
+    with span('firestore.get_booking'):
+        booking_doc = await booking_ref.get()
+    if not booking_doc.exists or booking_doc.to_dict().get('status') != BOOKING_PENDING:
+        return
+    booking = booking_doc.to_dict()
+    await release_slot_async(async_db, booking['hostUserId'], booking['slotId'], booking_ref, {
+        'status': BOOKING_FAILED,
+        'error': str(error),
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+    })
 
-    user_data = user_doc.to_dict()
-    
-    access_token = decrypt_token(user_data.get('encryptedAccessToken'))
-    refresh_token = decrypt_token(user_data.get('encryptedRefreshToken'))
 
-    if not access_token:
-        raise HTTPException(status_code=400, detail="User has no access token.")
+booking_queue = BookingQueue(process_booking_job, fail_booking_job)
 
-    creds = Credentials(
-        token=access_token,
-        refresh_token=refresh_token,
-        token_uri=client_config['web']['token_uri'],
-        client_id=client_config['web']['client_id'],
-        client_secret=client_config['web']['client_secret'],
-        scopes=SCOPES
-    )
 
-    try:
-        service = build('calendar', 'v3', credentials=creds)
+async def requeue_pending_bookings():
+    """Picks up bookings a previous process accepted but did not finish."""
+    query = async_db.collection('bookings').where(filter=firestore.FieldFilter("status", "==", BOOKING_PENDING))
+    async for booking_doc in query.stream():
+        booking_queue.enqueue(booking_doc.id)
 
-        now = datetime.utcnow()
-        time_min = now.isoformat() + 'Z'
-        time_max = (now + timedelta(days=14)).isoformat() + 'Z'
-
-        free_busy_body = {
-            "timeMin": time_min,
-            "timeMax": time_max,
-            "timeZone": "UTC",
-            "items": [{"id": "primary"}]
-        }
 
-        results = service.freebusy().query(body=free_busy_body).execute()
-        busy_intervals_raw = results['calendars']['primary']['busy']
+@app.get("/api/bookings/{booking_id}")
+async def get_booking_status(booking_id: str):
+    if not async_db:
+        raise HTTPException(status_code=500, detail="Firestore client not available.")
 
-        # Get settings from user data, with defaults
-        settings = user_data.get('settings', {})
-        working_hours_setting = settings.get('workingHours', {'start': '09:00', 'end': '17:00'})
-        
-        working_hours = {
-            'start': dt_time.fromisoformat(working_hours_setting['start']),
-            'end': dt_time.fromisoformat(working_hours_setting['end'])
-        }
-        working_days = settings.get('workingDays', [0, 1, 2, 3, 4]) # Mon-Fri
-        slot_duration_minutes = settings.get('slotDuration', 30)
-        slot_duration = timedelta(minutes=slot_duration_minutes)
-        user_timezone = pytz.timezone(settings.get('timezone', 'Asia/Tokyo'))
-
-
-        busy_times = []
-        for interval in busy_intervals_raw:
-            start_str = interval['start'].replace('Z', '+00:00')
-            end_str = interval['end'].replace('Z', '+00:00')
-            busy_times.append({
-                'start': datetime.fromisoformat(start_str),
-                'end': datetime.fromisoformat(end_str)
-            })
-
-        available_slots = []
-        today = datetime.now(user_timezone).date()
-        for i in range(14):
-            current_day = today + timedelta(days=i)
-            
-            if current_day.weekday() not in working_days:
-                continue
+    with span('firestore.get_booking'):
+        booking_doc = await async_db.collection('bookings').document(booking_id).get()
+    if not booking_doc.exists:
+        raise HTTPException(status_code=404, detail="Booking not found.")
+
+    booking = booking_doc.to_dict()
+    return {
+        "bookingId": booking_id,
+        # Bookings made before booking statuses existed were always confirmed.
+        "status": booking.get('status', BOOKING_CONFIRMED),
+        "slotId": booking.get('slotId'),
+        "googleMeetUrl": booking.get('googleMeetUrl'),
+        "error": booking.get('error'),
+    }
 
-            day_start = user_timezone.localize(datetime.combine(current_day, working_hours['start']))
-            day_end = user_timezone.localize(datetime.combine(current_day, working_hours['end']))
-            
-            potential_slot_start = day_start
-            while potential_slot_start + slot_duration <= day_end:
-                potential_slot_end = potential_slot_start + slot_duration
-                
-                is_busy = False
-                for busy in busy_times:
-                    if potential_slot_start < busy['end'] and potential_slot_end > busy['start']:
-                        is_busy = True
-                        break
-                
-                if not is_busy and potential_slot_start > datetime.now(user_timezone):
-                    available_slots.append({
-                        'slotId': potential_slot_start.isoformat(),
-                        'startTime': potential_slot_start.isoformat(),
-                        'endTime': potential_slot_end.isoformat(),
-                        'status': 'available'
-                    })
-                
-                potential_slot_start += slot_duration
-
-        slots_data = {
-            'userId': user_id,
-            'slots': available_slots,
-            'updatedAt': firestore.SERVER_TIMESTAMP
-        }
-        db.collection('slots').document(user_id).set(slots_data)
+
+@app.post("/api/user/me/slots/generate")
+async def generate_user_slots(user: UserContext = Depends(current_user_context)):
+    user_id, user_data = user.user_id, user.data
+    if not decrypt_token(user_data.get('encryptedAccessToken'), user_id, 'encryptedAccessToken',
+                         user_data.get('accessTokenExpiry')):
+        raise HTTPException(status_code=400, detail="User has no access token.")
+
+    try:
+        slot_settings = SlotSettings.from_user_settings(user_data.get('settings', {}))
+        slot_count = await regenerate_slots_for_dates_async(
+            async_db, calendar_client, calendar_pool.credentials(user_id, user_data), user_id, slot_settings,
+            datetime.now(slot_settings.timezone), calendar_ids=calendar_ids_of(user_data.get('settings')))
+        await save_refreshed_token_async(user_id)
 
         return {
-            "message": f"Successfully generated and saved {len(available_slots)} available slots.",
+            "message": f"Successfully generated and saved {slot_count} available slots.",
             "user_id": user_id,
         }
 
+    except FreeBusyCalendarError as error:
+        raise HTTPException(status_code=400, detail=f"Cannot read calendars: {error}")
     except HttpError as error:
         print(f'An error occurred: {error}')
         raise HTTPException(status_code=500, detail=f"Google Calendar API error: {error}")
@@ -326,51 +568,724 @@ def generate_user_slots(user_id: str = Depends(get_current_user)):
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
 
 
+@app.post("/api/user/me/calendar/watch")
+def watch_user_calendar(user: UserContext = Depends(current_user_context)):
+    """Subscribes to push notifications for each of the user's calendars and runs an initial sync."""
+    if not db:
+        raise HTTPException(status_code=500, detail="Firestore client not available.")
+    if not CALENDAR_WEBHOOK_URL:
+        raise HTTPException(status_code=500, detail="Server is not configured for calendar push notifications.")
+    user_id, user_data = user.user_id, user.data
+
+    try:
+        with calendar_pool.service(user_id, user_data) as service:
+            channels = start_watch_channels(db, service, user_id, CALENDAR_WEBHOOK_URL,
+                                            calendar_ids_of(user_data.get('settings')))
+            sync_user_calendar(db, service, user_id, user_data)
+        save_refreshed_token(user_id)
+        # Renewing by then keeps every channel alive.
+        expirations = [channel['channelExpiration'] for channel in channels.values() if channel['channelExpiration']]
+        return {"message": "Calendar watch started.", "calendarIds": list(channels),
+                "expiration": min(expirations, key=int, default=None)}
+    except HttpError as error:
+        print(f'An error occurred: {error}')
+        raise HTTPException(status_code=500, detail=f"Google Calendar API error: {error}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
+
+
+def run_incremental_sync(user_id: str, calendar_id: Optional[str] = None):
+    try:
+        user_doc = db.collection('users').document(user_id).get()
+        if not user_doc.exists:
+            return
+        user_data = user_doc.to_dict()
+        with calendar_pool.service(user_id, user_data) as service:
+            affected = sync_user_calendar(db, service, user_id, user_data,
+                                          calendar_ids=[calendar_id] if calendar_id else None)
+        save_refreshed_token(user_id)
+        print(f"Calendar sync for {user_id}: regenerated {'all days' if affected is None else len(affected)}")
+    except Exception as e:
+        print(f"ERROR in calendar sync for {user_id}: {e}")
+
+
+@app.post("/api/webhooks/calendar")
+def calendar_webhook(request: Request, background_tasks: BackgroundTasks):
+    """Receives Google Calendar push notifications and schedules an incremental sync."""
+    if not db:
+        raise HTTPException(status_code=500, detail="Firestore client not available.")
+
+    channel_id = request.headers.get('X-Goog-Channel-ID')
+    if not channel_id:
+        raise HTTPException(status_code=400, detail="Missing channel ID.")
+
+    owner = find_channel_owner(db, channel_id, request.headers.get('X-Goog-Channel-Token'))
+    if not owner:
+        raise HTTPException(status_code=404, detail="Unknown channel.")
+
+    # The first notification only confirms that the channel was created.
+    if request.headers.get('X-Goog-Resource-State') != 'sync':
+        background_tasks.add_task(run_incremental_sync, *owner)
+    return {"message": "Notification received."}
+
+
 @app.get("/api/user/me/slots")
 def get_user_slots(user_id: str = Depends(get_current_user)):
     if not db:
         raise HTTPException(status_code=500, detail="Firestore client not available.")
     try:
-        slots_ref = db.collection('slots').document(user_id)
-        slots_doc = slots_ref.get()
-        if not slots_doc.exists:
-            return {"slots": []}
-        return {"slots": slots_doc.to_dict().get('slots', [])}
+        return {"slots": read_slots(db, user_id)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
 
 
+def slots_etag(version: int, format: str) -> str:
+    return f'"{version}"' if format == 'json' else f'"{version}-{format}"'
+
+
+def etag_versions(if_none_match: Optional[str], format: str) -> List[int]:
+    """The slot versions of `format` listed in an If-None-Match header."""
+    versions = []
+    for tag in (if_none_match or '').split(','):
+        # If-None-Match compares weakly, so W/ tags count too.
+        tag = tag.strip().removeprefix('W/').strip('"')
+        if format != 'json':
+            if not tag.endswith(f"-{format}"):
+                continue
+            tag = tag[:-len(format) - 1]
+        if tag.isdigit():
+            versions.append(int(tag))
+    return versions
+
+
 @app.get("/api/slots/public/{token}")
-def get_public_slots(token: str):
-    if not db:
+async def get_public_slots(
+    token: str,
+    format: Literal['json', 'compact'] = 'json',
+    since: Optional[int] = Query(None, ge=0),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    The host's stored slots and their `version`.
+
+    Slots someone is booking right now have the status `held`. With
+    `format=compact` they come packed as `slot_codec.PackedSlots.to_json`
+    describes instead of a `slots` list, held slots marked as booked; slots
+    that cannot be packed are still sent as a list. Responses carry the version as a strong ETag, and an
+    If-None-Match with the current one gets a 304 after reading only the
+    slots' header document.
+
+    With `since` (a version from an earlier response), only the days changed
+    after it are sent, as `days` ({day: slots}, an empty list for a day that
+    no longer has slots). When that cannot be worked out, the full response
+    is sent instead.
+    """
+    if not async_db:
         raise HTTPException(status_code=500, detail="Firestore client not available.")
 
     try:
-        users_ref = db.collection('users')
-        query = users_ref.where(filter=firestore.FieldFilter("publicUrlToken", "==", token)).limit(1)
-        results = list(query.stream())
+        user = await find_user_by_public_token(token)
+        if not user:
+            raise HTTPException(status_code=404, detail="Public booking page not found.")
 
-        if not results:
+        user_id, user_data = user
+        headers = {"Cache-Control": "no-cache"}
+        if since is not None:
+            version, days = await read_slot_changes_async(async_db, user_id, since)
+            if days is not None:
+                return JSONResponse({"userName": user_data.get('email'), "version": version, "since": since,
+                                     "days": days}, headers=headers)
+
+        version, slots = await read_versioned_slots_async(
+            async_db, user_id, etag_versions(if_none_match, format) if since is None else ())
+        if version is not None:
+            headers["ETag"] = slots_etag(version, format)
+        if slots is None:
+            return Response(status_code=304, headers=headers)
+
+        if format == 'compact':
+            try:
+                packed = PackedSlots.from_slots(
+                    {**slot, 'status': 'booked'} if slot['status'] == STATUS_HELD else slot for slot in slots)
+                return JSONResponse({"userName": user_data.get('email'), "version": version,
+                                     **packed.to_json()}, headers=headers)
+            except ValueError:
+                if version is not None:
+                    headers["ETag"] = slots_etag(version, 'json')
+        # Slots are plain JSON already; skip FastAPI's per-field encoding of every slot.
+        return JSONResponse({
+            "userName": user_data.get('email'),
+            "version": version,
+            "slots": slots
+        }, headers=headers)
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
+
+
+@app.post("/api/slots/public/{token}/holds", status_code=status.HTTP_201_CREATED)
+async def create_slot_hold(token: str, req: HoldRequest):
+    """
+    Holds an available slot while the booker fills in the booking form.
+
+    Until `expiresAt`, other pages see the slot as `held` and only a booking
+    that passes the `holdId` can take it.
+    """
+    if not async_db:
+        raise HTTPException(status_code=500, detail="Firestore client not available.")
+    user = await find_user_by_public_token(token)
+    if not user:
+        raise HTTPException(status_code=404, detail="Public booking page not found.")
+
+    try:
+        hold = await hold_slot_async(async_db, user[0], req.slotId)
+    except (FileNotFoundError, ValueError) as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
+    return {"holdId": hold['holdId'], "slotId": req.slotId, "expiresAt": hold['expiresAt'].isoformat()}
+
+
+@app.delete("/api/slots/public/{token}/holds/{hold_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_slot_hold(token: str, hold_id: str):
+    """Gives a held slot back, e.g. when the booker picks another one. Expired holds need no call."""
+    if not async_db:
+        raise HTTPException(status_code=500, detail="Firestore client not available.")
+    user = await find_user_by_public_token(token)
+    if not user:
+        raise HTTPException(status_code=404, detail="Public booking page not found.")
+
+    try:
+        await release_hold_async(async_db, user[0], hold_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Hold not found.")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+async def reconcile_bookings():
+    """Repairs half-done bookings every RECONCILE_INTERVAL_SECONDS; see `reconcile_bookings`."""
+    while True:
+        await asyncio.sleep(RECONCILE_INTERVAL_SECONDS)
+        try:
+            stats = await reconcile_bookings_async(async_db, calendar_client, calendar_pool.credentials,
+                                                   booking_queue.enqueue)
+            if any(stats.values()):
+                print(f"Reconciled bookings: {dict(stats)}")
+        except Exception as e:
+            print(f"ERROR while reconciling bookings: {e}")
+
+
+async def write_refreshed_tokens():
+    """Stores queued refreshed access tokens every TOKEN_WRITE_INTERVAL_SECONDS; see `token_store`."""
+    while True:
+        await asyncio.sleep(TOKEN_WRITE_INTERVAL_SECONDS)
+        try:
+            with span('firestore.save_tokens'):
+                await token_writes.flush_async(async_db)
+        except Exception as e:
+            print(f"ERROR while storing refreshed tokens: {e}")
+
+
+async def rotate_token_keys():
+    """Re-encrypts stored tokens with the newest key every TOKEN_ROTATION_INTERVAL_SECONDS; see `rotate_tokens`."""
+    while True:
+        await asyncio.sleep(TOKEN_ROTATION_INTERVAL_SECONDS)
+        try:
+            stats = await asyncio.to_thread(rotate_stored_tokens, db, token_cipher, on_rotated=invalidate_user_profile)
+            if stats['rotated'] or stats['failed']:
+                print(f"Re-encrypted stored tokens: {dict(stats)}")
+        except Exception as e:
+            print(f"ERROR while re-encrypting stored tokens: {e}")
+
+
+async def sweep_expired_holds():
+    """Clears expired holds every HOLD_SWEEP_SECONDS; see `async_slot_store.sweep_expired_holds_async`."""
+    while True:
+        await asyncio.sleep(HOLD_SWEEP_SECONDS)
+        try:
+            await sweep_expired_holds_async(async_db)
+        except Exception as e:
+            print(f"ERROR while sweeping expired slot holds: {e}")
+
+
+# Public pages subscribe to their host's slot changes; see slot_events.
+slot_event_hub = SlotEventHub(lambda user_id: read_slots_version_async(async_db, user_id),
+                              lambda user_id, since: read_slot_changes_async(async_db, user_id, since))
+slot_change_listeners.append(slot_event_hub.notify)
+
+
+@app.get("/api/slots/public/{token}/events")
+async def stream_public_slot_events(
+    token: str,
+    since: Optional[int] = Query(None, ge=0),
+    last_event_id: Optional[str] = Header(None),
+):
+    """
+    Server-Sent Events with the host's slot changes.
+
+    `slots` events carry the days changed since the previous event, like the
+    `since` response of GET /api/slots/public/{token}. A `resync` event means
+    changes were missed and the page should fetch its slots again. Pass the
+    version the page shows as `since` to also get what changed before the
+    stream opened; a reconnecting EventSource resumes from Last-Event-ID.
+    """
+    if not async_db:
+        raise HTTPException(status_code=500, detail="Firestore client not available.")
+    user = await find_user_by_public_token(token)
+    if not user:
+        raise HTTPException(status_code=404, detail="Public booking page not found.")
+    user_id = user[0]
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+
+    try:
+        # Subscribe before catching up, so nothing falls between the two.
+        subscription = await slot_event_hub.subscribe(user_id)
+    except TooManySubscribersError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    async def events():
+        try:
+            yield "retry: 5000\n\n"
+            if since is not None:
+                version, days = await read_slot_changes_async(async_db, user_id, since)
+                if days is None:
+                    yield resync_event(version)
+                elif days:
+                    yield slots_event(version, since, days)
+            async for frame in subscription.frames():
+                yield frame
+        finally:
+            slot_event_hub.unsubscribe(subscription)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def availability_range(date_from: Optional[date], date_to: Optional[date], today: date):
+    """Applies the defaults of the availability endpoints' `from`/`to` parameters and checks them."""
+    date_from = date_from or today
+    date_to = date_to or date_from + timedelta(days=SLOT_HORIZON_DAYS - 1)
+    if date_to < date_from:
+        raise HTTPException(status_code=400, detail="'to' must not be before 'from'.")
+    if (date_to - date_from).days >= AVAILABILITY_MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"The range may span at most {AVAILABILITY_MAX_RANGE_DAYS} days.")
+    return date_from, date_to
+
+
+@app.get("/api/slots/public/{token}/availability")
+async def get_public_availability(
+    token: str,
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    duration: Optional[int] = Query(None, ge=5, le=8 * 60),
+    cursor: Optional[str] = None,
+    limit: int = Query(AVAILABILITY_PAGE_SIZE, ge=1, le=AVAILABILITY_MAX_PAGE_SIZE),
+):
+    """
+    Computes free slots for any date range (host timezone, inclusive) and slot duration.
+
+    Nothing is stored. Results are paged: pass `nextCursor` back as `cursor`
+    until it is null.
+    """
+    if not async_db:
+        raise HTTPException(status_code=500, detail="Firestore client not available.")
+
+    try:
+        user = await find_user_by_public_token(token)
+        if not user:
             raise HTTPException(status_code=404, detail="Public booking page not found.")
-        
-        user_doc = results[0]
-        user_id = user_doc.id
+        user_id, user_data = user
+        if not user_data.get('encryptedRefreshToken'):
+            raise HTTPException(status_code=400, detail="The host has not connected a calendar.")
 
-        slots_ref = db.collection('slots').document(user_id)
-        slots_doc = slots_ref.get()
+        slot_settings = SlotSettings.from_user_settings(user_data.get('settings', {}))
+        now = datetime.now(slot_settings.timezone)
+        date_from, date_to = availability_range(date_from, date_to, now.date())
 
-        if not slots_doc.exists:
-            return {"userName": user_doc.to_dict().get('email'), "slots": []}
+        credentials = calendar_pool.credentials(user_id, user_data)
+        calendar_ids = calendar_ids_of(user_data.get('settings'))
 
-        return {
-            "userName": user_doc.to_dict().get('email'),
-            "slots": slots_doc.to_dict().get('slots', [])
-        }
+        async def fetch_busy(time_min, time_max):
+            return await calendar_client.fetch_busy_times(credentials, time_min, time_max,
+                                                          calendar_ids=calendar_ids, owner=user_id)
+
+        # Reserved slots may not be on the calendar yet (queued bookings).
+        reserved = [(datetime.fromisoformat(slot['startTime']), datetime.fromisoformat(slot['endTime']))
+                    for slot in await read_slots_async(async_db, user_id) if slot['status'] != 'available']
+        try:
+            slots, next_cursor = await availability_page(fetch_busy, slot_settings, date_from, date_to, now,
+                                                          duration, cursor, limit, extra_busy=reserved)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        await save_refreshed_token_async(user_id)
+
+        return JSONResponse({
+            "userName": user_data.get('email'),
+            "timezone": slot_settings.timezone.zone,
+            "duration": duration or slot_settings.slot_duration_minutes,
+            "slots": slots,
+            "nextCursor": next_cursor,
+        })
 
+    except HTTPException:
+        raise
+    except FreeBusyCalendarError as error:
+        raise HTTPException(status_code=500, detail=f"Cannot read the host's calendars: {error}")
+    except HttpError as error:
+        print(f'An error occurred: {error}')
+        raise HTTPException(status_code=500, detail=f"Google Calendar API error: {error}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
 
 
+# --- Teams ---
+@app.post("/api/teams", status_code=status.HTTP_201_CREATED)
+def create_team(req: TeamRequest, owner: UserContext = Depends(current_user_context)):
+    """Creates a team booking page owned by the current user."""
+    if not db:
+        raise HTTPException(status_code=500, detail="Firestore client not available.")
+    current_user_id, owner_data = owner.user_id, owner.data
+
+    emails = list(dict.fromkeys(email for email in req.memberEmails if email != owner_data.get('email')))
+    member_ids_by_email = {}
+    # 'in' filters take at most 30 values.
+    for i in range(0, len(emails), 30):
+        query = db.collection('users').where(filter=firestore.FieldFilter("email", "in", emails[i:i + 30]))
+        member_ids_by_email.update({user_doc.to_dict()['email']: user_doc.id for user_doc in query.stream()})
+    unknown = [email for email in emails if email not in member_ids_by_email]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"No account found for: {', '.join(unknown)}")
+    member_ids = [current_user_id] + [member_ids_by_email[email] for email in emails]
+    if len(member_ids) > TEAM_MAX_MEMBERS:
+        raise HTTPException(status_code=400, detail=f"A team may have at most {TEAM_MAX_MEMBERS} members.")
+
+    settings = dict(owner_data.get('settings', {}))
+    if req.workingHours:
+        settings['workingHours'] = req.workingHours.model_dump()
+    if req.slotDuration:
+        settings['slotDuration'] = req.slotDuration
+    team_ref = db.collection('teams').document()
+    team = {
+        'teamId': team_ref.id,
+        'name': req.name,
+        'ownerUserId': current_user_id,
+        'memberUserIds': member_ids,
+        'mode': req.mode,
+        'settings': settings,
+        'sharedFreeBusy': req.sharedFreeBusy,
+        'publicUrlToken': base64.urlsafe_b64encode(os.urandom(16)).decode(),
+        'createdAt': firestore.SERVER_TIMESTAMP,
+    }
+    team_ref.set(team)
+    return {key: team[key] for key in ('teamId', 'name', 'mode', 'memberUserIds', 'publicUrlToken')}
+
+
+@app.get("/api/teams")
+def list_teams(current_user_id: str = Depends(get_current_user)):
+    """Teams owned by the current user."""
+    if not db:
+        raise HTTPException(status_code=500, detail="Firestore client not available.")
+    query = db.collection('teams').where(filter=firestore.FieldFilter("ownerUserId", "==", current_user_id))
+    return [{key: team_doc.to_dict().get(key) for key in ('teamId', 'name', 'mode', 'memberUserIds', 'publicUrlToken')}
+            for team_doc in query.stream()]
+
+
+def check_team_members(team_data: dict, members: Dict[str, dict]):
+    """A collective team needs every member's calendar; round robin makes do with the connected ones."""
+    connected = [user_id for user_id, user_data in members.items() if user_data.get('encryptedRefreshToken')]
+    if team_data['mode'] == TEAM_MODE_COLLECTIVE and len(connected) < len(team_data['memberUserIds']):
+        raise HTTPException(status_code=400, detail="Not every team member has connected a calendar.")
+    if not connected:
+        raise HTTPException(status_code=400, detail="No team member has connected a calendar.")
+    return {user_id: members[user_id] for user_id in connected}
+
+
+async def fetch_team_busy(team_data: dict, members: Dict[str, dict], time_min: datetime, time_max: datetime):
+    """Merged busy intervals (POSIX timestamps) of every member, by user ID."""
+    if team_data.get('sharedFreeBusy'):
+        # One freebusy query per 50 members, run with the owner's token against the members' addresses.
+        owner_id = team_data['ownerUserId']
+        by_calendar = await calendar_client.fetch_busy_times_by_calendar(
+            calendar_pool.credentials(owner_id, members[owner_id]),
+            [user_data['email'] for user_data in members.values()], time_min, time_max, owner=owner_id)
+        await save_refreshed_token_async(owner_id)
+        busy = {user_id: by_calendar[user_data['email']] for user_id, user_data in members.items()}
+    else:
+        async def member_busy(user_id, user_data):
+            intervals = await calendar_client.fetch_busy_times(
+                calendar_pool.credentials(user_id, user_data), time_min, time_max,
+                calendar_ids=calendar_ids_of(user_data.get('settings')), owner=user_id)
+            await save_refreshed_token_async(user_id)
+            return intervals
+
+        results = await asyncio.gather(*(member_busy(user_id, user_data) for user_id, user_data in members.items()))
+        busy = dict(zip(members, results))
+    return {user_id: merge_intervals((start.timestamp(), end.timestamp()) for start, end in intervals)
+            for user_id, intervals in busy.items()}
+
+
+@app.get("/api/teams/public/{token}/slots")
+async def get_team_availability(
+    token: str,
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    cursor: Optional[str] = None,
+    limit: int = Query(AVAILABILITY_PAGE_SIZE, ge=1, le=AVAILABILITY_MAX_PAGE_SIZE),
+):
+    """
+    Free slots of a team page, computed like GET /api/slots/public/{token}/availability.
+
+    Collective teams show slots where every member is free, round-robin teams
+    slots where at least one member is.
+    """
+    if not async_db:
+        raise HTTPException(status_code=500, detail="Firestore client not available.")
+
+    try:
+        team = await find_team_by_public_token(token)
+        if not team:
+            raise HTTPException(status_code=404, detail="Team booking page not found.")
+        team_id, team_data, members = team
+        members = check_team_members(team_data, members)
+
+        slot_settings = SlotSettings.from_user_settings(team_data.get('settings', {}))
+        now = datetime.now(slot_settings.timezone)
+        date_from, date_to = availability_range(date_from, date_to, now.date())
+
+        async def fetch_busy(time_min, time_max):
+            busy_by_host = await fetch_team_busy(team_data, members, time_min, time_max)
+            return [[(datetime.fromtimestamp(start, timezone.utc), datetime.fromtimestamp(end, timezone.utc))
+                     for start, end in busy] for busy in busy_by_host.values()]
+
+        try:
+            slots, next_cursor = await availability_page(fetch_busy, slot_settings, date_from, date_to, now,
+                                                          cursor=cursor, limit=limit, team_mode=team_data['mode'])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        return JSONResponse({
+            "teamName": team_data.get('name'),
+            "mode": team_data['mode'],
+            "timezone": slot_settings.timezone.zone,
+            "duration": slot_settings.slot_duration_minutes,
+            "slots": slots,
+            "nextCursor": next_cursor,
+        })
+
+    except HTTPException:
+        raise
+    except FreeBusyCalendarError as error:
+        raise HTTPException(status_code=500, detail=f"Cannot read the team's calendars: {error}")
+    except HttpError as error:
+        print(f'An error occurred: {error}')
+        raise HTTPException(status_code=500, detail=f"Google Calendar API error: {error}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
+
+
+def stored_team_booking_response(booking_id: str, booking: dict, slot_start: datetime):
+    """The response to a team booking request whose booking already exists."""
+    if datetime.fromisoformat(booking['slotId']) != slot_start:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for another booking.")
+    if booking.get('status', BOOKING_CONFIRMED) == BOOKING_PENDING:
+        return accepted_booking(booking_id)
+    response = {**confirmed_booking(booking_id, booking), "hostUserIds": booking['memberUserIds']}
+    booking_results.set(booking_id, (booking['slotId'], response))
+    return response
+
+
+@app.post("/api/teams/public/{token}/bookings")
+async def create_team_booking(token: str, req: TeamBookingRequest,
+                              idempotency_key: Optional[str] = Header(None, max_length=255)):
+    """
+    Books a team slot. Retries are safe, as with POST /api/bookings.
+
+    Collective bookings reserve the slot for every member and invite them all
+    to one event on the owner's calendar. Round-robin bookings go to the free
+    member with the fewest assignments so far.
+    """
+    if not async_db:
+        raise HTTPException(status_code=500, detail="Firestore client not available.")
+
+    try:
+        team = await find_team_by_public_token(token)
+        if not team:
+            raise HTTPException(status_code=404, detail="Team booking page not found.")
+        team_id, team_data, members = team
+        members = check_team_members(team_data, members)
+        mode = team_data['mode']
+
+        slot_settings = SlotSettings.from_user_settings(team_data.get('settings', {}))
+        now = datetime.now(slot_settings.timezone)
+        try:
+            slot_start = datetime.fromisoformat(req.slotId)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid slot ID.")
+        if slot_start.tzinfo is None:
+            raise HTTPException(status_code=400, detail="Invalid slot ID.")
+
+        # Looked up before the slot is re-checked: once booked, it is no longer available.
+        request_id = f"{req.slotId}-{req.bookerEmail}"
+        booking_id = booking_id_for(BOOKING_ID_SECRET, f"teams/{team_id}", idempotency_key or request_id)
+        stored = booking_results.get(booking_id)
+        if stored is not None:
+            if datetime.fromisoformat(stored[0]) != slot_start:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used for another booking.")
+            return stored[1]
+        booking_ref = async_db.collection('bookings').document(booking_id)
+        with span('firestore.get_booking'):
+            booking = existing_booking(await booking_ref.get())
+        if booking is not None:
+            return stored_team_booking_response(booking_id, booking, slot_start)
+
+        # Re-check the slot against the members' calendars for its day.
+        day = slot_start.astimezone(slot_settings.timezone).date()
+        day_start = slot_settings.timezone.localize(datetime.combine(day, datetime.min.time()))
+        busy_by_host = await fetch_team_busy(team_data, members, day_start, day_start + timedelta(days=1))
+        slot = next((slot for slot in iter_team_slots(list(busy_by_host.values()), mode, slot_settings, [day],
+                                                      now.timestamp())
+                     if datetime.fromisoformat(slot['startTime']) == slot_start), None)
+        if slot is None:
+            raise HTTPException(status_code=409, detail="Slot is no longer available.")
+
+        owner_id = team_data['ownerUserId']
+        if mode == TEAM_MODE_COLLECTIVE:
+            candidates = [owner_id] + [user_id for user_id in members if user_id != owner_id]
+        else:
+            slot_end = datetime.fromisoformat(slot['endTime'])
+            free = free_hosts(busy_by_host, slot_start.timestamp(), slot_end.timestamp())
+            candidates = assignment_order(free, await read_assignments_async(async_db, team_id))
+
+        timezones = {user_id: SlotSettings.from_user_settings(members[user_id].get('settings', {})).timezone
+                     for user_id in candidates}
+        # Every attempt gets its own event ID: Calendar keeps deleted events' IDs taken.
+        event_id = uuid.uuid4().hex
+        pending_booking = lambda host_ids: {
+            'bookingId': booking_id,
+            'teamId': team_id,
+            'hostUserId': host_ids[0],
+            'memberUserIds': host_ids,
+            'slotId': slot['slotId'],
+            'startTime': slot['startTime'],
+            'endTime': slot['endTime'],
+            'bookerName': req.bookerName,
+            'bookerEmail': req.bookerEmail,
+            'requestId': request_id,
+            'eventId': event_id,
+            'status': BOOKING_PENDING,
+            'createdAt': firestore.SERVER_TIMESTAMP,
+        }
+        try:
+            host_ids = await reserve_team_slot_async(async_db, team_id, mode, slot, candidates, timezones,
+                                                     booking_ref, pending_booking)
+        except ValueError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except DuplicateBookingError as duplicate:
+            return stored_team_booking_response(booking_id, duplicate.booking, slot_start)
+
+        organizer_id = host_ids[0]
+        event_body = booking_event_body(members[organizer_id], slot['startTime'], slot['endTime'],
+                                        req.bookerName, req.bookerEmail, request_id)
+        event_body['summary'] = f"{team_data['name']} with {req.bookerName}"
+        event_body['attendees'] += [{'email': members[user_id].get('email')} for user_id in host_ids[1:]]
+        event_body['id'] = event_id
+        try:
+            created_event = await calendar_client.insert_event(
+                calendar_pool.credentials(organizer_id, members[organizer_id]), 'primary', event_body,
+                conference_data_version=1)
+        except Exception as e:
+            await release_team_slot_async(async_db, team_id, mode, slot['startTime'], host_ids, booking_ref, {
+                'status': BOOKING_FAILED, 'error': str(e), 'updatedAt': firestore.SERVER_TIMESTAMP})
+            raise
+        await save_refreshed_token_async(organizer_id)
+        for user_id in host_ids:
+            invalidate_busy_times(user_id)
+        if team_data.get('sharedFreeBusy'):
+            invalidate_busy_times(owner_id)
+
+        await booking_ref.update({
+            'status': BOOKING_CONFIRMED,
+            'eventId': created_event.get('id'),
+            'googleMeetUrl': created_event.get('hangoutLink'),
+            'updatedAt': firestore.SERVER_TIMESTAMP,
+        })
+        response = {"message": "Booking successful!", "bookingId": booking_id, "hostUserIds": host_ids,
+                    "event_details": created_event}
+        booking_results.set(booking_id, (slot['slotId'], response))
+        return response
+
+    except HTTPException:
+        raise
+    except FreeBusyCalendarError as error:
+        raise HTTPException(status_code=500, detail=f"Cannot read the team's calendars: {error}")
+    except HttpError as error:
+        print(f'An error occurred: {error}')
+        raise HTTPException(status_code=500, detail=f"Google Calendar API error: {error}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
+
+
+def require_metrics_token(authorization: Optional[str] = Header(None)):
+    """Lets requests with METRICS_TOKEN through; without METRICS_TOKEN the operational endpoints are off."""
+    if not metrics_token_valid(authorization):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+
+@app.get("/api/cache/stats", dependencies=[Depends(require_metrics_token)])
+def get_cache_stats():
+    return {
+        "publicUsers": public_user_cache.stats(),
+        "slots": slots_cache.stats(),
+        "slotEvents": slot_event_hub.channel_stats(),
+        "calendarServices": calendar_pool.stats(),
+        "busyTimes": busy_cache.stats(),
+        "publicTeams": public_team_cache.stats(),
+        "authTokens": verified_tokens.stats(),
+        "userProfiles": user_profiles.stats(),
+        "authReads": auth_read_stats(),
+        "decryptedTokens": {**decrypted_tokens.stats(), 'decrypts': token_stats['decrypts']},
+        "tokenWrites": {**token_writes.stats, 'pending': token_writes.pending()},
+    }
+
+
+# Process-wide counters of the caches and the booking queue, exported next to the request timings.
+METRIC_CACHES = {
+    'public_users': public_user_cache,
+    'slots': slots_cache,
+    'busy_times': busy_cache,
+    'public_teams': public_team_cache,
+    'auth_tokens': verified_tokens,
+    'user_profiles': user_profiles,
+    'booking_results': booking_results,
+    'decrypted_tokens': decrypted_tokens,
+}
+GaugeCallback('schedule_sync_cache_hits_total', 'Cache lookups that found an entry.', ('cache',),
+              lambda: {(name,): cache.hits for name, cache in METRIC_CACHES.items()}, type='counter')
+GaugeCallback('schedule_sync_cache_misses_total', 'Cache lookups that found no entry.', ('cache',),
+              lambda: {(name,): cache.misses for name, cache in METRIC_CACHES.items()}, type='counter')
+GaugeCallback('schedule_sync_cache_entries', 'Entries held by a cache.', ('cache',),
+              lambda: {(name,): cache.stats()['size'] for name, cache in METRIC_CACHES.items()})
+GaugeCallback('schedule_sync_bookings_total', 'Queued booking jobs by outcome.', ('outcome',),
+              lambda: {(outcome,): count for outcome, count in booking_queue.stats.items()}, type='counter')
+GaugeCallback('schedule_sync_authenticated_requests_total', 'Requests with a valid bearer token.', (),
+              lambda: {(): auth_read_stats()['requests']}, type='counter')
+GaugeCallback('schedule_sync_token_decryptions_total', 'OAuth tokens decrypted, cache hits excluded.', (),
+              lambda: {(): token_stats['decrypts']}, type='counter')
+GaugeCallback('schedule_sync_token_writes_total', 'Refreshed access tokens by write-back outcome.', ('outcome',),
+              lambda: {(outcome,): count for outcome, count in token_writes.stats.items()}, type='counter')
+GaugeCallback('schedule_sync_user_document_reads_total', 'User documents read for signed-in users.', (),
+              lambda: {(): auth_read_stats()['userReads']}, type='counter')
+
+
+@app.get("/metrics", dependencies=[Depends(require_metrics_token)])
+def get_metrics():
+    """Request timings, span timings and counters in the Prometheus text format; see `metrics`."""
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.get("/api/auth/login")
 def auth_login():
     if not client_config:
@@ -385,7 +1300,7 @@ def auth_login():
 
 @app.get("/api/auth/callback")
 def auth_callback(request: Request):
-    if not all([client_config, db, f_key]):
+    if not all([client_config, db, token_cipher]):
         raise HTTPException(status_code=500, detail="Server is not properly configured.")
 
     flow = Flow.from_client_config(client_config, scopes=SCOPES, redirect_uri=REDIRECT_URI)
@@ -414,7 +1329,7 @@ def auth_callback(request: Request):
         user_data = {
             'userId': user_id,
             'email': user_email,
-            'encryptedAccessToken': encrypt_token(credentials.token),
+            **access_token_fields(credentials),
             'updatedAt': firestore.SERVER_TIMESTAMP,
         }
         if credentials.refresh_token:
@@ -437,7 +1352,12 @@ def auth_callback(request: Request):
             user_data['createdAt'] = firestore.SERVER_TIMESTAMP
             user_data['publicUrlToken'] = base64.urlsafe_b64encode(os.urandom(16)).decode()
 
+        # A refreshed token still queued would replace the one just received.
+        token_writes.discard(user_id)
         user_ref.set(user_data, merge=True)
+        invalidate_public_user(user_id)
+        invalidate_user_profile(user_id)
+        calendar_pool.invalidate(user_id)
 
         access_token_expires = timedelta(minutes=60)
         now = datetime.utcnow()
@@ -466,17 +1386,8 @@ def read_root():
     return {"message": "Welcome to the Schedule Sync API"}
 
 @app.get("/api/user/me/settings", response_model=UserSettings)
-def get_user_settings(current_user_id: str = Depends(get_current_user)):
-    if not db:
-        raise HTTPException(status_code=500, detail="Firestore client not available.")
-    
-    user_ref = db.collection('users').document(current_user_id)
-    user_doc = user_ref.get()
-    if not user_doc.exists:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    user_data = user_doc.to_dict()
-    settings = user_data.get("settings")
+def get_user_settings(user: UserContext = Depends(current_user_context)):
+    settings = user.data.get("settings")
     if not settings:
         raise HTTPException(status_code=404, detail="Settings not found for user.")
         
@@ -488,22 +1399,23 @@ def update_user_settings(settings: UserSettings, current_user_id: str = Depends(
         raise HTTPException(status_code=500, detail="Firestore client not available.")
     
     user_ref = db.collection('users').document(current_user_id)
-    # Use merge=True to update only the settings field
-    user_ref.set({'settings': settings.dict()}, merge=True)
+    # Field paths replace each setting as a whole (set with merge=True would merge nested maps like
+    # weeklyHours) and leave settings this model does not cover, e.g. timezone, alone.
+    # Optional settings left out are removed, so hosts can go back to workingHours or primary only.
+    try:
+        user_ref.update({f'settings.{name}': firestore.DELETE_FIELD if value is None else value
+                         for name, value in settings.model_dump().items()})
+    except google_exceptions.NotFound:
+        # update needs an existing document; without one there is nothing to keep or clear.
+        user_ref.set({'settings': settings.model_dump(exclude_none=True)}, merge=True)
+    invalidate_public_user(current_user_id)
+    invalidate_user_profile(current_user_id)
     
     return
 
 @app.get("/api/user/me", response_model=dict)
-def read_user_me(current_user_id: str = Depends(get_current_user)):
-    if not db:
-        raise HTTPException(status_code=500, detail="Firestore client not available.")
-    
-    user_ref = db.collection('users').document(current_user_id)
-    user_doc = user_ref.get()
-    if not user_doc.exists:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    user_data = user_doc.to_dict()
+def read_user_me(user: UserContext = Depends(current_user_context)):
+    user_data = user.data
     # Return a subset of user data, excluding sensitive info
     return {
         "userId": user_data.get('userId'),
@@ -0,0 +1,325 @@
+"""
+In-process performance metrics, served in the Prometheus text format.
+
+`RequestMetricsMiddleware` times every request by route. `span(name)` (or
+`@traced(name)`) times one step inside it: a Firestore operation, a Calendar
+API call, token decryption or refresh, the slot computation. Spans feed the
+`schedule_sync_span_seconds` histogram. `render_metrics` produces what GET
+/metrics serves; no client library or collector is needed, Prometheus (or
+curl) just scrapes it. GET /metrics and GET /api/cache/stats are only served
+with METRICS_TOKEN set, to requests sent with `Authorization: Bearer <token>`.
+
+A request's spans are also sent back in its `Server-Timing` header. They
+tell how long Firestore and Calendar calls took, so by default (SERVER_TIMING
+`signed-in`) only requests of a signed-in user (`allow_server_timing`) and
+profiled requests get it; `all` sends it on every response, `off` on none.
+
+With PROFILE_REQUESTS_KEY set, a request sent with `X-Profile: <key>` is also
+profiled: a background thread samples every thread's stack each
+PROFILE_INTERVAL_SECONDS while it runs, and the folded stacks (the input of
+flame graph tools) are written to PROFILE_DIR. The sampler sees the whole
+process, so requests running at the same time show up too.
+"""
+import asyncio
+import functools
+import hmac
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as _Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+PROFILE_REQUESTS_KEY = os.getenv("PROFILE_REQUESTS_KEY")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+SERVER_TIMING = os.getenv("SERVER_TIMING", "signed-in")  # all, signed-in or off
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_SECONDS", "0.005"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", tempfile.gettempdir())
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing count per label set."""
+
+    def __init__(self, name: str, help: str, label_names: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._values = _Counter()
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def value(self, *label_values: str) -> float:
+        with self._lock:
+            return self._values[label_values]
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"] + [
+            f"{self.name}{_labels(self.label_names, labels)} {_number(value)}" for labels, value in values]
+
+
+class Histogram:
+    """Observations per label set, counted into cumulative `le` buckets."""
+
+    def __init__(self, name: str, help: str, label_names: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [count per bucket..., count above the last bucket, sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, *label_values: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, *label_values: str) -> int:
+        with self._lock:
+            series = self._series.get(label_values)
+            return sum(series[:-1]) if series else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series_items = sorted((labels, list(series)) for labels, series in self._series.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in series_items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series[:-1]):
+                cumulative += count
+                bucket = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, bucket)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class GaugeCallback:
+    """A gauge read from `collect()` at scrape time, e.g. the size of a cache."""
+
+    def __init__(self, name: str, help: str, label_names: Iterable[str],
+                 collect: Callable[[], Dict[Tuple[str, ...], float]], type: str = 'gauge'):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.type = type
+        self._collect = collect
+        _registry.append(self)
+
+    def render(self) -> List[str]:
+        values = sorted((labels, value) for labels, value in self._collect().items() if value is not None)
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"] + [
+            f"{self.name}{_labels(self.label_names, labels)} {_number(value)}" for labels, value in values]
+
+
+def render_metrics() -> str:
+    return '\n'.join(line for metric in _registry for line in metric.render()) + '\n'
+
+
+request_seconds = Histogram('schedule_sync_http_request_duration_seconds',
+                            'Time from receiving a request to sending the end of its response.',
+                            ('method', 'route', 'status'))
+span_seconds = Histogram('schedule_sync_span_seconds',
+                         'Time spent in one step of a request: a Firestore operation, a Calendar call, ...',
+                         ('span',))
+span_errors = Counter('schedule_sync_span_errors_total', 'Spans that ended with an exception.', ('span',))
+profiled_requests = Counter('schedule_sync_profiled_requests_total', 'Requests run under the stack sampler.')
+
+# The spans of the current request: name -> [count, seconds].
+_request_spans = ContextVar('request_spans', default=None)
+# Whether the current request gets `Server-Timing`, in a list that dependencies run in threads can set.
+_request_timing = ContextVar('request_timing', default=None)
+
+
+def allow_server_timing():
+    """Lets the current request have `Server-Timing` (unless SERVER_TIMING is `off`)."""
+    timing = _request_timing.get()
+    if timing is not None and SERVER_TIMING != 'off':
+        timing[0] = True
+
+
+def metrics_token_valid(authorization: Optional[str]) -> bool:
+    """Whether an Authorization header carries METRICS_TOKEN. Always false without METRICS_TOKEN."""
+    if not METRICS_TOKEN or not authorization:
+        return False
+    return hmac.compare_digest(authorization.encode(), f"Bearer {METRICS_TOKEN}".encode())
+
+
+@contextmanager
+def span(name: str):
+    """Times the enclosed block as span `name`."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        span_errors.inc(name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        span_seconds.observe(elapsed, name)
+        spans = _request_spans.get()
+        if spans is not None:
+            totals = spans.setdefault(name, [0, 0.0])
+            totals[0] += 1
+            totals[1] += elapsed
+
+
+def traced(name: str):
+    """Decorator running every call of a function, sync or async, as span `name`."""
+    def decorate(function):
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def server_timing(spans: Dict[str, list], total: float) -> str:
+    """A `Server-Timing` header value: each span's total milliseconds, then the whole request's."""
+    entries = [f'{name};dur={seconds * 1000:.1f};desc="x{count}"' for name, (count, seconds) in spans.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ', '.join(entries)
+
+
+class StackSampler:
+    """Counts the folded stacks of every other thread, sampled every `interval` seconds."""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL_SECONDS):
+        self.interval = interval
+        self.samples = _Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self) -> 'StackSampler':
+        self._thread.start()
+        return self
+
+    def stop(self) -> _Counter:
+        self._stopped.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self):
+        own_id = threading.get_ident()
+        thread_names = {}
+        while not self._stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if thread_id not in thread_names:
+                    thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                self.samples[';'.join(reversed(stack))] += 1
+
+
+def _profile_requested(scope) -> bool:
+    if not PROFILE_REQUESTS_KEY:
+        return False
+    for name, value in scope.get('headers', ()):
+        if name == b'x-profile':
+            return hmac.compare_digest(value, PROFILE_REQUESTS_KEY.encode())
+    return False
+
+
+def write_profile(samples: _Counter, method: str, route: str) -> str:
+    """Writes folded stacks to PROFILE_DIR and returns the file's path."""
+    name = f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{method}-{route.strip('/').replace('/', '_') or 'root'}"
+    path = os.path.join(PROFILE_DIR, f"{name}-{os.getpid()}-{threading.get_ident()}.folded")
+    with open(path, 'w') as profile:
+        profile.writelines(f"{stack} {count}\n" for stack, count in samples.most_common())
+    return path
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware recording request latency by route template and sending `Server-Timing`."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        spans = {}
+        token = _request_spans.set(spans)
+        sampler = StackSampler().start() if _profile_requested(scope) else None
+        timing_allowed = [SERVER_TIMING == 'all' or (sampler is not None and SERVER_TIMING != 'off')]
+        timing_token = _request_timing.set(timing_allowed)
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                if timing_allowed[0]:
+                    timing = server_timing(spans, time.perf_counter() - started)
+                    message = {**message,
+                               'headers': [*message.get('headers', ()), (b'server-timing', timing.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timing.reset(timing_token)
+            _request_spans.reset(token)
+            route = scope.get('route')
+            # Unmatched paths share one label, so that scanners cannot create series at will.
+            route_path = getattr(route, 'path', 'unmatched')
+            request_seconds.observe(time.perf_counter() - started, scope['method'], route_path, str(status_code))
+            if sampler is not None:
+                samples = sampler.stop()
+                profiled_requests.inc()
+                path = await asyncio.to_thread(write_profile, samples, scope['method'], route_path)
+                print(f"Profiled {scope['method']} {scope['path']}: {sum(samples.values())} samples in {path}")
@@ -0,0 +1,25 @@
+"""
+Moves every user's legacy `slots/{userId}.slots` array into per-day slot documents.
+
+Usage (with the same environment as the API server):
+    python migrate_slots.py
+"""
+from dotenv import load_dotenv
+from google.cloud import firestore
+
+from slot_store import migrate_legacy_slots
+
+
+def main():
+    load_dotenv()
+    db = firestore.Client()
+    migrated = 0
+    for slots_doc in db.collection('slots').stream():
+        if migrate_legacy_slots(db, slots_doc.id):
+            migrated += 1
+            print(f"Migrated slots of {slots_doc.id}")
+    print(f"Done. Migrated {migrated} users.")
+
+
+if __name__ == "__main__":
+    main()
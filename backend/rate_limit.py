@@ -0,0 +1,71 @@
+import threading
+import time
+from typing import Callable, Hashable, Optional
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket: `rate` tokens per second, holding at most `capacity`.
+
+    `acquire` blocks until a token is available, so callers on any number of
+    threads together stay at or below `rate` requests per second after an
+    initial burst of up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+        self.waited_seconds = 0.0
+
+    def _reserve(self, tokens: float) -> float:
+        """Takes `tokens` (possibly going negative) and returns how long to wait for them."""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.waited_seconds += wait
+            return wait
+
+    def acquire(self, tokens: float = 1.0):
+        wait = self._reserve(tokens)
+        if wait > 0:
+            self._sleep(wait)
+
+
+class KeyedRateLimiter:
+    """One `TokenBucket` per key, e.g. per Google Cloud project whose API quota is shared."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, key: Hashable) -> TokenBucket:
+        with self._lock:
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(self.rate, self.capacity)
+            return self._buckets[key]
+
+    def acquire(self, key: Hashable, tokens: float = 1.0):
+        self.bucket(key).acquire(tokens)
+
+    def waited_seconds(self) -> float:
+        """Total time callers were held back, across all keys."""
+        with self._lock:
+            return sum(bucket.waited_seconds for bucket in self._buckets.values())
+
+
+def google_project_of(client_id: Optional[str]) -> str:
+    """The Cloud project number an OAuth client ID ("<number>-<hash>.apps.googleusercontent.com") belongs to."""
+    if not client_id:
+        return 'default'
+    return client_id.split('-', 1)[0]
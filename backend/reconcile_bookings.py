@@ -0,0 +1,196 @@
+"""
+Repairs bookings that a crash or a lost response left half done.
+
+A booking reserves its slot and writes its record in one transaction, then
+creates the Calendar event and confirms the record. Anything can stop in
+between, and processes from before booking records were written with the slot
+may have left booked slots without any record. `reconcile_bookings_async`
+finds and fixes:
+
+- Pending bookings older than RECONCILE_GRACE_SECONDS: handed back to the
+  booking queue, which creates their event (idempotently) or fails them.
+- Failed bookings of the last RECONCILE_LOOKBACK_SECONDS whose event exists
+  after all (the insert went through but its response was lost): the booker
+  was told the booking failed, so the event is deleted.
+- Booked slots without a pending or confirmed booking or a team
+  reservation: the record is recovered from the host's event at that time if
+  there is one with a guest; otherwise the slot is released.
+
+The API server runs it every RECONCILE_INTERVAL_SECONDS. Slots still in the
+legacy header array are left to the migration. Querying failed bookings by
+`updatedAt` needs a composite index on (status, updatedAt).
+"""
+import os
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from google.cloud import firestore
+from googleapiclient.errors import HttpError
+
+from async_slot_store import release_slot_async
+from booking_queue import BOOKING_CONFIRMED, BOOKING_FAILED, BOOKING_PENDING
+from slot_store import day_bucket_slots, slot_days_ref
+
+RECONCILE_INTERVAL_SECONDS = float(os.getenv("RECONCILE_INTERVAL_SECONDS", "600"))  # 0 turns it off
+RECONCILE_GRACE_SECONDS = float(os.getenv("RECONCILE_GRACE_SECONDS", "600"))
+RECONCILE_LOOKBACK_SECONDS = float(os.getenv("RECONCILE_LOOKBACK_SECONDS", str(24 * 60 * 60)))
+
+CredentialsFor = Callable[[str, dict], object]
+
+
+def _started_before(timestamp: Optional[datetime], cutoff: datetime) -> bool:
+    # A missing timestamp means the write predates the field; old enough.
+    return timestamp is None or timestamp <= cutoff
+
+
+async def resume_stale_bookings(db, finish_booking: Callable[[str], None], cutoff: datetime) -> int:
+    """Hands pending bookings created before `cutoff` to `finish_booking`. Team bookings are left alone."""
+    resumed = 0
+    query = db.collection('bookings').where(filter=firestore.FieldFilter('status', '==', BOOKING_PENDING))
+    async for booking_doc in query.stream():
+        booking = booking_doc.to_dict()
+        if 'teamId' not in booking and _started_before(booking.get('createdAt'), cutoff):
+            finish_booking(booking_doc.id)
+            resumed += 1
+    return resumed
+
+
+async def delete_events_of_failed_bookings(db, calendar_client, credentials_for: CredentialsFor,
+                                           since: datetime) -> int:
+    """Deletes Calendar events that exist for bookings which failed after `since`."""
+    deleted = 0
+    hosts = {}
+    query = (db.collection('bookings')
+             .where(filter=firestore.FieldFilter('status', '==', BOOKING_FAILED))
+             .where(filter=firestore.FieldFilter('updatedAt', '>=', since)))
+    async for booking_doc in query.stream():
+        booking = booking_doc.to_dict()
+        host_user_id = booking['hostUserId']
+        if host_user_id not in hosts:
+            host_doc = await db.collection('users').document(host_user_id).get()
+            hosts[host_user_id] = host_doc.to_dict() if host_doc.exists else None
+        if hosts[host_user_id] is None:
+            continue
+        # Bookings without an eventId predate per-attempt event IDs; their event ID is the booking ID.
+        event_id = booking.get('eventId', booking_doc.id)
+        try:
+            credentials = credentials_for(host_user_id, hosts[host_user_id])
+            event = await calendar_client.get_event(credentials, 'primary', event_id)
+            if event.get('status') == 'cancelled':
+                continue
+            await calendar_client.delete_event(credentials, 'primary', event_id)
+            deleted += 1
+        except HttpError as error:
+            if error.resp.status not in (404, 410):
+                print(f"ERROR while checking the event of failed booking {booking_doc.id}: {error}")
+        except Exception as e:
+            print(f"ERROR while checking the event of failed booking {booking_doc.id}: {e}")
+    return deleted
+
+
+def _booking_from_event(event: dict, user_id: str, host_email: Optional[str], slot: dict) -> Optional[dict]:
+    """The booking record an event of our booking flow stands for, if the event has a guest."""
+    guest = next((attendee for attendee in event.get('attendees', [])
+                  if attendee.get('email') and attendee.get('email') != host_email), None)
+    if guest is None:
+        return None
+    create_request = event.get('conferenceData', {}).get('createRequest', {})
+    return {
+        'bookingId': event['id'],
+        'hostUserId': user_id,
+        'slotId': slot['slotId'],
+        'startTime': slot['startTime'],
+        'endTime': slot['endTime'],
+        'bookerName': guest.get('displayName') or guest['email'],
+        'bookerEmail': guest['email'],
+        'requestId': create_request.get('requestId', f"{slot['slotId']}-{guest['email']}"),
+        'status': BOOKING_CONFIRMED,
+        'eventId': event['id'],
+        'googleMeetUrl': event.get('hangoutLink'),
+        'recovered': True,
+        'createdAt': firestore.SERVER_TIMESTAMP,
+    }
+
+
+async def reconcile_host_slots(db, calendar_client, credentials_for: CredentialsFor, user_id: str,
+                               user_data: dict, now: datetime, cutoff: datetime) -> Counter:
+    """
+    Recovers or releases a host's upcoming booked slots that have no live booking.
+
+    Days written after `cutoff` are skipped, in case a booking on them is
+    still in flight in a process that writes the record after the event.
+    """
+    stats = Counter()
+    live_slot_ids = set()
+    query = db.collection('bookings').where(filter=firestore.FieldFilter('hostUserId', '==', user_id))
+    async for booking_doc in query.stream():
+        booking = booking_doc.to_dict()
+        # Bookings made before booking statuses existed were always confirmed.
+        if 'teamId' not in booking and booking.get('status', BOOKING_CONFIRMED) != BOOKING_FAILED:
+            live_slot_ids.add(booking.get('slotId'))
+    # Team bookings mark the member's personal slots booked and list them in the member's reservation.
+    reservations_ref = db.collection('users').document(user_id).collection('teamReservations')
+    async for reservation_doc in reservations_ref.stream():
+        live_slot_ids.update(reservation_doc.to_dict().get('slotIds', []))
+
+    orphans = []
+    async for day_doc in slot_days_ref(db, user_id).stream():
+        day_data = day_doc.to_dict()
+        if not _started_before(day_data.get('updatedAt'), cutoff):
+            continue
+        orphans.extend(slot for slot in day_bucket_slots(day_data).values()
+                       if slot['status'] == 'booked' and slot['slotId'] not in live_slot_ids
+                       and datetime.fromisoformat(slot['endTime']) > now)
+    if not orphans:
+        return stats
+
+    credentials = credentials_for(user_id, user_data)
+    for slot in orphans:
+        slot_start = datetime.fromisoformat(slot['startTime'])
+        events = await calendar_client.list_events(credentials, 'primary', slot_start,
+                                                   datetime.fromisoformat(slot['endTime']))
+        recovered = None
+        for event in events:
+            start = event.get('start', {}).get('dateTime')
+            if event.get('status') != 'cancelled' and start and datetime.fromisoformat(
+                    start.replace('Z', '+00:00')) == slot_start:
+                recovered = _booking_from_event(event, user_id, user_data.get('email'), slot)
+                if recovered:
+                    break
+        if recovered:
+            await db.collection('bookings').document(recovered['bookingId']).set(recovered)
+            stats['recovered'] += 1
+        elif await release_slot_async(db, user_id, slot['slotId'], None):
+            stats['released'] += 1
+    return stats
+
+
+async def reconcile_bookings_async(db, calendar_client, credentials_for: CredentialsFor,
+                                   finish_booking: Callable[[str], None], now: Optional[datetime] = None,
+                                   grace_seconds: float = RECONCILE_GRACE_SECONDS) -> Counter:
+    """
+    One reconciliation pass over every booking and host.
+
+    Args:
+        credentials_for: Returns Calendar credentials for (user ID, user data).
+        finish_booking: Finishes a pending booking, e.g. `BookingQueue.enqueue`.
+        grace_seconds: How long a pending booking or a written day is left alone.
+
+    Returns:
+        Counts of `resumed` bookings, `events_deleted`, `recovered` records, `released` slots and host `errors`.
+    """
+    now = now or datetime.now(timezone.utc)
+    cutoff = now - timedelta(seconds=grace_seconds)
+    stats = Counter()
+    stats['resumed'] = await resume_stale_bookings(db, finish_booking, cutoff)
+    stats['events_deleted'] = await delete_events_of_failed_bookings(
+        db, calendar_client, credentials_for, now - timedelta(seconds=RECONCILE_LOOKBACK_SECONDS))
+    async for user_doc in db.collection('users').stream():
+        try:
+            stats.update(await reconcile_host_slots(db, calendar_client, credentials_for, user_doc.id,
+                                                    user_doc.to_dict(), now, cutoff))
+        except Exception as e:
+            print(f"ERROR while reconciling the bookings of {user_doc.id}: {e}")
+            stats['errors'] += 1
+    return stats
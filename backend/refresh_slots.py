@@ -0,0 +1,233 @@
+"""
+Regenerates the slots of every connected host for the full horizon.
+
+Streams the `users` collection in pages ordered by document ID. For each page,
+freebusy is fetched on a bounded thread pool, with Calendar requests
+rate-limited per Google Cloud project. Slots are then computed in one batch
+(`batch_slots`), and the slot documents are written in transactions that each
+cover several hosts. Bookings are preserved as in any regeneration. After each
+page a checkpoint is written, so an interrupted run can resume where it
+stopped.
+
+Usage (with the same environment as the API server):
+    python refresh_slots.py [--workers 8] [--qps 20] [--checkpoint refresh_checkpoint.json]
+
+Against the Firestore emulator and the fake Calendar server
+(`python -m benchmarks.fake_calendar --port 8089`):
+    FIRESTORE_EMULATOR_HOST=localhost:8081 GOOGLE_CALENDAR_API_ENDPOINT=http://localhost:8089/ \\
+        python refresh_slots.py
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from batch_slots import HostAvailability, compute_available_slots_batch
+from booking_queue import is_transient_error
+from calendar_pool import CALENDAR_HTTP_TIMEOUT_SECONDS
+from calendar_sync import fetch_busy_times
+from freebusy import calendar_ids_of
+from rate_limit import KeyedRateLimiter, google_project_of
+from slot_engine import SLOT_HORIZON_DAYS, SlotSettings
+from slot_store import save_regenerated_slots_many
+
+REFRESH_PAGE_SIZE = 200
+REFRESH_WORKERS = 8
+REFRESH_QPS_PER_PROJECT = 20.0
+REFRESH_WRITE_BATCH = 25
+REFRESH_MAX_ATTEMPTS = 3
+
+
+def _error_kind(error: Exception) -> str:
+    if isinstance(error, HttpError):
+        return f"HttpError {error.resp.status}"
+    return type(error).__name__
+
+
+def load_checkpoint(path: Optional[str]) -> dict:
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def save_checkpoint(path: Optional[str], last_user_id: str, stats: Counter):
+    if not path:
+        return
+    # Write-then-rename so that an interrupted run never leaves a truncated checkpoint.
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'lastUserId': last_user_id, 'stats': stats}, f)
+    os.replace(path + '.tmp', path)
+
+
+class BulkRefresh:
+    """
+    Refreshes slots for every host.
+
+    Args:
+        db: A sync Firestore client.
+        calendar_pool: A `CalendarServicePool`; it provides the hosts' credentials.
+        save_token: Called with a user ID after its Calendar calls, to store refreshed tokens.
+        project_of: Maps a user document to the Google Cloud project whose quota its calls use.
+    """
+
+    def __init__(self, db, calendar_pool, save_token: Callable[[str], None] = lambda user_id: None,
+                 project_of: Callable[[dict], str] = lambda user_data: 'default',
+                 workers: int = REFRESH_WORKERS, qps: float = REFRESH_QPS_PER_PROJECT,
+                 page_size: int = REFRESH_PAGE_SIZE, write_batch: int = REFRESH_WRITE_BATCH,
+                 max_attempts: int = REFRESH_MAX_ATTEMPTS, checkpoint: Optional[str] = None):
+        self.db = db
+        self.calendar_pool = calendar_pool
+        self.save_token = save_token
+        self.project_of = project_of
+        self.workers = workers
+        self.limiter = KeyedRateLimiter(qps)
+        self.page_size = page_size
+        self.write_batch = write_batch
+        self.max_attempts = max_attempts
+        self.checkpoint = checkpoint
+        self.stats = Counter({key: 0 for key in (
+            'hosts', 'refreshed', 'skipped', 'failed', 'calendarRequests', 'retries', 'slots')})
+        self.errors = Counter()
+        self._stats_lock = threading.Lock()
+        self._thread_local = threading.local()
+
+    def _count(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def _pages(self, start_after: Optional[str]):
+        # '__name__' orders by document ID; the client turns an ID cursor into a document reference.
+        query = self.db.collection('users').order_by('__name__').limit(self.page_size)
+        while True:
+            page_query = query.start_after({'__name__': start_after}) if start_after else query
+            page = list(page_query.stream())
+            if not page:
+                return
+            yield page
+            start_after = page[-1].id
+
+    def _thread_http(self) -> httplib2.Http:
+        # Each host is visited once, so connections are kept per worker thread rather than per host.
+        if not hasattr(self._thread_local, 'http'):
+            self._thread_local.http = httplib2.Http(timeout=CALENDAR_HTTP_TIMEOUT_SECONDS)
+        return self._thread_local.http
+
+    def _fetch_availability(self, user_id: str, user_data: dict, now: datetime) -> HostAvailability:
+        slot_settings = SlotSettings.from_user_settings(user_data.get('settings', {}))
+        project = self.project_of(user_data)
+        for attempt in range(1, self.max_attempts + 1):
+            self.limiter.acquire(project)
+            self._count('calendarRequests')
+            try:
+                credentials = self.calendar_pool.credentials(user_id, user_data)
+                service = self.calendar_pool.build_service(credentials, http=self._thread_http())
+                busy_times = fetch_busy_times(service, now, now + timedelta(days=SLOT_HORIZON_DAYS),
+                                              calendar_ids_of(user_data.get('settings')))
+                self.save_token(user_id)
+                return HostAvailability(user_id, busy_times, slot_settings)
+            except Exception as e:
+                if attempt == self.max_attempts or not is_transient_error(e):
+                    raise
+                self._count('retries')
+                time.sleep(2 ** (attempt - 1))
+
+    def _refresh_page(self, executor, page, now: datetime):
+        hosts = []
+        for user_doc in page:
+            user_data = user_doc.to_dict()
+            if not user_data.get('encryptedRefreshToken'):
+                self.stats['skipped'] += 1
+                continue
+            hosts.append((user_doc.id, user_data))
+
+        futures = [(user_id, executor.submit(self._fetch_availability, user_id, user_data, now))
+                   for user_id, user_data in hosts]
+        availability = []
+        for user_id, future in futures:
+            try:
+                availability.append(future.result())
+            except Exception as e:
+                self.stats['failed'] += 1
+                self.errors[_error_kind(e)] += 1
+                print(f"ERROR refreshing slots of {user_id}: {e}")
+
+        slots_by_host = compute_available_slots_batch(availability, now)
+        for i in range(0, len(availability), self.write_batch):
+            chunk = availability[i:i + self.write_batch]
+            regenerated = {host.user_id: slots_by_host[host.user_id].to_dicts() for host in chunk}
+            try:
+                save_regenerated_slots_many(self.db, regenerated, now,
+                                            timezones={host.user_id: host.slot_settings.timezone for host in chunk})
+                self.stats['refreshed'] += len(chunk)
+                self.stats['slots'] += sum(len(slots) for slots in regenerated.values())
+            except Exception as e:
+                self.stats['failed'] += len(chunk)
+                self.errors[_error_kind(e)] += len(chunk)
+                print(f"ERROR writing slots of {len(chunk)} hosts: {e}")
+
+    def run(self, now: Optional[datetime] = None) -> dict:
+        """Refreshes every host, resuming from the checkpoint if there is one. Returns the metrics."""
+        now = now or datetime.now(timezone.utc)
+        state = load_checkpoint(self.checkpoint)
+        self.stats.update(state.get('stats', {}))
+        start_after = state.get('lastUserId')
+        if start_after:
+            print(f"Resuming after user {start_after}")
+
+        hosts_before = self.stats['hosts']
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for page_number, page in enumerate(self._pages(start_after), 1):
+                page_started = time.perf_counter()
+                self.stats['hosts'] += len(page)
+                self._refresh_page(executor, page, now)
+                save_checkpoint(self.checkpoint, page[-1].id, self.stats)
+                print(f"page {page_number}: {len(page)} hosts in {time.perf_counter() - page_started:.2f}s, "
+                      f"total refreshed={self.stats['refreshed']} failed={self.stats['failed']}")
+
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        elapsed = time.perf_counter() - started
+        return {
+            **self.stats,
+            'errors': dict(self.errors),
+            'elapsedSeconds': round(elapsed, 3),
+            'hostsPerSecond': round((self.stats['hosts'] - hosts_before) / elapsed, 1) if elapsed else None,
+            'rateLimitWaitSeconds': round(self.limiter.waited_seconds(), 3),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=REFRESH_WORKERS, help="Concurrent Calendar requests.")
+    parser.add_argument('--qps', type=float, default=REFRESH_QPS_PER_PROJECT,
+                        help="Calendar requests per second per Google Cloud project.")
+    parser.add_argument('--page-size', type=int, default=REFRESH_PAGE_SIZE)
+    parser.add_argument('--write-batch', type=int, default=REFRESH_WRITE_BATCH, help="Hosts per Firestore commit.")
+    parser.add_argument('--checkpoint', help="Resume from / record progress in this file.")
+    args = parser.parse_args()
+
+    # Shares the API server's configuration, credentials handling and token write-back.
+    import main as api
+
+    project = google_project_of(api.GOOGLE_CLIENT_ID)
+    refresh = BulkRefresh(api.db, api.calendar_pool, save_token=api.save_refreshed_token,
+                          project_of=lambda user_data: project, workers=args.workers, qps=args.qps,
+                          page_size=args.page_size, write_batch=args.write_batch, checkpoint=args.checkpoint)
+    metrics = refresh.run()
+    # Refreshed tokens are queued by save_refreshed_token; store the rest before exiting.
+    api.token_writes.flush(api.db)
+    print(f"Done. metrics: {json.dumps(metrics)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Re-encrypts the Google tokens stored in user documents with the newest FERNET_KEY.
+
+After a new key is put first in FERNET_KEY (see `token_crypto`), tokens
+encrypted with an older key still decrypt, but the older key can only be
+removed once none are left. This goes through every user document and
+re-encrypts the tokens of those that still use an older key, each in a
+transaction, so that a token refreshed or a sign-in stored meanwhile is not
+overwritten. The API server runs it every TOKEN_ROTATION_INTERVAL_SECONDS
+while FERNET_KEY holds more than one key; run it by hand to finish sooner.
+
+Run from the backend directory:
+    python -m rotate_tokens
+"""
+import json
+import os
+import time
+from collections import Counter
+from typing import Callable
+
+from google.cloud import firestore
+
+from token_crypto import TokenCipher
+
+TOKEN_ROTATION_INTERVAL_SECONDS = float(os.getenv("TOKEN_ROTATION_INTERVAL_SECONDS", "3600"))  # 0 turns it off
+TOKEN_ROTATION_PAGE_SIZE = int(os.getenv("TOKEN_ROTATION_PAGE_SIZE", "500"))
+
+TOKEN_FIELDS = ('encryptedAccessToken', 'encryptedRefreshToken')
+
+
+def _stale_fields(cipher: TokenCipher, user_data: dict) -> list:
+    return [field for field in TOKEN_FIELDS
+            if user_data.get(field) and cipher.needs_rotation(user_data[field])]
+
+
+@firestore.transactional
+def _rotate_in_transaction(transaction, user_ref, cipher: TokenCipher) -> bool:
+    user_doc = user_ref.get(transaction=transaction)
+    if not user_doc.exists:
+        return False
+    user_data = user_doc.to_dict()
+    fields = _stale_fields(cipher, user_data)
+    if not fields:
+        return False
+    transaction.update(user_ref, {field: cipher.rotate(user_data[field]) for field in fields})
+    return True
+
+
+def rotate_stored_tokens(db, cipher: TokenCipher, page_size: int = TOKEN_ROTATION_PAGE_SIZE,
+                         on_rotated: Callable[[str], None] = lambda user_id: None) -> Counter:
+    """
+    Re-encrypts every user's tokens that use an older key.
+
+    Returns:
+        Counts of 'users' looked at, users 'rotated' and users 'failed'
+        (a token no configured key decrypts).
+    """
+    stats = Counter({'users': 0, 'rotated': 0, 'failed': 0})
+    if cipher.key_count == 1:
+        return stats
+    # '__name__' orders by document ID; the client turns an ID cursor into a document reference.
+    query = db.collection('users').order_by('__name__').limit(page_size)
+    start_after = None
+    while True:
+        page_query = query.start_after({'__name__': start_after}) if start_after else query
+        page = list(page_query.stream())
+        if not page:
+            return stats
+        for user_doc in page:
+            stats['users'] += 1
+            try:
+                if not _stale_fields(cipher, user_doc.to_dict()):
+                    continue
+                if _rotate_in_transaction(db.transaction(), user_doc.reference, cipher):
+                    stats['rotated'] += 1
+                    on_rotated(user_doc.id)
+            except Exception as e:
+                stats['failed'] += 1
+                print(f"ERROR while re-encrypting the tokens of user {user_doc.id}: {e!r}")
+        start_after = page[-1].id
+
+
+def main():
+    # Shares the API server's configuration.
+    import main as api
+
+    if not api.token_cipher or not api.db:
+        raise SystemExit("FERNET_KEY and Firestore must be configured.")
+    started = time.perf_counter()
+    stats = rotate_stored_tokens(api.db, api.token_cipher)
+    print(f"Done in {time.perf_counter() - started:.1f} s. stats: {json.dumps(stats)}")
+
+
+if __name__ == "__main__":
+    main()
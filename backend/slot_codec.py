@@ -0,0 +1,183 @@
+"""
+Compact encoding of slot lists.
+
+A slot dict repeats its start time as slotId and spells out every time as an
+ISO string. The packed form keeps a base time and, per slot, the start in
+minutes from the base, plus the slot duration and UTC offset (one value when
+all slots share it, otherwise one per slot) and a bitmap of booked slots.
+`PackedSlots` holds it in arrays and turns it back into the exact slot dicts
+it was built from.
+
+Two serializations exist: `to_document` for Firestore (arrays as little-endian
+bytes) and `to_json` for the public API (numbers, bitmap in base64).
+"""
+import base64
+import sys
+from array import array
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List
+
+ENCODING_PACKED = 'packed-v1'
+MINUTES_PER_DAY = 24 * 60
+
+_SLOT_KEYS = {'slotId', 'startTime', 'endTime', 'status'}
+_STATUSES = ('available', 'booked')
+_EPOCH = date(1970, 1, 1)
+
+
+def _to_bytes(values: array) -> bytes:
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _whole_minutes(delta: timedelta) -> int:
+    seconds = delta.total_seconds()
+    if seconds % 60:
+        raise ValueError("Slot times must be whole minutes.")
+    return int(seconds // 60)
+
+
+class PackedSlots:
+    """
+    A slot list as parallel arrays.
+
+    Attributes:
+        base: POSIX time (seconds) the starts count from.
+        starts: Start of each slot, in minutes after `base`, ascending.
+        durations: Length of each slot in minutes.
+        offsets: UTC offset, in minutes, each slot's times are written with.
+        booked: Bitmap, bit i set when slot i is booked.
+    """
+    __slots__ = ('base', 'starts', 'durations', 'offsets', 'booked')
+
+    def __init__(self, base: int, starts: array, durations: array, offsets: array, booked: bytearray):
+        self.base = base
+        self.starts = starts
+        self.durations = durations
+        self.offsets = offsets
+        self.booked = booked
+
+    @classmethod
+    def from_slots(cls, slots: Iterable[dict]) -> "PackedSlots":
+        """
+        Packs slot dicts.
+
+        Raises:
+            ValueError: If a slot cannot be reproduced exactly from the packed
+                form (extra fields, unknown status, seconds in its times, ...).
+        """
+        rows = []
+        for slot in slots:
+            if slot.keys() != _SLOT_KEYS or slot['slotId'] != slot['startTime'] or slot['status'] not in _STATUSES:
+                raise ValueError(f"Slot cannot be packed: {slot}")
+            start = datetime.fromisoformat(slot['startTime'])
+            end = datetime.fromisoformat(slot['endTime'])
+            if start.utcoffset() is None or start.utcoffset() != end.utcoffset() or end <= start:
+                raise ValueError(f"Slot cannot be packed: {slot}")
+            if start.second or start.microsecond:
+                raise ValueError("Slot times must be whole minutes.")
+            rows.append((int(start.timestamp()), _whole_minutes(end - start), _whole_minutes(start.utcoffset()),
+                         slot['status'] == 'booked'))
+        rows.sort()
+
+        base = rows[0][0] if rows else 0
+        booked = bytearray((len(rows) + 7) // 8)
+        for i, row in enumerate(rows):
+            if row[3]:
+                booked[i >> 3] |= 1 << (i & 7)
+        return cls(base, array('I', [(row[0] - base) // 60 for row in rows]), array('H', [row[1] for row in rows]),
+                   array('h', [row[2] for row in rows]), booked)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def is_booked(self, i: int) -> bool:
+        return bool(self.booked[i >> 3] & (1 << (i & 7)))
+
+    def __iter__(self) -> Iterator[dict]:
+        # Times are whole minutes at whole-minute offsets, so the ISO strings are
+        # built from minute counts instead of a datetime per slot.
+        base_minutes = self.base // 60
+        day_cache = {}
+        offset_cache = {}
+
+        def iso(local_minutes: int, suffix: str) -> str:
+            day, minute = divmod(local_minutes, MINUTES_PER_DAY)
+            day_str = day_cache.get(day)
+            if day_str is None:
+                day_str = day_cache[day] = (_EPOCH + timedelta(days=day)).isoformat()
+            return f"{day_str}T{minute // 60:02d}:{minute % 60:02d}:00{suffix}"
+
+        for i, start_minutes in enumerate(self.starts):
+            offset = self.offsets[i]
+            suffix = offset_cache.get(offset)
+            if suffix is None:
+                tz = timezone(timedelta(minutes=offset))
+                suffix = offset_cache[offset] = datetime(2000, 1, 1, tzinfo=tz).isoformat()[len('2000-01-01T00:00:00'):]
+            local_start = base_minutes + start_minutes + offset
+            start_time = iso(local_start, suffix)
+            yield {
+                'slotId': start_time,
+                'startTime': start_time,
+                'endTime': iso(local_start + self.durations[i], suffix),
+                'status': 'booked' if self.is_booked(i) else 'available',
+            }
+
+    def to_slots(self) -> List[dict]:
+        return list(self)
+
+    def _uniform(self, name: str, values: array, as_bytes: bool) -> Dict[str, object]:
+        # A single value covers the usual case of one duration / one offset for every slot.
+        if values and all(value == values[0] for value in values):
+            return {name: values[0]}
+        if not values:
+            return {name: 0}
+        return {name + 's': _to_bytes(values) if as_bytes else values.tolist()}
+
+    def to_document(self) -> dict:
+        """Firestore fields; see `from_document`."""
+        return {
+            'encoding': ENCODING_PACKED,
+            'count': len(self),
+            'base': self.base,
+            'starts': _to_bytes(self.starts),
+            **self._uniform('duration', self.durations, as_bytes=True),
+            **self._uniform('offset', self.offsets, as_bytes=True),
+            'booked': bytes(self.booked),
+        }
+
+    @classmethod
+    def from_document(cls, data: dict) -> "PackedSlots":
+        starts = _from_bytes('I', data['starts'])
+        count = len(starts)
+        durations = (_from_bytes('H', data['durations']) if 'durations' in data
+                     else array('H', [data['duration']]) * count)
+        offsets = _from_bytes('h', data['offsets']) if 'offsets' in data else array('h', [data['offset']]) * count
+        return cls(data['base'], starts, durations, offsets, bytearray(data['booked']))
+
+    def to_json(self) -> dict:
+        """
+        The compact public API form.
+
+        `starts` are minutes after `base` (seconds since the epoch); slot i is
+        booked when bit i of the base64 `booked` bitmap is set (least
+        significant bit first).
+        """
+        return {
+            'encoding': ENCODING_PACKED,
+            'base': self.base,
+            'starts': self.starts.tolist(),
+            **self._uniform('duration', self.durations, as_bytes=False),
+            **self._uniform('offset', self.offsets, as_bytes=False),
+            'booked': base64.b64encode(self.booked).decode(),
+        }
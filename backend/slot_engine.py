@@ -0,0 +1,291 @@
+from bisect import bisect_right
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, time as dt_time
+from typing import Collection, Iterable, Iterator, List, Optional, Tuple
+
+import pytz
+
+from tz_engine import DAY_SECONDS, ZoneTransitions, local_day_start, zone_transitions
+
+# Number of days ahead that slots are generated for.
+SLOT_HORIZON_DAYS = 14
+
+DEFAULT_WORKING_HOURS = {'start': '09:00', 'end': '17:00'}
+DEFAULT_WORKING_DAYS = [0, 1, 2, 3, 4]  # Mon-Fri
+DEFAULT_SLOT_DURATION = 30
+DEFAULT_TIMEZONE = 'Asia/Tokyo'
+
+
+Window = Tuple[dt_time, dt_time]
+
+
+@dataclass(frozen=True)
+class SlotSettings:
+    """
+    The subset of a user's settings that slot generation depends on.
+
+    Working hours are (start, end) windows of local wall time. A window whose
+    end is before its start runs overnight into the next day. `weekly_hours`,
+    when set, gives the windows of each weekday (Monday first) and replaces
+    `work_start`/`work_end`/`working_days`.
+    """
+    work_start: dt_time
+    work_end: dt_time
+    working_days: Tuple[int, ...]
+    slot_duration_minutes: int
+    timezone: pytz.BaseTzInfo
+    weekly_hours: Optional[Tuple[Tuple[Window, ...], ...]] = None
+
+    @classmethod
+    def from_user_settings(cls, settings: Optional[dict]) -> "SlotSettings":
+        """Builds SlotSettings from a user document's `settings` map, applying defaults."""
+        settings = settings or {}
+        working_hours = settings.get('workingHours', DEFAULT_WORKING_HOURS)
+        weekly_hours = settings.get('weeklyHours')
+        if weekly_hours is not None:
+            # Firestore map keys are strings: {"0": [{"start": "09:00", "end": "12:00"}, ...], ...}
+            weekly_hours = tuple(
+                tuple(sorted((dt_time.fromisoformat(hours['start']), dt_time.fromisoformat(hours['end']))
+                             for hours in weekly_hours.get(str(weekday), [])))
+                for weekday in range(7))
+        return cls(
+            work_start=dt_time.fromisoformat(working_hours['start']),
+            work_end=dt_time.fromisoformat(working_hours['end']),
+            working_days=tuple(settings.get('workingDays', DEFAULT_WORKING_DAYS)),
+            slot_duration_minutes=settings.get('slotDuration', DEFAULT_SLOT_DURATION),
+            timezone=pytz.timezone(settings.get('timezone', DEFAULT_TIMEZONE)),
+            weekly_hours=weekly_hours,
+        )
+
+    def windows(self, weekday: int) -> Tuple[Window, ...]:
+        """The working-hours windows that start on a weekday (0 is Monday)."""
+        if self.weekly_hours is not None:
+            return self.weekly_hours[weekday]
+        return ((self.work_start, self.work_end),) if weekday in self.working_days else ()
+
+
+def parse_busy_intervals(busy_intervals_raw: Iterable[dict]) -> List[Tuple[datetime, datetime]]:
+    """Parses the `busy` list of a freebusy response into (start, end) datetimes."""
+    busy_times = []
+    for interval in busy_intervals_raw:
+        start = datetime.fromisoformat(interval['start'].replace('Z', '+00:00'))
+        end = datetime.fromisoformat(interval['end'].replace('Z', '+00:00'))
+        busy_times.append((start, end))
+    return busy_times
+
+
+def merge_intervals(intervals: Iterable[Tuple[float, float]]) -> List[Tuple[float, float]]:
+    """
+    Sorts intervals and merges the ones that overlap or touch.
+
+    Args:
+        intervals: (start, end) pairs of any comparable type.
+
+    Returns:
+        A sorted list of disjoint (start, end) pairs.
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def compute_available_slots(
+    busy_times: Iterable[Tuple[datetime, datetime]],
+    slot_settings: SlotSettings,
+    now: Optional[datetime] = None,
+    days: int = SLOT_HORIZON_DAYS,
+    dates: Optional[Collection[date]] = None,
+) -> List[dict]:
+    """
+    Computes the free slots within the user's working hours.
+
+    Busy intervals are merged once and swept against the working-hours windows
+    in a single pass, so the cost is linear in the number of busy intervals
+    plus the number of candidate slots.
+
+    Args:
+        busy_times: Timezone-aware (start, end) pairs, in any order.
+        slot_settings: The user's slot settings.
+        now: Slots starting at or before this instant are skipped. Defaults to the current time.
+        days: Number of days, starting from today in the user's timezone, to generate slots for.
+        dates: If given, only days in this collection are generated.
+
+    Returns:
+        A list of slot dicts with `slotId`, `startTime`, `endTime` and `status`.
+    """
+    user_timezone = slot_settings.timezone
+    if now is None:
+        now = datetime.now(user_timezone)
+
+    busy = merge_intervals((start.timestamp(), end.timestamp()) for start, end in busy_times)
+    today = now.astimezone(user_timezone).date()
+    candidate_days = (today + timedelta(days=i) for i in range(days))
+    if dates is not None:
+        candidate_days = (day for day in candidate_days if day in dates)
+    return list(iter_available_slots(busy, slot_settings, candidate_days, now.timestamp()))
+
+
+def _seconds(t: dt_time) -> int:
+    return t.hour * 3600 + t.minute * 60 + t.second
+
+
+def _ceil_div(a: int, b: int) -> int:
+    return -(-a // b)
+
+
+def _window_runs(slot_settings: SlotSettings, transitions: ZoneTransitions, day: date) -> List[Tuple[int, int, int]]:
+    """`day_slot_runs` before overlapping windows are trimmed, ordered by first slot."""
+    duration = slot_settings.slot_duration_minutes * 60
+    midnight = local_day_start(day)
+    day_from = transitions.to_utc(midnight)
+    day_to = transitions.to_utc(midnight + DAY_SECONDS, latest=True)
+
+    runs = []
+    for shift_start, overnight_only in ((midnight - DAY_SECONDS, True), (midnight, False)):
+        weekday = (day.weekday() + (-1 if overnight_only else 0)) % 7
+        for start, end in slot_settings.windows(weekday):
+            start_s, end_s = _seconds(start), _seconds(end)
+            if end_s == start_s or (overnight_only and end_s > start_s):
+                continue
+            window_start = transitions.to_utc(shift_start + start_s, latest=True)
+            window_end = transitions.to_utc(shift_start + end_s + (DAY_SECONDS if end_s < start_s else 0))
+            if window_end <= window_start:
+                # The whole window lies in a repeated hour: take its first occurrence.
+                window_start = transitions.to_utc(shift_start + start_s)
+            first = max(0, _ceil_div(day_from - window_start, duration))
+            stop = min((window_end - window_start) // duration, _ceil_div(day_to - window_start, duration))
+            if first < stop:
+                runs.append((window_start, first, stop))
+    runs.sort(key=lambda run: run[0] + run[1] * duration)
+    return runs
+
+
+def _trim_runs(runs: List[Tuple[int, int, int]], duration: int,
+               taken_until: Optional[int]) -> Tuple[List[Tuple[int, int, int]], Optional[int]]:
+    disjoint = []
+    for window_start, first, stop in runs:
+        if taken_until is not None:
+            first = max(first, _ceil_div(taken_until - window_start, duration))
+        if first < stop:
+            disjoint.append((window_start, first, stop))
+            taken_until = max(taken_until or window_start, window_start + stop * duration)
+    return disjoint, taken_until
+
+
+def day_slot_runs(slot_settings: SlotSettings, transitions: ZoneTransitions,
+                  day: date) -> List[Tuple[int, int, int]]:
+    """
+    The candidate slots starting on a local day, before busy times are taken out.
+
+    A window starts at the last instant its start time occurs and ends at the
+    first instant its end time occurs, so slots keep to the window's wall times
+    while DST changes inside it lengthen or shorten it; a start or end skipped
+    by a DST gap moves to the end of the gap. Slots follow
+    each other in UTC from the window start. Overnight windows of the day
+    before contribute their slots after midnight, and a window never yields
+    slots overlapping an earlier one, including the last slot of the day before.
+
+    Returns:
+        (window start, first k, stop k) per window, ascending and disjoint:
+        slot k starts at `window start + k * duration` (UTC seconds).
+    """
+    duration = slot_settings.slot_duration_minutes * 60
+    # Only the end of the day before matters here, which its own first slots cannot change.
+    _, taken_until = _trim_runs(_window_runs(slot_settings, transitions, day - timedelta(days=1)), duration, None)
+    return _trim_runs(_window_runs(slot_settings, transitions, day), duration, taken_until)[0]
+
+
+def iter_available_slots(
+    busy: List[Tuple[float, float]],
+    slot_settings: SlotSettings,
+    days: Iterable[date],
+    not_before_ts: float,
+) -> Iterator[dict]:
+    """
+    Lazily yields the free slots of `days`, in order; the sweep behind `compute_available_slots`.
+
+    Works on UTC seconds with the zone's transition table (`tz_engine`);
+    `day_slot_runs` describes the candidate slots. Slot times are written with
+    the UTC offset in effect at each instant.
+
+    Args:
+        busy: Merged, sorted (start, end) busy intervals as POSIX timestamps (see `merge_intervals`).
+        slot_settings: The user's slot settings.
+        days: Days in the user's timezone, in ascending order. A slot belongs to the day it starts on.
+        not_before_ts: Only slots starting after this timestamp are yielded.
+    """
+    if slot_settings.slot_duration_minutes <= 0:
+        raise ValueError("slotDuration must be a positive number of minutes.")
+    transitions = zone_transitions(slot_settings.timezone)
+    duration = slot_settings.slot_duration_minutes * 60
+    busy_ends = [end for _, end in busy]
+    busy_count = len(busy)
+
+    for current_day in days:
+        day_index = local_day_start(current_day) // DAY_SECONDS
+        for window_start, k, stop in day_slot_runs(slot_settings, transitions, current_day):
+            busy_index = bisect_right(busy_ends, window_start + k * duration)
+            offset_until = None
+            while k < stop:
+                slot_start = window_start + k * duration
+                slot_end = slot_start + duration
+
+                while busy_index < busy_count and busy[busy_index][1] <= slot_start:
+                    busy_index += 1
+
+                if busy_index < busy_count and busy[busy_index][0] < slot_end:
+                    # Jump to the first slot that starts at or after the end of this busy block.
+                    k = max(k + 1, int(_ceil_div(busy[busy_index][1] - window_start, duration)))
+                    continue
+
+                if offset_until is None or slot_start >= offset_until:
+                    offset, offset_until = transitions.period_at(slot_start)
+                # Where a DST overlap repeats midnight, the slot may still start on the day before.
+                if slot_start > not_before_ts and (slot_start + offset) // DAY_SECONDS == day_index:
+                    start_time = transitions.isoformat(slot_start, offset)
+                    yield {
+                        'slotId': start_time,
+                        'startTime': start_time,
+                        'endTime': transitions.isoformat(slot_end, offset if slot_end < offset_until else None),
+                        'status': 'available'
+                    }
+                k += 1
+
+
+def slot_date(slot: dict) -> date:
+    """The day a stored slot belongs to, in the host timezone it was serialized with."""
+    return datetime.fromisoformat(slot['startTime']).date()
+
+
+def merge_regenerated_slots(
+    existing_slots: Iterable[dict],
+    regenerated_slots: Iterable[dict],
+    now: datetime,
+    dates: Optional[Collection[date]] = None,
+) -> List[dict]:
+    """
+    Merges freshly computed slots into a stored slot list.
+
+    Booked slots are always kept. Available slots are replaced by the
+    regenerated ones on the given dates, or on every date when `dates` is None.
+    Slots that have already ended are dropped.
+
+    Returns:
+        The merged slot list, ordered by start time.
+    """
+    merged = {}
+    for slot in existing_slots:
+        if datetime.fromisoformat(slot['endTime']) <= now:
+            continue
+        if slot.get('status') != 'available' or (dates is not None and slot_date(slot) not in dates):
+            merged[slot['slotId']] = slot
+    for slot in regenerated_slots:
+        merged.setdefault(slot['slotId'], slot)
+    return sorted(merged.values(), key=lambda slot: datetime.fromisoformat(slot['startTime']))
@@ -0,0 +1,204 @@
+"""
+In-process push of slot changes to public booking pages (Server-Sent Events).
+
+Every page watching a host subscribes to that host's channel. `slot_store`
+reports each write through `notify`; the channel's pump then reads what
+changed since its last version once (`slot_store.read_slot_changes`) and
+hands the same encoded event to every subscriber, so Firestore reads per
+change do not grow with the number of viewers. Pumps also poll the version
+every SLOT_EVENTS_POLL_SECONDS, which picks up writes made by other
+processes, and send a keepalive comment when nothing changed so that proxies
+don't close idle streams. Subscribers need no timers of their own.
+
+Each subscriber has a bounded buffer. A subscriber that falls behind loses
+its buffered events and gets a single `resync` event instead, after which the
+page refetches its slots.
+"""
+import asyncio
+import json
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+SLOT_EVENTS_BUFFER = int(os.getenv("SLOT_EVENTS_BUFFER", "16"))
+SLOT_EVENTS_POLL_SECONDS = float(os.getenv("SLOT_EVENTS_POLL_SECONDS", "15"))
+SLOT_EVENTS_MAX_SUBSCRIBERS = int(os.getenv("SLOT_EVENTS_MAX_SUBSCRIBERS", "20000"))
+
+VersionReader = Callable[[str], Awaitable[Optional[int]]]
+ChangesReader = Callable[[str, int], Awaitable[Tuple[Optional[int], Optional[Dict[str, List[dict]]]]]]
+
+
+class TooManySubscribersError(Exception):
+    pass
+
+
+def format_event(event: str, data: dict, event_id: Optional[int] = None) -> str:
+    """One SSE frame. The id is the slots' version, so a reconnecting EventSource resumes from it."""
+    frame = f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n"
+    if event_id is not None:
+        frame += f"id: {event_id}\n"
+    return frame + "\n"
+
+
+def slots_event(version: int, since: int, days: Dict[str, List[dict]]) -> str:
+    """The days changed between two versions, as in the `since` response of the public slots endpoint."""
+    return format_event('slots', {'version': version, 'since': since, 'days': days}, version)
+
+
+def resync_event(version: Optional[int]) -> str:
+    return format_event('resync', {'version': version}, version)
+
+
+KEEPALIVE = ": keepalive\n\n"
+
+
+class Subscription:
+    """One page's view of a host's channel."""
+
+    def __init__(self, hub: "SlotEventHub", user_id: str, buffer_size: int):
+        self.hub = hub
+        self.user_id = user_id
+        self._queue = asyncio.Queue(maxsize=buffer_size)
+
+    def put(self, frame: str):
+        if frame is KEEPALIVE and not self._queue.empty():
+            return
+        try:
+            self._queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            # Whatever is buffered is stale now; one resync replaces it.
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            self._queue.put_nowait(resync_event(None))
+            self.hub.stats['overflows'] += 1
+
+    async def frames(self):
+        """Yields SSE frames as the hub hands them over."""
+        while True:
+            yield await self._queue.get()
+
+
+class _Channel:
+    def __init__(self, version: Optional[int]):
+        self.version = version
+        self.subscribers: Set[Subscription] = set()
+        self.changed = asyncio.Event()
+        self.pump: Optional[asyncio.Task] = None
+
+
+class SlotEventHub:
+    """
+    Fans slot changes out to subscribers, one channel per host.
+
+    Args:
+        read_version: Returns a host's current slots version.
+        read_changes: Returns (version, {day: slots} changed after a version),
+            like `slot_store.read_slot_changes`.
+    """
+
+    def __init__(self, read_version: VersionReader, read_changes: ChangesReader,
+                 buffer_size: int = SLOT_EVENTS_BUFFER, poll_seconds: float = SLOT_EVENTS_POLL_SECONDS,
+                 max_subscribers: int = SLOT_EVENTS_MAX_SUBSCRIBERS):
+        self._read_version = read_version
+        self._read_changes = read_changes
+        self.buffer_size = buffer_size
+        self.poll_seconds = poll_seconds
+        self.max_subscribers = max_subscribers
+        self._channels: Dict[str, _Channel] = {}
+        self._loop = None
+        self.subscribers = 0
+        self.stats = {'events': 0, 'frames': 0, 'overflows': 0, 'reads': 0}
+
+    async def subscribe(self, user_id: str) -> Subscription:
+        """
+        Raises:
+            TooManySubscribersError: If the process already serves `max_subscribers`.
+        """
+        if self.subscribers >= self.max_subscribers:
+            raise TooManySubscribersError("Too many open slot streams.")
+        self._loop = asyncio.get_running_loop()
+        subscription = Subscription(self, user_id, self.buffer_size)
+        self.subscribers += 1
+        channel = self._channels.get(user_id)
+        if channel is None:
+            channel = self._channels[user_id] = _Channel(None)
+            channel.pump = asyncio.create_task(self._pump(user_id, channel))
+        channel.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        channel = self._channels.get(subscription.user_id)
+        if channel is None or subscription not in channel.subscribers:
+            return
+        channel.subscribers.discard(subscription)
+        self.subscribers -= 1
+        if not channel.subscribers:
+            channel.pump.cancel()
+            del self._channels[subscription.user_id]
+
+    def notify(self, user_id: str):
+        """Reports that a host's slots may have changed. Safe to call from any thread."""
+        loop = self._loop
+        if loop is None or user_id not in self._channels:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._wake(user_id)
+        elif not loop.is_closed():
+            loop.call_soon_threadsafe(self._wake, user_id)
+
+    def _wake(self, user_id: str):
+        channel = self._channels.get(user_id)
+        if channel is not None:
+            channel.changed.set()
+
+    async def _pump(self, user_id: str, channel: _Channel):
+        while True:
+            try:
+                if channel.version is None:
+                    self.stats['reads'] += 1
+                    channel.version = await self._read_version(user_id)
+                try:
+                    await asyncio.wait_for(channel.changed.wait(), self.poll_seconds)
+                    notified = True
+                except asyncio.TimeoutError:
+                    notified = False
+                channel.changed.clear()
+                self.stats['reads'] += 1
+                if channel.version is None:
+                    version, days = await self._read_version(user_id), None
+                else:
+                    version, days = await self._read_changes(user_id, channel.version)
+                if days is None:
+                    if version != channel.version:
+                        self._broadcast(channel, resync_event(version))
+                elif days:
+                    self._broadcast(channel, slots_event(version, channel.version, days))
+                elif not notified:
+                    self._broadcast(channel, KEEPALIVE, count=False)
+                channel.version = version
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"ERROR while reading slot changes of {user_id}: {e}")
+                await asyncio.sleep(self.poll_seconds)
+
+    def _broadcast(self, channel: _Channel, frame: str, count: bool = True):
+        if count:
+            self.stats['events'] += 1
+            self.stats['frames'] += len(channel.subscribers)
+        for subscription in channel.subscribers:
+            subscription.put(frame)
+
+    def channel_stats(self) -> dict:
+        return {'channels': len(self._channels), 'subscribers': self.subscribers, **self.stats}
+
+    async def aclose(self):
+        pumps = [channel.pump for channel in self._channels.values()]
+        for pump in pumps:
+            pump.cancel()
+        await asyncio.gather(*pumps, return_exceptions=True)
+        self._channels.clear()
+        self.subscribers = 0
@@ -0,0 +1,610 @@
+"""
+Firestore storage for slots.
+
+Slots are stored one document per day under `slots/{userId}/days/{YYYY-MM-DD}`,
+so booking a slot only touches its day. A day document holds its slots packed
+(`slot_codec`, `encoding: packed-v1`) or, when SLOT_ENCODING is `map` or the
+slots cannot be packed, as a `slots` map keyed by slotId; both are read.
+`slots/{userId}` itself is a header document. Older data may still hold every
+slot in a `slots` array on the header; readers and booking fall back to it, and
+the next regeneration (or `migrate_legacy_slots`) moves it into day buckets.
+
+Every write that changes slots also sets `updatedAt` on the header and on the
+day documents it touches, in the same commit. The header's `updatedAt` is the
+slots' version (`slots_version`): public pages use it as their ETag, and
+`read_slot_changes` returns the days changed since a version. Days emptied
+by a regeneration are kept as empty documents until they are past, so their
+removal shows up as a change too.
+
+A booker can put a hold on an available slot while filling in the booking
+form. Holds live in the day document (`holds`: {slotId: {holdId, expiresAt}},
+plus `holdsExpireAt`, the earliest expiry) and are written like any other
+slot change, so pages see a held slot as `held` right away. Expired holds are
+ignored wherever they are read and dropped by the next write of their day;
+`sweep_expired_holds_async` rewrites days whose holds ran out in the meantime
+so that versions, deltas and event streams notice.
+
+Team bookings (`team_store`) and personal bookings exclude each other: a team
+booking marks the member's overlapping slots as booked in the same
+transaction, and booking a slot fails while the host has a team reservation
+(`users/{userId}/teamReservations/{id}`) starting at the same time.
+"""
+import os
+import secrets
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone, tzinfo
+from typing import Callable, Collection, Dict, Iterable, List, Optional, Tuple
+
+from google.cloud import firestore
+
+from cache import TTLCache
+from metrics import traced
+from slot_codec import ENCODING_PACKED, PackedSlots
+from slot_engine import SlotSettings, merge_regenerated_slots, slot_date
+
+LAYOUT_DAILY = 'daily'
+SLOT_ENCODING = os.getenv("SLOT_ENCODING", "packed")
+HOLD_TTL_SECONDS = int(os.getenv("HOLD_TTL_SECONDS", "300"))
+HOLD_SWEEP_SECONDS = float(os.getenv("HOLD_SWEEP_SECONDS", "30"))
+STATUS_HELD = 'held'
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Per-process cache of user ID -> (version, slot list). Writes through this module
+# invalidate it; other processes see changes once the TTL runs out, and booking
+# always re-checks availability inside a transaction.
+slots_cache = TTLCache(
+    maxsize=int(os.getenv("SLOTS_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("SLOTS_CACHE_TTL_SECONDS", "30")),
+)
+
+# Called with the user ID after every write of a user's slots, e.g. `slot_events.SlotEventHub.notify`.
+slot_change_listeners: List[Callable[[str], None]] = []
+
+# Writes per user in this process, so that a read overlapping a write does not cache what it read.
+_slot_writes = Counter()
+
+
+def slots_changed(user_id: str):
+    """Drops the user's cached slots and tells the listeners. Called after (attempted) writes."""
+    _slot_writes[user_id] += 1
+    slots_cache.pop(user_id)
+    for listener in slot_change_listeners:
+        listener(user_id)
+
+
+def slots_header_ref(db, user_id: str):
+    return db.collection('slots').document(user_id)
+
+
+def slot_days_ref(db, user_id: str):
+    return slots_header_ref(db, user_id).collection('days')
+
+
+def _sort_slots(slots) -> List[dict]:
+    return sorted(slots, key=lambda slot: datetime.fromisoformat(slot['startTime']))
+
+
+def _group_by_day(slots) -> Dict[str, Dict[str, dict]]:
+    days = {}
+    for slot in slots:
+        days.setdefault(slot_date(slot).isoformat(), {})[slot['slotId']] = slot
+    return days
+
+
+def day_bucket_slots(day_data: dict) -> Dict[str, dict]:
+    """The slot map of a day document, in either encoding."""
+    if day_data.get('encoding') == ENCODING_PACKED:
+        return {slot['slotId']: slot for slot in PackedSlots.from_document(day_data)}
+    return day_data.get('slots', {})
+
+
+def day_bucket_holds(day_data: dict, now: datetime) -> Dict[str, dict]:
+    """The holds of a day document that have not expired by `now`, by slotId."""
+    return {slot_id: hold for slot_id, hold in day_data.get('holds', {}).items() if hold['expiresAt'] > now}
+
+
+def day_bucket_doc(day_id: str, slots: Dict[str, dict], holds: Optional[Dict[str, dict]] = None) -> dict:
+    """The day document storing `slots`, packed unless SLOT_ENCODING is `map` or a slot cannot be packed."""
+    doc = {'date': day_id, 'updatedAt': firestore.SERVER_TIMESTAMP}
+    if holds:
+        doc['holds'] = holds
+        doc['holdsExpireAt'] = min(hold['expiresAt'] for hold in holds.values())
+    if SLOT_ENCODING == 'packed':
+        try:
+            return {**doc, **PackedSlots.from_slots(slots.values()).to_document()}
+        except ValueError:
+            pass
+    return {**doc, 'slots': slots}
+
+
+def slots_version(header_data: Optional[dict]) -> Optional[int]:
+    """The version of a user's slots: the header's `updatedAt` in microseconds, or None if never written."""
+    updated_at = (header_data or {}).get('updatedAt')
+    if not isinstance(updated_at, datetime):
+        return None
+    return (updated_at - _EPOCH) // timedelta(microseconds=1)
+
+
+def version_time(version: int) -> datetime:
+    """The `updatedAt` a version stands for."""
+    return _EPOCH + timedelta(microseconds=version)
+
+
+def touch_header(transaction, db, user_id: str):
+    """
+    Bumps the slots' version in `transaction`. The header is written without
+    being read, so bookings of different days still don't conflict.
+    """
+    transaction.set(slots_header_ref(db, user_id), {'updatedAt': firestore.SERVER_TIMESTAMP}, merge=True)
+
+
+def visible_day_slots(day_data: dict, now: datetime) -> List[dict]:
+    """A day document's slots as pages show them: available slots under an active hold are `held`."""
+    slots = day_bucket_slots(day_data)
+    holds = day_bucket_holds(day_data, now)
+    if not holds:
+        return list(slots.values())
+    return [{**slot, 'status': STATUS_HELD} if slot_id in holds and slot['status'] == 'available' else slot
+            for slot_id, slot in slots.items()]
+
+
+def flatten_day_buckets_with_expiry(day_snapshots, now: datetime) -> Tuple[List[dict], Optional[datetime]]:
+    """(slots, when the first of their active holds expires, if any)."""
+    slots = []
+    holds_expire_at = None
+    for day_doc in day_snapshots:
+        day_data = day_doc.to_dict()
+        slots.extend(visible_day_slots(day_data, now))
+        for hold in day_bucket_holds(day_data, now).values():
+            if holds_expire_at is None or hold['expiresAt'] < holds_expire_at:
+                holds_expire_at = hold['expiresAt']
+    return _sort_slots(slots), holds_expire_at
+
+
+def flatten_day_buckets(day_snapshots, now: Optional[datetime] = None) -> List[dict]:
+    return flatten_day_buckets_with_expiry(day_snapshots, now or datetime.now(timezone.utc))[0]
+
+
+def slot_writes(user_id: str) -> int:
+    """Pass to `cache_slots` what this returned before reading the slots."""
+    return _slot_writes[user_id]
+
+
+def cache_slots(user_id: str, version: Optional[int], slots: List[dict], writes: int,
+                holds_expire_at: Optional[datetime] = None, now: Optional[datetime] = None):
+    """
+    Caches a user's slots, only until the first hold among them expires, and
+    not at all if this process wrote them since `writes` was taken.
+    """
+    if _slot_writes[user_id] != writes:
+        return
+    ttl = None
+    if holds_expire_at is not None:
+        ttl = (holds_expire_at - (now or datetime.now(timezone.utc))).total_seconds()
+    slots_cache.set(user_id, (version, slots), ttl=ttl)
+
+
+def slot_day_id(slot_id: str) -> str:
+    """
+    The day bucket a slotId belongs to.
+
+    Raises:
+        ValueError: If the slotId is not an ISO start time.
+    """
+    return datetime.fromisoformat(slot_id).date().isoformat()
+
+
+def reservation_id(slot_start: str) -> str:
+    """The team reservation document ID of a slot: its start in UTC, the same for every team and timezone."""
+    return datetime.fromisoformat(slot_start).astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def team_reservation_ref(db, user_id: str, slot_start: str):
+    return db.collection('users').document(user_id).collection('teamReservations').document(
+        reservation_id(slot_start))
+
+
+def check_team_reservation(snapshot):
+    """
+    Raises:
+        ValueError: If the host has a team booking at the slot's start.
+    """
+    if snapshot.exists:
+        raise ValueError("Slot is no longer available.")
+
+
+def read_slots(db, user_id: str) -> List[dict]:
+    """
+    Returns all stored slots of a user, ordered by start time.
+
+    Results are served from `slots_cache` when possible and must not be mutated.
+    """
+    return read_versioned_slots(db, user_id)[1]
+
+
+@traced('firestore.read_versioned_slots')
+def read_versioned_slots(db, user_id: str,
+                         known_versions: Collection[int] = ()) -> Tuple[Optional[int], Optional[List[dict]]]:
+    """
+    Returns (version, slots) of a user; see `read_slots`.
+
+    Args:
+        known_versions: Versions the caller already has. If the current
+            version is one of them, only the header is read and slots is None.
+    """
+    cached = slots_cache.get(user_id)
+    if cached is not None:
+        return cached if cached[0] not in known_versions else (cached[0], None)
+
+    writes = slot_writes(user_id)
+    header = slots_header_ref(db, user_id).get()
+    header_data = header.to_dict() if header.exists else None
+    version = slots_version(header_data)
+    if version is not None and version in known_versions:
+        return version, None
+    # The header is read first, so the slots are at least as new as `version`.
+    now = datetime.now(timezone.utc)
+    holds_expire_at = None
+    if header_data and 'slots' in header_data:
+        slots = header_data['slots']
+    else:
+        slots, holds_expire_at = flatten_day_buckets_with_expiry(slot_days_ref(db, user_id).stream(), now)
+    cache_slots(user_id, version, slots, writes, holds_expire_at, now)
+    return version, slots
+
+
+def changed_days(day_snapshots: Iterable, now: Optional[datetime] = None) -> Dict[str, List[dict]]:
+    """{day ID: slots} of changed day documents; an empty list means the day has no slots any more."""
+    now = now or datetime.now(timezone.utc)
+    return {day_doc.id: _sort_slots(visible_day_slots(day_doc.to_dict(), now)) for day_doc in day_snapshots}
+
+
+def changed_days_query(db, user_id: str, since: int):
+    return slot_days_ref(db, user_id).where('updatedAt', '>', version_time(since))
+
+
+@traced('firestore.read_slot_changes')
+def read_slot_changes(db, user_id: str, since: int) -> Tuple[Optional[int], Optional[Dict[str, List[dict]]]]:
+    """
+    Returns (version, {day ID: slots} of the days changed after version `since`).
+
+    The changes are None when they cannot be worked out from `since` (legacy
+    array data, or a version newer than the current one); read everything then.
+    Only the header and the changed day documents are read.
+    """
+    header = slots_header_ref(db, user_id).get()
+    header_data = header.to_dict() if header.exists else None
+    version = slots_version(header_data)
+    if version is None or since > version or 'slots' in header_data:
+        return version, None
+    if since == version:
+        return version, {}
+    return version, changed_days(changed_days_query(db, user_id, since).stream())
+
+
+def take_slot_from_array(slots: List[dict], slot_id: str) -> dict:
+    """Marks a slot in a legacy slot array as booked and returns it."""
+    for slot in slots:
+        if slot.get('slotId') == slot_id:
+            if slot.get('status') != 'available':
+                raise ValueError("Slot is no longer available.")
+            slot['status'] = 'booked'
+            return slot
+    raise ValueError("Slot ID not found.")
+
+
+def take_slot_from_day(slots: Dict[str, dict], slot_id: str, holds: Optional[Dict[str, dict]] = None,
+                       hold_id: Optional[str] = None) -> dict:
+    """
+    Marks a slot in a day bucket's slot map as booked and returns it.
+
+    Args:
+        holds: The day's active holds. A hold on the slot must be `hold_id`;
+            it is removed from `holds`.
+    """
+    slot = slots.get(slot_id)
+    if slot is None:
+        raise ValueError("Slot ID not found.")
+    if slot.get('status') != 'available':
+        raise ValueError("Slot is no longer available.")
+    hold = (holds or {}).get(slot_id)
+    if hold is not None:
+        if hold['holdId'] != hold_id:
+            raise ValueError("Slot is being booked by someone else.")
+        del holds[slot_id]
+    slot['status'] = 'booked'
+    return slot
+
+
+def hold_day_id(hold_id: str) -> str:
+    """
+    The day bucket a hold belongs to; hold IDs start with it.
+
+    Raises:
+        ValueError: If the hold ID is malformed.
+    """
+    day_id, _, _ = hold_id.partition('.')
+    return date.fromisoformat(day_id).isoformat()
+
+
+def hold_slot_in_day(slots: Dict[str, dict], holds: Dict[str, dict], slot_id: str, now: datetime) -> dict:
+    """Adds a hold on an available slot to a day's active holds and returns it."""
+    slot = slots.get(slot_id)
+    if slot is None:
+        raise ValueError("Slot ID not found.")
+    if slot.get('status') != 'available' or slot_id in holds:
+        raise ValueError("Slot is no longer available.")
+    hold = {'holdId': f"{slot_day_id(slot_id)}.{secrets.token_urlsafe(12)}",
+            'expiresAt': now + timedelta(seconds=HOLD_TTL_SECONDS)}
+    holds[slot_id] = hold
+    return hold
+
+
+def release_hold_in_day(holds: Dict[str, dict], hold_id: str) -> bool:
+    """Removes a hold from a day's active holds. Returns whether it was there."""
+    for slot_id, hold in holds.items():
+        if hold['holdId'] == hold_id:
+            del holds[slot_id]
+            return True
+    return False
+
+
+def release_slot_from_array(slots: List[dict], slot_id: str) -> bool:
+    """Marks a booked slot in a legacy slot array as available again. Returns whether it changed."""
+    for slot in slots:
+        if slot.get('slotId') == slot_id and slot.get('status') == 'booked':
+            slot['status'] = 'available'
+            return True
+    return False
+
+
+def release_slot_from_day(slots: Dict[str, dict], slot_id: str) -> bool:
+    """Marks a booked slot in a day bucket's slot map as available again. Returns whether it changed."""
+    slot = slots.get(slot_id)
+    if slot is None or slot.get('status') != 'booked':
+        return False
+    slot['status'] = 'available'
+    return True
+
+
+@firestore.transactional
+def book_slot_in_transaction(transaction, db, user_id, slot_id):
+    """Books a slot in the legacy layout, where every slot lives in one array."""
+    slots_ref = slots_header_ref(db, user_id)
+    snapshot = slots_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        raise FileNotFoundError("Slots document not found.")
+    check_team_reservation(team_reservation_ref(db, user_id, slot_id).get(transaction=transaction))
+
+    slots = snapshot.to_dict().get('slots', [])
+    slot = take_slot_from_array(slots, slot_id)
+    transaction.update(slots_ref, {'slots': slots, 'updatedAt': firestore.SERVER_TIMESTAMP})
+    return slot
+
+
+@firestore.transactional
+def book_slot_in_day_transaction(transaction, db, user_id, slot_id, hold_id=None):
+    """Books a slot in its day bucket. Only that day's document is read."""
+    day_ref = slot_days_ref(db, user_id).document(slot_day_id(slot_id))
+    snapshot = day_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        raise FileNotFoundError("Slots document not found.")
+    check_team_reservation(team_reservation_ref(db, user_id, slot_id).get(transaction=transaction))
+
+    day_data = snapshot.to_dict()
+    slots = day_bucket_slots(day_data)
+    holds = day_bucket_holds(day_data, datetime.now(timezone.utc))
+    slot = take_slot_from_day(slots, slot_id, holds, hold_id)
+    transaction.set(day_ref, day_bucket_doc(day_ref.id, slots, holds))
+    touch_header(transaction, db, user_id)
+    return slot
+
+
+@traced('firestore.book_slot')
+def book_slot(db, user_id: str, slot_id: str, hold_id: Optional[str] = None) -> dict:
+    """
+    Marks a slot as booked and returns it.
+
+    Args:
+        hold_id: The booker's hold on the slot, if any. A slot held by
+            someone else cannot be booked.
+
+    Raises:
+        FileNotFoundError: If the user has no slots.
+        ValueError: If the slot does not exist or is not available, or the
+            host has a team booking at the same time.
+    """
+    try:
+        slot_day_id(slot_id)
+    except ValueError:
+        raise ValueError("Slot ID not found.")
+
+    try:
+        try:
+            return book_slot_in_day_transaction(db.transaction(), db, user_id, slot_id, hold_id)
+        except FileNotFoundError:
+            # Not migrated yet: the slot may still be in the legacy array.
+            return book_slot_in_transaction(db.transaction(), db, user_id, slot_id)
+    finally:
+        # Also drop the cache on failure, since a conflict means the cached list is stale.
+        slots_changed(user_id)
+
+
+def plan_regeneration(user_id, legacy_slots, day_snapshots, regenerated_slots, now, dates):
+    """
+    Works out the writes that store regenerated slots in day buckets.
+
+    Args:
+        legacy_slots: The header's legacy `slots` array, or None if migrated.
+        day_snapshots: Snapshots of the day documents that may change.
+        now: The current time in the host's timezone. Day IDs are dates in
+            that timezone, so its date decides which days are past.
+
+    Returns:
+        (slots, deleted day IDs, {day ID: day document} to set, header update).
+        Days whose slots stay the same are not set, so they keep their
+        `updatedAt`; days emptied before they are past are set without slots.
+        Active holds are kept on slots that are still available.
+    """
+    existing_data = {day_doc.id: day_doc.to_dict() for day_doc in day_snapshots if day_doc.exists}
+    existing_by_day = {day_id: day_bucket_slots(day_data) for day_id, day_data in existing_data.items()}
+    existing_slots = list(legacy_slots or [])
+    for day_slots in existing_by_day.values():
+        existing_slots.extend(day_slots.values())
+
+    # The legacy array is migrated as a whole, whatever days are being regenerated.
+    slots = merge_regenerated_slots(existing_slots, regenerated_slots, now, dates)
+    slots_by_day = _group_by_day(slots)
+    today = now.date().isoformat()
+    deleted = []
+    for day_id, day_slots in existing_by_day.items():
+        if day_id in slots_by_day:
+            continue
+        if day_id < today:
+            deleted.append(day_id)
+        elif day_slots:
+            slots_by_day[day_id] = {}
+    changed = {}
+    for day_id, day_slots in slots_by_day.items():
+        if day_slots == existing_by_day.get(day_id):
+            continue
+        holds = {slot_id: hold for slot_id, hold in day_bucket_holds(existing_data.get(day_id, {}), now).items()
+                 if day_slots.get(slot_id, {}).get('status') == 'available'}
+        changed[day_id] = day_bucket_doc(day_id, day_slots, holds)
+
+    header_update = {'userId': user_id, 'layout': LAYOUT_DAILY}
+    if changed or deleted or legacy_slots is not None:
+        header_update['updatedAt'] = firestore.SERVER_TIMESTAMP
+    if legacy_slots is not None:
+        header_update['slots'] = firestore.DELETE_FIELD
+    return slots, deleted, changed, header_update
+
+
+def regeneration_scope(legacy_slots, dates) -> Optional[List[str]]:
+    """The day IDs a regeneration has to read, or None for every day document."""
+    if legacy_slots is not None or dates is None:
+        return None
+    return [day.isoformat() for day in sorted(dates)]
+
+
+def legacy_slots_of(header) -> Optional[List[dict]]:
+    """The legacy `slots` array of a header snapshot, or None if the user's slots are in day buckets."""
+    return header.to_dict().get('slots') if header.exists else None
+
+
+def _read_regeneration_state(transaction, db, user_id, dates):
+    """Reads what a regeneration of `dates` merges with: (legacy slots, day snapshots)."""
+    legacy_slots = legacy_slots_of(slots_header_ref(db, user_id).get(transaction=transaction))
+    days_ref = slot_days_ref(db, user_id)
+    scope = regeneration_scope(legacy_slots, dates)
+    if scope is None:
+        day_docs = list(days_ref.stream(transaction=transaction))
+    else:
+        day_docs = [days_ref.document(day_id).get(transaction=transaction) for day_id in scope]
+    return legacy_slots, day_docs
+
+
+def write_regeneration(transaction, db, user_id, legacy_slots, day_docs, regenerated_slots, now, dates):
+    """
+    Adds the writes of `plan_regeneration` to a transaction (sync or async,
+    whose writes are the same calls) and returns the merged slots.
+
+    Args:
+        legacy_slots, day_docs: What the transaction read, see `regeneration_scope`.
+    """
+    days_ref = slot_days_ref(db, user_id)
+    slots, deleted, day_docs_to_set, header_update = plan_regeneration(
+        user_id, legacy_slots, day_docs, regenerated_slots, now, dates)
+    for day_id in deleted:
+        transaction.delete(days_ref.document(day_id))
+    for day_id, day_doc in day_docs_to_set.items():
+        transaction.set(days_ref.document(day_id), day_doc)
+    transaction.set(slots_header_ref(db, user_id), header_update, merge=True)
+    return slots
+
+
+@firestore.transactional
+def _save_regenerated_slots_in_transaction(transaction, db, user_id, regenerated_slots, now, dates):
+    legacy_slots, day_docs = _read_regeneration_state(transaction, db, user_id, dates)
+    return write_regeneration(transaction, db, user_id, legacy_slots, day_docs, regenerated_slots, now, dates)
+
+
+@firestore.transactional
+def _save_many_in_transaction(transaction, db, regenerated_by_user, now, dates, timezones):
+    # Firestore transactions need every read before the first write.
+    states = {user_id: _read_regeneration_state(transaction, db, user_id, dates) for user_id in regenerated_by_user}
+    return {
+        user_id: write_regeneration(transaction, db, user_id, *states[user_id], regenerated_slots,
+                                    now.astimezone(timezones[user_id]) if timezones else now, dates)
+        for user_id, regenerated_slots in regenerated_by_user.items()
+    }
+
+
+@traced('firestore.save_regenerated_slots')
+def save_regenerated_slots(
+    db,
+    user_id: str,
+    regenerated_slots: List[dict],
+    now: datetime,
+    dates: Optional[Collection[date]] = None,
+) -> List[dict]:
+    """
+    Writes regenerated slots without losing bookings.
+
+    Available slots on `dates` (or on every date when None) are replaced and
+    booked slots are kept, see `slot_engine.merge_regenerated_slots`. Legacy
+    array data is moved into day buckets on the way.
+
+    Returns:
+        The slots of the regenerated days after the merge.
+    """
+    slots = _save_regenerated_slots_in_transaction(db.transaction(), db, user_id, regenerated_slots, now, dates)
+    slots_changed(user_id)
+    return slots
+
+
+@traced('firestore.save_regenerated_slots_many')
+def save_regenerated_slots_many(
+    db,
+    regenerated_by_user: Dict[str, List[dict]],
+    now: datetime,
+    dates: Optional[Collection[date]] = None,
+    timezones: Optional[Dict[str, tzinfo]] = None,
+) -> Dict[str, List[dict]]:
+    """
+    `save_regenerated_slots` for several users in one transaction, so their
+    writes go out in a single commit. Keep the batch small enough to stay under
+    Firestore's 500 writes per commit (about 16 per user for the full horizon).
+
+    Args:
+        timezones: Each user's timezone, when `now` is not in it.
+
+    Returns:
+        {user ID: the slots of the regenerated days after the merge}.
+    """
+    if not regenerated_by_user:
+        return {}
+    slots_by_user = _save_many_in_transaction(db.transaction(), db, regenerated_by_user, now, dates, timezones)
+    for user_id in regenerated_by_user:
+        slots_changed(user_id)
+    return slots_by_user
+
+
+def migrate_legacy_slots(db, user_id: str, now: Optional[datetime] = None) -> bool:
+    """
+    Moves a user's legacy `slots` array into day buckets.
+
+    Returns:
+        True if there was legacy data to migrate.
+    """
+    header = slots_header_ref(db, user_id).get()
+    if not header.exists or 'slots' not in header.to_dict():
+        return False
+    # Day IDs are dates in the host's timezone, like the slot engine's days.
+    user_doc = db.collection('users').document(user_id).get()
+    settings = user_doc.to_dict().get('settings') if user_doc.exists else None
+    now = (now or datetime.now(timezone.utc)).astimezone(SlotSettings.from_user_settings(settings).timezone)
+    _save_regenerated_slots_in_transaction(db.transaction(), db, user_id, [], now, set())
+    slots_changed(user_id)
+    return True
@@ -0,0 +1,128 @@
+"""
+Availability of a team of hosts.
+
+Collective teams need every host free, so a slot is blocked by the union of
+the hosts' busy intervals. Round-robin teams need any one host free for the
+whole slot. Two hosts busy one after the other are never busy at the same
+instant, yet neither can take a slot spanning both, so each host's busy
+intervals are first widened to the slot starts they block and those are
+intersected. Both are computed from the hosts' merged, sorted busy intervals
+with a k-way heap merge, in O(n log k) for n intervals over k hosts, and then
+fed to the regular slot sweep (`slot_engine.iter_available_slots`).
+"""
+import heapq
+import os
+from bisect import bisect_right
+from datetime import date
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from slot_engine import SlotSettings, iter_available_slots
+
+TEAM_MODE_COLLECTIVE = 'collective'
+TEAM_MODE_ROUND_ROBIN = 'round_robin'
+TEAM_MODES = (TEAM_MODE_COLLECTIVE, TEAM_MODE_ROUND_ROBIN)
+TEAM_MAX_MEMBERS = int(os.getenv("TEAM_MAX_MEMBERS", "200"))
+
+Intervals = List[Tuple[float, float]]
+
+
+def union_busy(host_busy: Sequence[Intervals]) -> Intervals:
+    """Times at which at least one host is busy. Each host's intervals must be merged and sorted."""
+    result = []
+    for start, end in heapq.merge(*host_busy):
+        if result and start <= result[-1][1]:
+            if end > result[-1][1]:
+                result[-1] = (result[-1][0], end)
+        else:
+            result.append((start, end))
+    return result
+
+
+def _widen(busy: Intervals, duration: float) -> Intervals:
+    # A slot starting in (start - duration, end) overlaps (start, end). Blocks that only touch stay
+    # apart: a slot can start right where one widened block ends.
+    result = []
+    for start, end in busy:
+        if result and start - duration < result[-1][1]:
+            result[-1] = (result[-1][0], max(end, result[-1][1]))
+        else:
+            result.append((start - duration, end))
+    return result
+
+
+def _boundaries(intervals: Intervals) -> Iterable[Tuple[float, int]]:
+    # Ends sort before starts at the same instant: the intervals are open.
+    for start, end in intervals:
+        yield start, 1
+        yield end, 0
+
+
+def blocked_starts(host_busy: Sequence[Intervals], duration: float) -> Intervals:
+    """
+    Open intervals of slot starts no single host is free for, with slots of `duration` seconds.
+
+    Each host's intervals must be merged and sorted. A start is blocked only if it is blocked for
+    every host, so this is the intersection of the hosts' widened busy intervals.
+    """
+    host_count = len(host_busy)
+    result = []
+    busy_hosts = 0
+    blocked_since = None
+    for at, is_start in heapq.merge(*(_boundaries(_widen(busy, duration)) for busy in host_busy)):
+        if is_start:
+            busy_hosts += 1
+            if busy_hosts == host_count:
+                blocked_since = at
+            continue
+        if busy_hosts == host_count:
+            result.append((blocked_since, at))
+        busy_hosts -= 1
+    return result
+
+
+def team_busy(host_busy: Sequence[Intervals], mode: str, duration: float) -> Intervals:
+    """
+    The intervals that block a team slot of `duration` seconds in `mode`, for the slot sweep.
+
+    Round-robin teams get the blocked starts (a, b) as (a + duration, b): the sweep skips a slot
+    starting at t when an interval starts before t + duration and ends after t. When fewer than
+    `duration` seconds of starts are blocked the pair is reversed, so the result is not a list of
+    busy times and must not be merged with other intervals.
+    """
+    if mode == TEAM_MODE_COLLECTIVE:
+        return union_busy(host_busy)
+    if mode == TEAM_MODE_ROUND_ROBIN:
+        return [(start + duration, end) for start, end in blocked_starts(host_busy, duration)]
+    raise ValueError(f"Unknown team mode: {mode}")
+
+
+def iter_team_slots(host_busy: Sequence[Intervals], mode: str, slot_settings: SlotSettings, days: Iterable[date],
+                    not_before_ts: float) -> Iterator[dict]:
+    """
+    Lazily yields the free team slots of `days` in `mode`, in order.
+
+    Args:
+        host_busy: Each host's merged, sorted busy intervals as POSIX timestamps.
+        mode: TEAM_MODE_COLLECTIVE or TEAM_MODE_ROUND_ROBIN.
+        slot_settings, days, not_before_ts: As for `slot_engine.iter_available_slots`.
+    """
+    blocked = team_busy(host_busy, mode, slot_settings.slot_duration_minutes * 60)
+    return iter_available_slots(blocked, slot_settings, days, not_before_ts)
+
+
+def is_free(busy: Intervals, start_ts: float, end_ts: float) -> bool:
+    """Whether [start_ts, end_ts) misses every interval of a merged, sorted list."""
+    i = bisect_right(busy, (start_ts, float('inf')))
+    if i and busy[i - 1][1] > start_ts:
+        return False
+    return i == len(busy) or busy[i][0] >= end_ts
+
+
+def free_hosts(busy_by_host: Dict[str, Intervals], start_ts: float, end_ts: float) -> List[str]:
+    """The hosts with nothing in [start_ts, end_ts)."""
+    return [host for host, busy in busy_by_host.items() if is_free(busy, start_ts, end_ts)]
+
+
+def assignment_order(hosts: Iterable[str], assignments: Dict[str, int]) -> List[str]:
+    """Round-robin candidates, least assigned first; ties go by host ID so the order is stable."""
+    return sorted(hosts, key=lambda host: (assignments.get(host, 0), host))
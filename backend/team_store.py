@@ -0,0 +1,192 @@
+"""
+Firestore storage of teams and their bookings (`firestore.AsyncClient`).
+
+Layout:
+    teams/{teamId}                        name, ownerUserId, memberUserIds, mode, settings, publicUrlToken
+    teams/{teamId}/members/{userId}       assignments: round-robin bookings given to the member
+    users/{userId}/teamReservations/{id}  one per team booking the user takes part in, keyed by the
+                                          slot's UTC start, so a host is never given one slot twice
+
+A member's own booking page must not offer the time of their team booking
+either: reserving a team slot marks the member's overlapping personal slots
+(`slot_store` day buckets) as booked in the same transaction, and the
+reservation lists them (`slotIds`) so that releasing it makes them available
+again. A member whose overlapping personal slot is booked or held is not free.
+"""
+from datetime import datetime, timedelta, timezone, tzinfo
+from typing import Callable, Dict, List
+
+from google.cloud import firestore
+
+from booking_store import check_new_booking
+from metrics import traced
+from slot_store import (day_bucket_doc, day_bucket_holds, day_bucket_slots, release_slot_from_day, slot_day_id,
+                        slot_days_ref, slots_changed, team_reservation_ref, touch_header)
+from team_engine import TEAM_MODE_COLLECTIVE, TEAM_MODE_ROUND_ROBIN
+
+
+def _personal_day_ids(slot: dict, tz: tzinfo) -> List[str]:
+    """The member's day buckets a team slot overlaps, in the member's timezone."""
+    first = datetime.fromisoformat(slot['startTime']).astimezone(tz).date()
+    last = (datetime.fromisoformat(slot['endTime']) - timedelta(microseconds=1)).astimezone(tz).date()
+    return [(first + timedelta(days=n)).isoformat() for n in range((last - first).days + 1)]
+
+
+def _overlapping(slots: Dict[str, dict], start: datetime, end: datetime) -> List[str]:
+    return [slot_id for slot_id, slot in slots.items()
+            if datetime.fromisoformat(slot['startTime']) < end and datetime.fromisoformat(slot['endTime']) > start]
+
+
+async def _read_personal_days(transaction, db, user_id, slot, tz, now):
+    """
+    The member's day buckets holding slots that overlap a team slot, as
+    {day ID: (slots, holds, overlapping slot IDs)}, or None if one of those
+    slots is booked or held.
+    """
+    start, end = datetime.fromisoformat(slot['startTime']), datetime.fromisoformat(slot['endTime'])
+    days = {}
+    for day_id in _personal_day_ids(slot, tz):
+        snapshot = await slot_days_ref(db, user_id).document(day_id).get(transaction=transaction)
+        if not snapshot.exists:
+            continue
+        day_data = snapshot.to_dict()
+        slots = day_bucket_slots(day_data)
+        holds = day_bucket_holds(day_data, now)
+        overlapping = _overlapping(slots, start, end)
+        if any(slots[slot_id].get('status') != 'available' or slot_id in holds for slot_id in overlapping):
+            return None
+        if overlapping:
+            days[day_id] = (slots, holds, overlapping)
+    return days
+
+
+@traced('firestore.read_assignments')
+async def read_assignments_async(db, team_id: str) -> Dict[str, int]:
+    """Round-robin assignment counts per member."""
+    members_ref = db.collection('teams').document(team_id).collection('members')
+    return {member_doc.id: member_doc.to_dict().get('assignments', 0)
+            async for member_doc in members_ref.stream()}
+
+
+@firestore.async_transactional
+async def _reserve_in_transaction(transaction, db, team_id, mode, slot, candidates, timezones,
+                                  booking_ref, booking_data):
+    check_new_booking(await booking_ref.get(transaction=transaction))
+    needed = len(candidates) if mode == TEAM_MODE_COLLECTIVE else 1
+    now = datetime.now(timezone.utc)
+    reserved = {}  # user ID -> personal day buckets to mark
+    for user_id in candidates:
+        snapshot = await team_reservation_ref(db, user_id, slot['startTime']).get(transaction=transaction)
+        if snapshot.exists:
+            continue
+        days = await _read_personal_days(transaction, db, user_id, slot, timezones[user_id], now)
+        if days is None:
+            continue
+        reserved[user_id] = days
+        if len(reserved) == needed:
+            break
+    if len(reserved) < needed:
+        raise ValueError("Slot is no longer available.")
+
+    members_ref = db.collection('teams').document(team_id).collection('members')
+    for user_id, days in reserved.items():
+        slot_ids = []
+        for day_id, (slots, holds, overlapping) in days.items():
+            for slot_id in overlapping:
+                slots[slot_id]['status'] = 'booked'
+            slot_ids += overlapping
+            transaction.set(slot_days_ref(db, user_id).document(day_id), day_bucket_doc(day_id, slots, holds))
+        if days:
+            touch_header(transaction, db, user_id)
+        transaction.set(team_reservation_ref(db, user_id, slot['startTime']), {
+            'teamId': team_id,
+            'bookingId': booking_ref.id,
+            'startTime': slot['startTime'],
+            'endTime': slot['endTime'],
+            'slotIds': slot_ids,
+        })
+    reserved = list(reserved)
+    if mode == TEAM_MODE_ROUND_ROBIN:
+        # Counts are only kept for round robin; a blind increment keeps concurrent bookings from conflicting.
+        transaction.set(members_ref.document(reserved[0]), {'assignments': firestore.Increment(1)}, merge=True)
+    transaction.set(booking_ref, booking_data(reserved))
+    return reserved
+
+
+@traced('firestore.reserve_team_slot')
+async def reserve_team_slot_async(db, team_id: str, mode: str, slot: dict, candidates: List[str],
+                                  timezones: Dict[str, tzinfo], booking_ref,
+                                  booking_data: Callable[[List[str]], dict]) -> List[str]:
+    """
+    Atomically reserves a team slot and writes its booking.
+
+    A collective booking reserves the slot for every candidate. A round-robin
+    booking goes to the first free candidate, which also counts towards that
+    member's assignments. A candidate is free without a reservation for the
+    slot and without a booked or held personal slot overlapping it.
+
+    Args:
+        timezones: Each candidate's timezone, which their personal day buckets follow.
+        booking_data: Function of the reserved user IDs returning the booking document data.
+
+    Returns:
+        The reserved user IDs.
+
+    Raises:
+        ValueError: If the slot is taken (collective: for any candidate; round robin: for all of them).
+        DuplicateBookingError: If `booking_ref` already holds a booking that
+            has not failed; nothing is written.
+    """
+    try:
+        return await _reserve_in_transaction(db.transaction(), db, team_id, mode, slot, candidates, timezones,
+                                             booking_ref, booking_data)
+    finally:
+        for user_id in candidates:
+            slots_changed(user_id)
+
+
+@firestore.async_transactional
+async def _release_in_transaction(transaction, db, team_id, mode, slot_start, user_ids, booking_ref, booking_update):
+    marked = {}  # user ID -> {day ID: (day data, slot IDs)}
+    for user_id in user_ids:
+        reservation = await team_reservation_ref(db, user_id, slot_start).get(transaction=transaction)
+        slot_ids = reservation.to_dict().get('slotIds', []) if reservation.exists else []
+        days = {}
+        for slot_id in slot_ids:
+            days.setdefault(slot_day_id(slot_id), []).append(slot_id)
+        marked[user_id] = {}
+        for day_id, day_slot_ids in days.items():
+            day = await slot_days_ref(db, user_id).document(day_id).get(transaction=transaction)
+            if day.exists:
+                marked[user_id][day_id] = (day.to_dict(), day_slot_ids)
+
+    now = datetime.now(timezone.utc)
+    for user_id, days in marked.items():
+        for day_id, (day_data, slot_ids) in days.items():
+            slots = day_bucket_slots(day_data)
+            for slot_id in slot_ids:
+                release_slot_from_day(slots, slot_id)
+            transaction.set(slot_days_ref(db, user_id).document(day_id),
+                            day_bucket_doc(day_id, slots, day_bucket_holds(day_data, now)))
+        if days:
+            touch_header(transaction, db, user_id)
+        transaction.delete(team_reservation_ref(db, user_id, slot_start))
+    if mode == TEAM_MODE_ROUND_ROBIN:
+        transaction.set(db.collection('teams').document(team_id).collection('members').document(user_ids[0]),
+                        {'assignments': firestore.Increment(-1)}, merge=True)
+    transaction.update(booking_ref, booking_update)
+
+
+@traced('firestore.release_team_slot')
+async def release_team_slot_async(db, team_id: str, mode: str, slot_start: str, user_ids: List[str],
+                                  booking_ref, booking_update: dict):
+    """
+    Undoes `reserve_team_slot_async` after the Calendar event could not be
+    created, making the members' personal slots it marked available again.
+    """
+    try:
+        await _release_in_transaction(db.transaction(), db, team_id, mode, slot_start, user_ids,
+                                      booking_ref, booking_update)
+    finally:
+        for user_id in user_ids:
+            slots_changed(user_id)
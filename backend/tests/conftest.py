@@ -0,0 +1,85 @@
+"""
+Shared fixtures: the app wired to the in-memory Firestore double and the fake
+Calendar server of `benchmarks`, with one host whose slots cover the next
+two weeks.
+"""
+from datetime import datetime
+
+import httpx
+import pytest
+
+from benchmarks.fixtures import configure_app_env
+
+configure_app_env()
+
+import main as api
+import slot_store
+from booking_queue import BookingQueue
+from booking_store import booking_results
+from calendar_client import AsyncCalendarClient
+from slot_engine import SlotSettings, compute_available_slots
+from token_crypto import decrypted_tokens
+from user_context import user_profiles
+from benchmarks.fake_calendar import FakeCalendar, FakeCalendarServer
+from benchmarks.fake_firestore import FakeAsyncFirestore, FakeFirestore
+
+HOST_ID = 'host-1'
+PUBLIC_TOKEN = 'public-token'
+SETTINGS = {'workingHours': {'start': '09:00', 'end': '17:00'}, 'slotDuration': 30,
+            'timezone': 'UTC', 'workingDays': [0, 1, 2, 3, 4, 5, 6]}
+
+
+@pytest.fixture
+def anyio_backend():
+    return 'asyncio'
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """An empty in-memory Firestore set as the app's clients, with the app's caches cleared."""
+    fake_db = FakeFirestore()
+    monkeypatch.setattr(api, 'db', fake_db)
+    monkeypatch.setattr(api, 'async_db', FakeAsyncFirestore(fake_db))
+    for cache in (api.public_user_cache, api.public_team_cache, api.busy_cache, slot_store.slots_cache, booking_results,
+                  decrypted_tokens, user_profiles):
+        cache.clear()
+    return fake_db
+
+
+@pytest.fixture
+def async_db(db):
+    """The `firestore.AsyncClient` view of `db`."""
+    return api.async_db
+
+
+@pytest.fixture
+def host(db):
+    """Seeds HOST_ID with its settings and regenerated slots; returns the slots."""
+    now = datetime.now(SlotSettings.from_user_settings(SETTINGS).timezone)
+    db.collection('users').document(HOST_ID).set({
+        'userId': HOST_ID, 'email': 'host@example.com', 'publicUrlToken': PUBLIC_TOKEN, 'settings': SETTINGS,
+        'encryptedAccessToken': api.encrypt_token('access'), 'encryptedRefreshToken': api.encrypt_token('refresh'),
+    })
+    slots = compute_available_slots([], SlotSettings.from_user_settings(SETTINGS), now)
+    slot_store.save_regenerated_slots(db, HOST_ID, slots, now)
+    return slots
+
+
+@pytest.fixture
+def calendar_server():
+    """A fake Google Calendar (and OAuth token endpoint) served on a local port; `.calendar` is the fake."""
+    with FakeCalendarServer(FakeCalendar()) as server:
+        yield server
+
+
+@pytest.fixture
+async def client(db, host, calendar_server, monkeypatch):
+    """An HTTP client of the app, booking synchronously against the fake Calendar."""
+    monkeypatch.setattr(api, 'BOOKING_MODE', 'sync')
+    monkeypatch.setattr(api, 'calendar_client', AsyncCalendarClient(base_url=calendar_server.url))
+    monkeypatch.setattr(api, 'booking_queue', BookingQueue(api.process_booking_job, api.fail_booking_job,
+                                                           max_attempts=3, retry_base_seconds=0.01))
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://test") as http:
+        yield http
+    await api.booking_queue.aclose()
+    await api.calendar_client.aclose()
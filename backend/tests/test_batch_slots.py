@@ -0,0 +1,83 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+from batch_slots import HostAvailability, compute_available_slots_batch
+from slot_engine import SlotSettings, compute_available_slots
+
+ZONES = ['UTC', 'Asia/Tokyo', 'Europe/London', 'America/New_York', 'Australia/Lord_Howe', 'America/Sao_Paulo']
+# Starts of two-week horizons with a DST change in at least one of ZONES.
+NOWS = [datetime(2025, 3, 5, 12, 0), datetime(2025, 3, 26, 23, 30), datetime(2025, 4, 1, 8, 0),
+        datetime(2025, 10, 22, 0, 15), datetime(2025, 10, 30, 18, 0)]
+
+
+def random_settings(rng):
+    settings = {'timezone': rng.choice(ZONES), 'slotDuration': rng.choice((15, 30, 45, 60, 90))}
+    kind = rng.randrange(3)
+    if kind == 0:
+        settings.update(workingHours={'start': '09:00', 'end': '17:00'}, workingDays=[0, 1, 2, 3, 4])
+    elif kind == 1:
+        # Overnight, across the 01:00-03:00 local times that DST changes skip or repeat.
+        settings.update(workingHours={'start': rng.choice(('20:00', '22:30', '23:00')),
+                                      'end': rng.choice(('02:00', '03:30', '06:00'))},
+                        workingDays=sorted(rng.sample(range(7), 4)))
+    else:
+        settings['weeklyHours'] = {
+            str(weekday): [{'start': '00:30', 'end': '03:30'}, {'start': '13:00', 'end': '01:00'}]
+            if weekday % 2 else [{'start': '08:00', 'end': '12:00'}]
+            for weekday in rng.sample(range(7), 5)}
+    return settings
+
+
+def random_busy(rng, start, count):
+    """Busy intervals anywhere in the horizon, many of them running over midnight."""
+    busy = []
+    for _ in range(count):
+        busy_start = start + timedelta(minutes=rng.randrange(0, 15 * 24 * 60, 5))
+        busy.append((busy_start, busy_start + timedelta(minutes=rng.choice((15, 40, 90, 300, 26 * 60)))))
+    return busy
+
+
+@pytest.mark.parametrize('now', NOWS, ids=lambda now: now.date().isoformat())
+def test_batch_matches_the_per_user_path(now):
+    rng = random.Random(now.toordinal())
+    now = pytz.utc.localize(now)
+    hosts = [HostAvailability(f"host-{n}", random_busy(rng, now - timedelta(days=1), rng.randrange(0, 60)),
+                              SlotSettings.from_user_settings(random_settings(rng)))
+             for n in range(60)]
+
+    batch = compute_available_slots_batch(hosts, now)
+    assert set(batch) == {host.user_id for host in hosts}
+    for host in hosts:
+        assert batch[host.user_id].to_dicts() == compute_available_slots(host.busy_times, host.slot_settings, now), \
+            host.slot_settings
+
+
+def test_hosts_sharing_settings_keep_their_own_busy_times():
+    now = pytz.utc.localize(datetime(2025, 3, 26, 0, 0))
+    slot_settings = SlotSettings.from_user_settings({'timezone': 'Europe/London', 'slotDuration': 30,
+                                                     'workingHours': {'start': '23:00', 'end': '02:00'},
+                                                     'workingDays': [5]})
+    london = pytz.timezone('Europe/London')
+    # Saturday 29 March, the night the clocks go forward.
+    night = (london.localize(datetime(2025, 3, 29, 23, 30)), london.localize(datetime(2025, 3, 30, 3, 0)))
+    hosts = [HostAvailability('busy', [night], slot_settings), HostAvailability('free', [], slot_settings)]
+
+    batch = compute_available_slots_batch(hosts, now)
+    def that_night(host_id):
+        return [slot['slotId'] for slot in batch[host_id].to_dicts() if slot['slotId'] < '2025-03-31']
+
+    # 01:00-02:00 local does not exist that night, so the window ends at 01:00 UTC.
+    assert that_night('free') == ['2025-03-29T23:00:00+00:00', '2025-03-29T23:30:00+00:00',
+                                  '2025-03-30T00:00:00+00:00', '2025-03-30T00:30:00+00:00']
+    assert that_night('busy') == ['2025-03-29T23:00:00+00:00']
+    assert batch['free'].to_dicts() == compute_available_slots([], slot_settings, now)
+    assert len(batch['free'].to_dicts()) > len(batch['busy'].to_dicts())
+
+
+def test_slot_duration_must_be_positive():
+    slot_settings = SlotSettings.from_user_settings({'slotDuration': 0})
+    with pytest.raises(ValueError):
+        compute_available_slots_batch([HostAvailability('host', [], slot_settings)])
@@ -0,0 +1,172 @@
+"""
+Booking requests against a fault at every step: each slot must end up with
+exactly one confirmed booking and one Calendar event, or free with neither.
+"""
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import main as api
+from async_slot_store import book_slot_async
+from booking_store import booking_results, derived_booking_id_secret
+from reconcile_bookings import RECONCILE_GRACE_SECONDS, reconcile_bookings_async
+from slot_store import read_slots, slots_cache
+
+from conftest import HOST_ID, PUBLIC_TOKEN
+
+pytestmark = pytest.mark.anyio
+
+
+async def book(client, slot_id, key):
+    return await client.post('/api/bookings', headers={'Idempotency-Key': key}, json={
+        'publicUrlToken': PUBLIC_TOKEN, 'slotId': slot_id, 'bookerName': 'Booker', 'bookerEmail': 'booker@example.com'})
+
+
+def slot_of(db, slot_id):
+    slots_cache.clear()
+    return next(slot for slot in read_slots(db, HOST_ID) if slot['slotId'] == slot_id)
+
+
+def live_bookings(db, slot_id):
+    return [doc.to_dict() for doc in db.collection('bookings').stream()
+            if doc.to_dict()['slotId'] == slot_id and doc.to_dict()['status'] != 'failed']
+
+
+def events_at(calendar, slot):
+    return [event for event in calendar.calendars.get('primary', {}).values()
+            if event['start']['dateTime'] == slot['startTime']]
+
+
+def assert_booked_once(db, calendar, slot_id):
+    slot = slot_of(db, slot_id)
+    bookings = live_bookings(db, slot_id)
+    assert slot['status'] == 'booked'
+    assert [booking['status'] for booking in bookings] == ['confirmed']
+    assert [event['id'] for event in events_at(calendar, slot)] == [bookings[0]['eventId']]
+
+
+def assert_free(db, calendar, slot_id):
+    slot = slot_of(db, slot_id)
+    assert slot['status'] == 'available'
+    assert live_bookings(db, slot_id) == []
+    assert events_at(calendar, slot) == []
+
+
+async def test_slot_transaction_fails_then_client_retries(client, db, host, calendar_server):
+    slot_id, key = host[0]['slotId'], uuid.uuid4().hex
+    db.fail_writes('days')
+    assert (await book(client, slot_id, key)).status_code == 500
+    assert (await book(client, slot_id, key)).status_code == 200
+    assert_booked_once(db, calendar_server.calendar, slot_id)
+
+
+async def test_calendar_503_is_finished_by_the_queue(client, db, host, calendar_server):
+    slot_id, key = host[0]['slotId'], uuid.uuid4().hex
+    calendar_server.calendar.fail_inserts(1, status=503)
+    assert (await book(client, slot_id, key)).status_code == 202
+    await api.booking_queue.join()
+    assert (await book(client, slot_id, key)).json()['status'] == 'confirmed'
+    assert_booked_once(db, calendar_server.calendar, slot_id)
+
+
+async def test_lost_insert_response_creates_one_event(client, db, host, calendar_server):
+    slot_id, key = host[0]['slotId'], uuid.uuid4().hex
+    calendar_server.calendar.fail_inserts(1, status=503, after_create=True)
+    assert (await book(client, slot_id, key)).status_code == 202
+    await api.booking_queue.join()
+    assert_booked_once(db, calendar_server.calendar, slot_id)
+
+
+async def test_failed_booking_update_is_retried(client, db, host, calendar_server):
+    slot_id, key = host[0]['slotId'], uuid.uuid4().hex
+    db.fail_writes('bookings', after=1)  # The reservation goes through, the confirmation fails.
+    assert (await book(client, slot_id, key)).status_code == 202
+    await api.booking_queue.join()
+    assert_booked_once(db, calendar_server.calendar, slot_id)
+
+
+async def test_permanent_403_frees_the_slot_until_a_retry(client, db, host, calendar_server):
+    slot_id, key = host[0]['slotId'], uuid.uuid4().hex
+    calendar_server.calendar.fail_inserts(1, status=403)
+    assert (await book(client, slot_id, key)).status_code == 500
+    assert_free(db, calendar_server.calendar, slot_id)
+
+    assert (await book(client, slot_id, key)).status_code == 200
+    assert_booked_once(db, calendar_server.calendar, slot_id)
+
+
+async def test_concurrent_duplicates_book_once(client, db, host, calendar_server):
+    slot_id, key = host[0]['slotId'], uuid.uuid4().hex
+    responses = await asyncio.gather(*(book(client, slot_id, key) for _ in range(5)))
+    assert {response.status_code for response in responses} <= {200, 202}
+    assert len({response.json()['bookingId'] for response in responses}) == 1
+    await api.booking_queue.join()
+    assert_booked_once(db, calendar_server.calendar, slot_id)
+
+    booking_results.clear()
+    db.reset_stats()
+    calendar_server.calendar.requests.clear()
+    assert (await book(client, slot_id, key)).status_code == 200
+    assert db.stats['commits'] == 0
+    assert calendar_server.calendar.request_count() == 0
+
+
+async def test_same_key_for_another_slot_is_rejected(client, db, host, calendar_server):
+    key = uuid.uuid4().hex
+    assert (await book(client, host[0]['slotId'], key)).status_code == 200
+    assert (await book(client, host[1]['slotId'], key)).status_code == 422
+    booking_results.clear()
+    assert (await book(client, host[1]['slotId'], key)).status_code == 422
+    assert_free(db, calendar_server.calendar, host[1]['slotId'])
+
+
+async def test_reconciliation_repairs_crashes_and_leftovers(client, db, host, calendar_server):
+    calendar = calendar_server.calendar
+    now = datetime.now(timezone.utc)
+    # Reconciliation only looks at slots that have not ended.
+    crashed_id, orphan_id, recoverable_id, failed_id = (slot['slotId'] for slot in host[16:20])
+    booking_ref = api.async_db.collection('bookings').document('crashed')
+    await book_slot_async(api.async_db, HOST_ID, crashed_id, booking=(booking_ref, lambda slot: {
+        'bookingId': 'crashed', 'hostUserId': HOST_ID, 'slotId': crashed_id,
+        'startTime': slot['startTime'], 'endTime': slot['endTime'], 'bookerName': 'Booker',
+        'bookerEmail': 'booker@example.com', 'requestId': f"{crashed_id}-booker@example.com",
+        'eventId': uuid.uuid4().hex, 'status': 'pending', 'createdAt': now - timedelta(hours=1)}))
+    await book_slot_async(api.async_db, HOST_ID, orphan_id)
+    recoverable = await book_slot_async(api.async_db, HOST_ID, recoverable_id)
+    calendar.upsert_event('legacyevent', datetime.fromisoformat(recoverable['startTime']),
+                          datetime.fromisoformat(recoverable['endTime']),
+                          attendees=[{'email': 'host@example.com'}, {'email': 'legacy@example.com'}])
+    failed = slot_of(db, failed_id)
+    calendar.upsert_event('failedevent', datetime.fromisoformat(failed['startTime']),
+                          datetime.fromisoformat(failed['endTime']))
+    db.collection('bookings').document('failed').set({
+        'bookingId': 'failed', 'hostUserId': HOST_ID, 'slotId': failed_id, 'eventId': 'failedevent',
+        'status': 'failed', 'updatedAt': now})
+
+    async def reconcile():
+        later = datetime.now(timezone.utc) + timedelta(seconds=2 * RECONCILE_GRACE_SECONDS)
+        stats = await reconcile_bookings_async(api.async_db, api.calendar_client, api.calendar_pool.credentials,
+                                               api.booking_queue.enqueue, now=later)
+        await api.booking_queue.join()
+        return stats
+
+    assert await reconcile() == {'resumed': 1, 'events_deleted': 1, 'recovered': 1, 'released': 1}
+    assert_booked_once(db, calendar, crashed_id)
+    assert_free(db, calendar, orphan_id)
+    assert_booked_once(db, calendar, recoverable_id)
+    assert_free(db, calendar, failed_id)
+    assert not any((await reconcile()).values())
+
+
+def test_booking_id_secret_is_derived_from_the_jwt_secret():
+    assert derived_booking_id_secret(None) is None
+    assert derived_booking_id_secret('jwt-secret') not in (None, 'jwt-secret')
+
+
+async def test_startup_fails_without_a_booking_id_secret(monkeypatch):
+    monkeypatch.setattr(api, 'BOOKING_ID_SECRET', None)
+    with pytest.raises(RuntimeError):
+        async with api.lifespan(api.app):
+            pass
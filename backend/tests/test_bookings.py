@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+import main as api
+from booking_store import booking_results
+from slot_store import read_slots, slots_cache
+
+from conftest import HOST_ID, PUBLIC_TOKEN
+
+pytestmark = pytest.mark.anyio
+
+
+async def book(client, slot_id, key=None, email='booker@example.com'):
+    headers = {'Idempotency-Key': key} if key else {}
+    return await client.post('/api/bookings', headers=headers, json={
+        'publicUrlToken': PUBLIC_TOKEN, 'slotId': slot_id, 'bookerName': 'Booker', 'bookerEmail': email})
+
+
+def bookings_of(db, slot_id):
+    return [doc.to_dict() for doc in db.collection('bookings').stream()
+            if doc.to_dict()['slotId'] == slot_id and doc.to_dict()['status'] != 'failed']
+
+
+def events_at(calendar, slot):
+    return [event for event in calendar.calendars.get('primary', {}).values()
+            if event['start']['dateTime'] == slot['startTime']]
+
+
+def status_of(db, slot_id):
+    slots_cache.clear()
+    return next(slot['status'] for slot in read_slots(db, HOST_ID) if slot['slotId'] == slot_id)
+
+
+async def test_retry_returns_the_first_booking(client, db, host, calendar_server):
+    slot = host[0]
+    first = await book(client, slot['slotId'], 'key-1')
+    assert first.status_code == 200, first.text
+
+    retry = await book(client, slot['slotId'], 'key-1')
+    assert retry.status_code == 200
+    assert retry.json()['bookingId'] == first.json()['bookingId']
+    assert len(bookings_of(db, slot['slotId'])) == 1
+    assert len(events_at(calendar_server.calendar, slot)) == 1
+    assert status_of(db, slot['slotId']) == 'booked'
+
+
+async def test_retry_from_another_process_reads_the_stored_booking(client, db, host, calendar_server):
+    slot_id = host[0]['slotId']
+    first = await book(client, slot_id, 'key-1')
+    booking_results.clear()
+    db.reset_stats()
+    calendar_server.calendar.requests.clear()
+
+    retry = await book(client, slot_id, 'key-1')
+    assert retry.json()['bookingId'] == first.json()['bookingId']
+    assert db.stats['commits'] == 0
+    assert calendar_server.calendar.request_count() == 0
+
+
+async def test_concurrent_duplicates_book_once(client, db, host, calendar_server):
+    slot = host[0]
+    responses = await asyncio.gather(*(book(client, slot['slotId'], 'key-1') for _ in range(5)))
+
+    assert {response.status_code for response in responses} <= {200, 202}
+    assert len({response.json()['bookingId'] for response in responses}) == 1
+    await api.booking_queue.join()
+    assert len(bookings_of(db, slot['slotId'])) == 1
+    assert len(events_at(calendar_server.calendar, slot)) == 1
+
+
+async def test_without_key_the_booker_and_slot_identify_the_request(client, db, host):
+    slot_id = host[0]['slotId']
+    first = await book(client, slot_id)
+    retry = await book(client, slot_id)
+
+    assert retry.status_code == 200
+    assert retry.json()['bookingId'] == first.json()['bookingId']
+    assert (await book(client, slot_id, email='other@example.com')).status_code == 409
+
+
+async def test_same_key_for_another_slot_is_rejected(client, db, host):
+    assert (await book(client, host[0]['slotId'], 'key-1')).status_code == 200
+
+    response = await book(client, host[1]['slotId'], 'key-1')
+    assert response.status_code == 422
+    assert status_of(db, host[1]['slotId']) == 'available'
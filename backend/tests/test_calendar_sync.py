@@ -0,0 +1,141 @@
+from datetime import timedelta
+
+import pytest
+
+from calendar_sync import fetch_busy_times, find_channel_owner, start_watch_channels, sync_user_calendar
+from slot_engine import SlotSettings, compute_available_slots
+from slot_store import book_slot, read_slots, slots_cache
+from benchmarks.fake_calendar import calendar_service
+from benchmarks.fixtures import fixed_now
+
+USER_ID = 'host-1'
+USER_DATA = {'settings': {'workingHours': {'start': '09:00', 'end': '17:00'}, 'slotDuration': 30,
+                          'timezone': 'Asia/Tokyo', 'workingDays': [0, 1, 2, 3, 4]}}
+
+
+@pytest.fixture
+def now():
+    return fixed_now()
+
+
+@pytest.fixture
+def service(calendar_server):
+    return calendar_service(calendar_server.url)
+
+
+def at(now, days, hour):
+    return now.tzinfo.normalize(now.replace(hour=hour, minute=0) + timedelta(days=days))
+
+
+def assert_slots_match_calendar(db, service, now, booked_ids=frozenset()):
+    """The stored slots equal a full regeneration, except that booked slots stay booked."""
+    slots_cache.clear()
+    expected = compute_available_slots(fetch_busy_times(service, now, now + timedelta(days=14)),
+                                       SlotSettings.from_user_settings(USER_DATA['settings']), now)
+    slots = read_slots(db, USER_ID)
+    booked = {slot['slotId'] for slot in slots if slot['status'] == 'booked'}
+    assert booked == set(booked_ids)
+    assert [slot for slot in slots if slot['status'] == 'available'] == [
+        slot for slot in expected if slot['slotId'] not in booked]
+
+
+def test_incremental_sync_only_regenerates_changed_days(db, calendar_server, service, now):
+    calendar = calendar_server.calendar
+    calendar.upsert_event('standup', at(now, 1, 10), at(now, 1, 11))
+    assert sync_user_calendar(db, service, USER_ID, USER_DATA, now=now) is None
+    assert_slots_match_calendar(db, service, now)
+
+    calendar.requests.clear()
+    calendar.upsert_event('standup', at(now, 3, 15), at(now, 3, 16))
+    affected = sync_user_calendar(db, service, USER_ID, USER_DATA, now=now)
+
+    assert affected == {at(now, 1, 0).date(), at(now, 3, 0).date()}
+    assert calendar.request_count('events.list') == 1
+    assert_slots_match_calendar(db, service, now)
+
+    assert sync_user_calendar(db, service, USER_ID, USER_DATA, now=now) == set()
+
+
+def test_expired_sync_token_falls_back_to_full_sync(db, calendar_server, service, now):
+    calendar = calendar_server.calendar
+    calendar.upsert_event('standup', at(now, 1, 10), at(now, 1, 11))
+    sync_user_calendar(db, service, USER_ID, USER_DATA, now=now)
+    booked_id = book_slot(db, USER_ID, read_slots(db, USER_ID)[0]['slotId'])['slotId']
+
+    calendar.expire_sync_tokens()
+    calendar.upsert_event('offsite', at(now, 8, 9), at(now, 8, 17))
+    calendar.requests.clear()
+
+    # The 410 answer to the stored token makes it list every event again and regenerate the whole horizon.
+    assert sync_user_calendar(db, service, USER_ID, USER_DATA, now=now) is None
+    assert calendar.request_count('events.list') == 2
+    assert_slots_match_calendar(db, service, now, {booked_id})
+
+    # The full sync stored a fresh token, so the next change is synced incrementally again.
+    calendar.cancel_event('offsite')
+    assert sync_user_calendar(db, service, USER_ID, USER_DATA, now=now) == {at(now, 8, 0).date()}
+    assert_slots_match_calendar(db, service, now, {booked_id})
+
+
+def test_each_calendar_has_its_own_sync_token(db, calendar_server, service, now):
+    calendar = calendar_server.calendar
+    calendar.add_calendar('team@example.com')
+    user_data = {'settings': {**USER_DATA['settings'], 'calendarIds': ['primary', 'team@example.com']}}
+    calendar.upsert_event('standup', at(now, 1, 10), at(now, 1, 11))
+    calendar.upsert_event('team-sync', at(now, 2, 10), at(now, 2, 11), calendar_id='team@example.com')
+    assert sync_user_calendar(db, service, USER_ID, user_data, now=now) is None
+
+    states = db.collection('calendarSync').document(USER_ID).get().to_dict()['calendars']
+    assert set(states) == {'primary', 'team@example.com'}
+    assert list(states['team@example.com']['eventIndex']) == ['team-sync']
+
+    calendar.upsert_event('team-sync', at(now, 4, 10), at(now, 4, 11), calendar_id='team@example.com')
+    calendar.requests.clear()
+    affected = sync_user_calendar(db, service, USER_ID, user_data, now=now, calendar_ids=['team@example.com'])
+
+    assert affected == {at(now, 2, 0).date(), at(now, 4, 0).date()}
+    assert calendar.request_count('events.list') == 1
+    slots_cache.clear()
+    expected = compute_available_slots(
+        fetch_busy_times(service, now, now + timedelta(days=14), calendar_ids=['primary', 'team@example.com']),
+        SlotSettings.from_user_settings(user_data['settings']), now)
+    assert read_slots(db, USER_ID) == expected
+
+    # Back to primary only: the other calendar's state is dropped.
+    sync_user_calendar(db, service, USER_ID, USER_DATA, now=now)
+    assert set(db.collection('calendarSync').document(USER_ID).get().to_dict()['calendars']) == {'primary'}
+
+
+def test_primary_only_state_is_taken_over(db, calendar_server, service, now):
+    calendar_server.calendar.upsert_event('standup', at(now, 1, 10), at(now, 1, 11))
+    sync_user_calendar(db, service, USER_ID, USER_DATA, now=now)
+    sync_ref = db.collection('calendarSync').document(USER_ID)
+    primary = sync_ref.get().to_dict()['calendars']['primary']
+    sync_ref.set({'syncToken': primary['syncToken'], 'eventIndex': primary['eventIndex']})
+
+    calendar_server.calendar.cancel_event('standup')
+    assert sync_user_calendar(db, service, USER_ID, USER_DATA, now=now) == {at(now, 1, 0).date()}
+    sync_state = sync_ref.get().to_dict()
+    assert 'syncToken' not in sync_state and list(sync_state['calendars']) == ['primary']
+
+
+def test_watch_channel_per_calendar(db, calendar_server, service):
+    calendar_ids = ['primary', 'team@example.com']
+    first = start_watch_channels(db, service, USER_ID, 'https://example.com/hook', calendar_ids)
+    channels = start_watch_channels(db, service, USER_ID, 'https://example.com/hook', calendar_ids)
+
+    assert list(channels) == calendar_ids
+    assert calendar_server.calendar.request_count('events.watch') == 4
+    assert calendar_server.calendar.request_count('channels.stop') == 2
+    for calendar_id, channel in channels.items():
+        assert find_channel_owner(db, channel['channelId'], channel['channelToken']) == (USER_ID, calendar_id)
+        assert find_channel_owner(db, channel['channelId'], 'wrong-token') is None
+        assert find_channel_owner(db, first[calendar_id]['channelId'], first[calendar_id]['channelToken']) is None
+
+
+def test_primary_only_channel_is_found(db):
+    db.collection('calendarSync').document(USER_ID).set(
+        {'userId': USER_ID, 'channelId': 'old-channel', 'channelToken': 'secret', 'resourceId': 'resource'})
+
+    assert find_channel_owner(db, 'old-channel', 'secret') == (USER_ID, 'primary')
+    assert find_channel_owner(db, 'old-channel', None) is None
@@ -0,0 +1,43 @@
+import pytest
+
+import metrics
+from benchmarks.fixtures import auth_headers
+
+from conftest import HOST_ID, PUBLIC_TOKEN
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.parametrize('path', ['/metrics', '/api/cache/stats'])
+async def test_operational_endpoints_need_the_metrics_token(client, monkeypatch, path):
+    monkeypatch.setattr(metrics, 'METRICS_TOKEN', 'metrics-token')
+    assert (await client.get(path)).status_code == 404
+    assert (await client.get(path, headers={'Authorization': 'Bearer wrong'})).status_code == 404
+    assert (await client.get(path, headers=auth_headers(HOST_ID))).status_code == 404
+    assert (await client.get(path, headers={'Authorization': 'Bearer metrics-token'})).status_code == 200
+
+    monkeypatch.setattr(metrics, 'METRICS_TOKEN', None)
+    assert (await client.get(path, headers={'Authorization': 'Bearer None'})).status_code == 404
+
+
+async def test_server_timing_only_for_signed_in_users(client):
+    public = await client.get(f'/api/slots/public/{PUBLIC_TOKEN}')
+    assert public.status_code == 200
+    assert 'server-timing' not in public.headers
+
+    signed_in = await client.get('/api/user/me/settings', headers=auth_headers(HOST_ID))
+    assert signed_in.status_code == 200
+    assert 'total;dur=' in signed_in.headers['server-timing']
+
+    rejected = await client.get('/api/user/me/settings', headers={'Authorization': 'Bearer forged'})
+    assert rejected.status_code == 401
+    assert 'server-timing' not in rejected.headers
+
+
+@pytest.mark.parametrize('setting, public_timing, signed_in_timing', [('all', True, True), ('off', False, False)])
+async def test_server_timing_setting(client, monkeypatch, setting, public_timing, signed_in_timing):
+    monkeypatch.setattr(metrics, 'SERVER_TIMING', setting)
+    public = await client.get(f'/api/slots/public/{PUBLIC_TOKEN}')
+    signed_in = await client.get('/api/user/me/settings', headers=auth_headers(HOST_ID))
+    assert ('server-timing' in public.headers) == public_timing
+    assert ('server-timing' in signed_in.headers) == signed_in_timing
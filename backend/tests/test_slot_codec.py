@@ -0,0 +1,60 @@
+import random
+from datetime import datetime
+
+import pytest
+import pytz
+
+from slot_codec import ENCODING_PACKED, PackedSlots
+from slot_engine import SlotSettings, compute_available_slots
+
+
+def slots_in(tz_name, now, duration=30, seed=0):
+    settings = SlotSettings.from_user_settings({
+        'workingHours': {'start': '08:00', 'end': '18:00'}, 'slotDuration': duration,
+        'timezone': tz_name, 'workingDays': [0, 1, 2, 3, 4, 5, 6]})
+    slots = compute_available_slots([], settings, settings.timezone.localize(now))
+    rng = random.Random(seed)
+    for slot in rng.sample(slots, len(slots) // 3):
+        slot['status'] = 'booked'
+    return slots
+
+
+@pytest.mark.parametrize('tz_name, now', [
+    ('UTC', datetime(2025, 1, 6, 8, 0)),
+    ('Asia/Kolkata', datetime(2025, 1, 6, 8, 0)),
+    # Both cross a DST change, so the slots use two UTC offsets.
+    ('America/New_York', datetime(2025, 3, 1, 8, 0)),
+    ('Australia/Lord_Howe', datetime(2025, 3, 30, 8, 0)),
+])
+def test_document_round_trip(tz_name, now):
+    slots = slots_in(tz_name, now)
+    document = PackedSlots.from_slots(slots).to_document()
+
+    assert document['encoding'] == ENCODING_PACKED
+    assert document['count'] == len(slots)
+    assert PackedSlots.from_document(document).to_slots() == slots
+
+
+def test_mixed_durations_round_trip():
+    slots = slots_in('Europe/Berlin', datetime(2025, 3, 20, 8, 0)) + slots_in(
+        'Europe/Berlin', datetime(2025, 6, 2, 8, 0), duration=45)
+    packed = PackedSlots.from_document(PackedSlots.from_slots(slots).to_document())
+
+    assert packed.to_slots() == sorted(slots, key=lambda slot: datetime.fromisoformat(slot['startTime']))
+
+
+def test_empty_round_trip():
+    assert PackedSlots.from_document(PackedSlots.from_slots([]).to_document()).to_slots() == []
+
+
+@pytest.mark.parametrize('slot', [
+    {'slotId': '2025-01-06T09:00:00+00:00', 'startTime': '2025-01-06T09:00:00+00:00',
+     'endTime': '2025-01-06T09:30:00+00:00', 'status': 'available', 'note': 'extra field'},
+    {'slotId': '2025-01-06T09:00:00+00:00', 'startTime': '2025-01-06T09:00:00+00:00',
+     'endTime': '2025-01-06T09:30:00+00:00', 'status': 'held'},
+    {'slotId': '2025-01-06T09:00:30+00:00', 'startTime': '2025-01-06T09:00:30+00:00',
+     'endTime': '2025-01-06T09:30:30+00:00', 'status': 'available'},
+])
+def test_unpackable_slots(slot):
+    with pytest.raises(ValueError):
+        PackedSlots.from_slots([slot])
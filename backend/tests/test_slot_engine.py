@@ -0,0 +1,77 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+from slot_engine import SlotSettings, compute_available_slots, merge_intervals
+
+TOKYO = pytz.timezone('Asia/Tokyo')
+SETTINGS = {'workingHours': {'start': '09:00', 'end': '17:00'}, 'slotDuration': 30,
+            'timezone': 'Asia/Tokyo', 'workingDays': [0, 1, 2, 3, 4]}
+
+
+def nested_scan_slots(busy_times, slot_settings, now, days):
+    """Every candidate slot checked against every busy interval, as generate_user_slots used to."""
+    tz = slot_settings.timezone
+    duration = timedelta(minutes=slot_settings.slot_duration_minutes)
+    slots = []
+    for i in range(days):
+        day = now.date() + timedelta(days=i)
+        if day.weekday() not in slot_settings.working_days:
+            continue
+        current = tz.localize(datetime.combine(day, slot_settings.work_start))
+        end = tz.localize(datetime.combine(day, slot_settings.work_end))
+        while current + duration <= end:
+            if current > now and not any(start < current + duration and current < stop for start, stop in busy_times):
+                slots.append(current.isoformat())
+            current += duration
+    return slots
+
+
+def test_merge_intervals():
+    assert merge_intervals([(5, 7), (1, 3), (3, 4), (6, 9), (10, 10), (12, 11)]) == [(1, 4), (5, 9)]
+    assert merge_intervals([]) == []
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_matches_the_nested_scan(seed):
+    rng = random.Random(seed)
+    slot_settings = SlotSettings.from_user_settings({**SETTINGS, 'slotDuration': rng.choice((15, 30, 45, 60))})
+    now = TOKYO.localize(datetime(2025, 1, 6, 10, 10))
+    busy_times = []
+    for _ in range(80):
+        start = now + timedelta(minutes=rng.randrange(0, 14 * 24 * 60, 5))
+        busy_times.append((start, start + timedelta(minutes=rng.randrange(5, 180, 5))))
+
+    slots = compute_available_slots(busy_times, slot_settings, now)
+    assert [slot['slotId'] for slot in slots] == nested_scan_slots(busy_times, slot_settings, now, 14)
+    assert all(slot['status'] == 'available' for slot in slots)
+    assert all(datetime.fromisoformat(slot['endTime']) - datetime.fromisoformat(slot['startTime'])
+               == timedelta(minutes=slot_settings.slot_duration_minutes) for slot in slots)
+
+
+def test_overnight_window_runs_into_the_next_day():
+    slot_settings = SlotSettings.from_user_settings({**SETTINGS, 'workingHours': {'start': '22:00', 'end': '02:00'},
+                                                     'slotDuration': 60, 'workingDays': [0]})
+    now = TOKYO.localize(datetime(2025, 1, 6, 0, 0))
+    # Slots belong to the day they start on, so Monday's window ends on Tuesday.
+    assert len(compute_available_slots([], slot_settings, now, days=1)) == 2
+    slots = compute_available_slots([], slot_settings, now, days=2)
+    assert [slot['slotId'] for slot in slots] == [
+        '2025-01-06T22:00:00+09:00', '2025-01-06T23:00:00+09:00',
+        '2025-01-07T00:00:00+09:00', '2025-01-07T01:00:00+09:00']
+
+
+def test_dates_limit_the_days():
+    slot_settings = SlotSettings.from_user_settings(SETTINGS)
+    now = TOKYO.localize(datetime(2025, 1, 6, 0, 0))
+    wanted = {now.date() + timedelta(days=2)}
+    slots = compute_available_slots([], slot_settings, now, dates=wanted)
+    assert {datetime.fromisoformat(slot['startTime']).date() for slot in slots} == wanted
+    assert len(slots) == 16
+
+
+def test_slot_duration_must_be_positive():
+    with pytest.raises(ValueError):
+        compute_available_slots([], SlotSettings.from_user_settings({**SETTINGS, 'slotDuration': 0}))
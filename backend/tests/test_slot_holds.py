@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from async_slot_store import hold_slot_async, sweep_expired_holds_async
+from slot_store import (HOLD_TTL_SECONDS, book_slot, read_slots, slot_day_id, slot_days_ref, slots_cache,
+                        slots_version, slots_header_ref)
+
+from conftest import HOST_ID
+
+pytestmark = pytest.mark.anyio
+
+
+def status_of(db, slot_id):
+    slots_cache.clear()
+    return next(slot['status'] for slot in read_slots(db, HOST_ID) if slot['slotId'] == slot_id)
+
+
+def expire_holds(db, slot_id):
+    """Moves the holds of the slot's day into the past, as if HOLD_TTL_SECONDS had gone by."""
+    day_ref = slot_days_ref(db, HOST_ID).document(slot_day_id(slot_id))
+    day_data = day_ref.get().to_dict()
+    past = datetime.now(timezone.utc) - timedelta(seconds=1)
+    for hold in day_data['holds'].values():
+        hold['expiresAt'] = past
+    day_ref.update({'holds': day_data['holds'], 'holdsExpireAt': past})
+
+
+async def test_hold_blocks_other_bookers(db, async_db, host):
+    slot_id = host[0]['slotId']
+    hold = await hold_slot_async(async_db, HOST_ID, slot_id)
+
+    assert status_of(db, slot_id) == 'held'
+    with pytest.raises(ValueError):
+        await hold_slot_async(async_db, HOST_ID, slot_id)
+    with pytest.raises(ValueError):
+        book_slot(db, HOST_ID, slot_id)
+    with pytest.raises(ValueError):
+        book_slot(db, HOST_ID, slot_id, hold_id=f"{slot_day_id(slot_id)}.someone-else")
+
+    assert book_slot(db, HOST_ID, slot_id, hold_id=hold['holdId'])['status'] == 'booked'
+    assert status_of(db, slot_id) == 'booked'
+
+
+async def test_hold_expires(db, async_db, host):
+    slot_id = host[1]['slotId']
+    hold = await hold_slot_async(async_db, HOST_ID, slot_id)
+    assert hold['expiresAt'] - datetime.now(timezone.utc) <= timedelta(seconds=HOLD_TTL_SECONDS)
+
+    expire_holds(db, slot_id)
+
+    # Reads and bookings ignore an expired hold before the sweeper removes it.
+    assert status_of(db, slot_id) == 'available'
+    assert book_slot(db, HOST_ID, slot_id)['status'] == 'booked'
+
+
+async def test_sweeper_drops_expired_holds(db, async_db, host):
+    slot_id = host[2]['slotId']
+    await hold_slot_async(async_db, HOST_ID, slot_id)
+    version = slots_version(slots_header_ref(db, HOST_ID).get().to_dict())
+
+    assert await sweep_expired_holds_async(async_db) == 0
+    expire_holds(db, slot_id)
+    assert await sweep_expired_holds_async(async_db) == 1
+    assert await sweep_expired_holds_async(async_db) == 0
+
+    day_data = slot_days_ref(db, HOST_ID).document(slot_day_id(slot_id)).get().to_dict()
+    assert 'holds' not in day_data
+    assert slots_version(slots_header_ref(db, HOST_ID).get().to_dict()) > version
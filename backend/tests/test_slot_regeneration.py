@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import pytz
+
+from async_slot_store import save_regenerated_slots_async
+from slot_engine import SlotSettings, compute_available_slots, parse_busy_intervals, slot_date
+from slot_store import (book_slot, migrate_legacy_slots, read_slots, save_regenerated_slots,
+                        save_regenerated_slots_many, slot_days_ref, slots_cache, slots_header_ref)
+from benchmarks.fake_firestore import FakeAsyncFirestore, FakeFirestore
+from benchmarks.fixtures import fixed_now, random_busy_intervals
+
+pytestmark = pytest.mark.anyio
+
+USER_ID = 'host-1'
+SETTINGS = SlotSettings.from_user_settings({
+    'workingHours': {'start': '09:00', 'end': '17:00'}, 'slotDuration': 30,
+    'timezone': 'Asia/Tokyo', 'workingDays': [0, 1, 2, 3, 4]})
+
+
+def stored_days(db):
+    return {day_doc.id: {key: value for key, value in day_doc.to_dict().items() if key != 'updatedAt'}
+            for day_doc in slot_days_ref(db, USER_ID).stream()}
+
+
+async def regenerate_both_ways(now, regenerated_slots, dates, setup):
+    """Runs the same regeneration through the sync and the async store and returns both databases."""
+    databases = []
+    for use_async in (False, True):
+        db = FakeFirestore()
+        setup(db)
+        if use_async:
+            await save_regenerated_slots_async(FakeAsyncFirestore(db), USER_ID, regenerated_slots, now, dates)
+        else:
+            save_regenerated_slots(db, USER_ID, regenerated_slots, now, dates)
+        databases.append(db)
+    return databases
+
+
+async def test_sync_and_async_regeneration_write_the_same_days():
+    now = fixed_now()
+    initial = compute_available_slots([], SETTINGS, now)
+    booked_ids = [initial[3]['slotId'], initial[40]['slotId']]
+
+    def setup(db):
+        save_regenerated_slots(db, USER_ID, initial, now)
+        for slot_id in booked_ids:
+            book_slot(db, USER_ID, slot_id)
+
+    busy = parse_busy_intervals(random_busy_intervals(40, now, 14, seed=1))
+    for dates in (None, {slot_date(initial[3]), slot_date(initial[40]) + timedelta(days=1)}):
+        regenerated = compute_available_slots(busy, SETTINGS, now, dates=dates)
+        sync_db, async_db = await regenerate_both_ways(now, regenerated, dates, setup)
+
+        assert stored_days(sync_db) == stored_days(async_db)
+        slots_cache.clear()
+        slots = read_slots(sync_db, USER_ID)
+        assert {slot['slotId'] for slot in slots if slot['status'] == 'booked'} == set(booked_ids)
+
+
+async def test_legacy_array_is_migrated_both_ways():
+    now = fixed_now()
+    legacy = compute_available_slots([], SETTINGS, now)[:20]
+    legacy[5]['status'] = 'booked'
+
+    def setup(db):
+        slots_header_ref(db, USER_ID).set({'userId': USER_ID, 'slots': legacy})
+
+    sync_db, async_db = await regenerate_both_ways(now, [], set(), setup)
+
+    assert stored_days(sync_db) == stored_days(async_db)
+    for db in (sync_db, async_db):
+        assert 'slots' not in slots_header_ref(db, USER_ID).get().to_dict()
+        slots_cache.clear()
+        assert read_slots(db, USER_ID) == legacy
+
+
+def seed_ended_day(db, tz_name):
+    """A host in `tz_name` with a legacy slot on 2025-01-08 and a day document for 2025-01-06, now over."""
+    db.collection('users').document(USER_ID).set({'settings': {'timezone': tz_name}})
+    slot = lambda day, hour: {'slotId': f"2025-01-{day:02}T{hour:02}:00:00+13:00",
+                              'startTime': f"2025-01-{day:02}T{hour:02}:00:00+13:00",
+                              'endTime': f"2025-01-{day:02}T{hour:02}:30:00+13:00", 'status': 'available'}
+    save_regenerated_slots(db, USER_ID, [slot(6, 9)], fixed_now('Pacific/Auckland'))
+    slots_header_ref(db, USER_ID).update({'slots': [slot(8, 9)]})
+
+
+def test_migration_uses_the_hosts_today():
+    # 12:00 UTC on the 6th is already the 7th in Auckland, so the 6th is past there.
+    now = datetime(2025, 1, 6, 12, 0, tzinfo=timezone.utc)
+    db = FakeFirestore()
+    seed_ended_day(db, 'Pacific/Auckland')
+
+    assert migrate_legacy_slots(db, USER_ID, now)
+    assert sorted(stored_days(db)) == ['2025-01-08']
+
+
+def test_batch_regeneration_uses_each_hosts_today():
+    now = datetime(2025, 1, 6, 12, 0, tzinfo=timezone.utc)
+    db = FakeFirestore()
+    seed_ended_day(db, 'Pacific/Auckland')
+
+    save_regenerated_slots_many(db, {USER_ID: []}, now, timezones={USER_ID: pytz.timezone('Pacific/Auckland')})
+    # The legacy slot was available, so the regeneration replaced it; the past day is deleted, not kept empty.
+    assert stored_days(db) == {}
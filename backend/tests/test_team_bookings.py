@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import main as api
+import slot_store
+from reconcile_bookings import RECONCILE_GRACE_SECONDS, reconcile_bookings_async
+from slot_store import read_slots, slots_cache
+
+from conftest import HOST_ID, PUBLIC_TOKEN, SETTINGS
+
+pytestmark = pytest.mark.anyio
+
+MEMBER_ID = 'host-2'
+TEAM_TOKEN = 'team-token'
+
+
+@pytest.fixture
+def team(db, host, calendar_server):
+    """A collective team of HOST_ID and MEMBER_ID, whose calendars the fake serves by email."""
+    db.collection('users').document(MEMBER_ID).set({
+        'userId': MEMBER_ID, 'email': 'member@example.com', 'publicUrlToken': 'member-token', 'settings': SETTINGS,
+        'encryptedAccessToken': api.encrypt_token('access'), 'encryptedRefreshToken': api.encrypt_token('refresh'),
+    })
+    db.collection('teams').document('team-1').set({
+        'name': 'Team', 'ownerUserId': HOST_ID, 'memberUserIds': [HOST_ID, MEMBER_ID], 'mode': 'collective',
+        'sharedFreeBusy': True, 'settings': SETTINGS, 'publicUrlToken': TEAM_TOKEN,
+    })
+    for email in ('host@example.com', 'member@example.com'):
+        calendar_server.calendar.add_calendar(email)
+
+
+async def book_team(client, slot_id, key=None, email='booker@example.com'):
+    headers = {'Idempotency-Key': key} if key else {}
+    return await client.post(f'/api/teams/public/{TEAM_TOKEN}/bookings', headers=headers, json={
+        'slotId': slot_id, 'bookerName': 'Booker', 'bookerEmail': email})
+
+
+async def book_personal(client, slot_id):
+    return await client.post('/api/bookings', json={
+        'publicUrlToken': PUBLIC_TOKEN, 'slotId': slot_id, 'bookerName': 'Booker', 'bookerEmail': 'own@example.com'})
+
+
+def status_of(db, slot_id):
+    slots_cache.clear()
+    return next(slot['status'] for slot in read_slots(db, HOST_ID) if slot['slotId'] == slot_id)
+
+
+async def test_team_booking_takes_the_members_personal_slot(client, db, host, team):
+    slot_id = host[0]['slotId']
+    response = await book_team(client, slot_id)
+    assert response.status_code == 200, response.text
+    assert status_of(db, slot_id) == 'booked'
+
+    personal = await book_personal(client, slot_id)
+    assert personal.status_code == 409
+
+
+async def test_booked_personal_slot_keeps_the_member_out_of_the_team_slot(client, db, host, team):
+    slot_id = host[0]['slotId']
+    # Booked without a Calendar event yet, so only the transaction can tell.
+    slot_store.book_slot(db, HOST_ID, slot_id)
+
+    response = await book_team(client, slot_id)
+    assert response.status_code == 409
+    assert not list(db.collection('users').document(MEMBER_ID).collection('teamReservations').stream())
+
+
+async def test_personal_booking_checks_team_reservations(client, db, host, team):
+    slot = host[0]
+    db.collection('users').document(HOST_ID).collection('teamReservations').document(
+        slot_store.reservation_id(slot['startTime'])).set({'teamId': 'team-1', 'startTime': slot['startTime']})
+
+    response = await book_personal(client, slot['slotId'])
+    assert response.status_code == 409
+    assert status_of(db, slot['slotId']) == 'available'
+
+
+async def test_failed_team_booking_gives_the_personal_slot_back(client, db, host, team, calendar_server):
+    slot_id = host[0]['slotId']
+    calendar_server.calendar.fail_inserts(1, status=403)
+
+    response = await book_team(client, slot_id)
+    assert response.status_code == 500
+    assert status_of(db, slot_id) == 'available'
+    assert (await book_personal(client, slot_id)).status_code == 200
+
+
+async def test_team_booking_retry_returns_the_first_booking(client, db, host, team, calendar_server):
+    slot_id = host[0]['slotId']
+    first = await book_team(client, slot_id, 'key-1')
+    assert first.status_code == 200, first.text
+    api.booking_results.clear()
+
+    retry = await book_team(client, slot_id, 'key-1')
+    assert retry.status_code == 200, retry.text
+    assert retry.json()['bookingId'] == first.json()['bookingId']
+    assert retry.json()['hostUserIds'] == first.json()['hostUserIds']
+    assert len(list(db.collection('bookings').stream())) == 1
+    assert len(calendar_server.calendar.calendars['primary']) == 1
+
+    other = await book_team(client, host[1]['slotId'], 'key-1')
+    assert other.status_code == 422
+
+
+async def test_round_robin_offers_only_slots_one_member_can_take(client, db, host, team, calendar_server):
+    db.collection('teams').document('team-1').update({'mode': 'round_robin'})
+    slot = host[0]
+    start = datetime.fromisoformat(slot['startTime'])
+    # Each member is busy for half of the first slot.
+    calendar_server.calendar.upsert_event('host-busy', start, start + timedelta(minutes=15),
+                                          calendar_id='host@example.com')
+    calendar_server.calendar.upsert_event('member-busy', start + timedelta(minutes=15), start + timedelta(minutes=30),
+                                          calendar_id='member@example.com')
+
+    response = await client.get(f'/api/teams/public/{TEAM_TOKEN}/slots')
+    assert response.status_code == 200, response.text
+    slot_ids = [team_slot['slotId'] for team_slot in response.json()['slots']]
+    assert slot['slotId'] not in slot_ids and host[1]['slotId'] in slot_ids
+    assert (await book_team(client, slot['slotId'])).status_code == 409
+    assert (await book_team(client, host[1]['slotId'])).status_code == 200
+
+
+async def test_reconcile_keeps_slots_of_team_bookings(client, db, host, team):
+    slot_id = host[0]['slotId']
+    response = await book_team(client, slot_id)
+    assert response.status_code == 200, response.text
+
+    later = datetime.now(timezone.utc) + timedelta(seconds=2 * RECONCILE_GRACE_SECONDS)
+    stats = await reconcile_bookings_async(api.async_db, api.calendar_client, api.calendar_pool.credentials,
+                                           api.booking_queue.enqueue, now=later)
+    assert not any(stats.values())
+    assert status_of(db, slot_id) == 'booked'
+    assert [booking.id for booking in db.collection('bookings').stream()] == [response.json()['bookingId']]
@@ -0,0 +1,86 @@
+import random
+from datetime import date, datetime, timedelta
+
+import pytest
+import pytz
+
+from slot_engine import SlotSettings, compute_available_slots
+from team_engine import (TEAM_MODE_COLLECTIVE, TEAM_MODE_ROUND_ROBIN, blocked_starts, free_hosts, iter_team_slots,
+                         union_busy)
+
+SETTINGS = {'workingHours': {'start': '09:00', 'end': '12:00'}, 'slotDuration': 30,
+            'timezone': 'UTC', 'workingDays': [0, 1, 2, 3, 4, 5, 6]}
+DAY = date(2025, 6, 2)
+
+
+def at(hour, minute=0, day=DAY):
+    return pytz.utc.localize(datetime.combine(day, datetime.min.time()) + timedelta(hours=hour, minutes=minute))
+
+
+def team_slots(host_busy, mode, settings=SETTINGS, days=(DAY,)):
+    return [slot['slotId'] for slot in iter_team_slots(host_busy, mode, SlotSettings.from_user_settings(settings),
+                                                        days, 0)]
+
+
+def naive_team_slots(host_busy, mode, settings, now, days):
+    """Checks every candidate slot against every host's intervals."""
+    need_all = mode == TEAM_MODE_COLLECTIVE
+    slots = []
+    for slot in compute_available_slots([], SlotSettings.from_user_settings(settings), now, days=days):
+        start = datetime.fromisoformat(slot['startTime']).timestamp()
+        end = datetime.fromisoformat(slot['endTime']).timestamp()
+        free = [all(b_end <= start or b_start >= end for b_start, b_end in busy) for busy in host_busy]
+        if all(free) if need_all else any(free):
+            slots.append(slot['slotId'])
+    return slots
+
+
+def test_round_robin_needs_one_host_free_for_the_whole_slot():
+    # Neither host is free 09:00-09:30, though they are never busy at the same time.
+    host_a = [(at(9).timestamp(), at(9, 15).timestamp())]
+    host_b = [(at(9, 15).timestamp(), at(9, 30).timestamp())]
+
+    slots = team_slots([host_a, host_b], TEAM_MODE_ROUND_ROBIN)
+    assert at(9).isoformat() not in slots
+    assert slots[0] == at(9, 30).isoformat() and len(slots) == 5
+    assert free_hosts({'a': host_a, 'b': host_b}, at(9).timestamp(), at(9, 30).timestamp()) == []
+
+
+def test_round_robin_slot_between_busy_blocks_stays_free():
+    # Host a is free exactly 09:30-10:00; host b is busy all morning.
+    host_a = [(at(9).timestamp(), at(9, 30).timestamp()), (at(10).timestamp(), at(12).timestamp())]
+    host_b = [(at(8).timestamp(), at(12).timestamp())]
+
+    assert team_slots([host_a, host_b], TEAM_MODE_ROUND_ROBIN) == [at(9, 30).isoformat()]
+    assert team_slots([host_a, host_b], TEAM_MODE_COLLECTIVE) == []
+
+
+def test_blocked_starts_are_open_intervals():
+    duration = 30 * 60
+    host_a = [(at(9).timestamp(), at(9, 15).timestamp())]
+    host_b = [(at(9, 15).timestamp(), at(9, 30).timestamp())]
+    # Starts in (08:45, 09:15) overlap a's block and starts in (08:45, 09:30) b's.
+    assert blocked_starts([host_a, host_b], duration) == [(at(8, 45).timestamp(), at(9, 15).timestamp())]
+    assert blocked_starts([host_a, []], duration) == []
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_matches_checking_every_host(seed):
+    rng = random.Random(seed)
+    settings = {'workingHours': {'start': '08:00', 'end': '18:00'}, 'slotDuration': rng.choice((20, 30, 45, 60)),
+                'timezone': 'Europe/London', 'workingDays': [0, 1, 2, 3, 4]}
+    tz = pytz.timezone('Europe/London')
+    now = tz.localize(datetime(2025, 3, 24, 7, 0))
+    host_busy = []
+    for _ in range(rng.randrange(1, 6)):
+        busy = []
+        for _ in range(40):
+            start = now + timedelta(minutes=rng.randrange(0, 14 * 24 * 60, 5))
+            busy.append((start.timestamp(), (start + timedelta(minutes=rng.randrange(5, 120, 5))).timestamp()))
+        host_busy.append(union_busy([sorted(busy)]))
+
+    days = [now.date() + timedelta(days=i) for i in range(14)]
+    for mode in (TEAM_MODE_COLLECTIVE, TEAM_MODE_ROUND_ROBIN):
+        expected = naive_team_slots(host_busy, mode, settings, now, 14)
+        slots = iter_team_slots(host_busy, mode, SlotSettings.from_user_settings(settings), days, now.timestamp())
+        assert [slot['slotId'] for slot in slots] == expected, mode
@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from cryptography.fernet import Fernet, InvalidToken
+
+from rotate_tokens import rotate_stored_tokens
+from token_crypto import TokenCipher, decrypted_tokens, parse_keys, token_stats
+from benchmarks.fake_firestore import FakeFirestore
+
+OLD_KEY, NEW_KEY = Fernet.generate_key().decode(), Fernet.generate_key().decode()
+
+
+@pytest.fixture(autouse=True)
+def clear_decrypted_tokens():
+    decrypted_tokens.clear()
+    yield
+    decrypted_tokens.clear()
+
+
+def test_parse_keys():
+    assert parse_keys(f" {NEW_KEY}, {OLD_KEY} ,") == [NEW_KEY, OLD_KEY]
+    assert parse_keys(None) == []
+    with pytest.raises(ValueError):
+        TokenCipher(parse_keys(''))
+
+
+def test_new_key_first_still_decrypts_old_tokens():
+    old_token = TokenCipher([OLD_KEY]).encrypt('refresh')
+    cipher = TokenCipher([NEW_KEY, OLD_KEY])
+
+    assert cipher.decrypt(old_token) == 'refresh'
+    assert cipher.needs_rotation(old_token)
+    assert not cipher.needs_rotation(cipher.encrypt('refresh'))
+    assert TokenCipher([NEW_KEY]).decrypt(cipher.rotate(old_token)) == 'refresh'
+
+
+def test_rotate_stored_tokens():
+    db = FakeFirestore()
+    old_cipher = TokenCipher([OLD_KEY])
+    for n in range(25):
+        db.collection('users').document(f"user-{n:02}").set({
+            'encryptedAccessToken': old_cipher.encrypt(f"access-{n}"),
+            'encryptedRefreshToken': old_cipher.encrypt(f"refresh-{n}")})
+    db.collection('users').document('user-new').set(
+        {'encryptedRefreshToken': TokenCipher([NEW_KEY]).encrypt('refresh-new')})
+    db.collection('users').document('user-broken').set(
+        {'encryptedRefreshToken': TokenCipher([Fernet.generate_key().decode()]).encrypt('lost')})
+
+    rotated = []
+    stats = rotate_stored_tokens(db, TokenCipher([NEW_KEY, OLD_KEY]), page_size=10, on_rotated=rotated.append)
+
+    assert stats == {'users': 27, 'rotated': 25, 'failed': 1}
+    assert sorted(rotated) == [f"user-{n:02}" for n in range(25)]
+    new_cipher = TokenCipher([NEW_KEY])
+    for n in range(25):
+        user_data = db.collection('users').document(f"user-{n:02}").get().to_dict()
+        assert new_cipher.decrypt(user_data['encryptedAccessToken']) == f"access-{n}"
+        assert new_cipher.decrypt(user_data['encryptedRefreshToken']) == f"refresh-{n}"
+    with pytest.raises(InvalidToken):
+        Fernet(OLD_KEY).decrypt(
+            db.collection('users').document('user-00').get().to_dict()['encryptedRefreshToken'].encode())
+
+    # Nothing is left to rotate, and a single key never rotates.
+    assert rotate_stored_tokens(db, TokenCipher([NEW_KEY, OLD_KEY]))['rotated'] == 0
+    assert rotate_stored_tokens(db, new_cipher) == {'users': 0, 'rotated': 0, 'failed': 0}
+
+
+def test_decrypted_tokens_are_cached_per_host_and_field(monkeypatch):
+    cipher = TokenCipher([NEW_KEY])
+    monkeypatch.setitem(token_stats, 'decrypts', 0)
+    first, second = cipher.encrypt('access-1'), cipher.encrypt('access-2')
+
+    assert cipher.decrypt(first, 'host-1', 'encryptedAccessToken') == 'access-1'
+    assert cipher.decrypt(first, 'host-1', 'encryptedAccessToken') == 'access-1'
+    assert token_stats['decrypts'] == 1
+    # A newly stored token replaces the host's entry instead of adding one.
+    assert cipher.decrypt(second, 'host-1', 'encryptedAccessToken') == 'access-2'
+    assert decrypted_tokens.stats()['size'] == 1
+    # Without a host the token is not cached.
+    cipher.decrypt(first)
+    cipher.decrypt(first)
+    assert token_stats['decrypts'] == 4
+
+
+def test_decrypted_access_tokens_expire_with_the_token(monkeypatch):
+    cipher = TokenCipher([NEW_KEY])
+    now = [1000.0]
+    monkeypatch.setattr(decrypted_tokens, '_clock', lambda: now[0])
+    monkeypatch.setitem(token_stats, 'decrypts', 0)
+    token = cipher.encrypt('access')
+
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=60)
+    cipher.decrypt(token, 'host-1', 'encryptedAccessToken', expires_at)
+    now[0] += 30
+    cipher.decrypt(token, 'host-1', 'encryptedAccessToken', expires_at)
+    assert token_stats['decrypts'] == 1
+    now[0] += 60
+    cipher.decrypt(token, 'host-1', 'encryptedAccessToken', expires_at)
+    assert token_stats['decrypts'] == 2
+
+    expired = datetime.utcnow() - timedelta(seconds=1)  # Naive UTC, as google-auth keeps it.
+    cipher.decrypt(token, 'host-2', 'encryptedAccessToken', expired)
+    assert decrypted_tokens.get(('host-2', 'encryptedAccessToken')) is None
@@ -0,0 +1,87 @@
+import pytest
+from google.api_core.exceptions import ServiceUnavailable
+
+from token_store import TokenWriteBack
+from benchmarks.fake_firestore import FakeAsyncFirestore, FakeFirestore
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def users():
+    db = FakeFirestore()
+    for user_id in ('a', 'b'):
+        db.collection('users').document(user_id).set({'token': 'old'})
+    return db
+
+
+def token_of(db, user_id):
+    return db.collection('users').document(user_id).get().to_dict()['token']
+
+
+def test_failed_batch_is_queued_again(users, capsys):
+    writes = TokenWriteBack()
+    writes.queue('a', {'token': 'a-1'})
+    writes.queue('b', {'token': 'b-1'})
+    users.fail_writes('users')
+
+    with pytest.raises(ServiceUnavailable):
+        writes.flush(users)
+    assert writes.pending() == 2
+    assert writes.stats['requeued'] == 2
+    assert 'a, b' in capsys.readouterr().out
+
+    assert writes.flush(users) == 2
+    assert (token_of(users, 'a'), token_of(users, 'b')) == ('a-1', 'b-1')
+    assert writes.pending() == 0
+
+
+def test_failed_batch_does_not_replace_newer_tokens(users, monkeypatch):
+    writes = TokenWriteBack()
+    writes.queue('a', {'token': 'a-1'})
+    writes.queue('b', {'token': 'b-1'})
+    batch = users.batch
+
+    def batch_refreshed_meanwhile():
+        pending = batch()
+
+        def commit():
+            # While the commit runs, a's token is refreshed again and b signs in.
+            writes.queue('a', {'token': 'a-2'})
+            writes.discard('b')
+            raise ServiceUnavailable("Injected write failure.")
+        pending.commit = commit
+        return pending
+
+    monkeypatch.setattr(users, 'batch', batch_refreshed_meanwhile)
+    with pytest.raises(ServiceUnavailable):
+        writes.flush(users)
+    monkeypatch.setattr(users, 'batch', batch)
+
+    assert writes.flush(users) == 1
+    assert (token_of(users, 'a'), token_of(users, 'b')) == ('a-2', 'old')
+
+
+def test_token_is_dropped_and_logged_after_max_attempts(users, capsys):
+    writes = TokenWriteBack(max_attempts=2)
+    writes.queue('a', {'token': 'a-1'})
+    users.fail_writes('users', count=2)
+
+    for _ in range(2):
+        with pytest.raises(ServiceUnavailable):
+            writes.flush(users)
+    assert writes.pending() == 0
+    assert writes.stats['dropped'] == 1
+    assert 'giving up' in capsys.readouterr().out
+    assert token_of(users, 'a') == 'old'
+
+
+async def test_async_flush_queues_a_failed_batch_again(users):
+    writes = TokenWriteBack()
+    writes.queue('a', {'token': 'a-1'})
+    users.fail_writes('users')
+
+    with pytest.raises(ServiceUnavailable):
+        await writes.flush_async(FakeAsyncFirestore(users))
+    assert await writes.flush_async(FakeAsyncFirestore(users)) == 1
+    assert token_of(users, 'a') == 'a-1'
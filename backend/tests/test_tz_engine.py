@@ -0,0 +1,163 @@
+"""
+The slot engine's offset tables against the pytz loop `generate_user_slots` ran before them.
+
+The loop localizes each window's bounds and steps through it with aware
+datetimes, which keeps the window start's UTC offset on every slot. Its
+instants stay right across a DST change, only the labels do not, so the
+reference here normalizes them. Windows whose bounds fall in a DST gap or
+overlap are skipped: `localize` guesses there, the engine follows its own
+documented rules (see benchmarks/bench_tz_engine.py).
+"""
+import random
+from datetime import date, datetime, time as dt_time, timedelta
+
+import pytest
+import pytz
+
+from slot_engine import SlotSettings, compute_available_slots, parse_busy_intervals
+from tz_engine import DAY_SECONDS, ZoneTransitions, zone_transitions
+from benchmarks.fixtures import random_busy_intervals
+
+# Zones with DST (both hemispheres, a 30-minute shift, a DST change at midnight) and without.
+ZONES = ['Europe/Berlin', 'America/New_York', 'America/Sao_Paulo', 'America/Santiago', 'Australia/Sydney',
+         'Australia/Lord_Howe', 'Pacific/Auckland', 'Asia/Tehran', 'America/Havana', 'Asia/Tokyo',
+         'Asia/Kolkata', 'UTC']
+DURATIONS = [15, 20, 30, 45, 60, 90]
+FIRST_DAY, LAST_DAY = date(1990, 1, 1), date(2036, 12, 31)
+
+
+def pytz_slots(busy_times, slot_settings, now, days):
+    """`generate_user_slots`' loop, with per-weekday windows and normalized offsets."""
+    user_timezone = slot_settings.timezone
+    slot_duration = timedelta(minutes=slot_settings.slot_duration_minutes)
+    today = now.astimezone(user_timezone).date()
+    available_slots = []
+    for i in range(days):
+        current_day = today + timedelta(days=i)
+        for work_start, work_end in slot_settings.windows(current_day.weekday()):
+            day_start = user_timezone.localize(datetime.combine(current_day, work_start))
+            day_end = user_timezone.localize(datetime.combine(current_day, work_end))
+            potential_slot_start = day_start
+            while potential_slot_start + slot_duration <= day_end:
+                potential_slot_end = potential_slot_start + slot_duration
+                is_busy = any(potential_slot_start < busy_end and potential_slot_end > busy_start
+                              for busy_start, busy_end in busy_times)
+                if not is_busy and potential_slot_start > now:
+                    start_time = user_timezone.normalize(potential_slot_start).isoformat()
+                    available_slots.append({
+                        'slotId': start_time,
+                        'startTime': start_time,
+                        'endTime': user_timezone.normalize(potential_slot_end).isoformat(),
+                        'status': 'available'
+                    })
+                potential_slot_start += slot_duration
+    return available_slots
+
+
+def unambiguous(tz, day, wall_time):
+    """Whether a wall time occurs exactly once on `day`."""
+    local = datetime.combine(day, wall_time)
+    try:
+        return tz.localize(local, is_dst=None) is not None
+    except (pytz.AmbiguousTimeError, pytz.NonExistentTimeError):
+        return False
+
+
+def random_settings(rng, zone):
+    """Random working hours that end on the day they start."""
+    settings = {'timezone': zone, 'slotDuration': rng.choice(DURATIONS)}
+    if rng.random() < 0.5:
+        start = rng.randrange(0, 20 * 60, 15)
+        end = rng.randrange(start + 60, 24 * 60, 15)
+        settings['workingHours'] = {'start': f"{start // 60:02d}:{start % 60:02d}",
+                                    'end': f"{end // 60:02d}:{end % 60:02d}"}
+        settings['workingDays'] = sorted(rng.sample(range(7), rng.randint(1, 7)))
+    else:
+        settings['weeklyHours'] = {}
+        for weekday in range(7):
+            bounds = sorted(rng.sample(range(0, 24 * 60, 15), 2 * rng.randint(0, 3)))
+            settings['weeklyHours'][str(weekday)] = [
+                {'start': f"{a // 60:02d}:{a % 60:02d}", 'end': f"{b // 60:02d}:{b % 60:02d}"}
+                for a, b in zip(bounds[::2], bounds[1::2])]
+    return settings
+
+
+def random_day(rng, zone):
+    """A random day; mostly one around a DST change of the zone."""
+    transitions = zone_transitions(pytz.timezone(zone))
+    low, high = ((day - date(1970, 1, 1)).days * DAY_SECONDS for day in (FIRST_DAY, LAST_DAY))
+    changes = [start for start in transitions.starts[1:] if low <= start < high]
+    if changes and rng.random() < 0.75:
+        instant = rng.choice(changes) + rng.randint(-1, 0) * DAY_SECONDS
+    else:
+        instant = rng.randrange(low, high)
+    return date(1970, 1, 1) + timedelta(days=(instant + transitions.offset_at(instant)) // DAY_SECONDS)
+
+
+def comparable(slot_settings, first_day, days):
+    tz = slot_settings.timezone
+    for i in range(days):
+        day = first_day + timedelta(days=i)
+        for work_start, work_end in slot_settings.windows(day.weekday()):
+            if not (unambiguous(tz, day, work_start) and unambiguous(tz, day, work_end)):
+                return False
+    return True
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_matches_the_pytz_loop(seed):
+    rng = random.Random(seed)
+    compared = across_changes = 0
+    while compared < 150:
+        zone = rng.choice(ZONES)
+        slot_settings = SlotSettings.from_user_settings(random_settings(rng, zone))
+        first_day = random_day(rng, zone)
+        days = rng.randint(1, 3)
+        if not comparable(slot_settings, first_day, days):
+            continue
+        tz = slot_settings.timezone
+        now = tz.localize(datetime.combine(first_day - timedelta(days=1), dt_time(12)))
+        busy = parse_busy_intervals(random_busy_intervals(rng.randint(0, 12), now, days + 1, max_minutes=180))
+
+        expected = pytz_slots(busy, slot_settings, now, days + 1)
+        assert compute_available_slots(busy, slot_settings, now, days + 1) == expected, (zone, first_day)
+        compared += 1
+        across_changes += len({slot['startTime'][-6:] for slot in expected}) > 1
+    # Most cases have slots on both sides of a DST change.
+    assert across_changes > 30
+
+
+@pytest.mark.parametrize('zone, day', [
+    ('Europe/Berlin', date(2025, 3, 30)),
+    ('Europe/Berlin', date(2025, 10, 26)),
+    ('America/New_York', date(2025, 3, 9)),
+    ('America/New_York', date(2025, 11, 2)),
+    ('Australia/Lord_Howe', date(2025, 4, 6)),
+    ('America/Sao_Paulo', date(2018, 11, 4)),
+])
+def test_all_day_windows_on_dst_days(zone, day):
+    slot_settings = SlotSettings.from_user_settings({
+        'timezone': zone, 'slotDuration': 30, 'workingHours': {'start': '04:00', 'end': '23:00'},
+        'workingDays': list(range(7))})
+    now = slot_settings.timezone.localize(datetime.combine(day - timedelta(days=1), dt_time(12)))
+    slots = compute_available_slots([], slot_settings, now, 2)
+
+    assert slots == pytz_slots([], slot_settings, now, 2)
+    assert len({slot['startTime'][-6:] for slot in slots}) == 2
+
+
+@pytest.mark.parametrize('zone', ['Europe/Berlin', 'America/New_York', 'Australia/Sydney'])
+def test_after_the_last_transition(zone):
+    # pytz's tables end in 2037 and keep the last offset from then on; the offset table does the same.
+    tz = pytz.timezone(zone)
+    slot_settings = SlotSettings.from_user_settings({
+        'timezone': zone, 'slotDuration': 60, 'workingHours': {'start': '09:00', 'end': '17:00'},
+        'workingDays': list(range(7))})
+    for day in (date(2038, 1, 19), date(2040, 7, 1), date(2099, 12, 30)):
+        now = tz.localize(datetime.combine(day - timedelta(days=1), dt_time(12)))
+        assert compute_available_slots([], slot_settings, now, 3) == pytz_slots([], slot_settings, now, 3)
+
+
+def test_only_pytz_zones():
+    with pytest.raises(TypeError):
+        ZoneTransitions.from_tzinfo(datetime.now().astimezone().tzinfo)
@@ -0,0 +1,55 @@
+import pytest
+
+from benchmarks.fixtures import auth_headers
+from conftest import HOST_ID, SETTINGS
+
+pytestmark = pytest.mark.anyio
+
+WEEKLY_HOURS = {'0': [{'start': '09:00', 'end': '12:00'}], '2': [{'start': '13:00', 'end': '17:00'}]}
+
+
+async def put_settings(client, **settings):
+    response = await client.put('/api/user/me/settings', headers=auth_headers(HOST_ID), json={
+        'workingHours': {'start': '10:00', 'end': '16:00'}, 'slotDuration': 45, **settings})
+    assert response.status_code == 204, response.text
+
+
+def stored_settings(db):
+    return db.collection('users').document(HOST_ID).get().to_dict()['settings']
+
+
+async def test_calendar_ids_can_be_cleared(client, db):
+    await put_settings(client, calendarIds=['primary', 'team@example.com'])
+    assert stored_settings(db)['calendarIds'] == ['primary', 'team@example.com']
+
+    await put_settings(client)
+    settings = stored_settings(db)
+    assert 'calendarIds' not in settings
+    assert settings['workingHours'] == {'start': '10:00', 'end': '16:00'} and settings['slotDuration'] == 45
+    # Settings the request does not cover are kept.
+    assert settings['timezone'] == SETTINGS['timezone'] and settings['workingDays'] == SETTINGS['workingDays']
+
+
+async def test_weekly_hours_can_be_cleared(client, db):
+    await put_settings(client, weeklyHours=WEEKLY_HOURS)
+    assert stored_settings(db)['weeklyHours'] == WEEKLY_HOURS
+
+    await put_settings(client)
+    assert 'weeklyHours' not in stored_settings(db)
+
+
+async def test_weekly_hours_are_replaced_not_merged(client, db):
+    await put_settings(client, weeklyHours=WEEKLY_HOURS)
+    await put_settings(client, weeklyHours={'4': [{'start': '08:00', 'end': '10:00'}]})
+
+    assert stored_settings(db)['weeklyHours'] == {'4': [{'start': '08:00', 'end': '10:00'}]}
+    response = await client.get('/api/user/me/settings', headers=auth_headers(HOST_ID))
+    assert response.json()['weeklyHours'] == {'4': [{'start': '08:00', 'end': '10:00'}]}
+
+
+async def test_settings_can_be_saved_without_a_user_document(client, db):
+    db.collection('users').document(HOST_ID).delete()
+
+    await put_settings(client, calendarIds=['primary'])
+    assert stored_settings(db) == {'workingHours': {'start': '10:00', 'end': '16:00'}, 'slotDuration': 45,
+                                   'calendarIds': ['primary']}
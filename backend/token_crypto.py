@@ -0,0 +1,106 @@
+"""
+Encryption of the Google OAuth tokens kept in user documents.
+
+FERNET_KEY holds one Fernet key, or several separated by commas, newest
+first. Tokens are encrypted with the first key and decrypted with whichever
+key matches (MultiFernet). To rotate keys, put a new one in front: stored
+tokens stay readable, `rotate_tokens` re-encrypts them with the new key, and
+once it finds none left the old key can be removed.
+
+Decrypted tokens are cached per host and token field, so reading a user
+document again (another request of the same host, an expired profile cache
+entry, a rebuilt Calendar pool entry) does not pay for decryption again. An
+entry is only used for the ciphertext it was decrypted from, so a newly stored
+token replaces it, and the cache holds at most one token of each kind per
+host. An access token's entry expires with the token.
+"""
+import os
+from collections import Counter
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+
+from cache import TTLCache
+from metrics import span
+
+# Per-process cache of (user ID, field) -> (ciphertext, token).
+decrypted_tokens = TTLCache(
+    maxsize=int(os.getenv("DECRYPTED_TOKEN_CACHE_SIZE", "8192")),
+    ttl=float(os.getenv("DECRYPTED_TOKEN_CACHE_TTL_SECONDS", "3600")),
+)
+
+# 'decrypts': tokens actually decrypted, i.e. not served by `decrypted_tokens`.
+token_stats = Counter()
+
+
+def parse_keys(value: Optional[str]) -> List[str]:
+    """The keys of a FERNET_KEY value, newest first."""
+    return [key.strip() for key in (value or '').split(',') if key.strip()]
+
+
+class TokenCipher:
+    """
+    Encrypts with the first of `keys` and decrypts with any of them.
+
+    Raises:
+        ValueError: If there is no key or a key is not a 32-byte URL-safe base64 string.
+    """
+
+    def __init__(self, keys: List[str]):
+        if not keys:
+            raise ValueError("No Fernet key given.")
+        fernets = [Fernet(key.encode()) for key in keys]
+        self._primary = fernets[0]
+        self._fernet = MultiFernet(fernets)
+        self.key_count = len(fernets)
+
+    def encrypt(self, token: str) -> str:
+        return self._primary.encrypt(token.encode()).decode()
+
+    def decrypt(self, encrypted_token: str, user_id: Optional[str] = None, field: Optional[str] = None,
+                expires_at: Optional[datetime] = None) -> str:
+        """
+        Args:
+            user_id: The host the token belongs to, and `field` the user
+                document field holding it. The token is only cached with both.
+            expires_at: When the token expires (naive means UTC); it is not
+                cached beyond that.
+
+        Raises:
+            InvalidToken: If no key decrypts it.
+        """
+        key = (user_id, field) if user_id and field else None
+        cached = decrypted_tokens.get(key) if key else None
+        if cached is not None and cached[0] == encrypted_token:
+            return cached[1]
+        token_stats['decrypts'] += 1
+        with span('token.decrypt'):
+            token = self._fernet.decrypt(encrypted_token.encode()).decode()
+        if key:
+            ttl = None
+            if expires_at is not None:
+                if expires_at.tzinfo is None:
+                    expires_at = expires_at.replace(tzinfo=timezone.utc)
+                ttl = (expires_at - datetime.now(timezone.utc)).total_seconds()
+            decrypted_tokens.set(key, (encrypted_token, token), ttl=ttl)
+        return token
+
+    def needs_rotation(self, encrypted_token: str) -> bool:
+        """Whether the token was encrypted with another key than the newest one."""
+        if self.key_count == 1:
+            return False
+        try:
+            self._primary.decrypt(encrypted_token.encode())
+            return False
+        except InvalidToken:
+            return True
+
+    def rotate(self, encrypted_token: str) -> str:
+        """
+        The token re-encrypted with the newest key.
+
+        Raises:
+            InvalidToken: If no key decrypts it.
+        """
+        return self._fernet.rotate(encrypted_token.encode()).decode()
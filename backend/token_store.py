@@ -0,0 +1,145 @@
+"""
+Batched write-back of refreshed Google access tokens.
+
+When google-auth refreshes a host's access token, the new token is stored in
+their user document, so that other processes and later requests start from it
+instead of refreshing again. Rather than one update on the request path per
+refresh, refreshed tokens are queued here and written together: the API
+server flushes the queue every TOKEN_WRITE_INTERVAL_SECONDS, and a queue that
+reaches TOKEN_WRITE_BATCH_SIZE hosts is flushed right away. A batch that
+fails is queued again, except for tokens that a newer one replaced meanwhile,
+and a token that failed TOKEN_WRITE_MAX_ATTEMPTS times is dropped and logged.
+A token that is never written (the process stops, the write keeps failing)
+only costs another refresh later.
+"""
+import os
+import threading
+from collections import Counter
+from typing import Callable, List, Tuple
+
+TOKEN_WRITE_INTERVAL_SECONDS = float(os.getenv("TOKEN_WRITE_INTERVAL_SECONDS", "5"))
+# Firestore allows at most 500 writes per batch.
+TOKEN_WRITE_BATCH_SIZE = min(int(os.getenv("TOKEN_WRITE_BATCH_SIZE", "500")), 500)
+TOKEN_WRITE_MAX_ATTEMPTS = int(os.getenv("TOKEN_WRITE_MAX_ATTEMPTS", "3"))
+
+
+class TokenWriteBack:
+    """
+    Refreshed token fields per host, waiting to be written.
+
+    Args:
+        on_written: Called with each user ID whose document was updated.
+    """
+
+    def __init__(self, batch_size: int = TOKEN_WRITE_BATCH_SIZE,
+                 on_written: Callable[[str], None] = lambda user_id: None,
+                 max_attempts: int = TOKEN_WRITE_MAX_ATTEMPTS):
+        self.batch_size = batch_size
+        self.on_written = on_written
+        self.max_attempts = max_attempts
+        self._pending = {}  # user ID -> fields; a later refresh replaces an earlier one
+        self._in_flight = {}  # user ID -> fields being written, until a newer token or discard replaces them
+        self._failures = Counter()  # user ID -> failed writes of the queued fields
+        self._lock = threading.Lock()
+        self.stats = Counter({'queued': 0, 'written': 0, 'batches': 0, 'requeued': 0, 'dropped': 0})
+
+    def queue(self, user_id: str, fields: dict) -> bool:
+        """Queues `fields` for the user's document; returns whether a full batch is waiting."""
+        with self._lock:
+            self._pending[user_id] = fields
+            self._in_flight.pop(user_id, None)
+            self._failures.pop(user_id, None)
+            self.stats['queued'] += 1
+            return len(self._pending) >= self.batch_size
+
+    def discard(self, user_id: str):
+        """Drops the user's queued token, e.g. when signing in stores a newer one."""
+        with self._lock:
+            self._pending.pop(user_id, None)
+            self._in_flight.pop(user_id, None)
+            self._failures.pop(user_id, None)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def _take(self) -> List[Tuple[str, dict]]:
+        with self._lock:
+            user_ids = list(self._pending)[:self.batch_size]
+            writes = [(user_id, self._pending.pop(user_id)) for user_id in user_ids]
+            self._in_flight.update(writes)
+            return writes
+
+    def _written(self, writes: List[Tuple[str, dict]]):
+        with self._lock:
+            self.stats['written'] += len(writes)
+            self.stats['batches'] += 1
+            for user_id, fields in writes:
+                if self._in_flight.get(user_id) is fields:
+                    del self._in_flight[user_id]
+                    self._failures.pop(user_id, None)
+        for user_id, _ in writes:
+            self.on_written(user_id)
+
+    def _failed(self, writes: List[Tuple[str, dict]], error: Exception):
+        """Queues a failed batch again, except tokens replaced meanwhile or out of attempts."""
+        requeued, dropped = [], []
+        with self._lock:
+            for user_id, fields in writes:
+                if self._in_flight.get(user_id) is not fields:
+                    continue
+                del self._in_flight[user_id]
+                self._failures[user_id] += 1
+                if self._failures[user_id] >= self.max_attempts:
+                    del self._failures[user_id]
+                    dropped.append(user_id)
+                else:
+                    self._pending.setdefault(user_id, fields)
+                    requeued.append(user_id)
+            self.stats['requeued'] += len(requeued)
+            self.stats['dropped'] += len(dropped)
+        if requeued:
+            print(f"WARNING: refreshed tokens of {len(requeued)} users not stored, queued again ({error!r}): "
+                  f"{', '.join(requeued)}")
+        if dropped:
+            print(f"ERROR: giving up storing the refreshed tokens of {len(dropped)} users after "
+                  f"{self.max_attempts} attempts ({error!r}): {', '.join(dropped)}")
+
+    def flush(self, db) -> int:
+        """
+        Writes everything queued, a batch per TOKEN_WRITE_BATCH_SIZE hosts, and
+        returns the number of documents written.
+
+        Raises:
+            Exception: From Firestore; the failed batch is queued again.
+        """
+        written = 0
+        while writes := self._take():
+            batch = db.batch()
+            for user_id, fields in writes:
+                batch.update(db.collection('users').document(user_id), fields)
+            try:
+                batch.commit()
+            except Exception as e:
+                self._failed(writes, e)
+                raise
+            self._written(writes)
+            written += len(writes)
+        return written
+
+    async def flush_async(self, async_db) -> int:
+        """`flush` with an async Firestore client."""
+        written = 0
+        while writes := self._take():
+            batch = async_db.batch()
+            for user_id, fields in writes:
+                batch.update(async_db.collection('users').document(user_id), fields)
+            try:
+                await batch.commit()
+            except Exception as e:
+                self._failed(writes, e)
+                raise
+            self._written(writes)
+            written += len(writes)
+        return written
+
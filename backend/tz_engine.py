@@ -0,0 +1,143 @@
+"""
+UTC offset tables for slot generation.
+
+pytz resolves a local time by searching the zone's transitions and building
+an aware datetime each time. `ZoneTransitions` holds the same transitions as
+two integer lists, the UTC second each period starts at and its UTC offset in
+seconds, so the slot engine converts between local wall times and UTC with a
+bisect and integer arithmetic, and writes ISO strings without a datetime per
+slot. Tables are built once per zone (`zone_transitions`). They come from
+pytz's own tables, which end in 2037 (see `ZoneTransitions.from_tzinfo`).
+
+Local times are counted in "local seconds": seconds since 1970-01-01 00:00 on
+the wall clock. A wall time can occur twice (a DST overlap) or not at all (a
+DST gap); `to_utc` picks the earliest or latest occurrence and maps a skipped
+time to the instant of the transition that skips it.
+"""
+from bisect import bisect_right
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+DAY_SECONDS = 24 * 60 * 60
+
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def local_day_start(day: date) -> int:
+    """Local seconds at the start of `day`."""
+    return (day.toordinal() - _EPOCH_ORDINAL) * DAY_SECONDS
+
+
+class ZoneTransitions:
+    """
+    A zone's UTC offsets as a table of periods.
+
+    Attributes:
+        starts: UTC seconds each period starts at, ascending; the first is far in the past.
+        offsets: UTC offset of each period in seconds.
+    """
+    __slots__ = ('zone', 'starts', 'offsets', '_days', '_clocks', '_suffixes')
+
+    def __init__(self, zone: str, starts: List[int], offsets: List[int]):
+        self.zone = zone
+        self.starts = starts
+        self.offsets = offsets
+        self._days = {}
+        self._clocks = {}
+        self._suffixes = {}
+
+    @classmethod
+    def from_tzinfo(cls, tz) -> "ZoneTransitions":
+        """
+        Builds the table of a pytz zone.
+
+        Reads pytz's private `_utc_transition_times` and `_transition_info`.
+        Their tables end in 2037; like pytz itself, the table keeps the last
+        offset from then on, so both agree for later dates too.
+
+        Raises:
+            TypeError: If `tz` is not a pytz zone (e.g. `zoneinfo`), whose transitions are not readable.
+        """
+        if not hasattr(tz, 'localize'):
+            raise TypeError(f"Not a pytz timezone: {tz!r}")
+        zone = getattr(tz, 'zone', str(tz))
+        transition_times = getattr(tz, '_utc_transition_times', None)
+        if not transition_times:
+            # UTC and fixed-offset zones have a single period.
+            return cls(zone, [-(1 << 62)], [int(tz.utcoffset(datetime(2000, 1, 1)).total_seconds())])
+
+        starts, offsets = [], []
+        for transition_time, (utc_offset, _, _) in zip(transition_times, tz._transition_info):
+            offset = int(utc_offset.total_seconds())
+            if offsets and offset == offsets[-1]:
+                continue  # Only the DST flag or abbreviation changed.
+            starts.append(int((transition_time - _EPOCH).total_seconds()) if starts else -(1 << 62))
+            offsets.append(offset)
+        return cls(zone, starts, offsets)
+
+    def offset_at(self, utc_seconds: int) -> int:
+        return self.offsets[bisect_right(self.starts, utc_seconds) - 1]
+
+    def period_at(self, utc_seconds: int) -> Tuple[int, int]:
+        """The UTC offset at an instant and the UTC second the next period starts at."""
+        i = bisect_right(self.starts, utc_seconds)
+        return self.offsets[i - 1], self.starts[i] if i < len(self.starts) else 1 << 62
+
+    def to_utc(self, local_seconds: int, latest: bool = False) -> int:
+        """
+        The UTC second a local wall time occurs at.
+
+        Args:
+            latest: In an overlap, take the later occurrence instead of the earlier one.
+
+        A wall time skipped by a gap maps to the transition, i.e. the first
+        instant after the gap.
+        """
+        starts, offsets = self.starts, self.offsets
+        # Offsets are under a day and transitions are further apart than that,
+        # so the period holding the answer is next to the one `local_seconds` falls in as UTC.
+        guess = bisect_right(starts, local_seconds) - 1
+        found = None
+        for i in range(max(guess - 1, 0), min(guess + 2, len(starts))):
+            utc_seconds = local_seconds - offsets[i]
+            if starts[i] <= utc_seconds and (i + 1 == len(starts) or utc_seconds < starts[i + 1]):
+                if found is None or latest:
+                    found = utc_seconds
+        if found is not None:
+            return found
+        for i in range(max(guess - 1, 1), min(guess + 2, len(starts))):
+            if starts[i] + offsets[i - 1] <= local_seconds < starts[i] + offsets[i]:
+                return starts[i]
+        raise ValueError(f"Cannot resolve local time {local_seconds} in {self.zone}.")
+
+    def isoformat(self, utc_seconds: int, offset: Optional[int] = None) -> str:
+        """
+        The ISO 8601 string of an instant in this zone, like `datetime.isoformat` of the aware datetime.
+
+        Args:
+            offset: The UTC offset at the instant, if the caller knows it already.
+        """
+        if offset is None:
+            offset = self.offset_at(utc_seconds)
+        day, second = divmod(utc_seconds + offset, DAY_SECONDS)
+        day_str = self._days.get(day)
+        if day_str is None:
+            if len(self._days) > 4096:
+                self._days.clear()
+            day_str = self._days[day] = date.fromordinal(_EPOCH_ORDINAL + day).isoformat()
+        clock = self._clocks.get(second)
+        if clock is None:
+            clock = self._clocks[second] = f"T{second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}"
+        suffix = self._suffixes.get(offset)
+        if suffix is None:
+            tz = timezone(timedelta(seconds=offset))
+            suffix = self._suffixes[offset] = datetime(2000, 1, 1, tzinfo=tz).isoformat()[len('2000-01-01T00:00:00'):]
+        return day_str + clock + suffix
+
+
+@lru_cache(maxsize=None)
+def zone_transitions(tz) -> ZoneTransitions:
+    """The (cached) transition table of a pytz zone."""
+    return ZoneTransitions.from_tzinfo(tz)
@@ -0,0 +1,57 @@
+"""
+The signed-in user of a request and their user document.
+
+Endpoints that need the user's data depend on `main.current_user_context`.
+FastAPI resolves a dependency once per request, so however many
+dependencies of a request ask for it, the user document is read at most
+once. Documents are also cached per process for USER_PROFILE_CACHE_TTL_SECONDS:
+writes through this process call `invalidate_user_profile`, and other
+processes may serve the old document until the entry expires.
+"""
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from auth import auth_stats
+from cache import TTLCache
+from metrics import span
+
+# Per-process cache of user ID -> user document data.
+user_profiles = TTLCache(
+    maxsize=int(os.getenv("USER_PROFILE_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("USER_PROFILE_CACHE_TTL_SECONDS", "30")),
+)
+
+
+@dataclass(frozen=True)
+class UserContext:
+    user_id: str
+    data: dict
+
+
+async def load_user_context(db, user_id: str) -> Optional[UserContext]:
+    """The user's context, or None if they have no user document."""
+    data = user_profiles.get(user_id)
+    if data is None:
+        auth_stats['userReads'] += 1
+        with span('firestore.get_user'):
+            user_doc = await db.collection('users').document(user_id).get()
+        if not user_doc.exists:
+            return None
+        data = user_doc.to_dict()
+        user_profiles.set(user_id, data)
+    return UserContext(user_id, data)
+
+
+def invalidate_user_profile(user_id: str):
+    user_profiles.pop(user_id)
+
+
+def auth_read_stats() -> dict:
+    """User document reads per authenticated request since the process started."""
+    requests = auth_stats['requests']
+    return {
+        'requests': requests,
+        'userReads': auth_stats['userReads'],
+        'readsPerRequest': auth_stats['userReads'] / requests if requests else None,
+    }
@@ -1,6 +1,6 @@
 'use client';
 
-import { useState, useEffect, useCallback, useMemo, Fragment } from 'react';
+import { useState, useEffect, useCallback, useMemo, useRef, Fragment } from 'react';
 import axios from 'axios';
 import Spinner from '../components/Spinner';
 import Alert from '../components/Alert';
@@ -11,13 +11,16 @@ type Slot = {
   slotId: string;
   startTime: string;
   endTime: string;
-  status: 'available' | 'booked';
+  status: 'available' | 'booked' | 'held'; // 'held': someone is filling in the booking form
 };
 
 // --- Data Fetching ---
-async function getPublicSlots(token: string) {
+// 'no-cache' revalidates with the response's ETag, so an unchanged page costs a 304.
+// With `since` (the version of the slots shown), only the days changed after it are returned.
+async function getPublicSlots(token: string, since?: number) {
   try {
-    const res = await fetch(`${process.env.NEXT_PUBLIC_API_BASE_URL}/api/slots/public/${token}`, { cache: 'no-store' });
+    const query = since === undefined ? '' : `?since=${since}`;
+    const res = await fetch(`${process.env.NEXT_PUBLIC_API_BASE_URL}/api/slots/public/${token}${query}`, { cache: 'no-cache' });
     if (!res.ok) {
       if (res.status === 404) return { error: 'This booking page does not exist.' };
       throw new Error('Failed to fetch slots');
@@ -30,6 +33,11 @@ async function getPublicSlots(token: string) {
 }
 
 
+// Replaces the slots of the days in a delta response; a day's slotIds start with its date.
+function applySlotChanges(slots: Slot[], days: Record<string, Slot[]>) {
+  const kept = slots.filter(slot => !(slot.slotId.slice(0, 10) in days));
+  return [...kept, ...Object.values(days).flat()].sort((a, b) => a.slotId.slice(0, 10).localeCompare(b.slotId.slice(0, 10)));
+}
 
 // --- Calendar Component for Booking ---
 const BookingCalendarView = ({ slots, onSlotClick, selectedSlotId }: { slots: Slot[], onSlotClick: (slot: Slot) => void, selectedSlotId?: string }) => {
@@ -41,12 +49,13 @@ const BookingCalendarView = ({ slots, onSlotClick, selectedSlotId }: { slots: Sl
   const slotsMap = useMemo(() => {
     const map = new Map<string, Slot>();
     for (const slot of slots) {
-      if (slot.status === 'available') {
+      // The selected slot stays visible while this page holds it.
+      if (slot.status === 'available' || slot.slotId === selectedSlotId) {
         map.set(new Date(slot.startTime).toISOString(), slot);
       }
     }
     return map;
-  }, [slots]);
+  }, [slots, selectedSlotId]);
 
   const changeWeek = (direction: 'next' | 'prev') => {
     setViewDate(current => {
@@ -124,10 +133,16 @@ export default function BookingPage({ params }: { params: { token: string } }) {
   const { token } = params;
   const [userName, setUserName] = useState('');
   const [slots, setSlots] = useState<Slot[]>([]);
+  const [version, setVersion] = useState<number | undefined>(undefined);
+  const versionRef = useRef<number | undefined>(undefined);
+  versionRef.current = version;
   const [error, setError] = useState<string | null>(null);
   const [isLoading, setIsLoading] = useState(true);
 
   const [selectedSlot, setSelectedSlot] = useState<Slot | null>(null);
+  const [holdId, setHoldId] = useState<string | null>(null);
+  // One key per chosen slot: resubmitting the form (e.g. after a timeout) cannot book twice.
+  const idempotencyKey = useRef('');
   const [bookerName, setBookerName] = useState('');
   const [bookerEmail, setBookerEmail] = useState('');
   const [isBooking, setIsBooking] = useState(false);
@@ -143,12 +158,85 @@ export default function BookingPage({ params }: { params: { token: string } }) {
       } else {
         setUserName(result.userName);
         setSlots(result.slots || []);
+        setVersion(result.version ?? undefined);
       }
       setIsLoading(false);
     };
     fetchData();
   }, [token]);
 
+  // Live updates: the server pushes the days whose slots changed, e.g. when someone else books.
+  const hasVersion = version !== undefined;
+  useEffect(() => {
+    if (!hasVersion) return;
+    const source = new EventSource(`${process.env.NEXT_PUBLIC_API_BASE_URL}/api/slots/public/${token}/events?since=${versionRef.current}`);
+    source.addEventListener('slots', (event) => {
+      const data = JSON.parse((event as MessageEvent).data);
+      setSlots(current => applySlotChanges(current, data.days));
+      setVersion(data.version);
+    });
+    source.addEventListener('resync', async () => {
+      const result = await getPublicSlots(token, versionRef.current);
+      if (result.error) return;
+      if (result.days) {
+        setSlots(current => applySlotChanges(current, result.days));
+      } else {
+        setSlots(result.slots || []);
+      }
+      setVersion(result.version ?? undefined);
+    });
+    return () => source.close();
+  }, [token, hasVersion]);
+
+  // Let the booker know as soon as the selected time is taken, instead of on submit.
+  // A slot this page holds shows as 'held' to everyone, this page included.
+  useEffect(() => {
+    if (selectedSlot && !isBooking && !slots.some(slot => slot.slotId === selectedSlot.slotId
+        && (slot.status === 'available' || (slot.status === 'held' && holdId)))) {
+      setFormError('The selected time was just booked by someone else. Please choose another slot.');
+    }
+  }, [slots, selectedSlot, isBooking, holdId]);
+
+  const releaseHold = () => {
+    if (holdId) {
+      axios.delete(`${process.env.NEXT_PUBLIC_API_BASE_URL}/api/slots/public/${token}/holds/${holdId}`).catch(console.error);
+      setHoldId(null);
+    }
+  };
+
+  // Hold the slot while the booker fills in the form, so nobody else can take it meanwhile.
+  const selectSlot = async (slot: Slot) => {
+    releaseHold();
+    setFormError(null);
+    setSelectedSlot(slot);
+    idempotencyKey.current = crypto.randomUUID();
+    try {
+      const { data } = await axios.post(`${process.env.NEXT_PUBLIC_API_BASE_URL}/api/slots/public/${token}/holds`, { slotId: slot.slotId });
+      setHoldId(data.holdId);
+    } catch (err: any) {
+      if (err.response?.status === 409) {
+        setFormError('Someone else is booking this time right now. Please choose another slot.');
+      }
+      // Otherwise book without a hold.
+    }
+  };
+
+  const cancelSelection = () => {
+    releaseHold();
+    setSelectedSlot(null);
+  };
+
+  const waitForBooking = async (statusUrl: string) => {
+    for (let attempt = 0; attempt < 30; attempt++) {
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+      const { data } = await axios.get(`${process.env.NEXT_PUBLIC_API_BASE_URL}${statusUrl}`);
+      if (data.status !== 'pending') {
+        return data;
+      }
+    }
+    return { status: 'pending' };
+  };
+
   const handleBookingSubmit = async (e: React.FormEvent) => {
     e.preventDefault();
     setFormError(null);
@@ -159,22 +247,36 @@ export default function BookingPage({ params }: { params: { token: string } }) {
     setIsBooking(true);
     setBookingResult(null);
     try {
-      await axios.post(`${process.env.NEXT_PUBLIC_API_BASE_URL}/api/bookings`, {
+      const response = await axios.post(`${process.env.NEXT_PUBLIC_API_BASE_URL}/api/bookings`, {
         publicUrlToken: token,
         slotId: selectedSlot.slotId,
         bookerName,
         bookerEmail,
-      });
+        holdId,
+      }, { headers: { 'Idempotency-Key': idempotencyKey.current } });
+      // 202: the slot is reserved and the calendar event is created in the background.
+      if (response.status === 202) {
+        const status = await waitForBooking(response.data.statusUrl);
+        if (status.status !== 'confirmed') {
+          throw { response: { data: { detail: status.error ? `Booking failed: ${status.error}` : 'Booking is still being processed. Please check your email later.' } } };
+        }
+      }
       setBookingResult({
         message: `Booking confirmed for ${new Date(selectedSlot.startTime).toLocaleString()}! A calendar invitation has been sent to your email.`,
         type: 'success',
       });
-      // Refetch slots to show updated availability
-      const updatedSlotsResult = await getPublicSlots(token);
+      // Fetch the changes since the shown slots to show updated availability
+      const updatedSlotsResult = await getPublicSlots(token, version);
       if (!updatedSlotsResult.error) {
-        setSlots(updatedSlotsResult.slots || []);
+        if (updatedSlotsResult.days) {
+          setSlots(current => applySlotChanges(current, updatedSlotsResult.days));
+        } else {
+          setSlots(updatedSlotsResult.slots || []);
+        }
+        setVersion(updatedSlotsResult.version ?? undefined);
       }
       setSelectedSlot(null);
+      setHoldId(null);
       setBookerName('');
       setBookerEmail('');
     } catch (err: any) {
@@ -224,7 +326,7 @@ export default function BookingPage({ params }: { params: { token: string } }) {
         {slots.length > 0 ? (
           <BookingCalendarView 
             slots={slots} 
-            onSlotClick={setSelectedSlot}
+            onSlotClick={selectSlot}
             selectedSlotId={selectedSlot?.slotId}
           />
         ) : (
@@ -259,7 +361,7 @@ export default function BookingPage({ params }: { params: { token: string } }) {
               </div>
               
               <div className="mt-8 flex justify-end gap-4">
-                <button type="button" onClick={() => setSelectedSlot(null)} className="px-6 py-2 border border-gray-300 rounded-md text-sm font-medium text-gray-700 bg-white hover:bg-gray-50">
+                <button type="button" onClick={cancelSelection} className="px-6 py-2 border border-gray-300 rounded-md text-sm font-medium text-gray-700 bg-white hover:bg-gray-50">
                   Cancel
                 </button>
                 <button type="submit" disabled={isBooking} className="px-6 py-2 border border-transparent rounded-md shadow-sm text-sm font-medium text-white bg-blue-600 hover:bg-blue-700 focus:outline-none focus:ring-2 focus:ring-offset-2 focus:ring-blue-500 disabled:bg-gray-400">